@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+Counts the queries made for each finished build of a diff's collection of
+builds: storing its snapshot (as sync_build does), and the mail, Phabricator
+and analytics build.finished listeners once all of them have finished.
+
+Uses the configured database and Redis; everything it creates is rolled back
+(or deleted). Notifications aren't sent.
+
+Usage: python benchmarks/build_finished.py [--builds N] [--jobs N] [--tests N] [--logs N]
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import mock
+import os
+import sys
+
+from uuid import uuid4
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from sqlalchemy import event  # NOQA
+
+from changes.config import create_app, db, redis  # NOQA
+from changes.constants import Result, Status  # NOQA
+from changes.lib import build_context_lib  # NOQA
+from changes.listeners import analytics_notifier, mail, phabricator_listener  # NOQA
+from changes.models.build import Build  # NOQA
+from changes.models.project import ProjectOption  # NOQA
+from changes.testutils.fixtures import Fixtures  # NOQA
+
+
+def create_collection(fixtures, num_builds, jobs_per_build, tests_per_job, logs_per_job):
+    """A diff's failing builds, one per project."""
+    repository = fixtures.create_repo()
+    collection_id = uuid4()
+    builds = []
+    for _ in range(num_builds):
+        project = fixtures.create_project(repository=repository)
+        db.session.add(ProjectOption(project=project, name='phabricator.notify', value='1'))
+        build = fixtures.create_build(
+            project, collection_id=collection_id, target='D1234', status=Status.finished,
+            result=Result.failed, source=fixtures.create_source(project))
+        for _ in range(jobs_per_build):
+            job = fixtures.create_job(build)
+            phase = fixtures.create_jobphase(job)
+            step = fixtures.create_jobstep(phase, result=Result.failed)
+            for _ in range(logs_per_job):
+                fixtures.create_logchunk(fixtures.create_logsource(step, name=uuid4().hex))
+            for n in range(tests_per_job):
+                fixtures.create_test(job, name='tests.test_{}'.format(n), result=Result.failed)
+        builds.append(build)
+    return builds
+
+
+def store_snapshot(build_id):
+    build_context_lib.store_build_snapshot(Build.query.get(build_id))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--builds', type=int, default=4, help='builds in the collection')
+    parser.add_argument('--jobs', type=int, default=3, help='jobs per build')
+    parser.add_argument('--tests', type=int, default=20, help='failing tests per job')
+    parser.add_argument('--logs', type=int, default=2, help='failing logs per job')
+    args = parser.parse_args()
+
+    app = create_app(ANALYTICS_POST_URL='http://example.com/analytics')
+    with app.app_context():
+        db.session.begin_nested()
+        statements = []
+
+        def count_statement(*args):
+            statements.append(1)
+
+        try:
+            builds = create_collection(Fixtures(), args.builds, args.jobs, args.tests, args.logs)
+            build_ids = [b.id for b in builds]
+            counts = {}
+            with mock.patch('changes.lib.notifications.send'):
+                event.listen(db.engine, 'before_cursor_execute', count_statement)
+                try:
+                    # each build's sync_build, then (once they've all
+                    # finished) each build's listeners, in their own tasks
+                    steps = [('snapshot', store_snapshot, build_id) for build_id in build_ids] + [
+                        (name, func, build_id)
+                        for build_id in build_ids
+                        for name, func in (
+                            ('mail', mail.build_finished_handler),
+                            ('phabricator', phabricator_listener.build_finished_handler),
+                            ('analytics', analytics_notifier.build_finished_handler),
+                        )
+                    ]
+                    for name, func, build_id in steps:
+                        del statements[:]
+                        db.session.expire_all()
+                        func(build_id=build_id)
+                        counts[name] = counts.get(name, 0) + len(statements)
+                finally:
+                    event.remove(db.engine, 'before_cursor_execute', count_statement)
+                    redis.delete(*[build_context_lib.SNAPSHOT_KEY.format(i.hex) for i in build_ids])
+
+            print('{} builds, {} jobs each, {} failing tests and {} failing logs per job\n'.format(
+                args.builds, args.jobs, args.tests, args.logs))
+            for name in ('snapshot', 'mail', 'phabricator', 'analytics'):
+                print('{:<20} {:>8.1f}'.format(name, counts[name] / float(args.builds)))
+            print('{:<20} {:>8.1f}  queries per finished build'.format(
+                'total', sum(counts.values()) / float(args.builds)))
+        finally:
+            db.session.rollback()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Times BuildReport.generate (the weekly build report) over many projects, and
+counts the queries it makes.
+
+Uses the configured database; everything it creates is rolled back.
+
+Usage: python benchmarks/build_report.py [--projects N] [--builds N] [--tests N] [--repeat N]
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from flask.ext.sqlalchemy import get_debug_queries  # NOQA
+
+from changes.config import create_app, db  # NOQA
+from changes.constants import Result, Status  # NOQA
+from changes.models.build import Build  # NOQA
+from changes.models.failurereason import FailureReason  # NOQA
+from changes.models.job import Job  # NOQA
+from changes.models.jobphase import JobPhase  # NOQA
+from changes.models.jobstep import JobStep  # NOQA
+from changes.models.project import Project  # NOQA
+from changes.models.repository import Repository  # NOQA
+from changes.models.source import Source  # NOQA
+from changes.models.test import TestCase  # NOQA
+from changes.reports.build import BuildReport  # NOQA
+
+REASONS = ('test_failures', 'missing_manifest_json', 'malformed_manifest_json', 'aborted')
+
+
+def create_projects(num_projects, builds_per_project, tests_per_build):
+    """Projects with builds (and their failures and tests) spread over the last two weeks."""
+    rand = random.Random(0)
+    now = datetime.utcnow()
+    projects = []
+    for _ in range(num_projects):
+        repository = Repository(url='http://example.com/{}'.format(uuid4().hex))
+        name = uuid4().hex
+        project = Project(repository=repository, name=name, slug=name)
+        projects.append(project)
+        db.session.add(project)
+        for _ in range(builds_per_project):
+            result = rand.choice((Result.passed, Result.passed, Result.failed))
+            build = Build(
+                project=project, source=Source(repository=repository), label='build',
+                status=Status.finished, result=result, duration=rand.randint(1000, 600000),
+                date_created=now - timedelta(seconds=rand.randint(0, 14 * 86400)),
+            )
+            job = Job(build=build, project=project, label='job', status=Status.finished, result=result)
+            step = JobStep(
+                job=job, project=project, phase=JobPhase(job=job, project=project, label='phase'),
+                label='step', status=Status.finished, result=result)
+            db.session.add_all([build, job, step])
+            if result == Result.failed:
+                db.session.add(FailureReason(
+                    id=uuid4(), step_id=step.id, job_id=job.id, build_id=build.id, project_id=project.id,
+                    reason=rand.choice(REASONS)))
+            for n in range(tests_per_build):
+                db.session.add(TestCase(
+                    job=job, project=project, name='tests.test_{}'.format(n), result=Result.passed,
+                    duration=rand.randint(0, 10000), date_created=build.date_created))
+        # assign ids
+        db.session.flush()
+    return projects
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--projects', type=int, default=300)
+    parser.add_argument('--builds', type=int, default=20, help='builds per project')
+    parser.add_argument('--tests', type=int, default=5, help='tests per build')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        try:
+            projects = create_projects(args.projects, args.builds, args.tests)
+            db.session.execute('ANALYZE')
+
+            report = BuildReport(projects)
+            num_queries = len(get_debug_queries())
+            report.generate()
+            num_queries = len(get_debug_queries()) - num_queries
+
+            best = min(timeit.repeat(report.generate, number=1, repeat=args.repeat))
+            print('{} projects, {} builds each, {} tests per build\n'.format(
+                args.projects, args.builds, args.tests))
+            print('{:<20} {:>8.2f}ms'.format('generate', best * 1000))
+            print('{:<20} {:>8}'.format('queries', num_queries))
+        finally:
+            db.session.rollback()
+
+
+if __name__ == '__main__':
+    main()
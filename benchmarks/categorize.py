@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Compares log categorization with a compiled RuleSet (streaming over the log's
+chunks) against matching every rule's regexp against the whole log, on a
+synthetic log and rule set.
+
+Usage: python benchmarks/categorize.py [--size BYTES] [--rules N] [--repeat N]
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from changes.experimental import categorize  # NOQA
+from changes.models.log import LOG_CHUNK_SIZE  # NOQA
+
+WORDS = ('PASSED', 'FAILED', 'tests/changes/api/test_build_details.py', 'INFO', 'DEBUG',
+         'Running', 'collecting', '...', 'ms', 'Traceback', 'sh', '[100%]', 'error', 'warning')
+
+
+def make_chunks(size):
+    """A log shaped like a build log, in LOG_CHUNK_SIZE chunks."""
+    rand = random.Random(0)
+    lines = []
+    total = 0
+    while total < size:
+        line = u'{:08.3f} {} {}\r\n'.format(
+            rand.random() * 1000, ' '.join(rand.choice(WORDS) for _ in range(rand.randint(2, 12))),
+            rand.getrandbits(32))
+        lines.append(line)
+        total += len(line)
+    # a few lines for rules to find
+    for n in (3, 97, 250):
+        lines.insert(rand.randrange(len(lines)), u'E{:04d} infra failure: timed out after 30s\r\n'.format(n))
+    text = u''.join(lines)
+    return [text[i:i + LOG_CHUNK_SIZE] for i in xrange(0, len(text), LOG_CHUNK_SIZE)]
+
+
+def make_rules(count):
+    """Mostly rules with a literal, and one in twenty without."""
+    rules = []
+    for n in range(count):
+        if n % 20 == 19:
+            regexp = r'^[A-Z]{{2}}{:03d}[a-z]+ \d+ failed$'.format(n)
+        else:
+            regexp = r'^E{:04d} [a-z ]+: timed out after \d+s$'.format(n)
+        rules.append(('tag{}'.format(n), '', regexp))
+    return rules
+
+
+def categorize_whole_log(project, rules, output):
+    """How categorize.categorize worked before RuleSet."""
+    output = output.replace('\r\n', '\n')
+    matched, applicable = set(), set()
+    for tag, rule_project, regexp in rules:
+        if not rule_project or rule_project == project:
+            applicable.add(tag)
+            if re.search(regexp, output, re.MULTILINE | re.DOTALL):
+                matched.add(tag)
+    return (matched, applicable)
+
+
+def bench(label, func, repeat):
+    best = min(timeit.repeat(func, number=1, repeat=repeat))
+    print('{:<40} {:8.3f}s'.format(label, best))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', type=int, default=50 * 1024 * 1024)
+    parser.add_argument('--rules', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    chunks = make_chunks(args.size)
+    rules = make_rules(args.rules)
+    print('{} chars in {} chunks, {} rules, Aho-Corasick: {}\n'.format(
+        sum(len(c) for c in chunks), len(chunks), len(rules),
+        'yes' if categorize.ahocorasick is not None else 'no (regexp alternation)'))
+
+    expected = categorize_whole_log('proj', rules, u''.join(chunks))
+    ruleset = categorize.RuleSet(rules)
+    assert ruleset.categorize('proj', chunks) == expected
+
+    bench('compile RuleSet', lambda: categorize.RuleSet(rules), args.repeat)
+    bench('join + re.search per rule', lambda: categorize_whole_log('proj', rules, u''.join(chunks)),
+          args.repeat)
+    bench('RuleSet over chunks', lambda: ruleset.categorize('proj', chunks), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+Measures getting a project's test durations for sharding: from its stored
+stats (changes.lib.duration_stats), versus reading every test of its last
+build and building the tree of groups (as expanders did before the stats
+were kept, and as seeding them still does). Also times folding a finished
+build into the stats, and reports the size of what expansion reads.
+
+Uses the configured database; everything it creates is deleted afterwards.
+
+Usage: python benchmarks/duration_stats.py [--tests N] [--runs N]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import sys
+import time
+
+from uuid import uuid4
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from changes.config import create_app, db  # NOQA
+from changes.constants import Result, Status  # NOQA
+from changes.lib import duration_stats  # NOQA
+from changes.models.build import Build  # NOQA
+from changes.models.durationstats import DurationStats  # NOQA
+from changes.models.job import Job  # NOQA
+from changes.models.project import Project  # NOQA
+from changes.models.repository import Repository  # NOQA
+from changes.models.source import Source  # NOQA
+
+
+def create_build(project, repository, num_tests):
+    build = Build(project=project, source=Source(repository=repository), label='build',
+                  status=Status.finished, result=Result.passed, tags=['commit'])
+    job = Job(build=build, project=project, label='job', status=Status.finished, result=Result.passed)
+    db.session.add(job)
+    db.session.flush()
+    # ten modules of a hundred classes each
+    db.session.execute("""
+        INSERT INTO test (id, job_id, project_id, label_sha, name, result, duration, date_created)
+        SELECT md5(:job_id || n::text)::uuid, :job_id, :project_id, md5(n::text),
+            'tests.module_' || (n % 10) || '.Class' || (n % 1000) || '.test_' || n,
+            1, (n * 7919) % 5000, now()
+        FROM generate_series(0, :tests - 1) n
+    """, {'job_id': job.id.hex, 'project_id': project.id.hex, 'tests': num_tests})
+    db.session.commit()
+    return build
+
+
+def timed(func, runs):
+    started = time.time()
+    for _ in range(runs):
+        func()
+        db.session.rollback()
+    return (time.time() - started) / runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tests', type=int, default=100000, help='tests per build')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        repository = Repository(url='http://example.com/{}'.format(uuid4().hex))
+        name = uuid4().hex
+        project = Project(repository=repository, name=name, slug=name)
+        db.session.add(project)
+        db.session.commit()
+        try:
+            create_build(project, repository, args.tests)
+
+            def from_last_build():
+                DurationStats.query.filter(DurationStats.project_id == project.id).delete()
+                duration_stats.get_test_stats(project.slug)
+
+            seed = timed(from_last_build, args.runs)
+            duration_stats.get_test_stats(project.slug)
+            db.session.commit()
+            read = timed(lambda: duration_stats.get_test_stats(project.slug), args.runs)
+
+            build = create_build(project, repository, args.tests)
+            started = time.time()
+            duration_stats.record_build(build)
+            db.session.commit()
+            record = time.time() - started
+
+            summary = DurationStats.query.filter(DurationStats.project_id == project.id).one().summary
+            print('{} tests'.format(args.tests))
+            print('{:<24} {:>9.0f}ms'.format('from last build', seed * 1000))
+            print('{:<24} {:>9.0f}ms'.format('from stats', read * 1000))
+            print('{:<24} {:>9.0f}ms'.format('record build', record * 1000))
+            print('{:<24} {:>9.0f}KB'.format('summary size', len(summary) / 1024))
+        finally:
+            db.session.rollback()
+            Project.query.filter(Project.id == project.id).delete(synchronize_session=False)
+            db.session.commit()
+
+
+if __name__ == '__main__':
+    main()
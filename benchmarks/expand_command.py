@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+"""
+Times expanding a Bazel target collection command into shards through
+CommandDetailsAPIView, creating the jobsteps one at a time
+(BuildStep.create_expanded_jobsteps) versus in bulk
+(DefaultBuildStep.create_expanded_jobsteps): how long the expand lock is
+held, and the database statements executed while it is.
+
+Uses the configured database and Redis; everything it creates is deleted
+afterwards. Sync tasks for the new jobsteps are queued as usual.
+
+Usage: python benchmarks/expand_command.py [--shards N] [--targets N] [--runs N]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from uuid import uuid4
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from sqlalchemy import event  # NOQA
+
+from changes.api import command_details  # NOQA
+from changes.buildsteps.base import BuildStep  # NOQA
+from changes.buildsteps.default import DefaultBuildStep  # NOQA
+from changes.config import create_app, db  # NOQA
+from changes.constants import Status  # NOQA
+from changes.models.build import Build  # NOQA
+from changes.models.command import Command, CommandType  # NOQA
+from changes.models.job import Job  # NOQA
+from changes.models.jobphase import JobPhase  # NOQA
+from changes.models.jobplan import JobPlan  # NOQA
+from changes.models.jobstep import JobStep  # NOQA
+from changes.models.plan import Plan  # NOQA
+from changes.models.project import Project  # NOQA
+from changes.models.repository import Repository  # NOQA
+from changes.models.source import Source  # NOQA
+from changes.models.step import Step  # NOQA
+
+
+class TimedLocks(object):
+    """Stands in for the Redis client, timing how long locks are held."""
+    def __init__(self, redis):
+        self.redis = redis
+        self.held = []
+
+    def __getattr__(self, name):
+        return getattr(self.redis, name)
+
+    def lock(self, *args, **kwargs):
+        return TimedLock(self.redis.lock(*args, **kwargs), self.held)
+
+
+class TimedLock(object):
+    def __init__(self, lock, held):
+        self.lock = lock
+        self.held = held
+
+    def __enter__(self):
+        result = self.lock.__enter__()
+        self.started = time.time()
+        return result
+
+    def __exit__(self, *exc_info):
+        self.held.append(time.time() - self.started)
+        return self.lock.__exit__(*exc_info)
+
+
+def create_command(max_executors):
+    repository = Repository(url='http://example.com/{}'.format(uuid4().hex))
+    name = uuid4().hex
+    project = Project(repository=repository, name=name, slug=name)
+    source = Source(repository=repository)
+    build = Build(project=project, source=source, label='build', status=Status.in_progress)
+    job = Job(build=build, project=project, source=source, label='job', status=Status.in_progress)
+    plan = Plan(project=project, label='plan')
+    Step(plan=plan, order=0, implementation='changes.buildsteps.default.DefaultBuildStep', data={
+        'commands': [
+            {'script': 'setup-bazel', 'type': 'setup'},
+            {'script': 'collect-targets', 'type': 'collect_bazel_targets'},
+            {'script': 'upload-logs', 'type': 'teardown'},
+        ],
+    })
+    phase = JobPhase(job=job, project=project, label='Collect targets', status=Status.in_progress)
+    step = JobStep(job=job, project=project, phase=phase, label='collect', status=Status.in_progress,
+                   data={'max_executors': max_executors})
+    command = Command(jobstep=step, label='collect-targets', script='collect-targets',
+                      type=CommandType.collect_bazel_targets, status=Status.in_progress)
+    db.session.add_all([plan, command])
+    db.session.flush()
+    db.session.add(JobPlan.build_jobplan(plan, job))
+    db.session.commit()
+    return project.id, command.id
+
+
+def collected_targets(num_targets):
+    targets = ['//pkg{}:test{}'.format(n % 500, n) for n in range(num_targets)]
+    return {
+        'cmd': 'bazel test {target_names}',
+        'affected_targets': targets,
+        'unaffected_targets': [],
+        'artifact_search_path': 'bazel-testlogs',
+        # a tenth of the targets were affected by changed files
+        'dependency_map': {target: ['pkg/BUILD', 'pkg/lib.py'] for target in targets[::10]},
+    }
+
+
+def run(app, label, args, output):
+    with app.app_context():
+        project_id, command_id = create_command(args.shards)
+
+    client = app.test_client()
+    locks = TimedLocks(command_details.redis)
+    statements = []
+
+    def count_statement(*args):
+        statements.append(time.time())
+
+    with app.app_context():
+        engine = db.engine
+    command_details.redis = locks
+    event.listen(engine, 'before_cursor_execute', count_statement)
+    try:
+        resp = client.post('/api/0/commands/{}/'.format(command_id.hex), data={
+            'status': 'finished',
+            'output': output,
+        })
+        assert resp.status_code == 200, resp.data
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_statement)
+        command_details.redis = locks.redis
+        with app.app_context():
+            # commands aren't deleted along with their jobsteps
+            Command.query.filter(Command.jobstep_id.in_(
+                db.session.query(JobStep.id).filter(JobStep.project_id == project_id)
+            )).delete(synchronize_session=False)
+            Project.query.filter(Project.id == project_id).delete(synchronize_session=False)
+            db.session.commit()
+
+    return locks.held[0], len(statements)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--shards', type=int, default=500)
+    parser.add_argument('--targets', type=int, default=50000)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    # a path for the repository's clone command
+    app = create_app(REPO_ROOT='/tmp')
+    output = json.dumps(collected_targets(args.targets))
+    print('{} targets into {} shards, best of {}\n'.format(args.targets, args.shards, args.runs))
+    print('{:<10} {:>12} {:>12}'.format('', 'lock held', 'statements'))
+
+    bulk = DefaultBuildStep.create_expanded_jobsteps
+    for label, create_expanded_jobsteps in (('each', BuildStep.create_expanded_jobsteps), ('bulk', bulk)):
+        DefaultBuildStep.create_expanded_jobsteps = create_expanded_jobsteps
+        try:
+            held, statements = min(run(app, label, args, output) for _ in range(args.runs))
+        finally:
+            DefaultBuildStep.create_expanded_jobsteps = bulk
+        print('{:<10} {:>10.0f}ms {:>12}'.format(label, held * 1000, statements))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Compares the JSON encoding backends in changes.utils.json_encoding, and
+serialize() + dumps() with and without native_types, on payloads shaped like
+our largest API responses (test lists and jobstep allocations).
+
+Usage: python benchmarks/json_encoding.py [--rows N] [--repeat N]
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import os
+import sys
+import timeit
+
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from changes.api.serializer import serialize  # NOQA
+from changes.constants import Result, Status  # NOQA
+from changes.utils import json_encoding  # NOQA
+
+
+def make_rows(count):
+    """
+    Rows as the TestCase and JobStep crumblers return them, i.e. with the
+    datetimes, UUIDs and Enums still to be serialized.
+    """
+    now = datetime.utcnow()
+    job_id = uuid4()
+    return [
+        {
+            'id': uuid4(),
+            'hash': uuid4().hex,
+            'job': {'id': job_id},
+            'name': u'tests.changes.api.test_build_details.BuildDetailsTest.test_%d' % n,
+            'package': u'tests.changes.api.test_build_details',
+            'shortName': u'test_%d' % n,
+            'duration': n % 5000,
+            'result': Result.passed if n % 7 else Result.failed,
+            'status': Status.finished,
+            'numRetries': 0,
+            'dateCreated': now - timedelta(seconds=n),
+            'dateStarted': now - timedelta(seconds=n + 60),
+            'dateFinished': now,
+            'data': {'phase': u'Test', 'weight': n % 13, 'tags': [u'a', u'b']},
+        }
+        for n in xrange(count)
+    ]
+
+
+def bench(label, func, repeat):
+    best = min(timeit.repeat(func, number=1, repeat=repeat))
+    print('{:<40} {:8.4f}s'.format(label, best))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    crumbled = serialize(rows)
+    print('{} rows, {} bytes, backends: {}\n'.format(
+        args.rows, len(json_encoding.dumps(crumbled)),
+        ', '.join(json_encoding._backends)))
+
+    print('dumps (already serialized)')
+    for name in json_encoding._backends:
+        json_encoding.set_backend(name)
+        bench('  ' + name, lambda: json_encoding.dumps(crumbled), args.repeat)
+
+    native = serialize(rows, native_types=True)
+    print('\ndumps (native_types)')
+    for name in json_encoding._backends:
+        json_encoding.set_backend(name)
+        bench('  ' + name, lambda: json_encoding.dumps(native, native_types=True), args.repeat)
+
+    json_encoding.set_backend(None)
+    print('\nserialize + dumps ({})'.format(json_encoding.get_backend()))
+    bench('  crumbled', lambda: json_encoding.dumps(serialize(rows)), args.repeat)
+    bench('  native_types', lambda: json_encoding.dumps(
+        serialize(rows, native_types=True), native_types=True), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
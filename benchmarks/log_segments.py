@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""
+Compares storing a log as LogChunks with sealing it into LogSegments: rows,
+bytes stored (including indexes) and the latency of the reads
+JobLogDetailsAPIView does (a tail read, a range read and a full raw read).
+
+Uses the configured database; everything it creates is rolled back.
+
+Usage: python benchmarks/log_segments.py [--size BYTES] [--segment-size N] [--codec C]
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from changes.config import create_app, db  # NOQA
+from changes.lib import log_segments  # NOQA
+from changes.models.log import LOG_CHUNK_SIZE, LogChunk, LogSegment  # NOQA
+from changes.testutils.fixtures import Fixtures  # NOQA
+
+WORDS = ('PASSED', 'FAILED', 'tests/changes/api/test_build_details.py', 'INFO', 'DEBUG',
+         'Running', 'collecting', '...', 'ms', 'ERROR', 'Traceback', 'sh', '[100%]')
+
+
+def make_log(size):
+    """Something shaped like a build log: short, repetitive lines with some noise."""
+    rand = random.Random(0)
+    lines = []
+    total = 0
+    while total < size:
+        line = u'{:08.3f} {} {}\n'.format(
+            rand.random() * 1000, ' '.join(rand.choice(WORDS) for _ in range(rand.randint(2, 12))),
+            rand.getrandbits(32))
+        lines.append(line)
+        total += len(line)
+    return u''.join(lines)[:size]
+
+
+def create_source(fixtures, text):
+    project = fixtures.create_project()
+    job = fixtures.create_job(fixtures.create_build(project))
+    source = fixtures.create_logsource(job=job, name='console')
+    for offset in xrange(0, len(text), LOG_CHUNK_SIZE):
+        db.session.add(LogChunk(
+            job=job, project=project, source=source, offset=offset,
+            size=len(text[offset:offset + LOG_CHUNK_SIZE]),
+            text=text[offset:offset + LOG_CHUNK_SIZE],
+        ))
+    db.session.flush()
+    return source
+
+
+def stored_bytes(model, source):
+    """The bytes the rows for `source` take, plus their share of the table's indexes."""
+    table = model.__table__.name
+    rows, row_bytes = db.session.execute(
+        'SELECT count(*), coalesce(sum(pg_column_size(t.*)), 0) FROM {} t WHERE source_id = :id'.format(table),
+        {'id': source.id},
+    ).fetchone()
+    total_rows, index_bytes = db.session.execute(
+        "SELECT (SELECT count(*) FROM {0}), pg_indexes_size('{0}')".format(table),
+    ).fetchone()
+    return rows, row_bytes + (index_bytes * rows // total_rows if total_rows else 0)
+
+
+def bench(label, func, repeat):
+    best = min(timeit.repeat(func, number=1, repeat=repeat))
+    print('{:<40} {:8.2f}ms'.format(label, best * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', type=int, default=5 * 1024 * 1024)
+    parser.add_argument('--segment-size', type=int, default=log_segments.SEGMENT_SIZE)
+    parser.add_argument('--codec', default='zlib', choices=sorted(log_segments.CODECS))
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        db.session.begin_nested()
+        try:
+            fixtures = Fixtures()
+            text = make_log(args.size)
+            chunked = create_source(fixtures, text)
+            sealed = create_source(fixtures, text)
+            log_segments.seal(sealed, segment_size=args.segment_size, codec=args.codec)
+            db.session.flush()
+            db.session.execute('ANALYZE logchunk; ANALYZE logsegment')
+
+            print('{} byte log, {} segments of {} chars\n'.format(
+                len(text), args.codec, args.segment_size))
+            print('{:<40} {:>8} {:>12}'.format('', 'rows', 'bytes'))
+            print('{:<40} {:>8} {:>12}'.format('chunks', *stored_bytes(LogChunk, chunked)))
+            print('{:<40} {:>8} {:>12}\n'.format('segments', *stored_bytes(LogSegment, sealed)))
+
+            size = len(text)
+            reads = (
+                ('tail (50000 chars)', {'min_end': size - 50000}),
+                ('range (offset=size/2, limit=50000)', {'after': size // 2, 'until': size // 2 + 50000}),
+                ('full', {}),
+            )
+            for label, kwargs in reads:
+                for name, source in (('chunks', chunked), ('segments', sealed)):
+                    bench('{} {}'.format(label, name),
+                          lambda: u''.join(c.text for c in log_segments.get_chunks(source, **kwargs)),
+                          args.repeat)
+        finally:
+            db.session.rollback()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+"""
+Load tests following logs as they're written, with many concurrent tailers:
+polling JobLogDetailsAPIView (as the log page does) versus long-polling
+JobLogTailAPIView. Reports requests and database queries made, how long
+chunks took to reach tailers, and how many requests were turned away.
+
+A writer appends a chunk to each log every --interval seconds. Uses the
+configured database and Redis; everything it creates is deleted afterwards.
+
+Usage: python benchmarks/log_tail.py [--tailers N] [--logs N] [--seconds N] [--max-connections N]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+from collections import Counter
+from uuid import uuid4
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from sqlalchemy import event  # NOQA
+
+from changes.config import create_app, db  # NOQA
+from changes.constants import Status  # NOQA
+from changes.models.build import Build  # NOQA
+from changes.models.job import Job  # NOQA
+from changes.models.jobphase import JobPhase  # NOQA
+from changes.models.jobstep import JobStep  # NOQA
+from changes.models.log import LogChunk, LogSource  # NOQA
+from changes.models.project import Project  # NOQA
+from changes.models.repository import Repository  # NOQA
+from changes.models.source import Source  # NOQA
+
+# the log page's POLL_INTERVAL
+POLL_INTERVAL = 1.0
+
+
+class Stats(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rejected = 0
+        self.queries = 0
+        # (written, received) times of chunks
+        self.latencies = []
+        # source id => chunks written before stopping
+        self.written = Counter()
+
+    def record(self, status, chunks):
+        now = time.time()
+        with self.lock:
+            self.requests += 1
+            if status == 503:
+                self.rejected += 1
+            # each chunk's text is the time it was written
+            self.latencies.extend((float(chunk['text']), now) for chunk in chunks)
+
+
+def create_logs(num_logs):
+    repository = Repository(url='http://example.com/{}'.format(uuid4().hex))
+    name = uuid4().hex
+    project = Project(repository=repository, name=name, slug=name)
+    build = Build(project=project, source=Source(repository=repository), label='build',
+                  status=Status.in_progress)
+    job = Job(build=build, project=project, label='job', status=Status.in_progress)
+    phase = JobPhase(job=job, project=project, label='phase')
+    sources = []
+    for _ in range(num_logs):
+        step = JobStep(job=job, project=project, phase=phase, label='step', status=Status.in_progress)
+        sources.append(LogSource(job=job, project=project, step=step, name='console'))
+    db.session.add_all(sources)
+    db.session.commit()
+    return project.id, job.id, [source.id for source in sources]
+
+
+def write_chunks(app, job_id, project_id, source_ids, interval, stats, stop):
+    """Appends a chunk to each log in turn, so each gets one every `interval` seconds."""
+    offsets = dict.fromkeys(source_ids, 0)
+    with app.app_context():
+        while True:
+            for source_id in source_ids:
+                # a last round once stopped, to let waiting tailers finish
+                stopped = stop.wait(interval / len(source_ids))
+                text = '{:.6f}'.format(time.time())
+                db.session.add(LogChunk(
+                    job_id=job_id, project_id=project_id, source_id=source_id,
+                    offset=offsets[source_id], size=len(text), text=text,
+                ))
+                offsets[source_id] += len(text)
+                db.session.commit()
+                if not stopped:
+                    with stats.lock:
+                        stats.written[source_id] += 1
+            if stopped:
+                return
+
+
+def poll(client, path, stats, stop):
+    # -1 reads from the end of the log
+    offset = -1
+    while not stop.is_set():
+        resp = client.get('{}?offset={}'.format(path, offset))
+        data = json.loads(resp.data)
+        stats.record(resp.status_code, data['chunks'])
+        if data['chunks']:
+            # nextOffset is one past the end of the log, and only chunks
+            # starting after offset are returned, so step back to the chunk
+            # that will start at the end
+            offset = data['nextOffset'] - 2
+        stop.wait(POLL_INTERVAL)
+
+
+def tail(client, path, stats, stop):
+    offset = 0
+    while not stop.is_set():
+        resp = client.get('{}tail/?offset={}'.format(path, offset))
+        if resp.status_code == 503:
+            stats.record(resp.status_code, [])
+            stop.wait(POLL_INTERVAL)
+            continue
+        data = json.loads(resp.data)
+        stats.record(resp.status_code, data['chunks'])
+        offset = data['nextOffset']
+
+
+def run(app, tailer, args):
+    with app.app_context():
+        project_id, job_id, source_ids = create_logs(args.logs)
+
+    stats = Stats()
+
+    def count_query(*args):
+        with stats.lock:
+            stats.queries += 1
+
+    stop = threading.Event()
+    tailed = [source_ids[n % len(source_ids)] for n in range(args.tailers)]
+    threads = [
+        threading.Thread(target=tailer, args=(
+            app.test_client(), '/api/0/jobs/{}/logs/{}/'.format(job_id.hex, source_id.hex), stats, stop))
+        for source_id in tailed
+    ]
+    threads.append(threading.Thread(target=write_chunks, args=(
+        app, job_id, project_id, source_ids, args.interval, stats, stop)))
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', count_query)
+    try:
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+    finally:
+        stopped_at = time.time()
+        stop.set()
+        for thread in threads:
+            thread.join()
+        event.remove(engine, 'before_cursor_execute', count_query)
+        with app.app_context():
+            Project.query.filter(Project.id == project_id).delete(synchronize_session=False)
+            db.session.commit()
+
+    # leaving out the last round of chunks
+    latencies = sorted(received - written for written, received in stats.latencies if written < stopped_at)
+    expected = sum(stats.written[source_id] for source_id in tailed)
+    print('{:<8} {:>9} {:>9} {:>9} {:>11} {:>9} {:>9}'.format(
+        tailer.__name__, stats.requests, stats.queries, stats.rejected,
+        '{}/{}'.format(len(latencies), expected),
+        '{:.0f}ms'.format(latencies[len(latencies) // 2] * 1000) if latencies else '-',
+        '{:.0f}ms'.format(latencies[len(latencies) * 99 // 100] * 1000) if latencies else '-',
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tailers', type=int, default=100)
+    parser.add_argument('--logs', type=int, default=50, help='logs being written (and tailed)')
+    parser.add_argument('--seconds', type=float, default=20, help='how long to run each mode for')
+    parser.add_argument('--interval', type=float, default=5,
+                        help='seconds between chunks of each log (default: %(default)s)')
+    parser.add_argument('--max-connections', type=int, default=None,
+                        help='LOG_TAIL_MAX_CONNECTIONS (default: one per tailer)')
+    args = parser.parse_args()
+
+    app = create_app(LOG_TAIL_MAX_CONNECTIONS=args.max_connections or args.tailers)
+    print('{} tailers of {} logs, a chunk per log every {}s, for {}s\n'.format(
+        args.tailers, args.logs, args.interval, args.seconds))
+    print('{:<8} {:>9} {:>9} {:>9} {:>11} {:>9} {:>9}'.format(
+        '', 'requests', 'queries', 'rejected', 'chunks', 'p50', 'p99'))
+    for tailer in (poll, tail):
+        run(app, tailer, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+"""
+Compares uploading a Jenkins console log to the artifact store a chunk at a
+time (base64 in JSON, a request per LOG_CHUNK_SIZE chunk) with uploading it
+in batches of raw bytes (as _sync_log does): throughput, requests made, and
+how many logs would be truncated by LOG_SYNC_TIMEOUT_SECS.
+
+Runs a fake Jenkins master and a fake artifact store locally; the artifact
+store can be given a per-request latency to stand in for the network and
+the server's own work.
+
+Usage: python benchmarks/log_upload.py [--sizes MB,MB,...] [--latency MS] [--timeout SECS]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+from base64 import b64decode
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from changes.backends.jenkins.builder import LOG_SYNC_TIMEOUT_SECS  # NOQA
+from changes.lib.artifact_store_lib import APPEND_BATCH_SIZE, ArtifactStoreClient  # NOQA
+from changes.models.log import LOG_CHUNK_SIZE  # NOQA
+from changes.utils.text import chunked  # NOQA
+
+LINE = 'Ran tests/changes/api/test_build_details.py::BuildDetailsTest::test_simple PASSED\n'
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients hang up on truncated logs
+        pass
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # so responses aren't held up by delayed ACKs, which would swamp the
+    # latency being measured
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, status, body, headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeJenkins(Handler):
+    """Serves /log/<bytes>/ as a console log of that many bytes."""
+
+    def do_GET(self):
+        size = int(self.path.split('/')[2])
+        self.send_response(200)
+        self.send_header('X-Text-Size', str(size))
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        line = LINE * (LOG_CHUNK_SIZE // len(LINE) + 1)
+        while size > 0:
+            self.wfile.write(line[:size])
+            size -= len(line)
+
+
+class FakeArtifactStore(Handler):
+    """
+    Accepts appends to chunked artifacts (both base64 chunks in JSON and raw
+    bytes), checking their offsets.
+    """
+    sizes = {}
+    requests = [0]
+    latency = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        time.sleep(self.latency)
+        data = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Type') == 'application/octet-stream':
+            offset = int(re.match(r'bytes (\d+)-', self.headers['Content-Range']).group(1))
+        else:
+            chunk = json.loads(data)
+            offset, data = chunk['byteoffset'], b64decode(chunk['bytes'])
+        with self.lock:
+            self.requests[0] += 1
+            size = self.sizes.get(self.path, 0)
+            if offset != size:
+                self.respond(400, json.dumps({'error': 'bad offset'}))
+                return
+            self.sizes[self.path] = size + len(data)
+        self.respond(200, json.dumps({
+            'name': self.path.split('/')[-1], 'bucketId': self.path.split('/')[2], 'state': 2,
+            'relativePath': 'console', 'size': size + len(data), 's3URL': '', 'deadlineMins': 30,
+            'dateCreated': '2016-10-12T10:00:00.000000Z',
+        }))
+
+
+def start(handler):
+    server = Server(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:{}'.format(server.server_port)
+
+
+def upload_chunks(client, artifact, resp):
+    offset = 0
+    for chunk in chunked(resp.iter_content(), LOG_CHUNK_SIZE):
+        client.post_artifact_chunk('bucket', artifact, offset, chunk)
+        offset += len(chunk)
+        yield offset
+
+
+def upload_batches(client, artifact, resp):
+    return client.append_artifact_chunks('bucket', artifact, 0, resp.iter_content(LOG_CHUNK_SIZE))
+
+
+def measure(label, upload, client, jenkins_url, size, timeout):
+    artifact = '{}-{}'.format(label, size)
+    requests_before = FakeArtifactStore.requests[0]
+    started = time.time()
+    truncated = False
+    offset = 0
+    resp = requests.get('{}/log/{}/'.format(jenkins_url, size), stream=True)
+    for offset in upload(client, artifact, resp):
+        if time.time() > started + timeout:
+            truncated = True
+            break
+    resp.close()
+    elapsed = time.time() - started
+    print('{:<10} {:>8.1f} {:>9.2f}s {:>9.1f} {:>9} {:>10}'.format(
+        label, size / 2 ** 20, elapsed, offset / 2 ** 20 / elapsed,
+        FakeArtifactStore.requests[0] - requests_before,
+        'at {:.0f}%'.format(offset * 100 / size) if truncated else 'no'))
+    return truncated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='1,10,50,100',
+                        help='log sizes, in MB (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=2,
+                        help='artifact store latency per request, in ms (default: %(default)s)')
+    parser.add_argument('--timeout', type=float, default=LOG_SYNC_TIMEOUT_SECS,
+                        help='seconds after which a log is truncated (default: %(default)s)')
+    args = parser.parse_args()
+
+    FakeArtifactStore.latency = args.latency / 1000
+    jenkins, jenkins_url = start(FakeJenkins)
+    store, store_url = start(FakeArtifactStore)
+    client = ArtifactStoreClient(store_url)
+    sizes = [int(float(s) * 2 ** 20) for s in args.sizes.split(',')]
+
+    print('{}ms per artifact store request, {}s timeout, {} KB batches\n'.format(
+        args.latency, args.timeout, APPEND_BATCH_SIZE // 1024))
+    print('{:<10} {:>8} {:>10} {:>9} {:>9} {:>10}'.format('', 'MB', 'time', 'MB/s', 'requests', 'truncated'))
+    for label, upload in (('chunks', upload_chunks), ('batches', upload_batches)):
+        truncated = sum(measure(label, upload, client, jenkins_url, size, args.timeout) for size in sizes)
+        print('{:<10} truncated {} of {} logs\n'.format(label, truncated, len(sizes)))
+    for server in (jenkins, store):
+        server.shutdown()
+        server.server_close()
+    # let connection threads see their connections close before exiting
+    client._session.close()
+    time.sleep(0.1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""
+Compares removing expired tests by deleting rows in chunks (as
+clean_project_tests does) with dropping whole partitions (as
+drop_old_test_partitions does): time taken, rows removed per second and WAL
+written.
+
+Works on scratch copies of the test table in the configured database, which
+are dropped afterwards.
+
+Usage: python benchmarks/test_retention.py [--rows N] [--weeks N] [--chunk-hours N]
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import os
+import sys
+import time
+
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from changes.config import create_app, db  # NOQA
+from changes.lib.partitioning import RangePartitioning  # NOQA
+
+PLAIN = 'bench_test_plain'
+PARTITIONED = 'bench_test_partitioned'
+
+
+def wal_position():
+    return db.session.execute('SELECT pg_current_wal_insert_lsn()').scalar()
+
+
+def wal_bytes_since(position):
+    return db.session.execute(
+        'SELECT pg_wal_lsn_diff(pg_current_wal_insert_lsn(), :position)', {'position': position},
+    ).scalar()
+
+
+def fill(table, rows, start, weeks):
+    """`rows` tests spread evenly over `weeks` weeks from `start`, in two projects."""
+    db.session.execute("""
+        INSERT INTO {} (id, job_id, project_id, label_sha, name, result, duration, date_created)
+        SELECT md5(n::text || 'id')::uuid, md5((n / 1000)::text)::uuid,
+            md5((n % 2)::text)::uuid, md5(n::text), 'tests/test_' || n, 1, n % 1000,
+            :start + (n::bigint * :seconds / :rows) * interval '1 second'
+        FROM generate_series(0, :rows - 1) n
+    """.format(table), {'start': start, 'rows': rows, 'seconds': weeks * 7 * 86400})
+    db.session.commit()
+
+
+def measure(label, func):
+    position = wal_position()
+    started = time.time()
+    removed = func()
+    elapsed = time.time() - started
+    wal = wal_bytes_since(position)
+    print('{:<32} {:>10} {:>9.2f}s {:>12.0f} {:>14}'.format(
+        label, removed, elapsed, removed / elapsed if elapsed else 0, wal))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--weeks', type=int, default=4)
+    parser.add_argument('--chunk-hours', type=int, default=1)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        partitioning = RangePartitioning(PARTITIONED)
+        start = partitioning.align(datetime(2016, 1, 4))
+        # everything but the last week is expired
+        cutoff = start + timedelta(weeks=args.weeks - 1)
+        try:
+            db.session.execute('CREATE TABLE {} (LIKE test INCLUDING ALL)'.format(PLAIN))
+            db.session.execute(
+                'CREATE TABLE {} (LIKE test INCLUDING DEFAULTS) PARTITION BY RANGE (date_created)'
+                .format(PARTITIONED))
+            db.session.execute('ALTER TABLE {} ADD PRIMARY KEY (id, date_created)'.format(PARTITIONED))
+            for columns in ('project_id', 'project_id, label_sha', 'project_id, label_sha, date_created',
+                            'date_created', 'step_id'):
+                db.session.execute('CREATE INDEX ON {} ({})'.format(PARTITIONED, columns))
+            db.session.execute('CREATE UNIQUE INDEX ON {} (job_id, label_sha, date_created)'.format(PARTITIONED))
+            partitioning.create_partitions(start, start + timedelta(weeks=args.weeks))
+            db.session.commit()
+
+            fill(PLAIN, args.rows, start, args.weeks)
+            fill(PARTITIONED, args.rows, start, args.weeks)
+            db.session.execute('CHECKPOINT')
+
+            print('{} tests over {} weeks, removing the first {} weeks\n'.format(
+                args.rows, args.weeks, args.weeks - 1))
+            print('{:<32} {:>10} {:>10} {:>12} {:>14}'.format('', 'rows', 'time', 'rows/s', 'WAL bytes'))
+
+            def delete_chunks():
+                removed = 0
+                chunk_start = start
+                while chunk_start < cutoff:
+                    chunk_end = chunk_start + timedelta(hours=args.chunk_hours)
+                    for project in range(2):
+                        removed += db.session.execute("""
+                            DELETE FROM {} WHERE project_id = md5(:project)::uuid
+                            AND date_created >= :start AND date_created < :end
+                        """.format(PLAIN), {'project': str(project), 'start': chunk_start,
+                                            'end': chunk_end}).rowcount
+                        db.session.commit()
+                    chunk_start = chunk_end
+                return removed
+
+            expired = db.session.execute('SELECT count(*) FROM {} WHERE date_created < :cutoff'.format(
+                PARTITIONED), {'cutoff': cutoff}).scalar()
+
+            def drop_partitions():
+                partitioning.drop_partitions_before(cutoff)
+                return expired
+
+            measure('chunked DELETE ({}h chunks)'.format(args.chunk_hours), delete_chunks)
+            measure('DETACH + DROP partitions', drop_partitions)
+        finally:
+            db.session.rollback()
+            db.session.execute('DROP TABLE IF EXISTS {}'.format(PLAIN))
+            db.session.execute('DROP TABLE IF EXISTS {}'.format(PARTITIONED))
+            db.session.commit()
+
+
+if __name__ == '__main__':
+    main()
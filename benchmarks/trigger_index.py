@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Compares working out which projects' file whitelists a commit's changed files
+match, by matching each project's patterns against the files (as
+changes.utils.project_trigger does) and with a TriggerIndex, for a synthetic
+monorepo.
+
+Usage: python benchmarks/trigger_index.py [--projects N] [--files N] [--repeat N]
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from changes.lib import trigger_index  # NOQA
+from changes.utils import project_trigger  # NOQA
+
+
+def make_whitelists(count):
+    """
+    Each project builds its own directory and a few of the shared libraries,
+    and one in ten has no whitelist. Shapes of pattern vary the way they do
+    in practice.
+    """
+    rand = random.Random(0)
+    whitelists = {}
+    for n in range(count):
+        if n % 10 == 9:
+            whitelists[n] = []
+            continue
+        patterns = ['services/svc{:04d}/*'.format(n)]
+        for lib in rand.sample(range(count // 4), 5):
+            patterns.append(rand.choice((
+                'libs/lib{:04d}/*',
+                'libs/lib{:04d}/*.py',
+                'libs/lib{:04d}/src/*/BUILD',
+            )).format(lib))
+        patterns.append('proto/svc{:04d}.proto'.format(n))
+        if n % 50 == 0:
+            patterns.append('*.bzl')
+        whitelists[n] = patterns
+    return whitelists
+
+
+def make_files(count, projects):
+    """A large commit's changed files, mostly in a few corners of the tree."""
+    rand = random.Random(1)
+    files = set()
+    while len(files) < count:
+        kind = rand.random()
+        if kind < 0.6:
+            path = 'libs/lib{:04d}/src/m{}/f{}.py'.format(
+                rand.randrange(projects // 4), rand.randrange(20), rand.randrange(1000))
+        elif kind < 0.9:
+            path = 'third_party/pkg{}/f{}.c'.format(rand.randrange(200), rand.randrange(1000))
+        elif kind < 0.99:
+            path = 'services/svc{:04d}/f{}.go'.format(rand.randrange(projects), rand.randrange(100))
+        else:
+            path = 'tools/rules{}.bzl'.format(rand.randrange(100))
+        files.add(path)
+    return sorted(files)
+
+
+def match_each(whitelists, files):
+    """Each project's whitelist against every file, until one matches."""
+    matched = set()
+    for project_id, patterns in whitelists.items():
+        options = {'build.file-whitelist': '\n'.join(patterns)}
+        if patterns and project_trigger._in_project_files_whitelist(options, files):
+            matched.add(project_id)
+    return matched
+
+
+def match_index(whitelists, files):
+    index = trigger_index.get_trigger_index('repo', whitelists)
+    return set(index.match(files))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--projects', type=int, default=1000)
+    parser.add_argument('--files', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    whitelists = make_whitelists(args.projects)
+    files = make_files(args.files, args.projects)
+    assert match_each(whitelists, files) == match_index(whitelists, files)
+
+    print('{} projects, {} changed files, best of {}'.format(args.projects, args.files, args.repeat))
+    print()
+
+    def best(func):
+        return min(timeit.repeat(func, number=1, repeat=args.repeat)) * 1000
+
+    def build():
+        trigger_index._index_cache.clear()
+        trigger_index.get_trigger_index('repo', whitelists)
+
+    results = [
+        ('each', best(lambda: match_each(whitelists, files))),
+        ('index, building it', best(lambda: (build(), match_index(whitelists, files)))),
+        ('index, cached', best(lambda: match_index(whitelists, files))),
+        ('  of which building', best(build)),
+    ]
+    for name, ms in results:
+        print('{:<22}{:>10.1f}ms'.format(name, ms))
+
+
+if __name__ == '__main__':
+    main()
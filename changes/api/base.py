@@ -2,31 +2,39 @@ import json
 
 from base64 import urlsafe_b64encode, urlsafe_b64decode
 from functools import wraps
+from hashlib import sha1
 from urllib import quote
 import logging
 
-from flask import Response, request, current_app
+from flask import Response, request, current_app, stream_with_context
 
 from flask.ext.sqlalchemy import get_debug_queries
 
 from flask.ext.restful import Resource
+from sqlalchemy.orm import Query
 
 from changes.api.serializer import serialize as serialize_func
+from changes.api.serializer.preload import pop_lazy_loads
 from changes.config import db
 from changes.config import statsreporter
+from changes.utils import json_encoding
+from changes.utils.batching import batched
 
 from time import time
 
 LINK_HEADER = '<{uri}&page={page}>; rel="{name}"'
 
+# number of items serialized and encoded at a time by APIView.respond_stream
+STREAM_CHUNK_SIZE = 500
+
 
 def _as_json(context):
     try:
-        return json.dumps(context)
+        return json_encoding.dumps(context, native_types=True)
     except TypeError:
         logging.warning(
             "unable to json-encode api response. Was the data not serialized?")
-        return json.dumps(serialize_func(context))
+        return json_encoding.dumps(serialize_func(context), native_types=True)
 
 
 def error(message, problems=None, http_code=400):
@@ -91,6 +99,10 @@ class ParamError(APIError):
 
 
 class APIView(Resource):
+    # Leave datetimes, Enums and UUIDs to the JSON encoder instead of crumbling
+    # them in `serialize` (which gives the same output, faster). Views that
+    # inspect their serialized data before responding should leave this off.
+    native_json_types = False
 
     def __init__(self, *args, **kwargs):
         super(APIView, self).__init__(*args, **kwargs)
@@ -102,15 +114,59 @@ class APIView(Resource):
         self.start_time = time()
 
         try:
-            response = super(APIView, self).dispatch_request(*args, **kwargs)
+            etag = self._get_etag(*args, **kwargs)
+            if etag is not None and request.if_none_match.contains_weak(etag):
+                statsreporter.stats().incr('changes_api_not_modified_class_{}'.format(
+                    self.__class__.__name__))
+                response = self._finalize_response(Response(status=304))
+            else:
+                response = super(APIView, self).dispatch_request(*args, **kwargs)
         except Exception:
             db.session.rollback()
             raise
         else:
-            db.session.commit()
+            # streamed responses (see respond_stream) keep reading from the
+            # session while the body is generated, and end the transaction
+            # themselves once they're done.
+            if not (isinstance(response, Response) and response.is_streamed):
+                db.session.commit()
+
+        if etag is not None and response.status_code in (200, 304):
+            response.set_etag(etag, weak=True)
+            # make browsers revalidate (with If-None-Match) on every request
+            response.headers['Cache-Control'] = 'no-cache'
         return response
 
-    def paginate(self, queryset, max_per_page=100, **kwargs):
+    def get_version(self, *args, **kwargs):
+        """
+        Returns a value that changes whenever the response to a GET request
+        (with the same arguments) would, or None to always send the full
+        response.
+
+        Views that implement this get ETags, and requests whose If-None-Match
+        matches are answered with 304 Not Modified without calling `get`. It
+        should be much cheaper than `get` (e.g. a single query for the
+        modification dates and row counts that the response depends on), and
+        it must cover everything in the response that can change.
+        """
+        return None
+
+    def _get_etag(self, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        version = self.get_version(*args, **kwargs)
+        if version is None:
+            return None
+        version = json_encoding.dumps(
+            [self.__class__.__name__, request.full_path, version], native_types=True)
+        return sha1(version).hexdigest()
+
+    def paginate(self, queryset, max_per_page=100, stream=False, **kwargs):
+        """
+        Responds with a page of `queryset` based on the `page` and `per_page`
+        request args. If `stream` is set, an unpaginated request (per_page=0)
+        is sent with `respond_stream` instead of being loaded all at once.
+        """
         page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', 25) or 0)
         if max_per_page and per_page > max_per_page:
@@ -125,6 +181,8 @@ class APIView(Resource):
         if per_page:
             offset = (page - 1) * per_page
             result = list(queryset[offset:offset + per_page + 1])
+        elif stream:
+            return self.respond_stream(queryset, **kwargs)
         else:
             page = 1
             result = list(queryset)
@@ -301,6 +359,69 @@ class APIView(Resource):
             mimetype='application/json',
             status=status_code,
         )
+        return self._finalize_response(response, links)
+
+    def respond_stream(self, items, status_code=200, serialize=True, serializers=None,
+                       links=None, key=None, as_object=False, chunk_size=STREAM_CHUNK_SIZE):
+        """
+        Like `respond`, but for large lists: `items` (e.g. a query) is consumed
+        lazily, and serialized and JSON-encoded `chunk_size` items at a time
+        while the response body is sent, so the full payload is never held in
+        memory.
+
+        If `key` is given, the list is wrapped in an object ({key: [...]}).
+        If `as_object` is set, `items` must be (name, value) pairs, which are
+        encoded as a single JSON object instead of a list.
+        """
+        if as_object:
+            start, end = '{', '}'
+        else:
+            start, end = '[', ']'
+        if key is not None:
+            start = '{%s:%s' % (json.dumps(key), start)
+            end = end + '}'
+        if isinstance(items, Query):
+            items = items.yield_per(chunk_size)
+
+        def encode(chunk):
+            if as_object:
+                names = [name for name, _ in chunk]
+                values = [value for _, value in chunk]
+                if serialize:
+                    values = self.serialize(values, serializers)
+                return ','.join(
+                    '%s:%s' % (json.dumps(name), _as_json(value))
+                    for name, value in zip(names, values)
+                )
+            if serialize:
+                chunk = self.serialize(chunk, serializers)
+            return ','.join(_as_json(item) for item in chunk)
+
+        def generate():
+            try:
+                yield start
+                first = True
+                for chunk in batched(items, chunk_size):
+                    data = encode(chunk)
+                    if not first:
+                        data = ',' + data
+                    first = False
+                    yield data
+                yield end
+            except Exception:
+                db.session.rollback()
+                raise
+            else:
+                db.session.commit()
+
+        response = Response(
+            stream_with_context(generate()),
+            mimetype='application/json',
+            status=status_code,
+        )
+        return self._finalize_response(response, links)
+
+    def _finalize_response(self, response, links=None):
         if links:
             response.headers['Link'] = ', '.join(links)
 
@@ -320,7 +441,17 @@ class APIView(Resource):
         statsreporter.stats().log_timing(db_timer_name, db_time_in_sec * 1000)
         response.headers['changes-server-db-time'] = db_time_in_sec
 
+        # queries issued from within Crumbler.crumble (only tracked when
+        # API_DEBUG_LAZY_LOADS is set); these are missing `eager_load`s
+        lazy_loads = pop_lazy_loads()
+        if lazy_loads:
+            response.headers['changes-lazy-loads'] = sum(lazy_loads.itervalues())
+            logging.warning('%s triggered lazy loads during serialization: %s',
+                            self.__class__.__name__,
+                            ', '.join('{}={}'.format(k, v) for k, v in sorted(lazy_loads.iteritems())))
+
         return response
 
     def serialize(self, *args, **kwargs):
+        kwargs.setdefault('native_types', self.native_json_types)
         return serialize_func(*args, **kwargs)
@@ -1,8 +1,9 @@
-from changes.api.base import APIView
+from changes.api.base import APIView, STREAM_CHUNK_SIZE
 
-from changes.lib.coverage import get_coverage_by_build_id, merged_coverage_data
+from changes.lib.coverage import get_coverage_by_build_id, iter_merged_coverage_data
 
 from changes.models.build import Build
+from changes.models.filecoverage import FileCoverage
 
 
 class BuildTestCoverageAPIView(APIView):
@@ -11,6 +12,9 @@ class BuildTestCoverageAPIView(APIView):
         if build is None:
             return '', 404
 
-        coverage = merged_coverage_data(get_coverage_by_build_id(build.id))
+        coverage = get_coverage_by_build_id(build.id).order_by(
+            FileCoverage.filename,
+        ).yield_per(STREAM_CHUNK_SIZE)
 
-        return self.respond(coverage)
+        return self.respond_stream(iter_merged_coverage_data(coverage),
+                                   serialize=False, as_object=True)
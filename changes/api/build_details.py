@@ -81,6 +81,8 @@ def get_parents_last_builds(build):
 
 
 class BuildDetailsAPIView(APIView):
+    native_json_types = True
+
     post_parser = RequestParser()
     post_parser.add_argument('priority', choices=BuildPriority._member_names_)
 
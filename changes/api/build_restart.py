@@ -10,6 +10,7 @@ from changes.models.build import Build
 from changes.models.job import Job
 from changes.models.jobstep import JobStep
 from changes.models.itemstat import ItemStat
+from changes.models.test import TestCase, delete_test_children
 
 
 class BuildRestartAPIView(APIView):
@@ -39,6 +40,10 @@ class BuildRestartAPIView(APIView):
             stat_ids.extend(job_ids)
             stat_ids.extend(step_ids)
 
+            delete_test_children(TestCase.query.filter(
+                TestCase.job_id.in_(job_ids),
+            ))
+
         if stat_ids:
             ItemStat.query.filter(
                 ItemStat.item_id.in_(stat_ids),
@@ -21,6 +21,8 @@ RESULT_CHOICES = [r.name for r in Result] + ['']
 
 
 class BuildTestIndexAPIView(APIView):
+    native_json_types = True
+
     parser = reqparse.RequestParser()
     parser.add_argument('query', type=unicode, location='args')
     parser.add_argument('result', type=unicode, location='args',
@@ -68,4 +70,4 @@ class BuildTestIndexAPIView(APIView):
 
         test_list = test_list.order_by(sort_dir(sort_col))
 
-        return self.paginate(test_list, max_per_page=None)
+        return self.paginate(test_list, max_per_page=None, stream=True)
@@ -7,7 +7,7 @@ from flask_restful.reqparse import RequestParser
 
 from changes.api.base import APIView, error
 from changes.api.validators.datetime import ISODatetime
-from changes.config import db, redis, statsreporter
+from changes.config import db, queue, redis, statsreporter
 from changes.constants import Result, Status
 from changes.expanders.bazel_targets import BazelTargetsExpander
 from changes.expanders.commands import CommandsExpander
@@ -58,6 +58,8 @@ class CommandDetailsAPIView(APIView):
         if lock:
             lock.__enter__()
 
+        # sync tasks for expanded jobsteps, queued once the lock is released
+        tasks = []
         try:
             command = Command.query.get(command_id)
             if command is None:
@@ -111,7 +113,7 @@ class CommandDetailsAPIView(APIView):
                         db.session.rollback()
                         return '', 500
 
-                    self.expand_command(command, expander, args.output)
+                    tasks = self.expand_command(command, expander, args.output)
 
             db.session.commit()
 
@@ -119,12 +121,20 @@ class CommandDetailsAPIView(APIView):
             if lock:
                 lock.__exit__(None, None, None)
 
+        if tasks:
+            queue.delay_many(tasks)
+
         return self.respond(command)
 
     def get_expander(self, type):
         return EXPANDERS.get(type)
 
     def expand_command(self, command, expander, data):
+        """
+        Creates the expander's jobsteps (uncommitted), and Tasks to sync them.
+        Returns the tasks, to be queued with queue.delay_many once they're
+        committed.
+        """
         jobstep = command.jobstep
         phase_name = data.get('phase')
         if not phase_name:
@@ -140,12 +150,11 @@ class CommandDetailsAPIView(APIView):
 
         _, buildstep = JobPlan.get_build_step_for_job(jobstep.job_id)
 
-        results = []
-        for future_jobstep in expander.expand(job=jobstep.job,
-                                              max_executors=jobstep.data['max_executors'],
-                                              test_stats_from=buildstep.get_test_stats_from()):
-            new_jobstep = buildstep.create_expanded_jobstep(jobstep, new_jobphase, future_jobstep)
-            results.append(new_jobstep)
+        results = buildstep.create_expanded_jobsteps(jobstep, new_jobphase, expander.expand(
+            job=jobstep.job,
+            max_executors=jobstep.data['max_executors'],
+            test_stats_from=buildstep.get_test_stats_from(),
+        ))
 
         # If there are no tests to run, the phase is done.
         if len(results) == 0:
@@ -155,11 +164,8 @@ class CommandDetailsAPIView(APIView):
 
         db.session.flush()
 
-        for new_jobstep in results:
-            sync_job_step.delay_if_needed(
-                step_id=new_jobstep.id.hex,
-                task_id=new_jobstep.id.hex,
-                parent_task_id=new_jobphase.job.id.hex,
-            )
-
-        return results
+        return sync_job_step.create_many([{
+            'step_id': new_jobstep.id.hex,
+            'task_id': new_jobstep.id.hex,
+            'parent_task_id': new_jobphase.job_id.hex,
+        } for new_jobstep in results])
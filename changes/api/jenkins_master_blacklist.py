@@ -3,7 +3,7 @@ from __future__ import absolute_import
 from flask.ext.restful import reqparse
 
 from changes.api.base import APIView
-from changes.backends.jenkins.builder import MASTER_BLACKLIST_KEY
+from changes.backends.jenkins.builder import MASTER_BLACKLIST_KEY, master_blacklist_cache
 from changes.config import redis
 
 
@@ -47,6 +47,8 @@ class JenkinsMasterBlacklistAPIView(APIView):
         else:
             if 0 == redis.sadd(MASTER_BLACKLIST_KEY, master):
                 warning = 'The master was already on the blacklist'
+        # so every process picks masters from the new blacklist
+        master_blacklist_cache.invalidate(MASTER_BLACKLIST_KEY)
 
         response = dict()
         blacklist = list(redis.smembers(MASTER_BLACKLIST_KEY))
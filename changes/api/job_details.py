@@ -14,6 +14,8 @@ from changes.utils.originfinder import find_failure_origins
 
 
 class JobDetailsAPIView(APIView):
+    native_json_types = True
+
     def get(self, job_id):
         job = Job.query.options(
             joinedload('project', innerjoin=True),
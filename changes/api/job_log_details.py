@@ -3,7 +3,8 @@ from __future__ import absolute_import, division, unicode_literals
 from flask import Response, request
 
 from changes.api.base import APIView
-from changes.models.log import LogChunk, LogSource
+from changes.lib import log_segments
+from changes.models.log import LogSource
 
 
 LOG_BATCH_SIZE = 50000  # in length of chars
@@ -27,33 +28,19 @@ class JobLogDetailsAPIView(APIView):
         elif limit == -1:
             limit = LOG_BATCH_SIZE
 
-        queryset = LogChunk.query.filter(
-            LogChunk.source_id == source.id,
-        ).order_by(LogChunk.offset.desc())
-
         if offset == -1:
             # starting from the end so we need to know total size
-            tail = queryset.limit(1).first()
+            size = log_segments.get_log_size(source)
 
-            if tail is None:
+            if not size:
                 logchunks = []
+            elif limit:
+                logchunks = log_segments.get_chunks(source, min_end=max(size - limit, 0))
             else:
-                if limit:
-                    queryset = queryset.filter(
-                        (LogChunk.offset + LogChunk.size) >= max(tail.offset + tail.size - limit, 0),
-                    )
-                logchunks = list(queryset)
+                logchunks = log_segments.get_chunks(source)
         else:
-            queryset = queryset.filter(
-                LogChunk.offset > offset,
-            )
-            if limit:
-                queryset = queryset.filter(
-                    LogChunk.offset <= offset + limit,
-                )
-            logchunks = list(queryset)
-
-        logchunks.sort(key=lambda x: x.date_created)
+            logchunks = log_segments.get_chunks(
+                source, after=offset, until=offset + limit if limit else None)
 
         if logchunks:
             next_offset = logchunks[-1].offset + logchunks[-1].size + 1
@@ -63,6 +50,9 @@ class JobLogDetailsAPIView(APIView):
         if raw:
             return Response(''.join(l.text for l in logchunks), mimetype='text/plain')
 
+        return self.respond_with_chunks(source, logchunks, next_offset)
+
+    def respond_with_chunks(self, source, logchunks, next_offset):
         context = self.serialize({
             'source': source,
             'chunks': logchunks,
@@ -0,0 +1,64 @@
+from __future__ import absolute_import, division, unicode_literals
+
+from flask import current_app
+from flask_restful import reqparse
+
+from changes.api.base import error
+from changes.api.job_log_details import JobLogDetailsAPIView
+from changes.config import db
+from changes.constants import Status
+from changes.lib import log_segments, log_tail
+from changes.models.log import LogSource
+
+
+class JobLogTailAPIView(JobLogDetailsAPIView):
+    get_parser = reqparse.RequestParser()
+
+    """How much of the log has been read (the previous response's nextOffset)."""
+    get_parser.add_argument('offset', type=int, required=True)
+
+    """The most text to return (in characters); capped at LOG_TAIL_MAX_BYTES."""
+    get_parser.add_argument('limit', type=int, default=0)
+
+    def get(self, job_id, source_id):
+        """
+        Long-polls for chunks of a LogSource: responds as soon as there are
+        any from `offset` on, or with none once LOG_TAIL_TIMEOUT seconds pass
+        (or straight away, if the step has finished). Responses are in the
+        same format as JobLogDetailsAPIView's, but nextOffset is the length
+        of the log read so far, to pass back as `offset`.
+        """
+        source = LogSource.query.get(source_id)
+        if source is None or source.job_id != job_id:
+            return '', 404
+
+        args = self.get_parser.parse_args()
+        if args.offset < 0:
+            return error('offset must not be negative', ['offset'])
+        max_bytes = current_app.config['LOG_TAIL_MAX_BYTES']
+        limit = min(args.limit, max_bytes) if args.limit > 0 else max_bytes
+
+        def fetch():
+            chunks = log_segments.get_chunks(
+                source, after=args.offset - 1, until=args.offset + limit - 1)
+            if not chunks:
+                # don't hold a transaction open while waiting
+                db.session.rollback()
+            return chunks
+
+        if source.step and source.step.status == Status.finished:
+            logchunks = fetch()
+        else:
+            try:
+                with log_tail.tailer_slot(current_app.config['LOG_TAIL_MAX_CONNECTIONS']):
+                    logchunks = log_tail.wait_for_chunks(
+                        source.id, args.offset, fetch, current_app.config['LOG_TAIL_TIMEOUT'])
+            except log_tail.TooManyTailers:
+                return error('Too many logs are being tailed; try again shortly', http_code=503)
+
+        if logchunks:
+            next_offset = logchunks[-1].offset + logchunks[-1].size
+        else:
+            next_offset = args.offset
+
+        return self.respond_with_chunks(source, logchunks, next_offset)
@@ -4,12 +4,15 @@ from collections import defaultdict
 
 from flask import request
 
+from sqlalchemy import select
 from sqlalchemy.orm import joinedload, subqueryload_all
 from sqlalchemy.sql import func
 
 from changes.api.base import APIView
 from changes.api.serializer.models.logsource import LogSourceWithoutStepCrumbler
 from changes.constants import Result
+from changes.db.utils import count_where
+from changes.models.command import Command
 from changes.models.job import Job
 from changes.models.jobphase import JobPhase
 from changes.models.jobstep import JobStep
@@ -19,6 +22,51 @@ from changes.config import db
 
 
 class JobPhaseIndexAPIView(APIView):
+    def get_version(self, job_id):
+        job = db.session.query(
+            Job.status, Job.result, Job.date_modified, Job.date_started,
+            Job.date_finished,
+            count_where(LogSource, LogSource.step_id.in_(
+                select([JobStep.id]).where(JobStep.job_id == job_id))),
+        ).filter(
+            Job.id == job_id,
+        ).first()
+        if job is None:
+            return None
+
+        steps = db.session.query(
+            JobStep.id, JobStep.status, JobStep.result, JobStep.node_id,
+            JobStep.replacement_id, JobStep.date_started, JobStep.date_finished,
+            JobStep.data,
+        ).filter(
+            JobStep.job_id == job_id,
+        ).order_by(JobStep.id)
+        # what test_counts reports; results can change without the number
+        # of tests changing
+        test_failures = db.session.query(
+            TestCase.step_id, func.count(),
+        ).filter(
+            TestCase.job_id == job_id,
+            TestCase.result == Result.failed,
+        ).group_by(TestCase.step_id).order_by(TestCase.step_id)
+        phases = db.session.query(
+            JobPhase.id, JobPhase.status, JobPhase.result, JobPhase.date_started,
+            JobPhase.date_finished,
+        ).filter(
+            JobPhase.job_id == job_id,
+        ).order_by(JobPhase.id)
+        commands = db.session.query(
+            func.count(Command.id), func.max(Command.date_started), func.max(Command.date_finished),
+        ).join(
+            JobStep, JobStep.id == Command.jobstep_id,
+        ).filter(
+            JobStep.job_id == job_id,
+        ).one()
+        return [
+            list(job), [list(s) for s in steps], [list(t) for t in test_failures],
+            [list(p) for p in phases], list(commands),
+        ]
+
     def get(self, job_id):
         get_test_counts = request.args.get('test_counts', False)
 
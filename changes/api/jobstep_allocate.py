@@ -3,14 +3,16 @@ import json
 import logging
 from datetime import datetime
 from uuid import UUID
-from flask import request
+from flask import Response, current_app, request
 from flask_restful.reqparse import RequestParser
+from redis.exceptions import RedisError
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.sql import func
 from changes.api.base import APIView, error
 from changes.constants import Status
-from changes.config import db, redis, statsreporter
-from changes.ext.redis import UnableToGetLock
+from changes.config import db, statsreporter
+from changes.lib import allocation_index
+from changes.lib.allocation_index import MAX_ACTIVE_JOBS_PER_PROJECT
 from changes.models.build import Build
 from changes.models.job import Job
 from changes.models.jobplan import JobPlan
@@ -19,7 +21,18 @@ from changes.constants import DEFAULT_CPUS, DEFAULT_MEMORY_MB
 
 
 class JobStepAllocateAPIView(APIView):
+    native_json_types = True
+
     def find_next_jobsteps(self, limit=10, cluster=None):
+        if current_app.config['ALLOCATION_INDEX_ENABLED']:
+            try:
+                if allocation_index.ensure_ready():
+                    return allocation_index.find_next_jobsteps(limit, cluster)
+            except RedisError:
+                logging.warning('Unable to use the allocation index', exc_info=True)
+        return self._find_next_jobsteps_from_db(limit, cluster)
+
+    def _find_next_jobsteps_from_db(self, limit=10, cluster=None):
         cluster_filter = JobStep.cluster == cluster if cluster else JobStep.cluster.is_(None)
 
         # find projects with pending allocations
@@ -48,7 +61,7 @@ class JobStepAllocateAPIView(APIView):
             ).group_by(
                 Job.project_id,
             )
-            if c >= 10
+            if c >= MAX_ACTIVE_JOBS_PER_PROJECT
             ]
 
         base_filters = [
@@ -134,6 +147,9 @@ class JobStepAllocateAPIView(APIView):
                 }
                 jobstep_data['cmd'] = allocation_cmd
 
+            # not streamed: a scheduler given a truncated list with a 200
+            # (if building it fails part way) can't tell it apart from a
+            # short one
             return self.respond({'jobsteps': jobstep_results})
 
     def post(self):
@@ -162,42 +178,66 @@ class JobStepAllocateAPIView(APIView):
         cluster = args.get('cluster')
 
         with statsreporter.stats().timer('jobstep_allocate_post'):
+            # Claiming the jobsteps in the index stops other schedulers from
+            # being offered them while we allocate them. Jobsteps that
+            # aren't in the index (e.g. because it's being rebuilt) are still
+            # allocated if the database says they're pending; the row locks
+            # below stop them being allocated twice.
+            claimed = False
+            if current_app.config['ALLOCATION_INDEX_ENABLED']:
+                try:
+                    if allocation_index.is_ready():
+                        claimed = not allocation_index.claim(jobstep_ids, cluster)
+                except RedisError:
+                    logging.warning('Unable to use the allocation index', exc_info=True)
+
             try:
-                lock_key = 'jobstep:allocate'
-                if cluster:
-                    lock_key = lock_key + ':' + cluster
-                with redis.lock(lock_key, nowait=True):
-                    jobsteps = JobStep.query.filter(JobStep.id.in_(jobstep_ids))
-
-                    for jobstep in jobsteps:
-                        if jobstep.cluster != cluster:
-                            db.session.rollback()
-                            err = 'Jobstep is in cluster %s but tried to allocate in cluster %s (id=%s, project=%s)'
-                            err_args = (jobstep.cluster, cluster, jobstep.id.hex, jobstep.project.slug)
-                            logging.warning(err, *err_args)
-                            return error(err % err_args)
-                        if jobstep.status != Status.pending_allocation:
-                            db.session.rollback()
-                            err = 'Jobstep %s for project %s was already allocated'
-                            err_args = (jobstep.id.hex, jobstep.project.slug)
-                            logging.warning(err, *err_args)
-                            return error(err % err_args, http_code=409)
-
-                        jobstep.status = Status.allocated
-                        jobstep.last_heartbeat = datetime.utcnow()
-                        db.session.add(jobstep)
-                        # The JobSteps returned are pending_allocation, and the initial state for a Mesos JobStep is
-                        # pending_allocation, so we can determine how long it was pending by how long ago it was
-                        # created.
-                        pending_seconds = (datetime.utcnow() - jobstep.date_created).total_seconds()
-                        statsreporter.stats().log_timing('duration_pending_allocation', pending_seconds * 1000)
-
-                    db.session.commit()
-
-                    return self.respond({'allocated': jobstep_ids})
-            except UnableToGetLock:
-                return error('Another allocation is in progress', http_code=409)
-            except IntegrityError:
-                err = 'Could not commit allocation'
-                logging.warning(err, exc_info=True)
-                return error(err, http_code=409)
+                response = self._allocate(jobstep_ids, cluster)
+            except Exception:
+                if claimed:
+                    db.session.rollback()
+                    allocation_index.requeue(UUID(id) for id in jobstep_ids)
+                raise
+            if claimed and not isinstance(response, Response):
+                allocation_index.requeue(UUID(id) for id in jobstep_ids)
+            return response
+
+    def _allocate(self, jobstep_ids, cluster):
+        try:
+            # locked in a consistent order, so that overlapping allocations
+            # can't deadlock
+            jobsteps = JobStep.query.filter(
+                JobStep.id.in_(jobstep_ids),
+            ).order_by(JobStep.id).with_for_update()
+
+            for jobstep in jobsteps:
+                if jobstep.cluster != cluster:
+                    db.session.rollback()
+                    err = 'Jobstep is in cluster %s but tried to allocate in cluster %s (id=%s, project=%s)'
+                    err_args = (jobstep.cluster, cluster, jobstep.id.hex, jobstep.project.slug)
+                    logging.warning(err, *err_args)
+                    return error(err % err_args)
+                if jobstep.status != Status.pending_allocation:
+                    db.session.rollback()
+                    err = 'Jobstep %s for project %s was already allocated'
+                    err_args = (jobstep.id.hex, jobstep.project.slug)
+                    logging.warning(err, *err_args)
+                    return error(err % err_args, http_code=409)
+
+                jobstep.status = Status.allocated
+                jobstep.last_heartbeat = datetime.utcnow()
+                db.session.add(jobstep)
+                # The JobSteps returned are pending_allocation, and the initial state for a Mesos JobStep is
+                # pending_allocation, so we can determine how long it was pending by how long ago it was
+                # created.
+                pending_seconds = (datetime.utcnow() - jobstep.date_created).total_seconds()
+                statsreporter.stats().log_timing('duration_pending_allocation', pending_seconds * 1000)
+
+            db.session.commit()
+
+            return self.respond({'allocated': jobstep_ids})
+        except IntegrityError:
+            db.session.rollback()
+            err = 'Could not commit allocation'
+            logging.warning(err, exc_info=True)
+            return error(err, http_code=409)
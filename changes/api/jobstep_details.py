@@ -34,6 +34,8 @@ assert set(STATUS_CHOICES) <= set(Status.__members__.keys())
 
 
 class JobStepDetailsAPIView(APIView):
+    native_json_types = True
+
     post_parser = RequestParser()
     post_parser.add_argument('date', type=ISODatetime())
     post_parser.add_argument('status', choices=STATUS_CHOICES)
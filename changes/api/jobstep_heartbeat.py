@@ -1,20 +1,42 @@
 from __future__ import absolute_import
 
+import logging
+
 from datetime import datetime
+from flask import current_app
 from flask_restful.reqparse import RequestParser
+from redis import RedisError
 
 from changes.api.base import APIView, error
 from changes.api.validators.datetime import ISODatetime
 from changes.config import db
 from changes.constants import Result
+from changes.lib import heartbeats
 from changes.models.jobstep import JobStep
 
+logger = logging.getLogger('changes.heartbeats')
+
 
 class JobStepHeartbeatAPIView(APIView):
     post_parser = RequestParser()
     post_parser.add_argument('date', type=ISODatetime())
 
     def post(self, step_id):
+        buffered = current_app.config['JOBSTEP_HEARTBEAT_BUFFER_ENABLED']
+
+        args = self.post_parser.parse_args()
+
+        current_datetime = args.date or datetime.utcnow()
+
+        if buffered:
+            try:
+                if heartbeats.is_checked(step_id):
+                    heartbeats.record(step_id, current_datetime)
+                    return self.respond({'id': step_id.hex, 'lastHeartbeat': current_datetime})
+            except RedisError:
+                logger.warning('Unable to buffer heartbeat for jobstep %s', step_id.hex, exc_info=True)
+                buffered = False
+
         jobstep = JobStep.query.get(step_id)
         if jobstep is None:
             return error("Not found", http_code=404)
@@ -24,9 +46,13 @@ class JobStepHeartbeatAPIView(APIView):
         if jobstep.result == Result.aborted:
             return error("Aborted", http_code=410)
 
-        args = self.post_parser.parse_args()
-
-        current_datetime = args.date or datetime.utcnow()
+        if buffered:
+            try:
+                heartbeats.mark_checked(step_id, current_app.config['JOBSTEP_HEARTBEAT_CHECK_TTL'])
+                heartbeats.record(step_id, current_datetime)
+                return self.respond({'id': step_id.hex, 'lastHeartbeat': current_datetime})
+            except RedisError:
+                logger.warning('Unable to buffer heartbeat for jobstep %s', step_id.hex, exc_info=True)
 
         jobstep.last_heartbeat = current_datetime
         db.session.add(jobstep)
@@ -5,15 +5,23 @@ import logging
 import requests
 
 from datetime import datetime
+from flask import current_app
 from flask.ext.restful import reqparse
 
 from changes.api.auth import get_current_user
 from changes.api.base import APIView, error
 from changes.config import db
 from changes.lib import mesos_lib
+from changes.lib.process_cache import ProcessCache
 from changes.models.jobstep import JobStep
 from changes.models.node import Node
 
+# The Jenkins master of each node (if any), by node id.
+node_master_cache = ProcessCache('node_jenkins_master')
+
+# Whether each Jenkins node is (temporarily) offline, by its URL.
+node_offline_cache = ProcessCache('jenkins_node_offline')
+
 
 class NodeStatusAPIView(APIView):
     get_parser = reqparse.RequestParser()
@@ -68,6 +76,7 @@ class NodeStatusAPIView(APIView):
             'offlineMessage': '[changes] Disabled by %s at %s' % (user.email, timestamp)
         }
         response = requests.Session().post(toggle_url, data=data, timeout=10)
+        node_offline_cache.invalidate(self.get_jenkins_url(jenkins_master, node.label))
 
         if response.status_code != 200:
             logging.warning('Unable to toggle offline status (%s)' % (toggle_url))
@@ -82,20 +91,26 @@ class NodeStatusAPIView(APIView):
 
         # If this is not a Jenkins node, we don't have master and return an empty dict.
         if master and node.label:
-            info_url = '%s/api/json' % (self.get_jenkins_url(master, node.label))
-            node_info = None
+            node_url = self.get_jenkins_url(master, node.label)
+            offline = None
             try:
-                response = requests.Session().get(info_url, timeout=10)
-                response.raise_for_status()
-                node_info = json.loads(response.text)
+                offline = node_offline_cache.get(
+                    node_url, lambda: self.get_jenkins_offline(node_url),
+                    current_app.config['JENKINS_NODE_STATUS_CACHE_TTL'])
             except:
-                logging.warning('Unable to get node info (%s)', info_url, exc_info=True)
+                logging.warning('Unable to get node info (%s/api/json)', node_url, exc_info=True)
 
-            if node_info and 'temporarilyOffline' in node_info:
-                context['offline'] = node_info['temporarilyOffline']
+            if offline is not None:
+                context['offline'] = offline
 
         return self.respond(context, serialize=False)
 
+    def get_jenkins_offline(self, node_url):
+        """Returns whether the node is temporarily offline (or None if Jenkins doesn't say)."""
+        response = requests.Session().get('%s/api/json' % (node_url,), timeout=10)
+        response.raise_for_status()
+        return json.loads(response.text).get('temporarilyOffline')
+
     def respond_mesos_status(self, node, mesos_master):
         node_hostname = node.label.strip()
         is_active = mesos_lib.is_active_slave(mesos_master, node_hostname)
@@ -106,6 +121,11 @@ class NodeStatusAPIView(APIView):
         return {'offline': is_maintenanced}
 
     def get_jenkins_master(self, node_id):
+        return node_master_cache.get(
+            node_id.hex, lambda: self._get_jenkins_master(node_id),
+            current_app.config['JENKINS_NODE_CACHE_TTL'])
+
+    def _get_jenkins_master(self, node_id):
         jobstep_data = db.session.query(
             JobStep.data
         ).filter(
@@ -76,6 +76,6 @@ class ProjectCoverageIndexAPIView(APIView):
 
         cover_list = cover_list.order_by(sort_by)
 
-        return self.paginate(cover_list, serializers={
+        return self.paginate(cover_list, stream=True, serializers={
             FileCoverage: GeneralizedFileCoverage(),
         })
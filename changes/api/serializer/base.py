@@ -2,14 +2,23 @@ from collections import defaultdict
 from datetime import datetime
 from enum import Enum
 from uuid import UUID
-from typing import cast, Any, Callable, Dict, Generic, Iterable, List, Optional, TypeVar  # NOQA
+from typing import cast, Any, Callable, Dict, Generic, Iterable, List, Optional, Tuple, TypeVar  # NOQA
 from itertools import izip
 
+from changes.api.serializer.preload import (
+    lazy_load_tracking_enabled, preload, query_count, record_lazy_loads
+)
+
 
 # Types for which serialization is a no-op. Everything boils down to these (or
 # to objects without crumblers, which we pass through unscathed)
 _PASSTHROUGH = (basestring, bool, int, long, type(None), float)
 
+# Types that `changes.utils.json_encoding.dumps(native_types=True)` encodes
+# itself, exactly as their crumblers would. serialize(native_types=True)
+# passes these through (except as dict keys) instead of crumbling them.
+_NATIVE = (datetime, Enum, UUID)
+
 T = TypeVar('T')
 
 
@@ -22,8 +31,8 @@ class Future(object):
         self.final = final
 
 
-def _gather(data, collected):
-    # type: (object, List[Future]) -> object
+def _gather(data, collected, passthrough=_PASSTHROUGH):
+    # type: (object, List[Future], Tuple[type, ...]) -> object
     """
     Crawls `data`, and returns an equivalent structure where any non-serializable
     objects are replaced with Future objects, to be filled in later.
@@ -32,23 +41,24 @@ def _gather(data, collected):
         data: the data to crawl
         collected: list which is populated with the Future
             objects this method generates
+        passthrough: types to leave as they are
     Returns:
         An object with the same structure as `data`, but with any
         non-serializable objects replaced with Future objects.
     """
-    if isinstance(data, _PASSTHROUGH):
+    if isinstance(data, passthrough):
         return data
 
     elif isinstance(data, dict):
         # optimize for the case that keys are strings
         keys = [k if isinstance(k, _PASSTHROUGH) else _gather(k, collected)
                 for k in data.iterkeys()]
-        values = [_gather(v, collected) for v in data.itervalues()]
+        values = [_gather(v, collected, passthrough) for v in data.itervalues()]
         return dict(izip(keys, values))
 
     elif isinstance(data, (list, tuple, set, frozenset)):
         data = cast(Iterable, data)
-        return [_gather(item, collected) for item in data]
+        return [_gather(item, collected, passthrough) for item in data]
 
     else:
         # need to crumble this.
@@ -57,8 +67,8 @@ def _gather(data, collected):
         return future
 
 
-def _finalize_futures(needs_crumble, extended_registry):
-    # type: (List[Future], Optional[Dict[type, Crumbler[object]]]) -> None
+def _finalize_futures(needs_crumble, extended_registry, passthrough=_PASSTHROUGH):
+    # type: (List[Future], Optional[Dict[type, Crumbler[object]]], Tuple[type, ...]) -> None
     """
     Given a list of Future objects that need to be crumbled, crumbles them,
     and then recursively gathers and crumbles the results of the Future
@@ -69,6 +79,7 @@ def _finalize_futures(needs_crumble, extended_registry):
     Args:
         needs_crumble: list of initial Future objects to be crumbled
         extended_registry: additional crumblers to use for this serialization
+        passthrough: types to leave as they are
     """
     while needs_crumble:
         fetches_by_class = defaultdict(list)  # type: Dict[type, List[Future]]
@@ -84,12 +95,19 @@ def _finalize_futures(needs_crumble, extended_registry):
                 for future in futures:
                     future.final = future.data
                 continue
-            extra_attrs = crumbler.get_extra_attrs_from_db(
-                {future.data for future in futures})
+            items = {future.data for future in futures}
+            preload(items, crumbler.eager_load)
+            extra_attrs = crumbler.get_extra_attrs_from_db(items)
+
+            track_lazy_loads = lazy_load_tracking_enabled()
             for future in futures:
                 item = future.data
+                if track_lazy_loads:
+                    queries_before = query_count()
                 crumbled = crumbler.crumble(item, extra_attrs.get(item))
-                future.final = _gather(crumbled, needs_crumble)
+                if track_lazy_loads:
+                    record_lazy_loads(crumbler, query_count() - queries_before)
+                future.final = _gather(crumbled, needs_crumble, passthrough)
 
 
 def _expand(data):
@@ -133,8 +151,8 @@ def _expand(data):
         return data
 
 
-def serialize(data, extended_registry=None):
-    # type: (object, Optional[Dict[type, Crumbler[object]]]) -> object
+def serialize(data, extended_registry=None, native_types=False):
+    # type: (object, Optional[Dict[type, Crumbler[object]]], bool) -> object
     """
     Converts a data structure of dicts, lists, SQLAlchemy objects, and other
     random python objects into something that can be passed to JSON.dumps. This
@@ -145,14 +163,20 @@ def serialize(data, extended_registry=None):
     want to use a special crumbler for Jobs that also adds Build
     information and passes { Job: JobWithBuildCrumbler }
 
+    native_types: leave datetimes, Enums and UUIDs as they are, rather than
+    crumbling them. Only use this when the result is encoded with
+    `changes.utils.json_encoding.dumps(native_types=True)`, which gives the same
+    output for them as their crumblers.
+
     Its safe (but CPU-expensive) to rerun serialize on data multiple times
     """
+    passthrough = _PASSTHROUGH + _NATIVE if native_types else _PASSTHROUGH
     needs_crumble = []  # type: List[Future]
-    initial = _gather(data, needs_crumble)
+    initial = _gather(data, needs_crumble, passthrough)
     if not needs_crumble:
         return initial
 
-    _finalize_futures(needs_crumble, extended_registry)
+    _finalize_futures(needs_crumble, extended_registry, passthrough)
 
     # everything should be fully crumbled now, just have to assemble it
     return _expand(initial)
@@ -210,6 +234,11 @@ class Crumbler(Generic[T]):
     went to these docs to find out more.
     """
 
+    # Relationships that `crumble` traverses, as dot-separated attribute
+    # paths (e.g. 'project' or 'source.revision'). The serializer bulk-loads
+    # these for a whole layer of objects before crumbling any of them.
+    eager_load = ()  # type: Tuple[str, ...]
+
     def __call__(self, item, attrs):
         # type: (T, Dict[str, Any]) -> object
         return self.crumble(item, attrs)
@@ -4,6 +4,8 @@ from changes.models.adminmessage import AdminMessage
 
 @register(AdminMessage)
 class AdminMessageCrumbler(Crumbler):
+    eager_load = ('user',)
+
     def crumble(self, instance, attrs):
         return {
             'id': instance.id.hex,
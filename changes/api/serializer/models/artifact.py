@@ -4,6 +4,8 @@ from changes.models.artifact import Artifact
 
 @register(Artifact)
 class ArtifactCrumbler(Crumbler):
+    eager_load = ('step',)
+
     def crumble(self, instance, attrs):
         return {
             'id': instance.id.hex,
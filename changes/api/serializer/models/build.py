@@ -13,6 +13,8 @@ from collections import defaultdict
 
 @register(Build)
 class BuildCrumbler(Crumbler):
+    eager_load = ('project', 'author', 'source')
+
     def get_extra_attrs_from_db(self, item_list):
         builds_by_id = {build.id: build for build in item_list}
 
@@ -5,6 +5,8 @@ from changes.utils.http import build_web_uri
 
 @register(Change)
 class ChangeCrumbler(Crumbler):
+    eager_load = ('project', 'author')
+
     def crumble(self, instance, attrs):
         result = {
             'id': instance.id.hex,
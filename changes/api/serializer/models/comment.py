@@ -4,6 +4,8 @@ from changes.models.comment import Comment
 
 @register(Comment)
 class CommentCrumbler(Crumbler):
+    eager_load = ('user',)
+
     def crumble(self, instance, attrs):
         return {
             'id': instance.id.hex,
@@ -8,6 +8,8 @@ from changes.models.job import Job
 
 @register(Job)
 class JobCrumbler(Crumbler):
+    eager_load = ('project',)
+
     def get_extra_attrs_from_db(self, item_list):
         stat_list = ItemStat.query.filter(
             ItemStat.item_id.in_(r.id for r in item_list),
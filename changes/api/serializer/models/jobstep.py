@@ -6,6 +6,7 @@ from changes.models.jobstep import JobStep
 
 @register(JobStep)
 class JobStepCrumbler(Crumbler):
+    eager_load = ('node',)
 
     def get_extra_attrs_from_db(self, item_list):
         result = {}
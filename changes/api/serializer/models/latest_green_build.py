@@ -4,6 +4,8 @@ from changes.models.latest_green_build import LatestGreenBuild
 
 @register(LatestGreenBuild)
 class LatestGreenBuildCrumbler(Crumbler):
+    eager_load = ('build',)
+
     def crumble(self, item, attrs):
         return {
             'branch': item.branch,
@@ -5,6 +5,8 @@ from changes.models.log import LogChunk
 
 @register(LogChunk)
 class LogChunkCrumbler(Crumbler):
+    eager_load = ('source',)
+
     def crumble(self, instance, attrs):
         return {
             'id': instance.id.hex,
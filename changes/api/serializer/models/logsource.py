@@ -6,6 +6,7 @@ from flask import current_app
 
 @register(LogSource)
 class LogSourceCrumbler(Crumbler):
+    eager_load = ('step',)
 
     def __init__(self, include_step=True):
         self._include_step = include_step
@@ -36,6 +37,10 @@ class LogSourceWithoutStepCrumbler(LogSourceCrumbler):
     Exactly like LogSourceCrumbler, but doesn't include LogSource.step in the result.
     Use this when you already have the JobStep data to avoid doing unnecessary extra work.
     """
+    # the steps are normally already loaded (so only Jenkins logs in the
+    # artifact store, which look at their step's data, find them in the session)
+    eager_load = ()
+
     def __init__(self):
         super(LogSourceWithoutStepCrumbler, self).__init__(include_step=False)
 
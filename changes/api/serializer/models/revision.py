@@ -10,6 +10,8 @@ from changes.models.revision import Revision
 
 @register(Revision)
 class RevisionCrumbler(Crumbler):
+    eager_load = ('author',)
+
     def get_extra_attrs_from_db(self, item_list):
         repo_ids = set(i.repository_id for i in item_list)
 
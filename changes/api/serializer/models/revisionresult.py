@@ -6,6 +6,8 @@ from changes.models.revisionresult import RevisionResult
 
 @register(RevisionResult)
 class RevisionResultCrumbler(Crumbler):
+    eager_load = ('build',)
+
     def crumble(self, instance, attrs):
         return {
             'id': instance.id.hex,
@@ -6,6 +6,8 @@ from changes.models.source import Source
 
 @register(Source)
 class SourceCrumbler(Crumbler):
+    eager_load = ('revision',)
+
     def crumble(self, instance, attrs):
         if instance.patch_id:
             if instance.data.get('phabricator.revisionURL'):
@@ -21,6 +21,8 @@ class TestCaseCrumbler(Crumbler):
 
 
 class TestCaseWithJobCrumbler(TestCaseCrumbler):
+    eager_load = ('job',)
+
     def crumble(self, instance, attrs):
         data = super(TestCaseWithJobCrumbler, self).crumble(instance, attrs)
         data['job'] = instance.job
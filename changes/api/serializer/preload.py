@@ -0,0 +1,145 @@
+"""
+Bulk-loading of the relationships that crumblers traverse.
+
+Crumblers declare the relationships they touch in `Crumbler.eager_load`, and
+the serializer calls `preload` for each layer of objects before crumbling
+them. This turns what would otherwise be one lazy-load SELECT per object (per
+relationship) into a single `IN` query per relationship for the whole layer.
+
+Setting `API_DEBUG_LAZY_LOADS` in the app config makes the serializer count the
+queries issued from within `Crumbler.crumble` (which should never hit the
+database), so that relationships missing from `eager_load` can be found.
+"""
+
+from __future__ import absolute_import
+
+from collections import defaultdict
+
+from flask import current_app, g, has_app_context
+from flask.ext.sqlalchemy import get_debug_queries
+from sqlalchemy import inspect, tuple_
+from sqlalchemy.exc import NoInspectionAvailable
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.interfaces import MANYTOONE
+from sqlalchemy.orm.properties import RelationshipProperty
+from typing import Any, Dict, Iterable, List, Optional  # NOQA
+
+
+def preload(items, paths):
+    # type: (Iterable[Any], Iterable[str]) -> None
+    """
+    Loads the relationships named by `paths` for all of `items` at once.
+
+    Each path is a dot-separated chain of relationship names, e.g.
+    'source.revision'. Only many-to-one relationships are bulk-loaded; any
+    other relationship (or an object that isn't a persistent SQLAlchemy
+    instance) is left alone and will be lazy-loaded as before.
+    """
+    for path in paths:
+        objs = list(items)
+        for name in path.split('.'):
+            objs = _load_relationship(objs, name)
+            if not objs:
+                break
+
+
+def _load_relationship(objs, name):
+    # type: (List[Any], str) -> List[Any]
+    """
+    Populates relationship `name` on every object in `objs` that hasn't
+    loaded it yet, using a single query. Returns the (distinct, non-None)
+    related objects, so that the next segment of a path can be loaded.
+    """
+    pending = defaultdict(list)  # type: Dict[tuple, List[Any]]
+    prop = None
+    related = []
+    for obj in objs:
+        try:
+            state = inspect(obj)
+        except NoInspectionAvailable:
+            continue
+
+        if name not in state.unloaded or not state.persistent:
+            value = getattr(obj, name, None)
+            if value is not None:
+                related.append(value)
+            continue
+
+        prop = state.mapper.get_property(name)
+        if not isinstance(prop, RelationshipProperty) or prop.direction is not MANYTOONE or prop.uselist:
+            value = getattr(obj, name)
+            if value is not None:
+                related.append(value)
+            continue
+
+        key = tuple(
+            getattr(obj, state.mapper.get_property_by_column(local).key)
+            for local, _ in prop.local_remote_pairs
+        )
+        if any(k is None for k in key):
+            set_committed_value(obj, name, None)
+        else:
+            pending[key].append(obj)
+
+    if pending:
+        target = prop.mapper
+        remote_cols = [remote for _, remote in prop.local_remote_pairs]
+        remote_keys = [target.get_property_by_column(c).key for c in remote_cols]
+
+        if len(remote_cols) == 1:
+            criteria = remote_cols[0].in_(k[0] for k in pending)
+        else:
+            criteria = tuple_(*remote_cols).in_(pending.keys())
+
+        session = inspect(pending.values()[0][0]).session
+        loaded = {
+            tuple(getattr(r, k) for k in remote_keys): r
+            for r in session.query(target.class_).filter(criteria)
+        }
+        for key, key_objs in pending.iteritems():
+            value = loaded.get(key)
+            for obj in key_objs:
+                set_committed_value(obj, name, value)
+        related.extend(loaded.itervalues())
+
+    seen = set()
+    result = []
+    for value in related:
+        if id(value) not in seen:
+            seen.add(id(value))
+            result.append(value)
+    return result
+
+
+def lazy_load_tracking_enabled():
+    # type: () -> bool
+    return has_app_context() and bool(current_app.config.get('API_DEBUG_LAZY_LOADS'))
+
+
+def query_count():
+    # type: () -> int
+    return len(get_debug_queries())
+
+
+def record_lazy_loads(crumbler, count):
+    # type: (Any, int) -> None
+    """
+    Records that `count` queries were issued while crumbling with `crumbler`.
+    """
+    if not count:
+        return
+    lazy_loads = getattr(g, 'serializer_lazy_loads', None)
+    if lazy_loads is None:
+        lazy_loads = g.serializer_lazy_loads = defaultdict(int)
+    lazy_loads[crumbler.__class__.__name__] += count
+
+
+def pop_lazy_loads():
+    # type: () -> Optional[Dict[str, int]]
+    """
+    Returns (and resets) a dict of crumbler class name => number of queries
+    issued from `crumble` in the current context, or None if there weren't any.
+    """
+    if not has_app_context():
+        return None
+    return g.__dict__.pop('serializer_lazy_loads', None)
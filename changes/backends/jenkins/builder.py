@@ -14,7 +14,7 @@ from contextlib import closing
 from datetime import datetime
 from flask import current_app
 from lxml import etree, objectify
-from typing import Any  # NOQA
+from typing import Any, Set  # NOQA
 
 from changes.artifacts.analytics_json import AnalyticsJsonHandler
 from changes.artifacts.coverage import CoverageHandler
@@ -23,12 +23,14 @@ from changes.artifacts.manager import Manager
 from changes.artifacts.manifest_json import ManifestJsonHandler
 from changes.artifacts.xunit import XunitHandler
 from changes.backends.base import BaseBackend, UnrecoverableException
+from changes.backends.jenkins.queue_snapshot import QUEUE_TREE, get_queue_snapshot
 from changes.buildsteps.base import BuildStep
 from changes.config import db, redis, statsreporter
 from changes.constants import Result, Status
 from changes.db.utils import get_or_create
 from changes.jobs.sync_job_step import sync_job_step
 from changes.lib.artifact_store_lib import ArtifactStoreClient
+from changes.lib.process_cache import ProcessCache
 from changes.models.artifact import Artifact
 from changes.models.failurereason import FailureReason
 from changes.models.jobphase import JobPhase
@@ -37,7 +39,6 @@ from changes.models.log import LogSource, LOG_CHUNK_SIZE
 from changes.models.node import Cluster, ClusterNode, Node
 from changes.storage.artifactstore import ArtifactStoreFileStorage
 from changes.utils.http import build_patch_uri
-from changes.utils.text import chunked
 
 RESULT_MAP = {
     'SUCCESS': Result.passed,
@@ -47,7 +48,6 @@ RESULT_MAP = {
     'UNSTABLE': Result.failed,
 }
 
-QUEUE_ID_XPATH = '/queue/item[action/parameter/name="CHANGES_BID" and action/parameter/value="{job_id}"]/id'
 BUILD_ID_XPATH = ('/freeStyleProject/build[action/parameter/name="CHANGES_BID" and '
                   'action/parameter/value="{job_id}"]/number')
 
@@ -59,6 +59,13 @@ LOG_SYNC_TIMEOUT_SECS = 30
 # The blacklist is used to temporarily remove jenkins masters from the pool of available masters.
 MASTER_BLACKLIST_KEY = 'jenkins_master_blacklist'
 
+# The blacklist, as of up to JENKINS_MASTER_BLACKLIST_CACHE_TTL seconds ago
+# (JenkinsMasterBlacklistAPIView invalidates it as it changes).
+master_blacklist_cache = ProcessCache('jenkins_master_blacklist')
+
+# Node ids by label, for nodes whose clusters have been looked up.
+node_id_cache = ProcessCache('jenkins_node_ids')
+
 # Default name for the Jenkins console log.
 # Note that artifactstore may alter the name for deduplication, so this cannot directly be used.
 JENKINS_LOG_NAME = 'jenkins-console'
@@ -69,6 +76,13 @@ class NotFound(Exception):
     pass
 
 
+def get_master_blacklist():
+    # type: () -> Set[str]
+    return master_blacklist_cache.get(
+        MASTER_BLACKLIST_KEY, lambda: redis.smembers(MASTER_BLACKLIST_KEY),
+        current_app.config['JENKINS_MASTER_BLACKLIST_CACHE_TTL'])
+
+
 class JenkinsBuilder(BaseBackend):
     def __init__(self, master_urls=None, diff_urls=None, job_name=None,
                  auth_keyname=None, verify=True,
@@ -304,32 +318,28 @@ class JenkinsBuilder(BaseBackend):
             # yet to complete
             has_more = resp.headers.get('X-More-Data') == 'true'
 
-            # XXX: requests doesnt seem to guarantee chunk_size, so we force it
-            # with our own helper
-            iterator = resp.iter_content()
-            for chunk in chunked(iterator, LOG_CHUNK_SIZE):
-                chunk_size = len(chunk)
-                try:
-                    self.artifact_store_client.post_artifact_chunk(bucket_name, artifact_name, offset, chunk)
-                    offset += chunk_size
-
+            # The log is streamed to the artifact store in batches of many
+            # chunks, each sent as raw bytes in a single request.
+            iterator = resp.iter_content(LOG_CHUNK_SIZE)
+            try:
+                for offset in self.artifact_store_client.append_artifact_chunks(
+                        bucket_name, artifact_name, offset, iterator):
                     if time.time() > start_time + LOG_SYNC_TIMEOUT_SECS:
                         raise RuntimeError('TOO LONG TO DOWNLOAD LOG: %s' % logsource.get_url())
-                except Exception as e:
-                    # On an exception or a timeout, attempt to truncate the log
-                    # Catch all exceptions, including timeouts and HTTP errors
+            except Exception as e:
+                # On an exception or a timeout, attempt to truncate the log
+                # Catch all exceptions, including timeouts and HTTP errors
 
-                    self.logger.warning('Exception when uploading logchunks: %s', e.message)
+                self.logger.warning('Exception when uploading logchunks: %s', e.message)
 
-                    has_more = False
+                has_more = False
 
-                    warning = ("\nLOG TRUNCATED. SEE FULL LOG AT "
-                               "{base}/job/{job}/{build}/consoleText\n").format(
-                        base=jobstep.data['master'],
-                        job=jobstep.data['job_name'],
-                        build=jobstep.data['build_no'])
-                    self.artifact_store_client.post_artifact_chunk(bucket_name, artifact_name, offset, warning)
-                    break
+                warning = ("\nLOG TRUNCATED. SEE FULL LOG AT "
+                           "{base}/job/{job}/{build}/consoleText\n").format(
+                    base=jobstep.data['master'],
+                    job=jobstep.data['job_name'],
+                    build=jobstep.data['build_no'])
+                self.artifact_store_client.post_artifact_chunk(bucket_name, artifact_name, offset, warning)
 
         # We **must** track the log offset externally as Jenkins embeds encoded
         # links and we cant accurately predict the next `start` param.
@@ -352,7 +362,7 @@ class JenkinsBuilder(BaseBackend):
         if is_diff and self.diff_urls:
             candidate_urls = self.diff_urls
 
-        blacklist = redis.smembers(MASTER_BLACKLIST_KEY)
+        blacklist = get_master_blacklist()
         master_urls = [c for c in candidate_urls if c not in blacklist]
 
         if len(master_urls) == 0:
@@ -382,17 +392,23 @@ class JenkinsBuilder(BaseBackend):
             raise Exception("Unable to successfully pick a master from {}.".format(master_urls))
         return best
 
+    def _get_queue_snapshot(self, master_base_url, fetched_after=None):
+        """Returns a (possibly shared) QueueSnapshot of a master's queue; see get_queue_snapshot."""
+        def fetch():
+            return json.loads(self._get_text_response(
+                master_base_url=master_base_url,
+                path='/queue/api/json/',
+                params={'tree': QUEUE_TREE},
+            ))
+
+        return get_queue_snapshot(
+            master_base_url, fetch, ttl=current_app.config['JENKINS_QUEUE_SNAPSHOT_TTL'],
+            fetched_after=fetched_after)
+
     def _count_queued_jobs(self, master_base_url, job_name):
-        response = self._get_json_response(
-            master_base_url=master_base_url,
-            path='/queue/',
-        )
-        return sum((
-            1 for i in response['items']
-            if i['task']['name'] == job_name
-        ))
+        return self._get_queue_snapshot(master_base_url).count(job_name)
 
-    def _find_job(self, master_base_url, job_name, changes_bid):
+    def _find_job(self, master_base_url, job_name, changes_bid, queued_at=None):
         """
         Given a job identifier, we attempt to poll the various endpoints
         for a limited amount of time, trying to match up either a queued item
@@ -402,7 +418,8 @@ class JenkinsBuilder(BaseBackend):
         information when we create a job initially.
 
         The changes_bid parameter should be the corresponding value to look for in
-        the CHANGES_BID parameter.
+        the CHANGES_BID parameter, and queued_at (a timestamp) when the job was
+        queued, if known.
 
         The result is a mapping with the following keys:
 
@@ -412,7 +429,7 @@ class JenkinsBuilder(BaseBackend):
         """
         # Check the queue first to ensure that we don't miss a transition
         # from queue -> active jobs
-        item_id = self._find_queue_item_id(master_base_url, changes_bid)
+        item_id = self._find_queue_item_id(master_base_url, changes_bid, queued_at)
         build_no = None
         if item_id:
             # Saw it in the queue, so we don't know the build number yet.
@@ -432,34 +449,23 @@ class JenkinsBuilder(BaseBackend):
             }
         return None
 
-    def _find_queue_item_id(self, master_base_url, changes_bid):
+    def _find_queue_item_id(self, master_base_url, changes_bid, queued_at=None):
         """Looks in a Jenkins master's queue for an item, and returns the ID if found.
         Args:
             master_base_url (str): Jenkins master URL, in scheme://host form.
             changes_bid (str): The identifier for this Jenkins build, typically the JobStep ID.
+            queued_at (float): When the item was queued (as a timestamp), if known, so that
+                we don't look in a snapshot of the queue from before then.
         Returns:
             str: Queue item id if found, otherwise None.
         """
-        xpath = QUEUE_ID_XPATH.format(job_id=changes_bid)
         try:
-            response = self._get_text_response(
-                master_base_url=master_base_url,
-                path='/queue/api/xml/',
-                params={
-                    'xpath': xpath,
-                    'wrapper': 'x',
-                },
-            )
+            snapshot = self._get_queue_snapshot(master_base_url, fetched_after=queued_at)
         except NotFound:
             return None
 
-        # it's possible that we managed to create multiple jobs in certain
-        # situations, so let's just get the newest one
-        try:
-            match = etree.fromstring(response).iter('id').next()
-        except StopIteration:
-            return None
-        return match.text
+        item = snapshot.find(changes_bid)
+        return item['id'] if item else None
 
     def _find_build_no(self, master_base_url, job_name, changes_bid):
         """Looks in a Jenkins master's list of current/recent builds for one with the given CHANGES_BID,
@@ -494,10 +500,24 @@ class JenkinsBuilder(BaseBackend):
             return None
         return match.text
 
+    def _get_node_id(self, master_base_url, label):
+        # A Node created here isn't cached, as the transaction creating it
+        # may yet be rolled back; it is once it's found already existing.
+        node_id, _ = node_id_cache.get(
+            label, lambda: self._load_node_id(master_base_url, label),
+            current_app.config['JENKINS_NODE_CACHE_TTL'],
+            cache_if=lambda value: not value[1])
+        return node_id
+
+    def _load_node_id(self, master_base_url, label):
+        node, created = self._get_node(master_base_url, label)
+        return node.id, created
+
     def _get_node(self, master_base_url, label):
+        """Returns the Node with the label, and whether it was created."""
         node, created = get_or_create(Node, {'label': label})
         if not created:
-            return node
+            return node, created
 
         try:
             response = self._get_text_response(
@@ -505,7 +525,7 @@ class JenkinsBuilder(BaseBackend):
                 path='/computer/{}/config.xml'.format(label),
             )
         except NotFound:
-            return node
+            return node, created
 
         # lxml expects the response to be in bytes, so let's assume it's utf-8
         # and send it back as the original format
@@ -521,9 +541,22 @@ class JenkinsBuilder(BaseBackend):
             cluster, _ = get_or_create(Cluster, {'label': cluster_name})
             get_or_create(ClusterNode, {'node': node, 'cluster': cluster})
 
-        return node
+        return node, created
 
     def _sync_step_from_queue(self, step):
+        # While it's still waiting in the queue, the (shared) snapshot of the
+        # queue says all we need to know.
+        try:
+            queued = self._get_queue_snapshot(step.data['master']).find(step.id.hex)
+        except Exception:
+            self.logger.warning('Unable to get queue snapshot from %s', step.data['master'], exc_info=True)
+            queued = None
+        if queued and queued['id'] == str(step.data['item_id']):
+            if queued['blocked']:
+                step.status = Status.queued
+                db.session.add(step)
+            return
+
         try:
             item = self._get_json_response(
                 step.data['master'],
@@ -588,9 +621,9 @@ class JenkinsBuilder(BaseBackend):
 
         # TODO(dcramer): we're doing a lot of work here when we might
         # not need to due to it being sync'd previously
-        node = self._get_node(step.data['master'], item['builtOn'])
-
-        step.node = node
+        step.node_id = self._get_node_id(step.data['master'], item['builtOn'])
+        # so step.node follows node_id (it's from the identity map, if loaded)
+        db.session.expire(step, ['node'])
         step.date_started = datetime.utcfromtimestamp(
             item['timestamp'] / 1000)
 
@@ -794,16 +827,21 @@ class JenkinsBuilder(BaseBackend):
                 'json': json.dumps(json_data),
             },
         )
+        # a snapshot of the queue fetched while the POST was in flight may
+        # not have the item yet
+        queued_at = time.time()
 
         # we retry for a period of time as Jenkins doesn't have strong consistency
         # guarantees and the job may not show up right away
         t = time.time() + 5
         job_data = None
         while time.time() < t:
-            job_data = self._find_job(master, job_name, changes_bid)
+            job_data = self._find_job(master, job_name, changes_bid, queued_at)
             if job_data:
                 break
             time.sleep(0.3)
+            # the last snapshot didn't have it, so look at a newer one
+            queued_at = time.time()
 
         if job_data is None:
             raise Exception('Unable to find matching job after creation. GLHF')
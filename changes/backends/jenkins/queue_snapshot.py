@@ -0,0 +1,156 @@
+"""
+Snapshots of Jenkins masters' queues, shared through Redis.
+
+Picking a master needs the number of queued builds per job on each master,
+and syncing a queued step needs its queue item. Rather than each builder and
+sync task fetching the queue (or an item of it) for itself, the queue of each
+master is fetched at most once per JENKINS_QUEUE_SNAPSHOT_TTL seconds across
+all workers, and indexed by job name and CHANGES_BID.
+
+When a snapshot has expired, one worker (holding a lock) fetches a new one
+while any others asking for it wait for that, rather than all fetching it.
+"""
+
+from __future__ import absolute_import
+
+import json
+import logging
+import time
+
+from collections import Counter
+from redis import RedisError
+from typing import Any, Callable, Dict, Optional  # NOQA
+
+from changes.config import redis
+from changes.ext.redis import UnableToGetLock
+
+logger = logging.getLogger('jenkins.queue_snapshot')
+
+SNAPSHOT_KEY = 'jenkins:queue-snapshot:{}'
+LOCK_KEY = 'jenkins:queue-snapshot:{}:lock'
+
+# Only what we index, to keep the (potentially large) response small.
+QUEUE_TREE = 'items[id,blocked,task[name],actions[parameters[name,value]]]'
+
+# How long to wait for another worker's fetch of a snapshot before fetching
+# it ourselves.
+WAIT_TIMEOUT = 5
+WAIT_INTERVAL = 0.05
+
+
+class QueueSnapshot(object):
+    """
+    Args:
+        fetched_at (float): When the fetch of the queue started (as a
+            timestamp); everything queued before then is in the snapshot.
+        counts (Dict[str, int]): Job name => number of queued builds.
+        items (Dict[str, Dict[str, Any]]): CHANGES_BID => the id, job name and
+            whether it's blocked of the queued build with that CHANGES_BID.
+    """
+
+    def __init__(self, fetched_at, counts, items):
+        # type: (float, Dict[str, int], Dict[str, Dict[str, Any]]) -> None
+        self.fetched_at = fetched_at
+        self.counts = counts
+        self.items = items
+
+    @classmethod
+    def from_queue(cls, fetched_at, queue):
+        # type: (float, Dict[str, Any]) -> QueueSnapshot
+        """Indexes the JSON of a master's /queue/."""
+        counts = Counter()  # type: Counter
+        items = {}
+        for item in queue['items']:
+            job_name = item['task']['name']
+            counts[job_name] += 1
+            for action in item.get('actions', []):
+                for param in action.get('parameters', []):
+                    if param['name'] == 'CHANGES_BID':
+                        # it's possible that we managed to queue several
+                        # builds; the first listed (the newest) wins
+                        items.setdefault(param.get('value'), {
+                            'id': str(item['id']),
+                            'job_name': job_name,
+                            'blocked': item.get('blocked', False),
+                        })
+        return cls(fetched_at, dict(counts), items)
+
+    @classmethod
+    def loads(cls, data):
+        # type: (str) -> QueueSnapshot
+        return cls(**json.loads(data))
+
+    def dumps(self):
+        # type: () -> str
+        return json.dumps({'fetched_at': self.fetched_at, 'counts': self.counts, 'items': self.items})
+
+    def count(self, job_name):
+        # type: (str) -> int
+        return self.counts.get(job_name, 0)
+
+    def find(self, changes_bid):
+        # type: (str) -> Optional[Dict[str, Any]]
+        return self.items.get(changes_bid)
+
+
+def get_queue_snapshot(master_base_url, fetch, ttl, fetched_after=None):
+    # type: (str, Callable[[], Dict[str, Any]], float, Optional[float]) -> QueueSnapshot
+    """
+    Returns a snapshot of the master's queue, sharing one from the last
+    `ttl` seconds if there is one.
+
+    Args:
+        master_base_url (str): Jenkins master URL, in scheme://host form.
+        fetch (Callable): Fetches the JSON of the master's queue, with at
+            least the fields in QUEUE_TREE.
+        ttl (float): How long (in seconds) to keep snapshots for; if not
+            positive, snapshots aren't shared.
+        fetched_after (float): If given, only a snapshot fetched after this
+            (a timestamp) will do, e.g. to see an item queued at that time.
+    """
+    if ttl <= 0:
+        return QueueSnapshot.from_queue(time.time(), fetch())
+
+    key = SNAPSHOT_KEY.format(master_base_url)
+
+    def load():
+        data = redis.get(key)
+        if data is None:
+            return None
+        snapshot = QueueSnapshot.loads(data)
+        if fetched_after is not None and snapshot.fetched_at < fetched_after:
+            return None
+        return snapshot
+
+    def refresh():
+        fetched_at = time.time()
+        snapshot = QueueSnapshot.from_queue(fetched_at, fetch())
+        try:
+            redis.setex(key, snapshot.dumps(), max(int(ttl), 1))
+        except RedisError:
+            logger.warning('Unable to store queue snapshot for %s', master_base_url, exc_info=True)
+        return snapshot
+
+    try:
+        snapshot = load()
+        if snapshot is not None:
+            return snapshot
+
+        try:
+            with redis.lock(LOCK_KEY.format(master_base_url), expire=30, nowait=True):
+                # it may have been refreshed while we were waiting for redis
+                return load() or refresh()
+        except UnableToGetLock:
+            pass
+
+        deadline = time.time() + WAIT_TIMEOUT
+        while time.time() < deadline:
+            time.sleep(WAIT_INTERVAL)
+            snapshot = load()
+            if snapshot is not None:
+                return snapshot
+        logger.warning('Timed out waiting for queue snapshot of %s', master_base_url)
+    except RedisError:
+        logger.warning('Unable to share queue snapshot for %s', master_base_url, exc_info=True)
+
+    return refresh()
@@ -136,6 +136,19 @@ class BuildStep(object):
     def create_expanded_jobstep(self, jobstep, new_jobphase, future_jobstep):
         raise NotImplementedError
 
+    def create_expanded_jobsteps(self, jobstep, new_jobphase, future_jobsteps):
+        """
+        Creates a JobStep for every FutureJobStep of an expansion, returning
+        them (flushed, uncommitted). Build steps that can create them more
+        efficiently together should override this.
+        """
+        new_jobsteps = [
+            self.create_expanded_jobstep(jobstep, new_jobphase, future_jobstep)
+            for future_jobstep in future_jobsteps
+        ]
+        db.session.flush()
+        return new_jobsteps
+
     def get_allocation_command(self, jobstep):
         raise NotImplementedError
 
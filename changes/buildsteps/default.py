@@ -3,11 +3,13 @@ from __future__ import absolute_import
 import os
 import uuid
 
+from collections import OrderedDict
 from copy import deepcopy
 from datetime import datetime
 from flask import current_app
 from itertools import chain
-from typing import Dict, List, Optional, Type  # NOQA
+from sqlalchemy.orm import defer
+from typing import Any, Dict, List, Optional, Tuple, Type  # NOQA
 
 from changes.artifacts.analytics_json import AnalyticsJsonHandler
 from changes.artifacts.bazel_target import BazelTargetHandler
@@ -17,11 +19,13 @@ from changes.artifacts.xunit import XunitHandler
 from changes.buildsteps.base import BuildStep, LXCConfig
 from changes.config import db, statsreporter
 from changes.constants import Cause, Result, ResultSource, Status, DEFAULT_CPUS, DEFAULT_MEMORY_MB
-from changes.db.utils import get_or_create
+from changes.db.utils import as_row, bulk_insert, get_or_create
 from changes.jobs.sync_job_step import sync_job_step
 from changes.models.bazeltarget import BazelTarget
 from changes.models.bazeltargetmessage import BazelTargetMessage
-from changes.models.command import CommandType, FutureCommand
+from changes.lib import allocation_index
+from changes.models.command import Command, CommandType, FutureCommand
+from changes.models.job import Job  # NOQA
 from changes.models.jobphase import JobPhase
 from changes.models.jobstep import JobStep, FutureJobStep
 from changes.models.snapshot import SnapshotImage
@@ -444,22 +448,32 @@ class DefaultBuildStep(BuildStep):
         Given a newly created jobstep, create bazel target objects and
         related data structures
         """
+        targets, messages = self._get_targets_for_jobstep(jobstep)
+        db.session.add_all([BazelTarget(**row) for row in targets])
+        db.session.add_all([BazelTargetMessage(**row) for row in messages])
+
+    def _get_targets_for_jobstep(self, jobstep):
+        # type: (JobStep) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]
+        """
+        Given a newly created jobstep, returns the bazel targets to create for
+        it, and their messages, as dicts of column values.
+        """
         # create bazel targets if necessary
-        target_map = {}
+        target_map = OrderedDict()  # type: Dict[str, Dict[str, Any]]
         if 'targets' in jobstep.data:
             for target_name in jobstep.data['targets']:
-                target = BazelTarget(
-                    step=jobstep,
-                    job_id=jobstep.job_id,
-                    name=target_name,
-                    status=Status.in_progress,
-                    result=Result.unknown,
-                    result_source=ResultSource.from_self,
-                )
-                db.session.add(target)
-                target_map[target_name] = target
+                target_map[target_name] = {
+                    'id': uuid.uuid4(),
+                    'step_id': jobstep.id,
+                    'job_id': jobstep.job_id,
+                    'name': target_name,
+                    'status': Status.in_progress,
+                    'result': Result.unknown,
+                    'result_source': ResultSource.from_self,
+                }
 
         # process dependency_map if it exists
+        messages = []
         dependency_map = jobstep.data.get('dependency_map') or {}
         for target_name, dependencies in dependency_map.iteritems():
             if not dependencies:
@@ -468,11 +482,36 @@ class DefaultBuildStep(BuildStep):
                 continue
             lines = ['This target was affected by the following files:']
             lines += ['    {}'.format(f) for f in dependencies]
-            message = BazelTargetMessage(
-                text='\n'.join(lines),
-                target=target_map[target_name],
-            )
-            db.session.add(message)
+            messages.append({
+                'text': '\n'.join(lines),
+                'target_id': target_map[target_name]['id'],
+            })
+
+        return target_map.values(), messages
+
+    def _get_setup_teardown_commands(self, job):
+        # type: (Job) -> Tuple[List[FutureCommand], List[FutureCommand]]
+        setup_commands = []
+        teardown_commands = []
+        for future_command in self.iter_all_commands(job):
+            if future_command.type.is_setup():
+                setup_commands.append(future_command)
+            elif future_command.type == CommandType.teardown:
+                teardown_commands.append(future_command)
+        return setup_commands, teardown_commands
+
+    def _init_expanded_jobstep(self, new_jobstep, base_jobstep_data):
+        # type: (JobStep, Dict[str, Any]) -> None
+        # inherit base properties from parent jobstep
+        for key, value in base_jobstep_data.items():
+            if key not in JOBSTEP_DATA_COPY_WHITELIST:
+                continue
+            if key not in new_jobstep.data:
+                new_jobstep.data[key] = deepcopy(value)
+        new_jobstep.status = Status.pending_allocation
+        new_jobstep.cluster = self.cluster
+        new_jobstep.data['expanded'] = True
+        BuildStep.handle_debug_infra_failures(new_jobstep, self.debug_config, 'expanded')
 
     def create_expanded_jobstep(self, base_jobstep, new_jobphase, future_jobstep, skip_setup_teardown=False):
         """
@@ -487,33 +526,17 @@ class DefaultBuildStep(BuildStep):
         Returns the newly created JobStep (uncommitted).
         """
         new_jobstep = future_jobstep.as_jobstep(new_jobphase)
-
-        base_jobstep_data = deepcopy(base_jobstep.data)
-
-        # inherit base properties from parent jobstep
-        for key, value in base_jobstep_data.items():
-            if key not in JOBSTEP_DATA_COPY_WHITELIST:
-                continue
-            if key not in new_jobstep.data:
-                new_jobstep.data[key] = value
-        new_jobstep.status = Status.pending_allocation
-        new_jobstep.cluster = self.cluster
-        new_jobstep.data['expanded'] = True
-        BuildStep.handle_debug_infra_failures(new_jobstep, self.debug_config, 'expanded')
+        self._init_expanded_jobstep(new_jobstep, base_jobstep.data)
         db.session.add(new_jobstep)
 
         # when we expand the command we need to include all setup and teardown
         # commands
-        setup_commands = []
-        teardown_commands = []
+        setup_commands = []  # type: List[FutureCommand]
+        teardown_commands = []  # type: List[FutureCommand]
         # TODO(nate): skip_setup_teardown really means "we're whitewashing this jobstep"
         # since we also don't set the command's path in those cases.
         if not skip_setup_teardown:
-            for future_command in self.iter_all_commands(base_jobstep.job):
-                if future_command.type.is_setup():
-                    setup_commands.append(future_command)
-                elif future_command.type == CommandType.teardown:
-                    teardown_commands.append(future_command)
+            setup_commands, teardown_commands = self._get_setup_teardown_commands(base_jobstep.job)
 
             # set any needed defaults for expanded commands
             for future_command in future_jobstep.commands:
@@ -530,6 +553,65 @@ class DefaultBuildStep(BuildStep):
 
         return new_jobstep
 
+    def create_expanded_jobsteps(self, base_jobstep, new_jobphase, future_jobsteps):
+        """
+        Converts every FutureJobstep of an expansion into a JobStep, as
+        create_expanded_jobstep does, but looks up the setup and teardown
+        commands once, and inserts the jobsteps, their commands, and their
+        bazel targets and messages in batches rather than through the session.
+
+        Returns the newly created JobSteps (flushed, uncommitted).
+        """
+        setup_commands, teardown_commands = self._get_setup_teardown_commands(base_jobstep.job)
+        # what the rows refer to
+        db.session.flush()
+
+        jobsteps = []  # type: List[Dict[str, Any]]
+        commands = []  # type: List[Dict[str, Any]]
+        targets = []  # type: List[Dict[str, Any]]
+        messages = []  # type: List[Dict[str, Any]]
+        for future_jobstep in future_jobsteps:
+            # not through as_jobstep, which would add it to the session along
+            # with the phase
+            new_jobstep = JobStep(
+                job_id=new_jobphase.job_id,
+                phase_id=new_jobphase.id,
+                project_id=new_jobphase.project_id,
+                label=future_jobstep.label,
+                status=Status.queued,
+                data=future_jobstep.data,
+            )
+            self._init_expanded_jobstep(new_jobstep, base_jobstep.data)
+            if new_jobstep in db.session:
+                db.session.expunge(new_jobstep)
+            jobsteps.append(as_row(new_jobstep))
+
+            for future_command in future_jobstep.commands:
+                self._set_command_defaults(future_command)
+            # setup -> newly generated commands from expander -> teardown
+            for index, future_command in enumerate(chain(setup_commands,
+                                                         future_jobstep.commands,
+                                                         teardown_commands)):
+                commands.append(as_row(future_command.as_command(new_jobstep, index)))
+
+            step_targets, step_messages = self._get_targets_for_jobstep(new_jobstep)
+            targets.extend(step_targets)
+            messages.extend(step_messages)
+
+        bulk_insert(JobStep, jobsteps)
+        bulk_insert(Command, commands)
+        bulk_insert(BazelTarget, targets)
+        bulk_insert(BazelTargetMessage, messages)
+
+        jobstep_ids = [row['id'] for row in jobsteps]
+        allocation_index.track_inserted(db.session, jobstep_ids)
+        if not jobstep_ids:
+            return []
+        # their data (with each shard's targets) is slow to decode, and isn't
+        # needed straight away
+        by_id = {s.id: s for s in JobStep.query.options(defer('data')).filter(JobStep.id.in_(jobstep_ids))}
+        return [by_id[jobstep_id] for jobstep_id in jobstep_ids]
+
     def get_client_adapter(self):
         return 'basic'
 
@@ -27,6 +27,7 @@ from changes.ext.celery import Celery
 from changes.ext.redis import Redis
 from changes.ext.statsreporter import StatsReporter
 from changes.url_converters.uuid import UUIDConverter
+from changes.utils import json_encoding
 from changes.utils.dirs import enforce_is_subdir
 
 from sqlalchemy import event
@@ -101,6 +102,15 @@ def create_app(_read_config=True, **config):
 
     app.config['API_TRACEBACKS'] = True
 
+    # Count the queries issued while crumbling API responses (i.e. lazy loads
+    # of relationships missing from a Crumbler's `eager_load`), and report them
+    # in the 'changes-lazy-loads' response header and the logs.
+    app.config['API_DEBUG_LAZY_LOADS'] = False
+
+    # Backend used to encode API responses, Celery messages and JSON columns
+    # (see changes.utils.json_encoding). None picks the fastest one available.
+    app.config['JSON_ENCODER_BACKEND'] = None
+
     # Expiration delay between when a snapshot image becomes superceded and when
     # it becomes truly expired (and thus no longer included in the sync information
     # for any cluster that runs that particular image's plan)
@@ -199,6 +209,7 @@ def create_app(_read_config=True, **config):
         Queue('delete', routing_key='delete'),
         Queue('repo.sync', Exchange('fanout', 'fanout'), routing_key='repo.sync'),
         Queue('grouper.sync', routing_key='grouper.sync'),
+        Queue('notifications', routing_key='notifications'),
         Broadcast('repo.update'),
     )
     app.config['CELERY_ROUTES'] = {
@@ -234,10 +245,22 @@ def create_app(_read_config=True, **config):
             'queue': 'events',
             'routing_key': 'events',
         },
+        'run_untracked_event_listener': {
+            'queue': 'events',
+            'routing_key': 'events',
+        },
         'fire_signal': {
             'queue': 'events',
             'routing_key': 'events',
         },
+        'deliver_notifications': {
+            'queue': 'notifications',
+            'routing_key': 'notifications',
+        },
+        'sweep_notifications': {
+            'queue': 'notifications',
+            'routing_key': 'notifications',
+        },
         'update_local_repos': {
             'queue': 'repo.update',
         },
@@ -255,19 +278,55 @@ def create_app(_read_config=True, **config):
         },
     }
 
+    # (listener, signal[, options]); see changes.jobs.signals.get_listeners.
+    # Listeners that talk to other services, or whose work mustn't be lost,
+    # are tracked so they're retried.
     app.config['EVENT_LISTENERS'] = (
-        ('changes.listeners.mail.build_finished_handler', 'build.finished'),
-        ('changes.listeners.green_build.revision_result_updated_handler', 'revision_result.updated'),
-        ('changes.listeners.build_revision.revision_created_handler', 'revision.created'),
-        ('changes.listeners.build_finished_notifier.build_finished_handler', 'build.finished'),
-        ('changes.listeners.phabricator_listener.build_finished_handler', 'build.finished'),
-        ('changes.listeners.analytics_notifier.build_finished_handler', 'build.finished'),
-        ('changes.listeners.analytics_notifier.job_finished_handler', 'job.finished'),
-        ('changes.listeners.revision_result.revision_result_build_finished_handler', 'build.finished'),
-        ('changes.listeners.stats_notifier.build_finished_handler', 'build.finished'),
+        ('changes.listeners.mail.build_finished_handler', 'build.finished', {'tracked': True}),
+        ('changes.listeners.green_build.revision_result_updated_handler', 'revision_result.updated', {'tracked': True}),
+        ('changes.listeners.build_revision.revision_created_handler', 'revision.created', {
+            'tracked': True,
+            # don't trigger builds for a revision twice
+            'dedupe': ('repository_id', 'revision_sha'),
+        }),
+        ('changes.listeners.build_finished_notifier.build_finished_handler', 'build.finished', {'tracked': True}),
+        ('changes.listeners.phabricator_listener.build_finished_handler', 'build.finished', {'tracked': True}),
+        ('changes.listeners.analytics_notifier.build_finished_handler', 'build.finished', {'tracked': True}),
+        ('changes.listeners.analytics_notifier.job_finished_handler', 'job.finished', {'tracked': True}),
+        ('changes.listeners.revision_result.revision_result_build_finished_handler', 'build.finished', {'tracked': True}),
+        ('changes.listeners.stats_notifier.build_finished_handler', 'build.finished', {'inline': True}),
         ('changes.listeners.snapshot_build.build_finished_handler', 'build.finished'),
+        ('changes.listeners.duration_stats.build_finished_handler', 'build.finished'),
     )
 
+    # how long (in seconds) a listener with a dedupe key is remembered for
+    app.config['EVENT_LISTENER_DEDUPE_TTL'] = 24 * 3600
+
+    # Deliver notifications to other services from an outbox
+    # (changes.lib.notifications), by workers on the 'notifications' queue,
+    # rather than in the listeners. Delivery is retried with backoff from
+    # NOTIFICATION_RETRY_DELAY seconds up to NOTIFICATION_RETRY_MAX_DELAY,
+    # NOTIFICATION_MAX_ATTEMPTS times in all. A worker has a notification to
+    # itself for NOTIFICATION_LEASE seconds; NOTIFICATION_CONCURRENCY limits
+    # how many deliver to each destination at once (1 if it's not listed).
+    app.config['NOTIFICATION_OUTBOX_ENABLED'] = False
+    app.config['NOTIFICATION_SENDERS'] = {
+        'mail': 'changes.listeners.mail.MailSender',
+        'phabricator': 'changes.utils.phabricator_utils.CommentSender',
+        'analytics': 'changes.listeners.analytics_notifier.AnalyticsSender',
+        # one at a time, as receivers may reject green builds out of order
+        'green_build': 'changes.listeners.green_build.GreenBuildSender',
+    }
+    app.config['NOTIFICATION_CONCURRENCY'] = {
+        'mail': 4,
+        'phabricator': 4,
+        'analytics': 2,
+    }
+    app.config['NOTIFICATION_RETRY_DELAY'] = 30
+    app.config['NOTIFICATION_RETRY_MAX_DELAY'] = 3600
+    app.config['NOTIFICATION_MAX_ATTEMPTS'] = 10
+    app.config['NOTIFICATION_LEASE'] = 300
+
     # restrict outbound notifications to the given domains
     app.config['MAIL_DOMAIN_WHITELIST'] = ()
 
@@ -322,7 +381,23 @@ def create_app(_read_config=True, **config):
         'update-local-repos': {
             'task': 'update_local_repos',
             'schedule': timedelta(minutes=1),
-        }
+        },
+        'seal-logs': {
+            'task': 'seal_logs',
+            'schedule': timedelta(minutes=5),
+        },
+        'drop-old-test-partitions': {
+            'task': 'drop_old_test_partitions',
+            'schedule': timedelta(hours=1),
+        },
+        'flush-heartbeats': {
+            'task': 'flush_heartbeats',
+            'schedule': timedelta(seconds=30),
+        },
+        'sweep-notifications': {
+            'task': 'sweep_notifications',
+            'schedule': timedelta(minutes=1),
+        },
     }
     app.config['CELERY_TIMEZONE'] = 'UTC'
 
@@ -353,6 +428,16 @@ def create_app(_read_config=True, **config):
     app.config['PHABRICATOR_USERNAME'] = None
     app.config['PHABRICATOR_CERT'] = None
 
+    # how long (in seconds) the failing tests of a diff's base commit build
+    # are cached per process when reporting a diff's failures
+    app.config['BASE_COMMIT_FAILURES_CACHE_TTL'] = 300
+
+    # how long (in seconds) the snapshot sync_build takes of a finished build
+    # (its failing tests and logs, parent build, failure reasons and stats)
+    # is shared with the build.finished listeners through Redis; long enough
+    # to cover the rest of its collection finishing. 0 to not share it.
+    app.config['BUILD_SNAPSHOT_TTL'] = 6 * 3600
+
     # Configuration to access Zookeeper - currently used to discover mesos master leader instance
     # E.g., if mesos master is configured to talk to zk://zk1:2181,zk2:2181/mesos,
     # set ZOOKEEPER_HOSTS = 'zk1:2181,zk2:2181'
@@ -371,6 +456,9 @@ def create_app(_read_config=True, **config):
     # URL any project analytics JSON entries will be posted to.
     # Entries will be posted as JSON, with the intended table specified as 'source' in the URL params.
     app.config['ANALYTICS_PROJECT_POST_URL'] = None
+    # The most records (of builds, or a finished job's jobsteps) posted to
+    # ANALYTICS_POST_URL or ANALYTICS_JOBSTEP_POST_URL in one request.
+    app.config['ANALYTICS_POST_MAX_RECORDS'] = 500
 
     app.config['SUPPORT_CONTACT'] = 'support'
 
@@ -491,6 +579,67 @@ def create_app(_read_config=True, **config):
     # a 3 minute timeout is conservative and should be safe.
     app.config['JOBSTEP_ALLOCATION_TIMEOUT_SECONDS'] = 3 * 60
 
+    # Keep pending jobsteps in a Redis index (changes.lib.allocation_index) for
+    # JobStepAllocateAPIView, instead of finding them with several queries per
+    # scheduler poll. The index is rebuilt from the database this often (in
+    # seconds), to catch anything it missed.
+    app.config['ALLOCATION_INDEX_ENABLED'] = True
+    app.config['ALLOCATION_INDEX_REBUILD_INTERVAL'] = 60
+
+    # How the text of finished logs is compressed when it's sealed into
+    # logsegments; 'zlib', or 'zstd' if the zstandard package is installed.
+    app.config['LOG_SEGMENT_CODEC'] = 'zlib'
+
+    # JobLogTailAPIView holds requests open until new log text is written
+    # (see changes.lib.log_tail), for up to LOG_TAIL_TIMEOUT seconds. Each
+    # response has at most LOG_TAIL_MAX_BYTES characters, and each process
+    # holds at most LOG_TAIL_MAX_CONNECTIONS requests open, answering any more
+    # with a 503.
+    app.config['LOG_TAIL_TIMEOUT'] = 30
+    app.config['LOG_TAIL_MAX_BYTES'] = 50000
+    app.config['LOG_TAIL_MAX_CONNECTIONS'] = 20
+
+    # How long (in seconds) snapshots of Jenkins masters' queues are shared
+    # between builders and sync tasks for (see
+    # changes.backends.jenkins.queue_snapshot). 0 fetches them every time.
+    app.config['JENKINS_QUEUE_SNAPSHOT_TTL'] = 5
+
+    # How long (in seconds) each process caches Jenkins lookups for (see
+    # changes.lib.process_cache): the master blacklist, which is also
+    # invalidated everywhere whenever it's changed through the API; nodes'
+    # ids and masters; and whether nodes are offline, which is invalidated
+    # when they're toggled through the API, but not when that's done in
+    # Jenkins itself. 0 looks them up every time.
+    app.config['JENKINS_MASTER_BLACKLIST_CACHE_TTL'] = 60
+    app.config['JENKINS_NODE_CACHE_TTL'] = 300
+    app.config['JENKINS_NODE_STATUS_CACHE_TTL'] = 15
+
+    # Test (and Bazel target) durations used for sharding are smoothed over
+    # finished commit builds (see changes.lib.duration_stats): each build is
+    # weighted by DURATION_STATS_ALPHA, and tests missing from
+    # DURATION_STATS_MAX_AGE builds in a row are forgotten. Shards are
+    # balanced by the smoothed duration ('ewma') or, to be more pessimistic
+    # about tests whose duration varies, its 90th percentile ('p90').
+    app.config['DURATION_STATS_ALPHA'] = 0.3
+    app.config['DURATION_STATS_MAX_AGE'] = 50
+    app.config['DURATION_STATS_SHARD_BY'] = 'ewma'
+
+    # Buffer jobstep heartbeats in Redis (changes.lib.heartbeats) rather than
+    # writing each one to the database; the flush-heartbeats task writes them
+    # out. Once a jobstep has been found to exist and not be aborted, its
+    # heartbeats skip the database for this long (in seconds).
+    app.config['JOBSTEP_HEARTBEAT_BUFFER_ENABLED'] = True
+    app.config['JOBSTEP_HEARTBEAT_CHECK_TTL'] = 30
+
+    # When STATSD_HOST is set, stats are aggregated in-process and sent every
+    # STATSD_FLUSH_INTERVAL seconds (0 sends each as it's reported), packed
+    # into datagrams of at most STATSD_MAX_PACKET_SIZE bytes. At most
+    # STATSD_MAX_BUFFERED counters, gauges and timings are held between flushes;
+    # the rest are dropped and counted.
+    app.config['STATSD_FLUSH_INTERVAL'] = 1.0
+    app.config['STATSD_MAX_PACKET_SIZE'] = 1432
+    app.config['STATSD_MAX_BUFFERED'] = 10000
+
     app.config.update(config)
 
     if _read_config:
@@ -502,6 +651,8 @@ def create_app(_read_config=True, **config):
             path = os.path.normpath(os.path.expanduser('~/.changes/changes.conf.py'))
             app.config.from_pyfile(path, silent=True)
 
+    json_encoding.set_backend(app.config['JSON_ENCODER_BACKEND'])
+
     # default the DSN for changes-client to the server's DSN
     app.config.setdefault('CLIENT_SENTRY_DSN', app.config['SENTRY_DSN'])
 
@@ -580,11 +731,14 @@ def create_app(_read_config=True, **config):
 
     configure_jobs(app)
     configure_transaction_logging(app)
+    configure_allocation_index(app)
+    configure_heartbeats(app)
+    configure_log_tail(app)
 
     rules_file = app.config.get('CATEGORIZE_RULES_FILE')
     if rules_file:
         # Fail at startup if we have a bad rules file.
-        categorize.load_rules(rules_file)
+        categorize.load_ruleset(rules_file)
 
     import jinja2
     webapp_template_folder = os.path.join(PROJECT_ROOT, 'webapp/html')
@@ -648,6 +802,7 @@ def configure_api_routes(app):
     from changes.api.job_artifact_index import JobArtifactIndexAPIView
     from changes.api.job_details import JobDetailsAPIView
     from changes.api.job_log_details import JobLogDetailsAPIView
+    from changes.api.job_log_tail import JobLogTailAPIView
     from changes.api.jobphase_index import JobPhaseIndexAPIView
     from changes.api.jobstep_allocate import JobStepAllocateAPIView
     from changes.api.jobstep_needs_abort import JobStepNeedsAbortAPIView
@@ -742,6 +897,7 @@ def configure_api_routes(app):
     api.add_resource(InitialIndexAPIView, '/initial/')
     api.add_resource(JobDetailsAPIView, '/jobs/<uuid:job_id>/')
     api.add_resource(JobLogDetailsAPIView, '/jobs/<uuid:job_id>/logs/<uuid:source_id>/')
+    api.add_resource(JobLogTailAPIView, '/jobs/<uuid:job_id>/logs/<uuid:source_id>/tail/')
     api.add_resource(JobPhaseIndexAPIView, '/jobs/<uuid:job_id>/phases/')
     api.add_resource(JobArtifactIndexAPIView, '/jobs/<uuid:job_id>/artifacts/')
     api.add_resource(JobStepAllocateAPIView, '/jobsteps/allocate/')
@@ -927,10 +1083,14 @@ def configure_jobs(app):
     from changes.jobs.check_repos import check_repos
     from changes.jobs.cleanup_tasks import cleanup_tasks
     from changes.jobs.create_job import create_job
-    from changes.jobs.delete_old_data import delete_old_data, delete_old_data_10m, delete_old_data_5h_delayed
+    from changes.jobs.delete_old_data import (
+        delete_old_data, delete_old_data_10m, delete_old_data_5h_delayed, drop_old_test_partitions)
+    from changes.jobs.deliver_notifications import deliver_notifications, sweep_notifications
+    from changes.jobs.flush_heartbeats import flush_heartbeats
     from changes.jobs.import_repo import import_repo
+    from changes.jobs.seal_logs import seal_logs
     from changes.jobs.signals import (
-        fire_signal, run_event_listener
+        fire_signal, run_event_listener, run_untracked_event_listener
     )
     from changes.jobs.sync_artifact import sync_artifact
     from changes.jobs.sync_build import sync_build
@@ -949,14 +1109,20 @@ def configure_jobs(app):
     queue.register('delete_old_data', delete_old_data)
     queue.register('delete_old_data_10m', delete_old_data_10m)
     queue.register('delete_old_data_5h_delayed', delete_old_data_5h_delayed)
+    queue.register('deliver_notifications', deliver_notifications)
+    queue.register('drop_old_test_partitions', drop_old_test_partitions)
     queue.register('fire_signal', fire_signal)
+    queue.register('flush_heartbeats', flush_heartbeats)
     queue.register('import_repo', import_repo)
     queue.register('run_event_listener', run_event_listener)
+    queue.register('run_untracked_event_listener', run_untracked_event_listener)
+    queue.register('seal_logs', seal_logs)
     queue.register('sync_artifact', sync_artifact)
     queue.register('sync_build', sync_build)
     queue.register('sync_grouper', sync_grouper)
     queue.register('sync_job', sync_job)
     queue.register('sync_job_step', sync_job_step)
+    queue.register('sweep_notifications', sweep_notifications)
     queue.register('sync_repo', sync_repo)
     queue.register('update_project_stats', update_project_stats)
     queue.register('update_project_plan_stats', update_project_plan_stats)
@@ -974,8 +1140,8 @@ def configure_jobs(app):
     def register_changes_json():
         from kombu.serialization import register
         from kombu.utils.encoding import bytes_t
-        from json import dumps, loads
         from uuid import UUID
+        from changes.utils.json_encoding import dumps, loads
 
         def _loads(obj):
             if isinstance(obj, UUID):
@@ -993,6 +1159,47 @@ def configure_jobs(app):
     register_changes_json()
 
 
+def configure_allocation_index(app):
+    """Keep the jobstep allocation index up to date as jobsteps, jobs and builds change."""
+    from changes.lib import allocation_index
+
+    if not app.config['ALLOCATION_INDEX_ENABLED']:
+        return
+
+    for name, listener in (('after_flush', allocation_index.track_changes),
+                           ('after_commit', allocation_index.apply_changes),
+                           ('after_rollback', allocation_index.discard_changes)):
+        if not event.contains(Session, name, listener):
+            event.listen(Session, name, listener)
+
+    from changes.models.jobstep import JobStep
+    if not event.contains(JobStep.cluster, 'set', allocation_index.load_previous_cluster):
+        event.listen(JobStep.cluster, 'set', allocation_index.load_previous_cluster, active_history=True)
+
+
+def configure_heartbeats(app):
+    """Stop accepting buffered heartbeats for jobsteps as soon as they're aborted."""
+    from changes.lib import heartbeats
+    from changes.models.jobstep import JobStep
+
+    if not app.config['JOBSTEP_HEARTBEAT_BUFFER_ENABLED']:
+        return
+
+    if not event.contains(JobStep.result, 'set', heartbeats.forget_checked):
+        event.listen(JobStep.result, 'set', heartbeats.forget_checked)
+
+
+def configure_log_tail(app):
+    """Publish the new sizes of logs as their chunks are committed, for tailers waiting on them."""
+    from changes.lib import log_tail
+
+    for name, listener in (('after_flush', log_tail.track_changes),
+                           ('after_commit', log_tail.publish_changes),
+                           ('after_rollback', log_tail.discard_changes)):
+        if not event.contains(Session, name, listener):
+            event.listen(Session, name, listener)
+
+
 def configure_transaction_logging(app):
     """Add sqlalchemy transaction event listeners to detect long running transactions.
 
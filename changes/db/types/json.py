@@ -1,12 +1,12 @@
 from __future__ import absolute_import
 
-import json
-
 from collections import MutableMapping
 
 from sqlalchemy.ext.mutable import Mutable
 from sqlalchemy.types import TypeDecorator, Unicode
 
+from changes.utils import json_encoding
+
 
 class MutableDict(Mutable, MutableMapping):
     def __init__(self, value):
@@ -52,13 +52,13 @@ class JSONEncodedDict(TypeDecorator):
         if value:
             if isinstance(value, MutableDict):
                 value = value.value
-            return unicode(json.dumps(value))
+            return unicode(json_encoding.dumps(value))
 
         return u'{}'
 
     def process_result_value(self, value, dialect):
         if value:
-            return json.loads(value)
+            return json_encoding.loads(value)
 
         return {}
 
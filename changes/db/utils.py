@@ -2,8 +2,12 @@ import itertools
 
 from changes.config import db
 
+from sqlalchemy import and_, func, inspect, select
 from sqlalchemy.exc import IntegrityError
 
+# rows per INSERT statement in bulk_insert
+BULK_INSERT_BATCH_SIZE = 1000
+
 
 def try_create(model, where):
     """Try to create an object in the database and return it if successful.
@@ -24,6 +28,77 @@ def try_create(model, where):
     return instance
 
 
+def bulk_insert(model, rows, batch_size=BULK_INSERT_BATCH_SIZE):
+    """Insert rows into a model's table with multi-row INSERT statements.
+
+    For when thousands of rows are created at once: much faster than adding
+    model instances to the session and flushing them, or than SQLAlchemy's
+    own multi-row inserts. The rows never pass through the session, so
+    nothing inserted is in it, and session events (and relationships) don't
+    see them; anything they refer to must already have been flushed.
+
+    Args:
+        model (Model): The model whose table to insert into.
+        rows (list): A dict of values by attribute name for each row. Columns
+            missing from a row get their default, if they have one.
+        batch_size (int): Maximum rows per INSERT.
+    """
+    table = model.__table__
+    mapper = inspect(model)
+    connection = db.session.connection()
+    dialect = connection.dialect
+    preparer = dialect.identifier_preparer
+    columns = [
+        (column, mapper.get_property_by_column(column).key,
+         column.type.dialect_impl(dialect).bind_processor(dialect))
+        for column in table.columns
+    ]
+
+    statement = 'INSERT INTO {} ({}) VALUES '.format(
+        preparer.format_table(table),
+        ', '.join(preparer.format_column(column) for column, _, _ in columns),
+    )
+    template = '({})'.format(', '.join(['%s'] * len(columns)))
+    # values are quoted by the driver...
+    cursor = connection.connection.cursor()
+    try:
+        for i in xrange(0, len(rows), batch_size):
+            values = []
+            for row in rows[i:i + batch_size]:
+                params = []
+                for column, key, process in columns:
+                    value = row[key] if key in row else _get_column_default(column)
+                    params.append(process(value) if process else value)
+                values.append(cursor.mogrify(template, params))
+            # ...but executed through SQLAlchemy, in the session's transaction,
+            # which formats it (with no parameters) again
+            connection.execute((statement + ', '.join(values)).replace('%', '%%'))
+    finally:
+        cursor.close()
+
+
+def as_row(instance):
+    """
+    Returns a model instance's column values by attribute name, for
+    bulk_insert. Those that are None are left out, to get their defaults.
+    """
+    row = {}
+    for attr in inspect(instance).mapper.column_attrs:
+        value = getattr(instance, attr.key)
+        if value is not None:
+            row[attr.key] = value
+    return row
+
+
+def _get_column_default(column):
+    default = column.default
+    if default is None or not (default.is_scalar or default.is_callable):
+        return None
+    if default.is_callable:
+        return default.arg(None)
+    return default.arg
+
+
 def try_update(model, where, values):
     result = db.session.query(type(model)).filter_by(
         **where
@@ -131,3 +206,11 @@ def model_repr(*attrs):
         return u'<%s at 0x%x: %s>' % (cls, id(self), ', '.join(pairs))
 
     return _repr
+
+
+def count_where(model, *criteria):
+    """
+    Returns a scalar subquery counting the rows of `model` matching
+    `criteria`, for use as a column in a larger query.
+    """
+    return select([func.count()]).select_from(model.__table__).where(and_(*criteria)).as_scalar()
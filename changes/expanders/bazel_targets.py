@@ -2,15 +2,14 @@ from __future__ import absolute_import, division
 
 from typing import Dict, List, Tuple  # NOQA
 
-from changes.api.client import api_client
 from changes.config import db, statsreporter
 from changes.constants import Result, ResultSource, SelectiveTestingPolicy, Status
 from changes.expanders.base import Expander
+from changes.lib import duration_stats
 from changes.models.bazeltarget import BazelTarget
 from changes.models.bazeltargetmessage import BazelTargetMessage
 from changes.models.buildmessage import BuildMessage
 from changes.models.command import FutureCommand
-from changes.models.job import Job
 from changes.models.jobstep import FutureJobStep
 from changes.utils.shards import shard
 
@@ -122,7 +121,12 @@ class BazelTargetsExpander(Expander):
                 'artifact_search_path': self.data['artifact_search_path'],
             }
             if 'dependency_map' in self.data:
-                data['dependency_map'] = self.data['dependency_map']
+                # only this shard's targets are looked up in it
+                dependency_map = self.data['dependency_map']
+                data['dependency_map'] = {
+                    target: dependency_map[target]
+                    for target in target_list if target in dependency_map
+                }
             future_jobstep = FutureJobStep(
                 label=self.data.get('label') or future_command.label,
                 commands=[future_command],
@@ -149,36 +153,4 @@ class BazelTargetsExpander(Expander):
                 If a target has no duration recorded, it is excluded
                 from all calculations and mapping.
         """
-        response = api_client.get('/projects/{project}/'.format(
-            project=project_slug))
-        last_build = response['lastPassingBuild']
-
-        if not last_build:
-            # use a failing build if no build has passed yet
-            last_build = response['lastBuild']
-
-        if not last_build:
-            return {}, 0
-
-        job_list = db.session.query(Job.id).filter(
-            Job.build_id == last_build['id'],
-        )
-
-        if job_list:
-            target_durations = dict(db.session.query(
-                BazelTarget.name, BazelTarget.duration
-            ).filter(
-                BazelTarget.job_id.in_(job_list),
-                ~BazelTarget.duration.is_(None),
-            ))
-        else:
-            target_durations = dict()
-
-        total_duration = sum(target_durations.itervalues())
-
-        if total_duration > 0:
-            avg_test_time = int(total_duration / len(target_durations))
-        else:
-            avg_test_time = 0
-
-        return target_durations, avg_test_time
+        return duration_stats.get_target_stats(project_slug)
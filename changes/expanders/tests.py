@@ -2,15 +2,11 @@ from __future__ import absolute_import
 
 from typing import Dict, List, Tuple  # NOQA
 
-from changes.api.client import api_client
-from changes.config import db
 from changes.expanders.base import Expander
+from changes.lib import duration_stats
 from changes.models.command import FutureCommand
-from changes.models.job import Job
 from changes.models.jobstep import FutureJobStep
-from changes.models.test import TestCase
 from changes.utils.shards import shard
-from changes.utils.trees import build_flat_tree
 
 
 class TestsExpander(Expander):
@@ -71,62 +67,10 @@ class TestsExpander(Expander):
 
     @classmethod
     def get_test_stats(cls, project_slug):
-        response = api_client.get('/projects/{project}/'.format(
-            project=project_slug))
-        last_build = response['lastPassingBuild']
-
-        if not last_build:
-            # use a failing build if no build has passed yet
-            last_build = response['lastBuild']
-
-        if not last_build:
-            return {}, 0
-
-        # XXX(dcramer): ideally this would be abstracted via an API
-        job_list = db.session.query(Job.id).filter(
-            Job.build_id == last_build['id'],
-        )
-
-        if job_list:
-            test_durations = dict(db.session.query(
-                TestCase.name, TestCase.duration
-            ).filter(
-                TestCase.job_id.in_(job_list),
-            ))
-        else:
-            test_durations = dict()
-
-        test_names = []
-        total_count, total_duration = 0, 0
-        for test in test_durations:
-            test_names.append(test)
-            total_duration += test_durations[test]
-            total_count += 1
-
-        test_stats = {}
-        if test_names:
-            sep = TestCase(name=test_names[0]).sep
-            tree = build_flat_tree(test_names, sep=sep)
-            for group_name, group_tests in tree.iteritems():
-                segments = cls._normalize_test_segments(group_name)
-                test_stats[segments] = sum(test_durations[t] for t in group_tests)
-
-        # the build report can contain different test suites so this isnt the
-        # most accurate
-        if total_duration > 0:
-            avg_test_time = int(total_duration / total_count)
-        else:
-            avg_test_time = 0
-
-        return test_stats, avg_test_time
+        # type: (str) -> Tuple[Dict[Tuple[str, ...], int], int]
+        return duration_stats.get_test_stats(project_slug)
 
     @classmethod
     def _normalize_test_segments(cls, test_name):
-        sep = TestCase(name=test_name).sep
-        segments = test_name.split(sep)
-
-        # kill the file extension
-        if sep is '/' and '.' in segments[-1]:
-            segments[-1] = segments[-1].rsplit('.', 1)[0]
-
-        return tuple(segments)
+        # type: (str) -> Tuple[str, ...]
+        return duration_stats.normalize_test_segments(test_name)
@@ -1,9 +1,30 @@
 """Tools for tagging test outputs based on regexp based rules."""
 
 import ast
+import os
 import re
+import sre_constants
+import sre_parse
 
-from typing import Any, AnyStr, Tuple  # NOQA
+from typing import Any, AnyStr, Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple, Union  # NOQA
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Flags rules are matched with.
+RULE_FLAGS = re.MULTILINE | re.DOTALL
+
+# How much (normalized) output to scan, and match rules against, at a time.
+SCAN_WINDOW_SIZE = 1024 * 1024
+
+# How much of the end of each window is scanned again with the next, so that
+# matches spanning windows are found if they're no longer than this.
+MATCH_OVERLAP = 64 * 1024
+
+# Shorter literals occur in most outputs, so aren't worth scanning for.
+MIN_LITERAL_LENGTH = 3
 
 
 class ParseError(Exception):
@@ -83,25 +104,243 @@ def _parse_regexp(regexp):
     return regexp
 
 
+class RuleSet(object):
+    """Rules compiled for categorizing many outputs.
+
+    Each rule's regexp is compiled once, along with the literal strings that
+    any match must contain. Outputs are categorized a window at a time, so
+    they needn't be held in memory: each window is scanned for all of the
+    literals at once, and only rules whose literals were all found in it are
+    matched with their regexp. A rule is no longer checked once it's matched,
+    and the rest of the output isn't read once every rule has.
+
+    Windows overlap by MATCH_OVERLAP, so longer matches are only found if they
+    fall within a window.
+    """
+
+    def __init__(self, rules):
+        # type: (Iterable[Tuple[AnyStr, AnyStr, AnyStr]]) -> None
+        self.rules = [
+            (tag, project, re.compile(regexp, RULE_FLAGS), _required_literals(regexp))
+            for tag, project, regexp in rules
+        ]
+        self._scanners = {}  # type: Dict[FrozenSet[str], _LiteralScanner]
+
+    def __len__(self):
+        return len(self.rules)
+
+    def _get_scanner(self, literals):
+        # type: (FrozenSet[str]) -> _LiteralScanner
+        scanner = self._scanners.get(literals)
+        if scanner is None:
+            scanner = self._scanners[literals] = _LiteralScanner(literals)
+        return scanner
+
+    def categorize(self, project, output):
+        # type: (AnyStr, Union[AnyStr, Iterable[AnyStr]]) -> Tuple[Set[AnyStr], Set[AnyStr]]
+        """See `categorize`."""
+        applicable = set()
+        rules = []
+        for tag, rule_project, regexp, literals in self.rules:
+            if not rule_project or rule_project == project:
+                applicable.add(tag)
+                rules.append((tag, regexp, literals))
+        if not rules:
+            return (set(), applicable)
+
+        if isinstance(output, basestring):
+            output = [output]
+
+        literals = frozenset().union(*(l for _, _, l in rules))
+        scanner = self._get_scanner(literals) if literals else None
+
+        matched = set()
+        for text in _windows(_normalize_newlines(output)):
+            found = scanner.find(text) if scanner else set()
+            for tag, regexp, rule_literals in rules:
+                if tag not in matched and rule_literals <= found and regexp.search(text):
+                    matched.add(tag)
+            rules = [rule for rule in rules if rule[0] not in matched]
+            if not rules:
+                break
+        return (matched, applicable)
+
+
+_ruleset_cache = {}  # type: Dict[str, Tuple[Tuple[float, int], RuleSet]]
+
+
+def load_ruleset(path):
+    # type: (str) -> RuleSet
+    """Load and compile the rules in a file (see `load_rules`).
+
+    The RuleSet is cached until the file's modification time or size changes.
+    """
+    stat = os.stat(path)
+    version = (stat.st_mtime, stat.st_size)
+    cached = _ruleset_cache.get(path)
+    if cached is None or cached[0] != version:
+        cached = _ruleset_cache[path] = (version, RuleSet(load_rules(path)))
+    return cached[1]
+
+
 def categorize(project, rules, output):
     """Categorize test output based on rules.
 
     Args:
       project (str): name of the project
-      rules (iterable of (str, str, str) tuples):
+      rules (RuleSet or iterable of (str, str, str) tuples):
           each rule is a tuple (tag, project, regexp) that is matched against output
-      output (str): output of a (partial) test run / build
+      output (str or iterable of str): output of a (partial) test run / build, or
+          its consecutive chunks
 
     Returns:
       A tuple of sets with (matched_categories, applicable_categories), where
       applicable_categories are the names of rules that apply to the provided project.
       applicable_categories is a superset of matched_categories.
     """
-    output = output.replace('\r\n', '\n')
-    matched, applicable = set(), set()
-    for tag, rule_project, regexp in rules:
-        if not rule_project or rule_project == project:
-            applicable.add(tag)
-            if re.search(regexp, output, re.MULTILINE | re.DOTALL):
-                matched.add(tag)
-    return (matched, applicable)
+    if not isinstance(rules, RuleSet):
+        rules = RuleSet(rules)
+    return rules.categorize(project, output)
+
+
+def _windows(chunks):
+    # type: (Iterable[AnyStr]) -> Iterator[AnyStr]
+    """Yield the text of `chunks` in windows of about SCAN_WINDOW_SIZE.
+
+    Each window starts with the last MATCH_OVERLAP characters of the previous
+    one, and both start and end at line breaks where there are any, so that
+    ^ and $ only match where they would in the whole text.
+    """
+    pending = []  # type: List[AnyStr]
+    pending_size = 0
+    pending_lines = False
+    tail = ''
+    for chunk in chunks:
+        pending.append(chunk)
+        pending_size += len(chunk)
+        pending_lines = pending_lines or '\n' in chunk
+        # hold a partial last line back for the next window, unless it's
+        # getting too long
+        if pending_size < (SCAN_WINDOW_SIZE if pending_lines else 2 * SCAN_WINDOW_SIZE):
+            continue
+        text = ''.join(pending)
+        end = text.rfind('\n') + 1 or len(text)
+        window = tail + text[:end]
+        yield window
+        pending, pending_size, pending_lines = [text[end:]], len(text) - end, False
+        start = len(window) - MATCH_OVERLAP - 1
+        if start <= 0:
+            tail = window
+        else:
+            start = window.find('\n', start)
+            tail = window[start + 1:] if start != -1 else window[-MATCH_OVERLAP:]
+    if pending_size or not tail:
+        yield tail + ''.join(pending)
+
+
+def _normalize_newlines(chunks):
+    # type: (Iterable[AnyStr]) -> Iterable[AnyStr]
+    """Yield `chunks` with CRLFs replaced by LFs, including CRLFs split across chunks."""
+    carry = ''
+    for chunk in chunks:
+        chunk = carry + chunk
+        carry = ''
+        if chunk.endswith('\r'):
+            chunk, carry = chunk[:-1], '\r'
+        yield chunk.replace('\r\n', '\n')
+    if carry:
+        yield carry
+
+
+def _required_literals(regexp):
+    # type: (str) -> FrozenSet[str]
+    """Return strings that every match of `regexp` must contain.
+
+    These are the runs of at least MIN_LITERAL_LENGTH ASCII characters in the
+    top-level sequence of the regexp (including inside groups); none are
+    returned if the regexp is case-insensitive.
+    """
+    parsed = sre_parse.parse(regexp, RULE_FLAGS)
+    if parsed.pattern.flags & re.IGNORECASE:
+        return frozenset()
+    runs = ['']
+
+    def walk(items):
+        for op, av in items:
+            if op == sre_constants.LITERAL and av < 128:
+                runs[-1] += chr(av)
+            elif op == sre_constants.SUBPATTERN:
+                walk(av[1])
+            elif op == sre_constants.AT:
+                # zero width, e.g. ^ or \b
+                continue
+            else:
+                runs.append('')
+
+    walk(parsed)
+    return frozenset(run for run in runs if len(run) >= MIN_LITERAL_LENGTH)
+
+
+class _LiteralScanner(object):
+    """Finds which of a set of literal strings occur in some text."""
+
+    def __init__(self, literals):
+        # type: (FrozenSet[str]) -> None
+        self.literals = literals
+        if ahocorasick is not None and literals:
+            self._automaton = ahocorasick.Automaton()
+            for literal in literals:
+                self._automaton.add_word(literal, literal)
+            self._automaton.make_automaton()
+        else:
+            self._automaton = None
+
+    def find(self, text):
+        # type: (AnyStr) -> Set[str]
+        """Return the literals that occur in `text`."""
+        if self._automaton is not None:
+            if isinstance(text, unicode):
+                # the literals are ASCII, so they match the same in UTF-8
+                text = text.encode('utf-8')
+            return {literal for _, literal in self._automaton.iter(text)}
+        # Without Aho-Corasick, a regexp of the literals (as a trie, so each
+        # position is checked against all of them at once) in a lookahead
+        # finds the longest literal starting at each position; any shorter
+        # literal starting there is a prefix of it, and is found by checking
+        # the longer literals found for substrings.
+        pattern = _trie_pattern(self.literals)
+        found = set(m.group(1) for m in pattern.finditer(text))
+        found.update(l for l in self.literals - found if any(l in f for f in found))
+        return found
+
+
+_pattern_cache = {}  # type: Dict[FrozenSet[str], Any]
+
+
+def _trie_pattern(literals):
+    # type: (FrozenSet[str]) -> Any
+    """Return a compiled regexp that captures the longest of `literals` at each position."""
+    pattern = _pattern_cache.get(literals)
+    if pattern is None:
+        if len(_pattern_cache) > 100:
+            _pattern_cache.clear()
+        trie = {}  # type: Dict[str, Any]
+        for literal in literals:
+            node = trie
+            for char in literal:
+                node = node.setdefault(char, {})
+            node[''] = {}
+        pattern = _pattern_cache[literals] = re.compile('(?=({}))'.format(_trie_regexp(trie)))
+    return pattern
+
+
+def _trie_regexp(node):
+    # type: (Dict[str, Any]) -> str
+    alternatives = [re.escape(char) + _trie_regexp(child)
+                    for char, child in sorted(node.iteritems()) if char]
+    if not alternatives:
+        return ''
+    if len(alternatives) == 1 and '' not in node:
+        return alternatives[0]
+    # greedy, so longer literals are preferred
+    return '(?:{}){}'.format('|'.join(alternatives), '?' if '' in node else '')
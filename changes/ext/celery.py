@@ -47,6 +47,27 @@ class _Celery(object):
                 )
         return task_id
 
+    def delay_many(self, tasks):
+        """
+        Publishes many tasks, given as (name, kwargs) pairs, at once: like a
+        celery group, they share a producer connection and a group id.
+        """
+        celery = self.celery
+        if celery.conf.CELERY_ALWAYS_EAGER:
+            for name, kwargs in tasks:
+                self.delay(name, kwargs=kwargs)
+            return
+
+        group_id = uuid4().hex
+        with celery.producer_or_acquire() as P:
+            for name, kwargs in tasks:
+                self.logger.debug('Firing task %r kwargs=%r (group %s)', name, kwargs, group_id)
+                P.publish_task(
+                    task_name=name,
+                    task_kwargs=kwargs,
+                    group_id=group_id,
+                )
+
     def retry(self, name, *args, **kwargs):
         # unlike delay, we actually want to rely on Celery's retry logic
         # and because we can only execute this within a task, it's safe
@@ -1,9 +1,14 @@
+import atexit
+import os
 import re
+import socket
+import threading
 import time
 import logging
+from collections import defaultdict
 from contextlib import contextmanager
 from functools import wraps
-from typing import Iterator, Optional  # NOQA
+from typing import Dict, Iterator, List, Optional, Union  # NOQA
 
 import statsd
 
@@ -30,6 +35,10 @@ class StatsReporter(object):
        STATSD_HOST (address of statsd host as a string)
        STATSD_PORT (port statsd is listening on as an int)
        STATSD_PREFIX (string to be automatically prepended to all reported stats for namespacing)
+       STATSD_FLUSH_INTERVAL (seconds to aggregate stats for before sending them; 0 to
+           send each as it's reported)
+       STATSD_MAX_PACKET_SIZE (bytes per datagram when sending aggregated stats)
+       STATSD_MAX_BUFFERED (number of distinct values to hold between flushes)
 
     If STATSD_HOST isn't specified, none of the others will be used and this app will
     get a no-op Stats instance.
@@ -42,9 +51,19 @@ class StatsReporter(object):
 
     def init_app(self, app):
         if not self._stats and app.config.get('STATSD_HOST'):
-            sd = statsd.StatsClient(host=app.config['STATSD_HOST'],
-                                    prefix=app.config['STATSD_PREFIX'],
-                                    port=app.config['STATSD_PORT'])
+            if app.config.get('STATSD_FLUSH_INTERVAL'):
+                sd = AggregatingStatsClient(
+                    host=app.config['STATSD_HOST'],
+                    prefix=app.config['STATSD_PREFIX'],
+                    port=app.config['STATSD_PORT'],
+                    flush_interval=app.config['STATSD_FLUSH_INTERVAL'],
+                    max_packet_size=app.config['STATSD_MAX_PACKET_SIZE'],
+                    max_buffered=app.config['STATSD_MAX_BUFFERED'],
+                )
+            else:
+                sd = statsd.StatsClient(host=app.config['STATSD_HOST'],
+                                        prefix=app.config['STATSD_PREFIX'],
+                                        port=app.config['STATSD_PORT'])
             self._stats = Stats(client=sd)
 
     def stats(self):
@@ -141,3 +160,139 @@ class Stats(object):
         interestingly named keys and this avoids unintentionally using them."""
         if not cls._KEY_RE.match(key):
             raise Exception("Invalid key: {}".format(repr(key)))
+
+
+class AggregatingStatsClient(object):
+    """A stand-in for statsd.StatsClient that buffers what's reported, and sends
+    it every flush_interval seconds (from a background thread, and at exit).
+
+    Counters are summed and gauges keep their last value, so a hot loop costs
+    a few lines per flush rather than a packet per call. Every timing is sent,
+    as statsd's percentiles need each sample. Lines are packed into datagrams
+    of up to max_packet_size bytes.
+
+    At most max_buffered counters, gauges and timings are held between flushes;
+    anything beyond that, or that fails to send, is dropped and counted, and the
+    count is reported as statsd_dropped with the next flush.
+    """
+
+    DROPPED_KEY = 'statsd_dropped'
+
+    def __init__(self, host='localhost', port=8125, prefix=None, flush_interval=1.0,
+                 max_packet_size=1432, max_buffered=10000):
+        self._addr = (socket.gethostbyname(host), port)
+        self._prefix = prefix
+        self.flush_interval = flush_interval
+        self.max_packet_size = max_packet_size
+        self.max_buffered = max_buffered
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._pid = None  # type: Optional[int]
+        self._reset()
+        atexit.register(self.flush)
+
+    def _reset(self):
+        self._counters = defaultdict(float)  # type: Dict[str, float]
+        self._gauges = {}  # type: Dict[str, float]
+        self._timings = defaultdict(list)  # type: Dict[str, List[float]]
+        self._num_buffered = 0
+
+    def incr(self, stat, count=1):
+        with self._locked():
+            if stat in self._counters or self._make_room():
+                self._counters[stat] += count
+
+    def gauge(self, stat, value):
+        with self._locked():
+            if stat in self._gauges or self._make_room():
+                self._gauges[stat] = value
+
+    def timing(self, stat, delta):
+        with self._locked():
+            if self._make_room():
+                self._timings[stat].append(delta)
+
+    @contextmanager
+    def _locked(self):
+        # type: () -> Iterator[None]
+        pid = os.getpid()
+        if self._pid != pid:
+            self._start_flusher(pid)
+        with self._lock:
+            yield
+
+    def _make_room(self):
+        # type: () -> bool
+        """Whether a new value can be buffered; if not, it's counted as dropped."""
+        if self._num_buffered >= self.max_buffered:
+            self.dropped += 1
+            return False
+        self._num_buffered += 1
+        return True
+
+    def _start_flusher(self, pid):
+        # type: (int) -> None
+        if self._pid is not None:
+            # forked (e.g. into a Celery worker process): the flush thread
+            # didn't come along, the lock may have been held by a thread that
+            # didn't either, and what the parent buffered is the parent's
+            self._lock = threading.Lock()
+            self._reset()
+            self.dropped = 0
+        self._pid = pid
+        thread = threading.Thread(target=self._run, name='statsd-flush')
+        thread.daemon = True
+        thread.start()
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Sends everything buffered."""
+        with self._lock:
+            counters, gauges, timings = self._counters, self._gauges, self._timings
+            dropped, self.dropped = self.dropped, 0
+            self._reset()
+
+        lines = []  # type: List[str]
+        for stat, count in counters.iteritems():
+            lines.append(self._line(stat, count, 'c'))
+        if dropped:
+            lines.append(self._line(self.DROPPED_KEY, dropped, 'c'))
+        for stat, value in gauges.iteritems():
+            lines.append(self._line(stat, value, 'g'))
+        for stat, values in timings.iteritems():
+            for value in values:
+                lines.append(self._line(stat, value, 'ms'))
+
+        for packet in self._pack(lines):
+            try:
+                self._sock.sendto(packet, self._addr)
+            except (socket.error, socket.gaierror):
+                with self._lock:
+                    self.dropped += packet.count('\n') + 1
+
+    def _line(self, stat, value, type):
+        # type: (str, Union[int, float], str) -> str
+        if self._prefix:
+            stat = '{}.{}'.format(self._prefix, stat)
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        return '{}:{}|{}'.format(stat, value, type)
+
+    def _pack(self, lines):
+        # type: (List[str]) -> Iterator[str]
+        packet = []  # type: List[str]
+        size = 0
+        for line in lines:
+            if packet and size + 1 + len(line) > self.max_packet_size:
+                yield '\n'.join(packet)
+                packet, size = [], 0
+            size += len(line) + (1 if packet else 0)
+            packet.append(line)
+        if packet:
+            yield '\n'.join(packet)
@@ -1,15 +1,34 @@
 from __future__ import absolute_import
 
+import logging
+import time
+
+from collections import Counter
 from datetime import datetime, timedelta
 
-from changes.config import queue, statsreporter
+from sqlalchemy import and_, select, tuple_
+
+from changes.config import db, queue, statsreporter
 from changes.constants import Status
 from changes.models.task import Task
-from changes.queue.task import TrackedTask
 
 CHECK_TIME = timedelta(minutes=60)
 EXPIRE_TIME = timedelta(days=7)
 
+# How many stale tasks to load (and requeue) at a time.
+REQUEUE_BATCH_SIZE = 500
+
+# The most tasks with the same name to requeue per run, so that recovering
+# from an outage doesn't flood the workers; the rest are requeued by later runs.
+REQUEUE_LIMIT_PER_TASK_NAME = 1000
+
+# How many finished tasks to delete per statement, and for how long to keep
+# deleting them per run, so that no single statement holds its locks for long.
+DELETE_BATCH_SIZE = 1000
+DELETE_TIME_BUDGET = timedelta(seconds=20)
+
+logger = logging.getLogger('cleanup-tasks')
+
 
 # NOTE: This isn't itself a TrackedTask, but probably should be.
 @statsreporter.timer('task_duration_cleanup_task')
@@ -22,24 +41,98 @@ def cleanup_tasks():
     """
     now = datetime.utcnow()
 
-    pending_tasks = Task.query.filter(
-        Task.status != Status.finished,
-        Task.date_modified < now - CHECK_TIME,
-    )
-
-    for task in pending_tasks:
-        task_func = TrackedTask(queue.get_task(task.task_name))
-        task_func.delay(
-            task_id=task.task_id.hex,
-            parent_task_id=task.parent_id.hex if task.parent_id else None,
-            **task.data['kwargs']
+    requeued = requeue_stale_tasks(now - CHECK_TIME)
+    deleted = delete_finished_tasks(now - EXPIRE_TIME)
+
+    stats = statsreporter.stats()
+    stats.incr('tasks_requeued', sum(requeued.values()))
+    stats.incr('tasks_deleted', sum(deleted.values()))
+    for task_name, count in requeued.iteritems():
+        stats.incr('tasks_requeued_{}'.format(task_name), count)
+    for task_name, count in deleted.iteritems():
+        stats.incr('tasks_deleted_{}'.format(task_name), count)
+    if requeued or deleted:
+        logger.info('Requeued %s; deleted %s', dict(requeued), dict(deleted))
+
+
+def requeue_stale_tasks(cutoff):
+    # type: (datetime) -> Counter
+    """
+    Requeues the unfinished tasks that haven't been modified since `cutoff`,
+    oldest first and up to REQUEUE_LIMIT_PER_TASK_NAME of each name.
+
+    Returns the number requeued by task name.
+    """
+    requeued = Counter()  # type: Counter
+    position = None
+    while True:
+        query = db.session.query(
+            Task.id, Task.task_name, Task.task_id, Task.parent_id, Task.date_modified, Task.data,
+        ).filter(
+            Task.status != Status.finished,
+            Task.date_modified < cutoff,
         )
+        if position is not None:
+            query = query.filter(tuple_(Task.date_modified, Task.id) > position)
+        batch = query.order_by(Task.date_modified, Task.id).limit(REQUEUE_BATCH_SIZE).all()
+        if not batch:
+            break
+        position = (batch[-1].date_modified, batch[-1].id)
+
+        to_requeue = []
+        for task in batch:
+            if requeued[task.task_name] < REQUEUE_LIMIT_PER_TASK_NAME:
+                requeued[task.task_name] += 1
+                to_requeue.append(task)
+
+        if to_requeue:
+            # As TrackedTask.delay does for existing tasks, so they aren't
+            # requeued again until they're stale again.
+            Task.query.filter(
+                Task.id.in_([t.id for t in to_requeue]),
+            ).update({
+                Task.date_modified: datetime.utcnow(),
+            }, synchronize_session=False)
+            db.session.commit()
+
+            queue.delay_many([
+                (task.task_name, dict(
+                    (task.data or {}).get('kwargs', {}),
+                    task_id=task.task_id.hex,
+                    parent_task_id=task.parent_id.hex if task.parent_id else None,
+                ))
+                for task in to_requeue
+            ])
 
-    deleted = Task.query.filter(
-        Task.status == Status.finished,
-        Task.date_modified < now - EXPIRE_TIME,
-        # Filtering by date_created isn't necessary, but it allows us to filter using an index on
-        # a value that doesn't update, which makes our deletion more efficient.
-        Task.date_created < now - EXPIRE_TIME,
-    ).delete(synchronize_session=False)
-    statsreporter.stats().incr('tasks_deleted', deleted)
+        if len(batch) < REQUEUE_BATCH_SIZE:
+            break
+    return requeued
+
+
+def delete_finished_tasks(cutoff):
+    # type: (datetime) -> Counter
+    """
+    Deletes tasks that finished before `cutoff`, DELETE_BATCH_SIZE at a time
+    until there are none left or DELETE_TIME_BUDGET is used up.
+
+    Returns the number deleted by task name.
+    """
+    deleted = Counter()  # type: Counter
+    table = Task.__table__
+    deadline = time.time() + DELETE_TIME_BUDGET.total_seconds()
+    while time.time() < deadline:
+        ids = select([table.c.id]).where(and_(
+            table.c.status == Status.finished,
+            table.c.date_modified < cutoff,
+            # Filtering by date_created isn't necessary, but it allows us to filter using an index on
+            # a value that doesn't update, which makes our deletion more efficient.
+            table.c.date_created < cutoff,
+        )).limit(DELETE_BATCH_SIZE)
+        rows = db.session.execute(
+            table.delete().where(table.c.id.in_(ids)).returning(table.c.task_name)
+        ).fetchall()
+        db.session.commit()
+        deleted.update(task_name for task_name, in rows)
+        if len(rows) < DELETE_BATCH_SIZE:
+            break
+    return deleted
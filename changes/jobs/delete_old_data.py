@@ -3,10 +3,12 @@ from __future__ import absolute_import, print_function
 import logging
 
 from datetime import datetime, timedelta
+from typing import Iterable, Optional  # NOQA
 
 from changes.config import db, statsreporter
+from changes.lib.partitioning import PARTITIONS_AHEAD
 from changes.models.project import Project, ProjectOptionsHelper
-from changes.models.test import TestCase
+from changes.models.test import TEST_PARTITIONING, TEST_PARTITIONINGS, TestCase, delete_test_children
 
 DEFAULT_TEST_RETENTION_DAYS = 120
 MINIMUM_TEST_RETENTION_DAYS = 7
@@ -14,6 +16,34 @@ MINIMUM_TEST_RETENTION_DAYS = 7
 logger = logging.getLogger('delete-old-data')
 
 
+def get_test_retention_days(project, num_days=None):
+    # type: (Project, Optional[float]) -> Optional[float]
+    """
+    The number of days to keep `project`'s tests for, or None if it's less
+    than MINIMUM_TEST_RETENTION_DAYS (and so shouldn't be trusted).
+    """
+    test_retention_days = num_days or float(
+        ProjectOptionsHelper.get_option(project, 'history.test-retention-days') or
+        DEFAULT_TEST_RETENTION_DAYS
+    )
+    if test_retention_days < MINIMUM_TEST_RETENTION_DAYS:
+        logger.warning(
+            'Test retention days for project %s is %d, which is less than the minimum of %d. '
+            'Not cleaning tests for this project.' %
+            (project.slug, test_retention_days, MINIMUM_TEST_RETENTION_DAYS))
+        return None
+    return test_retention_days
+
+
+def get_test_retention_horizon(retention_days):
+    # type: (Iterable[Optional[float]]) -> float
+    """
+    The number of days after which no project needs its tests anymore, given
+    each project's get_test_retention_days.
+    """
+    return max([DEFAULT_TEST_RETENTION_DAYS] + [d for d in retention_days if d is not None])
+
+
 def clean_project_tests(project, from_date, chunk_size, num_days=None):
     # type: (Project, datetime, timedelta, int) -> int
     """Deletes old tests from a project and returns number of rows deleted.
@@ -27,25 +57,21 @@ def clean_project_tests(project, from_date, chunk_size, num_days=None):
         logger.warning('The minutes worth of tests to delete is %s but it must be positive.' %
                        chunk_size)
         return 0
-    test_retention_days = num_days or float(
-        ProjectOptionsHelper.get_option(project, 'history.test-retention-days') or
-        DEFAULT_TEST_RETENTION_DAYS
-    )
-    if test_retention_days < MINIMUM_TEST_RETENTION_DAYS:
-        logger.warning(
-            'Test retention days for project %s is %d, which is less than the minimum of %d. '
-            'Not cleaning tests for this project.' %
-            (project.slug, test_retention_days, MINIMUM_TEST_RETENTION_DAYS))
+    test_retention_days = get_test_retention_days(project, num_days)
+    if test_retention_days is None:
         return 0
 
     test_delete_date = from_date - timedelta(days=test_retention_days)
     test_delete_date_limit = test_delete_date - chunk_size
 
-    rows_deleted = db.session.query(TestCase).filter(
+    tests = db.session.query(TestCase).filter(
         TestCase.project_id == project.id,
         TestCase.date_created < test_delete_date,
         TestCase.date_created >= test_delete_date_limit,
-        ).delete()
+        )
+
+    delete_test_children(tests)
+    rows_deleted = tests.delete()
 
     db.session.commit()
 
@@ -81,7 +107,44 @@ def delete_old_data_limited(chunk_size, from_date=None):
     try:
         projects = Project.query.all()
 
+        if TEST_PARTITIONING.is_partitioned():
+            # tests kept for the longest retention are removed by
+            # drop_old_test_partitions; only shorter retentions need deletes
+            retention_days = {p: get_test_retention_days(p) for p in projects}
+            horizon = get_test_retention_horizon(retention_days.values())
+            projects = [p for p in projects if retention_days[p] is not None and retention_days[p] < horizon]
+
         for project in projects:
             clean_project_tests(project, from_date, chunk_size)
     except Exception as e:
         logger.exception(e.message)
+
+
+@statsreporter.timer('task_duration_drop_old_test_partitions')
+def drop_old_test_partitions(now=None):
+    # type: (Optional[datetime]) -> None
+    """
+    Drops the partitions of the test tables that are past every project's
+    test retention, and creates the partitions new tests will need. Does
+    nothing for tables that haven't been partitioned.
+    """
+    if now is None:
+        now = datetime.utcnow()
+    horizon = get_test_retention_horizon(get_test_retention_days(p) for p in Project.query.all())
+    cutoff = now - timedelta(days=horizon)
+
+    for partitioning in TEST_PARTITIONINGS:
+        if not partitioning.is_partitioned():
+            continue
+        try:
+            partitioning.create_partitions(now, now + partitioning.interval * PARTITIONS_AHEAD)
+            db.session.commit()
+        except Exception:
+            # e.g. the default partition already has rows in a new range
+            db.session.rollback()
+            logger.exception('Failed to create partitions of %s', partitioning.table)
+
+        dropped = partitioning.drop_partitions_before(cutoff)
+        if dropped:
+            logger.info('Dropped partitions of %s: %s', partitioning.table, ', '.join(dropped))
+        statsreporter.stats().incr('count_test_partitions_dropped', len(dropped))
@@ -0,0 +1,26 @@
+from __future__ import absolute_import
+
+from changes.config import queue, statsreporter
+from changes.lib import notifications
+
+
+@statsreporter.timer('task_duration_deliver_notifications')
+def deliver_notifications(destination):
+    """
+    Delivers the notifications due to a destination (see
+    changes.lib.notifications).
+    """
+    notifications.deliver(destination)
+
+
+@statsreporter.timer('task_duration_sweep_notifications')
+def sweep_notifications():
+    """
+    Delivers notifications that are due, such as retries, but that no
+    deliver_notifications task is on its way for.
+    """
+    destinations = notifications.due_destinations()
+    if destinations:
+        queue.delay_many([
+            ('deliver_notifications', {'destination': d}) for d in destinations
+        ])
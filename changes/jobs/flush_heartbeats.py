@@ -0,0 +1,14 @@
+from __future__ import absolute_import
+
+from changes.config import statsreporter
+from changes.lib import heartbeats
+
+
+@statsreporter.timer('task_duration_flush_heartbeats')
+def flush_heartbeats():
+    """
+    Writes the jobstep heartbeats buffered in Redis by JobStepHeartbeatAPIView
+    to the database (see changes.lib.heartbeats).
+    """
+    flushed = heartbeats.flush()
+    statsreporter.stats().incr('jobstep_heartbeats_flushed', flushed)
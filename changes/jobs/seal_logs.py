@@ -0,0 +1,52 @@
+from __future__ import absolute_import
+
+import logging
+
+from datetime import datetime, timedelta
+
+from sqlalchemy.sql import exists
+
+from changes.config import db, statsreporter
+from changes.constants import Status
+from changes.lib import log_segments
+from changes.models.jobstep import JobStep
+from changes.models.log import LogChunk, LogSource
+
+# How long after a jobstep finishes to seal its logs, so that late log
+# uploads (and the listeners that read the logs) don't race with sealing.
+MIN_AGE = timedelta(hours=1)
+
+# The most logsources to seal per run.
+BATCH_SIZE = 100
+
+logger = logging.getLogger('seal-logs')
+
+
+@statsreporter.timer('task_duration_seal_logs')
+def seal_logs():
+    """
+    Seals the logchunks of logsources whose jobsteps have finished into
+    compressed logsegments (see changes.lib.log_segments), oldest first.
+    """
+    cutoff = datetime.utcnow() - MIN_AGE
+
+    sources = LogSource.query.join(
+        JobStep, LogSource.step_id == JobStep.id,
+    ).filter(
+        JobStep.status == Status.finished,
+        JobStep.date_finished < cutoff,
+        exists().where(LogChunk.source_id == LogSource.id),
+    ).order_by(
+        LogSource.date_created.asc(),
+    ).limit(BATCH_SIZE)
+
+    for source in list(sources):
+        try:
+            num_segments = log_segments.seal(source)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logger.exception('Failed to seal logsource %s', source.id.hex)
+            continue
+        statsreporter.stats().incr('log_sources_sealed')
+        statsreporter.stats().incr('log_segments_created', num_segments)
@@ -1,26 +1,132 @@
+from __future__ import absolute_import
+
+import logging
+
 from flask import current_app
+from typing import Any, Dict, List, Optional, Tuple  # NOQA
+from uuid import uuid4
 
+from changes.config import db, queue, redis, statsreporter
+from changes.constants import Status
+from changes.models.task import Task
 from changes.queue.task import tracked_task
 from changes.utils.imports import import_string
 
+logger = logging.getLogger('signals')
+
 
 class SuspiciousOperation(Exception):
     pass
 
 
+def get_listeners(signal=None):
+    # type: (str) -> List[Tuple[str, Dict[str, Any]]]
+    """
+    Returns the registered listeners (for the given signal, or all of them),
+    with their options.
+
+    EVENT_LISTENERS entries are (listener, signal) pairs, optionally followed
+    by a dict of options:
+
+    - inline: run the listener in the process firing the signal, rather than
+      queueing it; for cheap listeners. Failures are logged, not retried.
+    - tracked: run the listener as a tracked task (run_event_listener), with
+      a Task row, and retries if it fails.
+    - dedupe: names of signal kwargs; the listener is only run once for the
+      same values of them (within EVENT_LISTENER_DEDUPE_TTL seconds).
+
+    Otherwise listeners are queued as plain Celery tasks
+    (run_untracked_event_listener).
+    """
+    listeners = []
+    for entry in current_app.config['EVENT_LISTENERS']:
+        listener, l_signal = entry[:2]
+        if signal is None or l_signal == signal:
+            listeners.append((listener, entry[2] if len(entry) > 2 else {}))
+    return listeners
+
+
+def dispatch_signal(signal, kwargs):
+    # type: (str, Dict[str, Any]) -> None
+    """
+    Fires a signal: queues every listener registered for it at once (see
+    get_listeners), and runs the inline ones.
+
+    Commits the session.
+    """
+    inline = []  # type: List[str]
+    tasks = []  # type: List[Tuple[str, Dict[str, Any]]]
+    claimed = []  # type: List[str]
+    for listener, options in get_listeners(signal):
+        if options.get('dedupe'):
+            key = _claim(listener, signal, kwargs, options['dedupe'])
+            if key is None:
+                statsreporter.stats().incr('event_listener_deduped')
+                continue
+            claimed.append(key)
+
+        if options.get('inline'):
+            inline.append(listener)
+            continue
+
+        task_kwargs = {
+            'listener': listener,
+            'signal': signal,
+            'kwargs': kwargs,
+        }
+        if options.get('tracked'):
+            task_kwargs['task_id'] = uuid4().hex
+            db.session.add(Task(
+                task_name=run_event_listener.task_name,
+                task_id=task_kwargs['task_id'],
+                data={'kwargs': {k: v for k, v in task_kwargs.iteritems() if k != 'task_id'}},
+                status=Status.queued,
+            ))
+            tasks.append((run_event_listener.task_name, task_kwargs))
+        else:
+            tasks.append(('run_untracked_event_listener', task_kwargs))
+
+    try:
+        # the Task rows must exist before their tasks run
+        db.session.commit()
+        if tasks:
+            queue.delay_many(tasks)
+    except Exception:
+        # nothing was run, so the signal can be fired again
+        if claimed:
+            redis.delete(*claimed)
+        raise
+
+    for listener in inline:
+        try:
+            import_string(listener)(**kwargs)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logger.exception('Failed to run listener %s for signal %s', listener, signal)
+
+
+def _claim(listener, signal, kwargs, dedupe):
+    # type: (str, str, Dict[str, Any], List[str]) -> Optional[str]
+    """
+    Returns the dedupe key claimed if this is the first time the listener is
+    run for these values, or None if it isn't.
+    """
+    key = 'signal:{}:{}:{}'.format(signal, listener, ':'.join(
+        unicode(kwargs.get(name)) for name in dedupe))
+    if redis.set(key, '1', nx=True, ex=current_app.config['EVENT_LISTENER_DEDUPE_TTL']):
+        return key
+    return None
+
+
 @tracked_task
 def fire_signal(signal, kwargs):
     """
-    Tasks fire signals by spawning fire_signal tasks; they grab every
-    associated listener and spawn run_event_listener tasks for each
+    Fires a signal from a task of its own. Signals are now fired directly
+    with dispatch_signal; this remains for any fire_signal tasks still
+    queued.
     """
-    for listener, l_signal in current_app.config['EVENT_LISTENERS']:
-        if l_signal == signal:
-            run_event_listener.delay(
-                listener=listener,
-                signal=signal,
-                kwargs=kwargs,
-            )
+    dispatch_signal(signal, kwargs)
 
 
 @tracked_task
@@ -28,11 +134,31 @@ def run_event_listener(listener, signal, kwargs):
     """
     Actually run the listener
 
-    See fire_signal, which doesn't actually run it
+    See dispatch_signal, which doesn't actually run it
     """
-    # simple check to make sure this is registered
-    if not any(l == listener for l, _ in current_app.config['EVENT_LISTENERS']):
-        raise SuspiciousOperation('%s is not a registered event listener' % (listener,))
+    _check_registered(listener)
 
     func = import_string(listener)
     func(**kwargs)
+
+
+def run_untracked_event_listener(listener, signal, kwargs):
+    """
+    As run_event_listener, for listeners that aren't tracked: no Task row is
+    kept, and failures aren't retried.
+    """
+    _check_registered(listener)
+
+    func = import_string(listener)
+    try:
+        func(**kwargs)
+    except Exception:
+        db.session.rollback()
+        raise
+    db.session.commit()
+
+
+def _check_registered(listener):
+    # simple check to make sure this is registered
+    if not any(l == listener for l, _ in get_listeners()):
+        raise SuspiciousOperation('%s is not a registered event listener' % (listener,))
@@ -5,7 +5,8 @@ from sqlalchemy.sql import func
 from changes.config import db, queue, statsreporter
 from changes.constants import Result, Status
 from changes.db.utils import try_create
-from changes.jobs.signals import fire_signal
+from changes.jobs.signals import dispatch_signal
+from changes.lib import build_context_lib
 from changes.models.build import Build
 from changes.models.itemstat import ItemStat
 from changes.models.job import Job
@@ -138,7 +139,14 @@ def sync_build(build_id):
         except Exception:
             current_app.logger.exception('Failing recording aggregate stats for build %s', build.id)
 
-    fire_signal.delay(
+    # for the build.finished listeners to share (they compute it themselves
+    # if they have to)
+    try:
+        build_context_lib.store_build_snapshot(build)
+    except Exception:
+        current_app.logger.exception('Failed to store snapshot of build %s', build.id)
+
+    dispatch_signal(
         signal='build.finished',
         kwargs={'build_id': build.id.hex},
     )
@@ -8,7 +8,7 @@ from changes.backends.base import UnrecoverableException
 from changes.config import db, queue, statsreporter
 from changes.constants import Status, Result
 from changes.db.utils import try_create
-from changes.jobs.signals import fire_signal
+from changes.jobs.signals import dispatch_signal
 from changes.models.itemstat import ItemStat
 from changes.models.job import Job
 from changes.models.jobphase import JobPhase
@@ -224,7 +224,7 @@ def sync_job(job_id):
     except Exception:
         current_app.logger.exception('Failing recording aggregate stats for job %s', job.id)
 
-    fire_signal.delay(
+    dispatch_signal(
         signal='job.finished',
         kwargs={'job_id': job.id.hex},
     )
@@ -16,6 +16,7 @@ from changes.constants import Status, Result, ResultSource
 from changes.config import db, statsreporter
 from changes.db.utils import try_create
 from changes.jobs.sync_artifact import sync_artifact
+from changes.lib import heartbeats
 from changes.lib.artifact_store_lib import ArtifactStoreClient
 from changes.models.artifact import Artifact
 from changes.models.bazeltarget import BazelTarget
@@ -372,6 +373,8 @@ def sync_job_step(step_id):
 
     # only synchronize if upstream hasn't suggested we're finished
     if step.status != Status.finished:
+        # heartbeats may not have been flushed to the database yet
+        heartbeats.refresh(step)
         implementation.update_step(step=step)
 
     db.session.flush()
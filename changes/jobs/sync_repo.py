@@ -5,7 +5,7 @@ import logging
 from datetime import datetime
 
 from changes.config import db
-from changes.jobs.signals import fire_signal
+from changes.jobs.signals import dispatch_signal
 from changes.models.repository import Repository, RepositoryBackend, RepositoryStatus
 from changes.models.revision import Revision
 from changes.queue.task import tracked_task
@@ -93,7 +93,7 @@ def sync(repo):
         # triggering on branchless commits.
         if revision.branches and not revision.date_created_signal:
             revision.date_created_signal = datetime.utcnow()
-            fire_signal.delay(
+            dispatch_signal(
                 signal='revision.created',
                 kwargs={'repository_id': repo.id.hex,
                         'revision_sha': revision.sha},
@@ -0,0 +1,413 @@
+"""
+A Redis index of the jobsteps waiting to be allocated, so that schedulers
+polling JobStepAllocateAPIView don't have to scan the jobstep table.
+
+Jobsteps in pending_allocation are kept in a sorted set per cluster and build
+priority, scored by their creation time, and the number of active (allocated or
+in-progress) jobs per project is kept alongside them for the per-project limit.
+
+The index is updated after each commit that moves a jobstep into or out of
+pending_allocation, changes a job's status or changes a build's priority (see
+`track_changes` and `apply_changes`). It is also rebuilt from the database
+every ALLOCATION_INDEX_REBUILD_INTERVAL seconds to make up for anything missed
+(e.g. a failed Redis write, or a rolled-back transaction after a committed
+savepoint). Jobsteps read from the index are checked against the database, so
+stale entries are harmless.
+"""
+
+from __future__ import absolute_import
+
+import logging
+
+from calendar import timegm
+from collections import defaultdict
+from flask import current_app
+from sqlalchemy import inspect, or_
+from sqlalchemy.orm import Session, joinedload  # NOQA
+from typing import Dict, Iterable, List, Optional, Tuple  # NOQA
+from uuid import UUID  # NOQA
+
+from changes.config import db, redis
+from changes.constants import Status
+from changes.ext.redis import UnableToGetLock
+from changes.models.build import Build, BuildPriority
+from changes.models.job import Job
+from changes.models.jobstep import JobStep
+
+logger = logging.getLogger('changes.allocation_index')
+
+# projects with this many active jobs only get jobsteps allocated if there's
+# nothing else to allocate
+MAX_ACTIVE_JOBS_PER_PROJECT = 10
+
+# the most ranges of each queue read by find_next_jobsteps, so that a deep
+# queue for projects over their limit can't make it read the whole index
+SCAN_RANGES = 10
+
+ACTIVE_STATUSES = frozenset([Status.allocated, Status.in_progress])
+
+QUEUE_KEY = 'jobstep:allocation:queue:{cluster}:{priority}'
+ACTIVE_JOBS_KEY = 'jobstep:allocation:active-jobs'
+ACTIVE_COUNTS_KEY = 'jobstep:allocation:active-counts'
+READY_KEY = 'jobstep:allocation:ready'
+REBUILD_LOCK_KEY = 'jobstep:allocation:rebuild'
+
+# highest priority first
+PRIORITIES = sorted(BuildPriority, key=lambda p: p.value, reverse=True)
+
+# Claims all of the given jobsteps (removing them from the queues), or none of
+# them if any aren't queued. Returns the ids that weren't queued.
+# KEYS: the queues of a cluster, ARGV: jobstep ids
+_CLAIM_SCRIPT = """
+local missing = {}
+for _, id in ipairs(ARGV) do
+    local found = false
+    for _, queue in ipairs(KEYS) do
+        if redis.call('ZSCORE', queue, id) then
+            found = true
+            break
+        end
+    end
+    if not found then
+        table.insert(missing, id)
+    end
+end
+if #missing == 0 then
+    for _, queue in ipairs(KEYS) do
+        redis.call('ZREM', queue, unpack(ARGV))
+    end
+end
+return missing
+"""
+
+# Marks a job as active, counting it against its project (only once).
+# KEYS: active jobs, active counts, ARGV: job id, project id
+_ACTIVATE_SCRIPT = """
+if redis.call('HSETNX', KEYS[1], ARGV[1], ARGV[2]) == 1 then
+    redis.call('HINCRBY', KEYS[2], ARGV[2], 1)
+end
+"""
+
+# Marks a job as no longer active.
+# KEYS: active jobs, active counts, ARGV: job id
+_DEACTIVATE_SCRIPT = """
+local project = redis.call('HGET', KEYS[1], ARGV[1])
+if project then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    if redis.call('HINCRBY', KEYS[2], project, -1) <= 0 then
+        redis.call('HDEL', KEYS[2], project)
+    end
+end
+"""
+
+_scripts = {}  # type: Dict[str, object]
+
+
+def _script(source):
+    if source not in _scripts:
+        _scripts[source] = redis.register_script(source)
+    return _scripts[source]
+
+
+def _queue_key(cluster, priority):
+    # type: (Optional[str], BuildPriority) -> str
+    return QUEUE_KEY.format(cluster=cluster or '', priority=priority.name)
+
+
+def _queue_keys(cluster):
+    # type: (Optional[str]) -> List[str]
+    return [_queue_key(cluster, p) for p in PRIORITIES]
+
+
+def _score(date_created):
+    """Microseconds since the epoch (exactly representable as a score)."""
+    return timegm(date_created.utctimetuple()) * 1000000 + date_created.microsecond
+
+
+def _pending_jobstep_rows(session, *criteria):
+    return session.query(
+        JobStep.id, JobStep.cluster, JobStep.date_created, Build.priority,
+    ).join(
+        Job, JobStep.job_id == Job.id,
+    ).join(
+        Build, Job.build_id == Build.id,
+    ).filter(
+        JobStep.status == Status.pending_allocation,
+        *criteria
+    )
+
+
+def _add_rows(pipe, rows):
+    for jobstep_id, cluster, date_created, priority in rows:
+        for p in PRIORITIES:
+            if p != priority:
+                pipe.zrem(_queue_key(cluster, p), jobstep_id.hex)
+        pipe.zadd(_queue_key(cluster, priority), **{jobstep_id.hex: _score(date_created)})
+
+
+def is_ready():
+    # type: () -> bool
+    return bool(redis.exists(READY_KEY))
+
+
+def rebuild():
+    """
+    Adds all pending jobsteps to the queues (stale entries are removed as
+    they're found by `find_next_jobsteps`) and recounts active jobs.
+    """
+    rows = list(_pending_jobstep_rows(db.session))
+    active_jobs = list(db.session.query(
+        Job.id, Job.project_id,
+    ).filter(
+        Job.status.in_(ACTIVE_STATUSES),
+    ))
+    counts = defaultdict(int)  # type: Dict[str, int]
+    for _, project_id in active_jobs:
+        counts[project_id.hex] += 1
+
+    pipe = redis.pipeline()
+    _add_rows(pipe, rows)
+    pipe.delete(ACTIVE_JOBS_KEY, ACTIVE_COUNTS_KEY)
+    if active_jobs:
+        pipe.hmset(ACTIVE_JOBS_KEY, {j.hex: p.hex for j, p in active_jobs})
+        pipe.hmset(ACTIVE_COUNTS_KEY, counts)
+    pipe.setex(READY_KEY, 1, current_app.config['ALLOCATION_INDEX_REBUILD_INTERVAL'])
+    pipe.execute()
+
+
+def ensure_ready():
+    # type: () -> bool
+    """
+    Rebuilds the index if it's due. Returns False if it needs rebuilding but
+    another process is already doing so (i.e. it can't be used yet).
+    """
+    if is_ready():
+        return True
+    try:
+        with redis.lock(REBUILD_LOCK_KEY, expire=60, nowait=True):
+            if not is_ready():
+                rebuild()
+    except UnableToGetLock:
+        return is_ready()
+    return True
+
+
+def find_next_jobsteps(limit, cluster=None):
+    # type: (int, Optional[str]) -> List[JobStep]
+    """
+    Returns up to `limit` pending jobsteps in the order they should be
+    allocated: by build priority and then age, preferring jobs that have
+    already started, and leaving projects with MAX_ACTIVE_JOBS_PER_PROJECT
+    active jobs until last.
+
+    Each queue is read in ranges of `limit * 2` until there are `limit`
+    jobsteps from projects below their limit (or SCAN_RANGES ranges have been
+    read), so only started jobs within those ranges are preferred.
+    """
+    cluster = cluster or None
+    started, unstarted, over_limit = [], [], []  # type: Tuple[List[JobStep], List[JobStep], List[JobStep]]
+    window = max(limit * 2, 1)
+    for key in _queue_keys(cluster):
+        offset = 0
+        for _ in xrange(SCAN_RANGES):
+            if len(started) + len(unstarted) >= limit:
+                break
+            ids = redis.zrange(key, offset, offset + window - 1)
+            if not ids:
+                break
+            jobsteps = _load_pending(ids, key, cluster)
+            # stale entries were removed, so the next range starts earlier
+            offset += len(jobsteps)
+            if not jobsteps:
+                continue
+            project_ids = sorted({js.project_id.hex for js in jobsteps})
+            active_counts = dict(zip(project_ids, redis.hmget(ACTIVE_COUNTS_KEY, project_ids))) if project_ids else {}
+            for jobstep in jobsteps:
+                if int(active_counts[jobstep.project_id.hex] or 0) >= MAX_ACTIVE_JOBS_PER_PROJECT:
+                    over_limit.append(jobstep)
+                elif jobstep.job.status in ACTIVE_STATUSES:
+                    started.append(jobstep)
+                else:
+                    unstarted.append(jobstep)
+    return (started + unstarted + over_limit)[:limit]
+
+
+def _load_pending(ids, key, cluster):
+    # type: (List[str], str, Optional[str]) -> List[JobStep]
+    """
+    Loads the jobsteps with the given ids (in that order), removing any that
+    are no longer pending from the queue.
+    """
+    jobsteps = {
+        js.id.hex: js
+        for js in JobStep.query.options(
+            joinedload('job', innerjoin=True),
+        ).filter(
+            JobStep.id.in_(ids),
+        )
+    }
+    result = []
+    stale = []
+    for id in ids:
+        jobstep = jobsteps.get(id)
+        if jobstep is None or jobstep.status != Status.pending_allocation or jobstep.cluster != cluster:
+            stale.append(id)
+        else:
+            result.append(jobstep)
+    if stale:
+        redis.zrem(key, *stale)
+    return result
+
+
+def claim(jobstep_ids, cluster=None):
+    # type: (List[str], Optional[str]) -> List[str]
+    """
+    Atomically removes all of the given jobsteps (hex ids) from the queues of
+    `cluster`, or none of them if any aren't queued. Returns the ids of the
+    ones that weren't queued.
+    """
+    if not jobstep_ids:
+        return []
+    return _script(_CLAIM_SCRIPT)(keys=_queue_keys(cluster), args=jobstep_ids)
+
+
+def requeue(jobstep_ids):
+    # type: (Iterable[UUID]) -> None
+    """Adds back the given jobsteps that are still pending (e.g. after a failed allocation)."""
+    jobstep_ids = list(jobstep_ids)
+    if not jobstep_ids:
+        return
+    pipe = redis.pipeline()
+    _add_rows(pipe, _pending_jobstep_rows(db.session, JobStep.id.in_(jobstep_ids)))
+    pipe.execute()
+
+
+def track_changes(session, flush_context):
+    """
+    after_flush listener that records the changes to apply to the index once
+    the transaction commits.
+    """
+    changes = session.info.get('allocation_index')
+    new_pending = []  # type: List[UUID]
+    new_priority = []  # type: List[UUID]
+
+    def record():
+        return changes or session.info.setdefault('allocation_index', _new_changes())
+
+    # (session.new is built afresh on every access)
+    new = session.new
+    for obj in new | session.dirty:
+        is_new = obj in new
+        if isinstance(obj, JobStep):
+            if not (is_new or _changed(obj, 'status', 'cluster')):
+                continue
+            changes = record()
+            clusters = set(inspect(obj).attrs.cluster.history.deleted or ()) | {obj.cluster}
+            changes['added'].pop(obj.id, None)
+            changes['removed'][obj.id] = clusters
+            if obj.status == Status.pending_allocation:
+                new_pending.append(obj.id)
+        elif isinstance(obj, Job):
+            if not (is_new or _changed(obj, 'status')):
+                continue
+            changes = record()
+            changes['jobs'][obj.id] = (obj.project_id, obj.status in ACTIVE_STATUSES)
+        elif isinstance(obj, Build):
+            if is_new or not _changed(obj, 'priority'):
+                continue
+            changes = record()
+            new_priority.append(obj.id)
+
+    for obj in session.deleted:
+        if isinstance(obj, JobStep):
+            changes = record()
+            changes['added'].pop(obj.id, None)
+            changes['removed'][obj.id] = {obj.cluster}
+        elif isinstance(obj, Job):
+            changes = record()
+            changes['jobs'][obj.id] = (obj.project_id, False)
+
+    if new_pending or new_priority:
+        criteria = []
+        if new_pending:
+            criteria.append(JobStep.id.in_(new_pending))
+        if new_priority:
+            criteria.append(Build.id.in_(new_priority))
+        with session.no_autoflush:
+            rows = list(_pending_jobstep_rows(session, or_(*criteria)))
+        for row in rows:
+            changes['added'][row.id] = row
+
+
+def track_inserted(session, jobstep_ids):
+    # type: (Session, List[UUID]) -> None
+    """
+    Records jobsteps inserted without the session (e.g. with bulk_insert),
+    which `track_changes` can't see, to be added to the index once the
+    transaction commits.
+    """
+    if not (jobstep_ids and current_app.config['ALLOCATION_INDEX_ENABLED']):
+        return
+    changes = session.info.setdefault('allocation_index', _new_changes())
+    for row in _pending_jobstep_rows(session, JobStep.id.in_(jobstep_ids)):
+        changes['added'][row.id] = row
+
+
+def load_previous_cluster(target, value, oldvalue, initiator):
+    """
+    'set' listener for JobStep.cluster. It's registered with active_history,
+    which makes SQLAlchemy load the previous cluster (if it had expired) so
+    that `track_changes` can find it in the attribute's history.
+    """
+
+
+def _changed(obj, *attrs):
+    state = inspect(obj)
+    return any(state.attrs[a].history.has_changes() for a in attrs)
+
+
+def _new_changes():
+    return {
+        # jobstep id => (id, cluster, date_created, priority) to add
+        'added': {},
+        # jobstep id => clusters to remove it from
+        'removed': {},
+        # job id => (project id, whether it's active)
+        'jobs': {},
+    }
+
+
+def apply_changes(session):
+    """
+    after_commit listener that applies the changes recorded by
+    `track_changes`. Errors are logged rather than raised, as the commit
+    has already happened (and the index will be rebuilt eventually).
+    """
+    changes = session.info.pop('allocation_index', None)
+    if not changes:
+        return
+    try:
+        pipe = redis.pipeline()
+        # removals go first, as jobsteps that moved are in both
+        for jobstep_id, clusters in changes['removed'].iteritems():
+            for cluster in clusters:
+                for key in _queue_keys(cluster):
+                    pipe.zrem(key, jobstep_id.hex)
+        _add_rows(pipe, changes['added'].itervalues())
+        for job_id, (project_id, active) in changes['jobs'].iteritems():
+            if active:
+                _script(_ACTIVATE_SCRIPT)(
+                    keys=[ACTIVE_JOBS_KEY, ACTIVE_COUNTS_KEY],
+                    args=[job_id.hex, project_id.hex], client=pipe)
+            else:
+                _script(_DEACTIVATE_SCRIPT)(
+                    keys=[ACTIVE_JOBS_KEY, ACTIVE_COUNTS_KEY],
+                    args=[job_id.hex], client=pipe)
+        pipe.execute()
+    except Exception:
+        logger.exception('Unable to update the allocation index')
+
+
+def discard_changes(session):
+    """after_rollback listener that forgets the changes recorded by `track_changes`."""
+    session.info.pop('allocation_index', None)
@@ -12,6 +12,10 @@ DEFAULT_TIMEOUT_SEC = 15
 MAX_RETRIES = 5
 RETRY_SLEEP_MSEC = 1000
 
+# How many bytes of a chunked artifact to send per request when appending
+# a stream of chunks to it (see append_artifact_chunks).
+APPEND_BATCH_SIZE = 1024 * 1024
+
 
 def is_error(resp):
     return not resp.ok
@@ -26,6 +30,24 @@ def is_retriable_error(resp):
     return is_error(resp) and resp.status_code >= 500
 
 
+def join_chunks(chunks, batch_size):
+    """
+    Joins an iterable of strings into batches of at least batch_size bytes
+    (bar the last), without splitting any of them.
+    """
+    batch = []
+    size = 0
+    for chunk in chunks:
+        batch.append(chunk)
+        size += len(chunk)
+        if size >= batch_size:
+            yield ''.join(batch)
+            batch = []
+            size = 0
+    if batch:
+        yield ''.join(batch)
+
+
 # Copied from artifactstore server, see go server for documentation
 class BucketState:
     UNKNOWN = 0
@@ -206,6 +228,51 @@ class ArtifactStoreClient:
                 .json()
         )
 
+    def append_artifact_bytes(self, bucket_name, artifact_name, offset, data):
+        """
+        Writes raw bytes to a chunked artifact at the given offset, which
+        (unlike post_artifact_chunk) doesn't need them base64 encoded in JSON.
+
+        :return: The updated Artifact
+        """
+        return Artifact(
+            self._simple_retry_request('post', '/buckets/%s/artifacts/%s' % (bucket_name, artifact_name),
+                                       data=data,
+                                       headers={
+                                           'Content-Type': 'application/octet-stream',
+                                           'Content-Range': 'bytes %d-%d/*' % (offset, offset + len(data) - 1),
+                                       },
+                                       randomize_sleep=False)
+                .json()
+        )
+
+    def append_artifact_chunks(self, bucket_name, artifact_name, offset, chunks, batch_size=APPEND_BATCH_SIZE):
+        """
+        Writes an iterable of chunks to a chunked artifact starting at the
+        given offset, in batches of about batch_size bytes (a request each).
+
+        If a batch is rejected, it may be because an earlier attempt at it was
+        written after all (e.g. its response was lost), so the rest of it is
+        written from wherever the artifact actually ends.
+
+        :return: A generator of the offset after each batch written
+        """
+        for batch in join_chunks(chunks, batch_size):
+            try:
+                self.append_artifact_bytes(bucket_name, artifact_name, offset, batch)
+            except requests.HTTPError as e:
+                if not is_terminal_error(e.response):
+                    raise
+                size = self.get_artifact(bucket_name, artifact_name).size
+                if not offset < size <= offset + len(batch):
+                    raise
+                self._logger.warning('Resuming write to %s/%s from %d, rather than %d',
+                                     bucket_name, artifact_name, size, offset)
+                if size < offset + len(batch):
+                    self.append_artifact_bytes(bucket_name, artifact_name, size, batch[size - offset:])
+            offset += len(batch)
+            yield offset
+
     def close_chunked_artifact(self, bucket_name, artifact_name):
         """
         Closes a chunked artifact
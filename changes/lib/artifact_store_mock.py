@@ -1,6 +1,8 @@
 from cStringIO import StringIO
 from datetime import datetime
-from changes.lib.artifact_store_lib import Artifact, ArtifactState, Bucket, BucketState
+from changes.lib.artifact_store_lib import (
+    APPEND_BATCH_SIZE, Artifact, ArtifactState, Bucket, BucketState, join_chunks
+)
 
 
 class ArtifactStoreMock:
@@ -127,6 +129,25 @@ class ArtifactStoreMock:
         ArtifactStoreMock.artifacts[bucket_name][artifact_name] = a
         return a
 
+    def append_artifact_bytes(self, bucket_name, artifact_name, offset, data):
+        """
+        Writes raw bytes to a chunked artifact
+
+        :return: The updated Artifact
+        """
+        return self.post_artifact_chunk(bucket_name, artifact_name, offset, data)
+
+    def append_artifact_chunks(self, bucket_name, artifact_name, offset, chunks, batch_size=APPEND_BATCH_SIZE):
+        """
+        Writes an iterable of chunks to a chunked artifact, in batches
+
+        :return: A generator of the offset after each batch written
+        """
+        for batch in join_chunks(chunks, batch_size):
+            self.append_artifact_bytes(bucket_name, artifact_name, offset, batch)
+            offset += len(batch)
+            yield offset
+
     def close_chunked_artifact(self, bucket_name, artifact_name):
         """
         Closes a chunked artifact
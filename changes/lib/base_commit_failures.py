@@ -0,0 +1,73 @@
+"""
+Which tests failed in the build of a diff's base commit, so that notifications
+can tell new failures from ones the diff inherited.
+
+Many diffs share a base commit (and a diff's builds all do), so lookups are
+cached per process for BASE_COMMIT_FAILURES_CACHE_TTL seconds.
+"""
+
+from __future__ import absolute_import
+
+from flask import current_app
+from sqlalchemy import and_
+from typing import FrozenSet, Optional  # NOQA
+from uuid import UUID  # NOQA
+
+from changes.config import db
+from changes.constants import Result, Status
+from changes.lib.process_cache import ProcessCache
+from changes.models.build import Build
+from changes.models.job import Job
+from changes.models.source import Source
+from changes.models.test import TestCase
+
+_cache = ProcessCache('base_commit_failures')
+
+
+def get_failing_test_hashes(project_id, revision_sha):
+    # type: (UUID, str) -> Optional[FrozenSet[str]]
+    """
+    Returns the name hashes (TestCase.name_sha) of the tests that failed in
+    the project's latest finished build of the commit, or None if it has no
+    finished build of the commit with any jobs. None isn't cached, as a build
+    of the commit may be about to finish.
+    """
+    return _cache.get(
+        '{}:{}'.format(project_id.hex, revision_sha),
+        lambda: _load(project_id, revision_sha),
+        current_app.config['BASE_COMMIT_FAILURES_CACHE_TTL'],
+        cache_if=lambda failures: failures is not None,
+    )
+
+
+def _load(project_id, revision_sha):
+    # type: (UUID, str) -> Optional[FrozenSet[str]]
+    base_build = db.session.query(
+        Build.id,
+    ).join(
+        Source, Build.source_id == Source.id,
+    ).filter(
+        Build.project_id == project_id,
+        Source.revision_sha == revision_sha,
+        Source.patch_id.is_(None),
+        # a rebuild still in progress only has some of its failures
+        Build.status == Status.finished,
+    ).order_by(
+        Build.date_created.desc(),
+    ).limit(1).subquery()
+
+    # a row per failing test of each of the build's jobs, or a row with no
+    # test for jobs without failures
+    rows = db.session.query(
+        Job.id, TestCase.name_sha,
+    ).join(
+        base_build, Job.build_id == base_build.c.id,
+    ).outerjoin(
+        TestCase, and_(
+            TestCase.job_id == Job.id,
+            TestCase.result == Result.failed,
+        ),
+    ).distinct().all()
+    if not rows:
+        return None
+    return frozenset(name_sha for _, name_sha in rows if name_sha is not None)
@@ -1,21 +1,34 @@
+import json
+import zlib
+
 from itertools import chain, imap
 from datetime import datetime
+from uuid import UUID
 
 from changes.artifacts import xunit
 from flask import current_app
+from redis import RedisError
 
 from changes.api.build_details import get_parents_last_builds
+from changes.config import db, redis
 from changes.constants import Result
-from changes.models.build import Build  # NOQA
+from changes.lib import log_segments
+from changes.models.build import Build
+from changes.models.failurereason import FailureReason
+from changes.models.itemstat import ItemStat
 from changes.models.job import Job
+from changes.models.jobplan import JobPlan
 from changes.models.jobstep import JobStep
-from changes.models.log import LogSource, LogChunk
+from changes.models.log import LogSource
 from changes.models.test import TestCase
 from changes.utils.http import build_web_uri
+from sqlalchemy import distinct
 from sqlalchemy.orm import subqueryload_all
 
 from typing import Any, cast, Dict, List, NamedTuple, Optional, Tuple  # NOQA
 
+SNAPSHOT_KEY = 'build-snapshot:{}'
+
 
 def _get_project_uri(build):
     return '/projects/{}/'.format(build.project.slug)
@@ -159,15 +172,15 @@ def _get_build_target(build):
 
 def _get_build_context(build, get_parent=True):
     # type: (Build, bool) -> Dict[str, Any]
-    jobs = list(Job.query.filter(Job.build_id == build.id))
-    jobs_context = map(_get_job_context, jobs)
+    snapshot = get_build_snapshot(build)
+    jobs_context = map(_get_job_context, snapshot.jobs)
 
     parent_build_context = None
-    if get_parent:
-        parent_build = get_parents_last_builds(build)
+    if get_parent and snapshot.parent_build_id:
+        parent_build = Build.query.get(snapshot.parent_build_id)
         if parent_build:
             parent_build_context = _get_build_context(
-                parent_build[0], get_parent=False)
+                parent_build, get_parent=False)
 
     return {
         'build': build,
@@ -183,8 +196,173 @@ def _get_build_context(build, get_parent=True):
     }
 
 
+# Stand-ins for the Job and TestCase of a build context, with what's kept of
+# them in build snapshots.
+JobSummary = NamedTuple('JobSummary',
+                        [('id', UUID),
+                         ('label', unicode),
+                         ('result', Result)])
+
+TestCaseSummary = NamedTuple('TestCaseSummary',
+                             [('id', UUID),
+                              ('name', unicode),
+                              ('package', Optional[unicode]),
+                              ('name_sha', str)])
+
+
 def _get_job_context(job):
-    # type: (Job) -> Dict[str, Any]
+    # type: (Dict[str, Any]) -> Dict[str, Any]
+    """Returns the context of one of a build snapshot's jobs."""
+    failing_tests = [
+        {
+            'test_case': TestCaseSummary(
+                UUID(test['id']), test['name'], test['package'], test['name_sha']),
+            'uri': test['uri'],
+            'message': test['message'],
+        } for test in job['failing_tests']
+    ]
+
+    context = {
+        'job': JobSummary(UUID(job['id']), job['label'], Result[job['result']]),
+        'uri': job['uri'],
+        'failing_tests': failing_tests,
+        'failing_tests_count': len(failing_tests),
+        'failing_logs': job['failing_logs'],
+        'failing_logs_count': len(job['failing_logs']),
+    }
+
+    return context
+
+
+class BuildSnapshot(object):
+    """
+    What the build.finished listeners need of a finished build beyond the
+    Build itself: its jobs' failing tests and logs, its parent build, and
+    its failure reasons and stats.
+
+    The snapshot is computed once, when sync_build finishes the build, and
+    shared through Redis for BUILD_SNAPSHOT_TTL seconds, rather than each
+    listener (and, for a collection, each of its builds' listeners) querying
+    it all again.
+
+    Args:
+        build_id (str): The build's id, as hex.
+        parent_build_id (Optional[str]): The id of the last build of the
+            build's parent revision, if there is one.
+        jobs (List[Dict[str, Any]]): The build's jobs (id, label, result,
+            uri and the options of their plans), each with its failing tests
+            (id, name, package, name_sha, uri and message) and the clippings
+            of its failing logs (name, text and uri).
+        failure_reasons (List[str]): The distinct reasons of the build's
+            failures, sorted, ignoring replaced jobsteps.
+        jobsteps_replaced (int): How many of its jobsteps were replaced.
+        item_stats (Dict[str, int]): The build's stats.
+    """
+
+    def __init__(self, build_id, parent_build_id, jobs, failure_reasons, jobsteps_replaced, item_stats):
+        # type: (str, Optional[str], List[Dict[str, Any]], List[str], int, Dict[str, int]) -> None
+        self.build_id = build_id
+        self.parent_build_id = parent_build_id
+        self.jobs = jobs
+        self.failure_reasons = failure_reasons
+        self.jobsteps_replaced = jobsteps_replaced
+        self.item_stats = item_stats
+
+    @classmethod
+    def from_build(cls, build):
+        # type: (Build) -> BuildSnapshot
+        parent_builds = get_parents_last_builds(build)
+        jobs = list(Job.query.filter(Job.build_id == build.id))
+        jobs_options = {
+            jobplan.job_id: jobplan.data['snapshot']['options']
+            for jobplan in JobPlan.query.filter(JobPlan.build_id == build.id)
+            if jobplan.data and 'snapshot' in jobplan.data
+        }
+        return cls(
+            build_id=build.id.hex,
+            parent_build_id=parent_builds[0].id.hex if parent_builds else None,
+            jobs=[_get_job_snapshot(job, jobs_options.get(job.id, {})) for job in jobs],
+            failure_reasons=_get_failure_reasons(build),
+            jobsteps_replaced=JobStep.query.join(
+                Job, Job.id == JobStep.job_id,
+            ).filter(
+                Job.build_id == build.id,
+                JobStep.replacement_id.isnot(None),
+            ).count(),
+            item_stats=dict(db.session.query(
+                ItemStat.name, ItemStat.value,
+            ).filter(
+                ItemStat.item_id == build.id,
+            )),
+        )
+
+    @classmethod
+    def loads(cls, data):
+        # type: (str) -> BuildSnapshot
+        return cls(**json.loads(zlib.decompress(data)))
+
+    def dumps(self):
+        # type: () -> str
+        return zlib.compress(json.dumps({
+            'build_id': self.build_id,
+            'parent_build_id': self.parent_build_id,
+            'jobs': self.jobs,
+            'failure_reasons': self.failure_reasons,
+            'jobsteps_replaced': self.jobsteps_replaced,
+            'item_stats': self.item_stats,
+        }, separators=(',', ':')))
+
+
+def store_build_snapshot(build):
+    # type: (Build) -> BuildSnapshot
+    """
+    Computes the snapshot of a finished build and shares it, replacing any
+    from before the build was last restarted.
+    """
+    snapshot = BuildSnapshot.from_build(build)
+    ttl = current_app.config['BUILD_SNAPSHOT_TTL']
+    if ttl > 0:
+        try:
+            redis.setex(SNAPSHOT_KEY.format(build.id.hex), snapshot.dumps(), ttl)
+        except RedisError:
+            current_app.logger.warning('Unable to store snapshot of build %s', build.id.hex, exc_info=True)
+    return snapshot
+
+
+def get_build_snapshot(build):
+    # type: (Build) -> BuildSnapshot
+    """
+    Returns the shared snapshot of a finished build, or computes (and shares)
+    it if there isn't one, e.g. because it has expired.
+    """
+    if current_app.config['BUILD_SNAPSHOT_TTL'] > 0:
+        try:
+            data = redis.get(SNAPSHOT_KEY.format(build.id.hex))
+        except RedisError:
+            current_app.logger.warning('Unable to get snapshot of build %s', build.id.hex, exc_info=True)
+        else:
+            if data is not None:
+                return BuildSnapshot.loads(data)
+    return store_build_snapshot(build)
+
+
+def _get_failure_reasons(build):
+    # type: (Build) -> List[str]
+    failure_reasons = [r for r, in db.session.query(
+        distinct(FailureReason.reason)
+    ).join(
+        JobStep, JobStep.id == FailureReason.step_id,
+    ).filter(
+        FailureReason.build_id == build.id,
+        JobStep.replacement_id.is_(None),
+    ).all()]
+    # The order isn't particularly meaningful; the sorting is primarily
+    # to make the same set of reasons reliably result in the same JSON.
+    return sorted(failure_reasons)
+
+
+def _get_job_snapshot(job, options):
+    # type: (Job, Dict[str, Any]) -> Dict[str, Any]
     def get_job_failing_tests(job, limit=500):
         failing_tests = TestCase.query.options(
             subqueryload_all('messages')
@@ -193,16 +371,16 @@ def _get_job_context(job):
             TestCase.result == Result.failed,
         ).order_by(TestCase.name.asc())
 
-        failing_tests = [
+        return [
             {
-                'test_case': test_case,
+                'id': test_case.id.hex,
+                'name': test_case.name,
+                'package': test_case.package,
+                'name_sha': test_case.name_sha,
                 'uri': build_web_uri(_get_test_case_uri(test_case)),
                 'message': xunit.get_testcase_messages(test_case),
             } for test_case in failing_tests[:limit]
         ]
-        failing_tests_count = len(failing_tests)
-
-        return failing_tests, failing_tests_count
 
     def get_job_failing_log_sources(job):
         failing_log_sources = LogSource.query.join(
@@ -212,7 +390,7 @@ def _get_job_context(job):
             JobStep.job_id == job.id,
         ).order_by(JobStep.date_created)
 
-        failing_logs = [
+        return [
             {
                 'text': _get_log_clipping(
                     log_source, max_size=5000, max_lines=25),
@@ -220,42 +398,30 @@ def _get_job_context(job):
                 'uri': build_web_uri(_get_log_uri(log_source)),
             } for log_source in failing_log_sources if not log_source.is_infrastructural()
         ]
-        failing_log_sources_count = len(failing_logs)
-
-        return failing_logs, failing_log_sources_count
 
-    failing_tests, failing_tests_count = get_job_failing_tests(job)
-    failing_logs, failing_logs_count = get_job_failing_log_sources(job)
-
-    context = {
-        'job': job,
+    return {
+        'id': job.id.hex,
+        'label': job.label,
+        'result': job.result.name,
         'uri': build_web_uri(_get_job_uri(job)),
-        'failing_tests': failing_tests,
-        'failing_tests_count': len(failing_tests),
-        'failing_logs': failing_logs,
-        'failing_logs_count': len(failing_logs),
+        'options': options,
+        'failing_tests': get_job_failing_tests(job),
+        'failing_logs': get_job_failing_log_sources(job),
     }
 
-    return context
-
 
 def _get_log_clipping(logsource, max_size=5000, max_lines=25):
     # type: (LogSource, int, int) -> str
     if logsource.in_artifact_store:
         # We don't yet get clippings for ArtifactStore logs.
         return ""
-    queryset = LogChunk.query.filter(
-        LogChunk.source_id == logsource.id,
-    )
-    tail = queryset.order_by(LogChunk.offset.desc()).limit(1).first()
+    size = log_segments.get_log_size(logsource)
     # in case logsource has no LogChunks
-    if tail is None:
+    if not size:
         current_app.logger.warning('LogSource (id=%s) had no LogChunks', logsource.id.hex)
         return ""
 
-    chunks = list(queryset.filter(
-        (LogChunk.offset + LogChunk.size) >= max(tail.offset - max_size, 0),
-    ).order_by(LogChunk.offset.asc()))
+    chunks = log_segments.get_chunks(logsource, min_end=max(size - max_size, 0))
 
     clipping = ''.join(l.text for l in chunks).strip()[-max_size:]
     # only return the last 25 lines
@@ -6,7 +6,7 @@ from changes.models.filecoverage import FileCoverage
 from changes.models.job import Job
 from changes.models.project import Project
 from changes.models.source import Source
-from typing import Iterable, NamedTuple, Set  # NOQA
+from typing import Iterable, Iterator, NamedTuple, Set, Tuple  # NOQA
 
 
 def get_coverage_by_source_id(source_id):
@@ -122,6 +122,25 @@ def merged_coverage_data(coverages):
     return coverage
 
 
+def iter_merged_coverage_data(coverages):
+    # type: (Iterable[FileCoverage]) -> Iterator[Tuple[str, str]]
+    """Like merged_coverage_data(), but yields (filename, data) pairs.
+
+    The argument must be ordered by filename, so that each file's coverage
+    can be merged and emitted without holding every file in memory.
+    """
+    filename, data = None, None
+    for c in coverages:
+        if c.filename == filename:
+            data = merge_coverage(data, c.data)
+            continue
+        if filename is not None:
+            yield filename, data
+        filename, data = c.filename, c.data
+    if filename is not None:
+        yield filename, data
+
+
 CoverageStats = NamedTuple(
     'CoverageStats',
     [('lines_covered', int),
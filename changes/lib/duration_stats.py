@@ -0,0 +1,283 @@
+"""
+Smoothed per-project durations of tests and Bazel targets, used to shard them
+across executors.
+
+Each project has a DurationStats row per kind, which every finished commit
+build is folded into (see changes.listeners.duration_stats). A test's
+duration is smoothed with an exponentially weighted moving average (and
+variance), so one slow or fast run doesn't reshuffle every shard, and tests
+that haven't been seen in DURATION_STATS_MAX_AGE builds are dropped.
+
+Sharding only needs `summary`: the average duration, and the smoothed
+duration and 90th percentile estimate of every test and group of tests (by
+normalized name), precomputed when a build is folded in, so expanding a job
+reads one compressed blob rather than every test of the last build.
+
+As with the project's last build, passing builds are preferred: failing
+builds are only folded in until a build has passed, and the first passing
+build replaces whatever they left.
+"""
+
+from __future__ import absolute_import, division
+
+import json
+import math
+import zlib
+
+from datetime import datetime
+from flask import current_app
+from sqlalchemy.orm import Query  # NOQA
+from typing import Any, Dict, List, Optional, Tuple  # NOQA
+
+from changes.config import db
+from changes.constants import Result, Status
+from changes.db.utils import get_or_create, try_create
+from changes.lib import build_type
+from changes.models.bazeltarget import BazelTarget
+from changes.models.build import Build
+from changes.models.durationstats import DurationStats
+from changes.models.job import Job
+from changes.models.project import Project
+from changes.models.source import Source
+from changes.models.test import TestCase
+from changes.utils.trees import build_flat_tree
+
+TESTS = 'tests'
+TARGETS = 'targets'
+
+# the 90th percentile of a normal distribution, in standard deviations
+P90_Z = 1.2816
+
+# column of each stat in the summary's rows
+_SUMMARY_COLUMNS = {'ewma': 1, 'p90': 2}
+
+
+def normalize_test_segments(test_name):
+    # type: (str) -> Tuple[str, ...]
+    sep = TestCase(name=test_name).sep
+    segments = test_name.split(sep)
+
+    # kill the file extension
+    if sep == '/' and '.' in segments[-1]:
+        segments[-1] = segments[-1].rsplit('.', 1)[0]
+
+    return tuple(segments)
+
+
+def get_test_stats(project_slug):
+    # type: (str) -> Tuple[Dict[Tuple[str, ...], int], int]
+    """
+    Returns the durations of a project's tests, and groups of tests, by
+    normalized name (see normalize_test_segments), and their average
+    duration.
+    """
+    summary = _get_summary(project_slug, TESTS)
+    if summary is None:
+        return {}, 0
+    column = _SUMMARY_COLUMNS[current_app.config['DURATION_STATS_SHARD_BY']]
+    return {tuple(row[0]): row[column] for row in summary['stats']}, int(summary['avg'])
+
+
+def get_target_stats(project_slug):
+    # type: (str) -> Tuple[Dict[str, int], int]
+    """Returns the durations of a project's Bazel targets, and their average."""
+    summary = _get_summary(project_slug, TARGETS)
+    if summary is None:
+        return {}, 0
+    column = _SUMMARY_COLUMNS[current_app.config['DURATION_STATS_SHARD_BY']]
+    return {row[0]: row[column] for row in summary['stats']}, int(summary['avg'])
+
+
+def record_build(build):
+    # type: (Build) -> None
+    """
+    Folds the durations of a finished commit build into its project's stats.
+    Builds already folded in are ignored.
+    """
+    is_commit_build = db.session.query(
+        Build.query.join(
+            Source, Build.source_id == Source.id,
+        ).filter(
+            Build.id == build.id,
+            Build.status == Status.finished,
+            *build_type.get_any_commit_build_filters()
+        ).exists()
+    ).scalar()
+    if not is_commit_build:
+        return
+
+    passed = build.result == Result.passed
+    for kind in (TESTS, TARGETS):
+        durations = _get_durations(kind, build.id)
+        if not durations:
+            continue
+
+        stats, _ = get_or_create(DurationStats, where={
+            'project_id': build.project_id,
+            'kind': kind,
+        }, defaults={
+            'summary': _encode(_summarize(kind, _new_state())),
+            'state': _encode(_new_state()),
+        })
+        # builds of a project can finish together
+        stats = DurationStats.query.filter(
+            DurationStats.id == stats.id,
+        ).with_for_update().populate_existing().one()
+        if stats.last_build_id == build.id:
+            continue
+
+        state = _decode(stats.state)
+        if passed and not state['passed']:
+            state = _new_state()
+            stats.num_builds = 0
+        elif not passed and state['passed']:
+            continue
+
+        _fold(state, durations, passed, stats.num_builds)
+        stats.num_builds += 1
+        stats.last_build_id = build.id
+        stats.state = _encode(state)
+        stats.summary = _encode(_summarize(kind, state))
+        stats.date_modified = datetime.utcnow()
+        db.session.add(stats)
+
+
+def _get_summary(project_slug, kind):
+    # type: (str, str) -> Optional[Dict[str, Any]]
+    project = Project.query.filter(Project.slug == project_slug).first()
+    if project is None:
+        return None
+
+    stats = DurationStats.query.filter(
+        DurationStats.project_id == project.id,
+        DurationStats.kind == kind,
+    ).first()
+    if stats is not None:
+        return _decode(stats.summary)
+
+    # nothing has been recorded yet (e.g. no build has finished since stats
+    # were introduced), so start from the project's last build
+    build = _get_last_build(project)
+    if build is None:
+        return None
+    durations = _get_durations(kind, build.id)
+    if not durations:
+        return None
+
+    state = _new_state()
+    _fold(state, durations, build.result == Result.passed, 0)
+    summary = _summarize(kind, state)
+    # if another expansion got there first, theirs is just as good
+    try_create(DurationStats, {
+        'project_id': project.id,
+        'kind': kind,
+        'num_builds': 1,
+        'last_build_id': build.id,
+        'summary': _encode(summary),
+        'state': _encode(state),
+    })
+    return summary
+
+
+def _get_last_build(project):
+    # type: (Project) -> Optional[Build]
+    """The project's last passing commit build, or its last commit build if none has passed."""
+    def query():
+        # type: () -> Query
+        return Build.query.join(
+            Source, Build.source_id == Source.id,
+        ).filter(
+            Build.project_id == project.id,
+            Build.status == Status.finished,
+            *build_type.get_any_commit_build_filters()
+        ).order_by(
+            Build.date_created.desc(),
+        )
+
+    return query().filter(Build.result == Result.passed).first() or query().first()
+
+
+def _get_durations(kind, build_id):
+    # type: (str, Any) -> Dict[str, int]
+    job_list = db.session.query(Job.id).filter(
+        Job.build_id == build_id,
+    )
+    if kind == TESTS:
+        return dict(db.session.query(
+            TestCase.name, TestCase.duration,
+        ).filter(
+            TestCase.job_id.in_(job_list),
+            ~TestCase.duration.is_(None),
+        ))
+    return dict(db.session.query(
+        BazelTarget.name, BazelTarget.duration,
+    ).filter(
+        BazelTarget.job_id.in_(job_list),
+        ~BazelTarget.duration.is_(None),
+    ))
+
+
+def _new_state():
+    # type: () -> Dict[str, Any]
+    # tests maps name => [ewma, variance, number of the last build it was in]
+    return {'passed': False, 'tests': {}}
+
+
+def _fold(state, durations, passed, build_num):
+    # type: (Dict[str, Any], Dict[str, int], bool, int) -> None
+    alpha = current_app.config['DURATION_STATS_ALPHA']
+    max_age = current_app.config['DURATION_STATS_MAX_AGE']
+
+    tests = state['tests']
+    for name, duration in durations.iteritems():
+        if name not in tests:
+            tests[name] = [duration, 0, build_num]
+            continue
+        mean, var, _ = tests[name]
+        diff = duration - mean
+        incr = alpha * diff
+        tests[name] = [mean + incr, (1 - alpha) * (var + diff * incr), build_num]
+
+    for name in [n for n, values in tests.iteritems() if build_num - values[2] >= max_age]:
+        del tests[name]
+
+    state['passed'] = passed
+
+
+def _summarize(kind, state):
+    # type: (str, Dict[str, Any]) -> Dict[str, Any]
+    tests = state['tests']
+    if not tests:
+        return {'avg': 0, 'stats': []}
+
+    avg = sum(mean for mean, _, _ in tests.itervalues()) / len(tests)
+
+    if kind == TARGETS:
+        groups = {name: [name] for name in tests}
+    else:
+        # the build report can contain different test suites, so this
+        # isn't always accurate
+        sep = TestCase(name=min(tests)).sep
+        groups = {
+            normalize_test_segments(group_name): group_tests
+            for group_name, group_tests in build_flat_tree(tests, sep=sep).iteritems()
+        }
+
+    rows = []  # type: List[List[Any]]
+    for key, group_tests in groups.iteritems():
+        # a group's tests run one after another, so their means and
+        # variances add up
+        mean = sum(tests[t][0] for t in group_tests)
+        var = sum(tests[t][1] for t in group_tests)
+        rows.append([key, int(round(mean)), int(round(mean + P90_Z * math.sqrt(var)))])
+    return {'avg': avg, 'stats': rows}
+
+
+def _encode(value):
+    # type: (Any) -> str
+    return zlib.compress(json.dumps(value, separators=(',', ':')))
+
+
+def _decode(blob):
+    # type: (str) -> Any
+    return json.loads(zlib.decompress(blob))
@@ -0,0 +1,173 @@
+"""
+Buffers jobstep heartbeats in Redis, so that JobStepHeartbeatAPIView doesn't
+write to the database for every heartbeat of every running jobstep.
+
+Heartbeats are kept in a hash keyed by jobstep id, and the ids of jobsteps
+with heartbeats that haven't been written to the database yet are kept in a
+set. `flush` (run periodically by changes.jobs.flush_heartbeats) writes them
+all to jobstep.last_heartbeat with a single UPDATE, then drops the ones that
+haven't changed since from the hash.
+
+Anything reading last_heartbeat for a decision should use `refresh` first, as
+the database may be up to a flush interval behind.
+"""
+
+from __future__ import absolute_import
+
+import logging
+
+from calendar import timegm
+from datetime import datetime
+from redis import RedisError
+from typing import Dict, List, Optional, Tuple  # NOQA
+from uuid import UUID  # NOQA
+
+from changes.config import db, redis
+from changes.constants import Result
+from changes.models.jobstep import JobStep
+
+logger = logging.getLogger('changes.heartbeats')
+
+HEARTBEATS_KEY = 'jobstep:heartbeats'
+DIRTY_KEY = 'jobstep:heartbeats:dirty'
+CHECKED_KEY = 'jobstep:heartbeats:checked:{}'
+
+# Takes the ids in the dirty set, returning them and their heartbeats as a
+# flat list of pairs.
+# KEYS: dirty set, heartbeats hash
+_POP_DIRTY_SCRIPT = """
+local ids = redis.call('SMEMBERS', KEYS[1])
+redis.call('DEL', KEYS[1])
+local result = {}
+for _, id in ipairs(ids) do
+    local value = redis.call('HGET', KEYS[2], id)
+    if value then
+        table.insert(result, id)
+        table.insert(result, value)
+    end
+end
+return result
+"""
+
+# Removes the given heartbeats from the hash, unless they've since changed.
+# KEYS: heartbeats hash, ARGV: pairs of jobstep id and heartbeat
+_FORGET_SCRIPT = """
+for i = 1, #ARGV, 2 do
+    if redis.call('HGET', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+    end
+end
+"""
+
+_scripts = {}  # type: Dict[str, object]
+
+
+def _script(source):
+    if source not in _scripts:
+        _scripts[source] = redis.register_script(source)
+    return _scripts[source]
+
+
+def _to_timestamp(dt):
+    # type: (datetime) -> str
+    return '{}.{:06d}'.format(timegm(dt.utctimetuple()), dt.microsecond)
+
+
+def _from_timestamp(value):
+    # type: (str) -> datetime
+    seconds, _, micros = value.partition('.')
+    return datetime.utcfromtimestamp(int(seconds)).replace(microsecond=int(micros or 0))
+
+
+def record(step_id, date):
+    # type: (UUID, datetime) -> None
+    """Records a heartbeat for the given jobstep, to be written by the next flush."""
+    with redis.pipeline() as pipe:
+        pipe.hset(HEARTBEATS_KEY, step_id.hex, _to_timestamp(date))
+        pipe.sadd(DIRTY_KEY, step_id.hex)
+        pipe.execute()
+
+
+def get(step_id):
+    # type: (UUID) -> Optional[datetime]
+    """Returns the last heartbeat for the given jobstep that hasn't been flushed, if any."""
+    value = redis.hget(HEARTBEATS_KEY, step_id.hex)
+    return _from_timestamp(value) if value is not None else None
+
+
+def refresh(step):
+    # type: (JobStep) -> None
+    """
+    Sets `step.last_heartbeat` to its buffered heartbeat, if that's newer.
+    If Redis is unavailable, the database's value is left as it is.
+    """
+    try:
+        buffered = get(step.id)
+    except RedisError:
+        logger.warning('Unable to read buffered heartbeat for jobstep %s', step.id.hex, exc_info=True)
+        return
+    if buffered is not None and (step.last_heartbeat is None or buffered > step.last_heartbeat):
+        step.last_heartbeat = buffered
+
+
+def is_checked(step_id):
+    # type: (UUID) -> bool
+    """
+    Whether the given jobstep was recently found to exist and not be aborted
+    (see `mark_checked`), so a heartbeat for it needn't look it up.
+    """
+    return bool(redis.exists(CHECKED_KEY.format(step_id.hex)))
+
+
+def mark_checked(step_id, ttl):
+    # type: (UUID, int) -> None
+    redis.setex(CHECKED_KEY.format(step_id.hex), 1, ttl)
+
+
+def forget_checked(target, value, oldvalue, initiator):
+    """
+    A 'set' listener on JobStep.result, so that heartbeats for a jobstep stop
+    being accepted as soon as it's aborted rather than once its check expires.
+    """
+    if value == Result.aborted and target.id is not None:
+        try:
+            redis.delete(CHECKED_KEY.format(target.id.hex))
+        except RedisError:
+            logger.warning('Unable to forget heartbeat check for jobstep %s', target.id.hex, exc_info=True)
+
+
+def flush():
+    # type: () -> int
+    """
+    Writes all buffered heartbeats to the database (never moving a
+    last_heartbeat backwards) and commits. Returns the number of jobsteps
+    written.
+    """
+    values = _script(_POP_DIRTY_SCRIPT)(keys=[DIRTY_KEY, HEARTBEATS_KEY])
+    if not values:
+        return 0
+    pairs = zip(values[::2], values[1::2])  # type: List[Tuple[str, str]]
+
+    rows = []
+    params = {}
+    for n, (step_id, value) in enumerate(pairs):
+        rows.append('(CAST(:id_{0} AS uuid), CAST(:date_{0} AS timestamp))'.format(n))
+        params['id_{}'.format(n)] = step_id
+        params['date_{}'.format(n)] = _from_timestamp(value)
+
+    try:
+        db.session.execute("""
+            UPDATE jobstep SET last_heartbeat = heartbeat.date
+            FROM (VALUES {}) AS heartbeat (id, date)
+            WHERE jobstep.id = heartbeat.id
+            AND (jobstep.last_heartbeat IS NULL OR jobstep.last_heartbeat < heartbeat.date)
+        """.format(', '.join(rows)), params)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        # leave them for the next flush
+        redis.sadd(DIRTY_KEY, *[step_id for step_id, _ in pairs])
+        raise
+
+    _script(_FORGET_SCRIPT)(keys=[HEARTBEATS_KEY], args=[x for pair in pairs for x in pair])
+    return len(pairs)
@@ -0,0 +1,257 @@
+"""
+Compressed storage for completed logs.
+
+Logs are written as LogChunks of up to LOG_CHUNK_SIZE characters, each its
+own (heavily indexed) row. Once a log is complete, `seal` replaces its chunks
+with LogSegments: runs of contiguous chunks compressed together, holding up
+to SEGMENT_SIZE characters each.
+
+Reads go through `get_log_size` and `get_chunks` (or `iter_text`, to stream
+a whole log), which work whether the log is sealed or not. Text read from segments is split back into LOG_CHUNK_SIZE
+chunks, so callers see the same shape of data either way; only the segments
+overlapping the requested range are fetched and decompressed.
+"""
+
+from __future__ import absolute_import
+
+import zlib
+
+from uuid import UUID, uuid5  # NOQA
+
+from flask import current_app
+
+from typing import Iterator, List, Optional  # NOQA
+
+from changes.config import db
+from changes.models.log import LOG_CHUNK_SIZE, LogChunk, LogSegment, LogSource  # NOQA
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# The (uncompressed) size to seal segments at, in characters. Bigger segments
+# compress a little better, but every read of part of one decompresses all of
+# it; past this size, tail reads slow down for little gain in storage (see
+# benchmarks/log_segments.py).
+SEGMENT_SIZE = LOG_CHUNK_SIZE * 8
+
+# How many chunks (or segments) iter_text fetches from the database at a time.
+STREAM_BATCH_SIZE = 100
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def _zstd_compress(data):
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+
+def _zstd_decompress(data):
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+# codec name => (compress, decompress), both functions of bytes
+CODECS = {
+    'zlib': (lambda data: zlib.compress(data, ZLIB_LEVEL), zlib.decompress),
+}
+if zstandard is not None:
+    CODECS['zstd'] = (_zstd_compress, _zstd_decompress)
+
+
+def compress(text, codec):
+    # type: (unicode, str) -> str
+    return CODECS[codec][0](text.encode('utf-8'))
+
+
+def decompress(data, codec):
+    # type: (str, str) -> unicode
+    return CODECS[codec][1](bytes(data)).decode('utf-8')
+
+
+def seal(source, segment_size=SEGMENT_SIZE, codec=None):
+    # type: (LogSource, int, Optional[str]) -> int
+    """
+    Moves the text of `source`'s chunks into segments of about
+    `segment_size` characters, stopping at the first gap in the chunks (if
+    any). The caller is responsible for committing.
+
+    This should only be used for logs that are complete, as chunks appended
+    at or before the sealed size afterwards would be ignored.
+
+    Returns the number of segments created.
+    """
+    if codec is None:
+        codec = current_app.config['LOG_SEGMENT_CODEC']
+    if codec not in CODECS:
+        raise ValueError('Unknown (or unavailable) log segment codec: {}'.format(codec))
+
+    chunks = LogChunk.query.filter(
+        LogChunk.source_id == source.id,
+        LogChunk.offset >= source.sealed_size,
+    ).order_by(LogChunk.offset.asc())
+
+    sealed_size = source.sealed_size
+    segment_offset = sealed_size
+    texts = []  # type: List[unicode]
+    sealed_chunk_ids = []  # type: List[UUID]
+    num_segments = 0
+
+    def add_segment():
+        db.session.add(LogSegment(
+            source_id=source.id,
+            offset=segment_offset,
+            size=sealed_size - segment_offset,
+            codec=codec,
+            data=compress(u''.join(texts), codec),
+        ))
+
+    for chunk in chunks:
+        if chunk.offset != sealed_size:
+            break
+        texts.append(chunk.text)
+        sealed_chunk_ids.append(chunk.id)
+        sealed_size += chunk.size
+        if sealed_size - segment_offset >= segment_size:
+            add_segment()
+            num_segments += 1
+            segment_offset = sealed_size
+            texts = []
+
+    if texts:
+        add_segment()
+        num_segments += 1
+
+    if sealed_chunk_ids:
+        LogChunk.query.filter(
+            LogChunk.id.in_(sealed_chunk_ids),
+        ).delete(synchronize_session=False)
+        source.sealed_size = sealed_size
+        db.session.add(source)
+
+    return num_segments
+
+
+def get_log_size(source):
+    # type: (LogSource) -> int
+    """Returns the length of `source`'s log (so far)."""
+    tail = LogChunk.query.filter(
+        LogChunk.source_id == source.id,
+    ).order_by(LogChunk.offset.desc()).limit(1).first()
+    if tail is None:
+        return source.sealed_size or 0
+    return tail.offset + tail.size
+
+
+def get_chunks(source, after=None, until=None, min_end=None):
+    # type: (LogSource, Optional[int], Optional[int], Optional[int]) -> List[LogChunk]
+    """
+    Returns the chunks of `source`'s log in order, optionally only those
+    with `after < offset <= until` and/or `offset + size >= min_end`.
+
+    Chunks read from segments are transient LogChunks (they aren't, and
+    shouldn't be, added to the session).
+    """
+    sealed_size = source.sealed_size or 0
+    result = []  # type: List[LogChunk]
+
+    if sealed_size and (after is None or after < sealed_size):
+        segments = LogSegment.query.filter(
+            LogSegment.source_id == source.id,
+        )
+        if after is not None:
+            segments = segments.filter(LogSegment.offset + LogSegment.size > after + 1)
+        if until is not None:
+            segments = segments.filter(LogSegment.offset <= until)
+        if min_end is not None:
+            segments = segments.filter(LogSegment.offset + LogSegment.size >= min_end)
+        # the text after `after` starts with a new chunk, as it would have
+        # if it was written after the previous read
+        start = after + 1 if after is not None else 0
+        for segment in segments.order_by(LogSegment.offset.asc()):
+            result.extend(
+                chunk for chunk in _split_segment(source, segment, start)
+                if _matches(chunk, after, until, min_end)
+            )
+
+    if until is None or until >= sealed_size:
+        chunks = LogChunk.query.filter(
+            LogChunk.source_id == source.id,
+        )
+        if after is not None:
+            chunks = chunks.filter(LogChunk.offset > after)
+        if until is not None:
+            chunks = chunks.filter(LogChunk.offset <= until)
+        if min_end is not None:
+            chunks = chunks.filter(LogChunk.offset + LogChunk.size >= min_end)
+        result.extend(chunks.order_by(LogChunk.offset.asc()))
+
+    return result
+
+
+def iter_text(source, batch_size=STREAM_BATCH_SIZE):
+    # type: (LogSource, int) -> Iterator[unicode]
+    """
+    Yields the text of `source`'s whole log in order, a segment or chunk at a
+    time. Unlike get_chunks, rows are read through a server-side cursor, in
+    batches, so only a little of even a huge log is held in memory at once.
+    """
+    if source.sealed_size:
+        segments = db.session.query(
+            LogSegment.data, LogSegment.codec,
+        ).filter(
+            LogSegment.source_id == source.id,
+        ).order_by(
+            LogSegment.offset.asc(),
+        )
+        for data, codec in _stream(segments, batch_size):
+            yield decompress(data, codec)
+
+    chunks = db.session.query(
+        LogChunk.text,
+    ).filter(
+        LogChunk.source_id == source.id,
+    ).order_by(
+        LogChunk.offset.asc(),
+    )
+    for text, in _stream(chunks, batch_size):
+        yield text
+
+
+def _stream(query, batch_size):
+    return query.execution_options(stream_results=True).yield_per(batch_size)
+
+
+def _split_segment(source, segment, start):
+    # type: (LogSource, LogSegment, int) -> List[LogChunk]
+    """
+    Splits the text of `segment` into chunks, skipping anything before
+    `start` (an offset in the log).
+    """
+    text = decompress(segment.data, segment.codec)
+    return [
+        LogChunk(
+            # stable, so clients can tell chunks apart between requests
+            id=uuid5(segment.id, str(i)),
+            job_id=source.job_id,
+            project_id=source.project_id,
+            source=source,
+            offset=segment.offset + i,
+            size=len(text[i:i + LOG_CHUNK_SIZE]),
+            text=text[i:i + LOG_CHUNK_SIZE],
+            date_created=segment.date_created,
+        )
+        for i in xrange(max(start - segment.offset, 0), len(text), LOG_CHUNK_SIZE)
+    ]
+
+
+def _matches(chunk, after, until, min_end):
+    # type: (LogChunk, Optional[int], Optional[int], Optional[int]) -> bool
+    if after is not None and chunk.offset <= after:
+        return False
+    if until is not None and chunk.offset > until:
+        return False
+    if min_end is not None and chunk.offset + chunk.size < min_end:
+        return False
+    return True
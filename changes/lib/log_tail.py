@@ -0,0 +1,154 @@
+"""
+Lets log viewers wait for new log text instead of polling for it.
+
+When LogChunks are committed, the new size of each log they belong to is
+published on a Redis channel for that log (`track_changes` and
+`publish_changes` are session listeners; see configure_log_tail).
+`wait_for_chunks` subscribes to a log's channel and blocks until there are
+chunks past a given offset, or a timeout passes, so JobLogTailAPIView only
+queries logchunk again when something has actually been written.
+
+Each waiting request ties up a worker (and a Redis connection) for up to the
+timeout, so `tailer_slot` caps how many a process will hold at once.
+"""
+
+from __future__ import absolute_import
+
+import logging
+import threading
+import time
+
+from contextlib import contextmanager
+from redis import RedisError
+from redis.client import PubSub  # NOQA
+from select import select
+from typing import Callable, Dict, List, Optional  # NOQA
+from uuid import UUID  # NOQA
+
+from changes.config import redis
+from changes.models.log import LogChunk
+
+logger = logging.getLogger('changes.log_tail')
+
+CHANNEL = 'logsource:{}:written'
+
+_num_tailers = 0
+_tailers_lock = threading.Lock()
+
+
+class TooManyTailers(Exception):
+    pass
+
+
+def track_changes(session, flush_context):
+    """
+    after_flush listener that records the sizes of logs that new chunks
+    were written to, to publish once the transaction commits.
+    """
+    sizes = None  # type: Optional[Dict[UUID, int]]
+    for obj in session.new:
+        if isinstance(obj, LogChunk):
+            if sizes is None:
+                sizes = session.info.setdefault('log_tail', {})
+            sizes[obj.source_id] = max(sizes.get(obj.source_id, 0), obj.offset + obj.size)
+
+
+def publish_changes(session):
+    """
+    after_commit listener that publishes the sizes recorded by
+    `track_changes`. Errors are logged rather than raised; tailers will
+    still see the chunks when they time out.
+    """
+    sizes = session.info.pop('log_tail', None)
+    if not sizes:
+        return
+    try:
+        pipe = redis.pipeline(transaction=False)
+        for source_id, size in sizes.iteritems():
+            pipe.publish(CHANNEL.format(source_id.hex), size)
+        pipe.execute()
+    except Exception:
+        logger.exception('Unable to publish log changes')
+
+
+def discard_changes(session):
+    """after_rollback listener that forgets the sizes recorded by `track_changes`."""
+    session.info.pop('log_tail', None)
+
+
+@contextmanager
+def tailer_slot(max_tailers):
+    # type: (int) -> None
+    """
+    Holds one of this process's `max_tailers` slots for waiting on logs,
+    raising TooManyTailers if they're all taken.
+    """
+    global _num_tailers
+    with _tailers_lock:
+        if _num_tailers >= max_tailers:
+            raise TooManyTailers()
+        _num_tailers += 1
+    try:
+        yield
+    finally:
+        with _tailers_lock:
+            _num_tailers -= 1
+
+
+def wait_for_chunks(source_id, size, fetch, timeout):
+    # type: (UUID, int, Callable[[], List[LogChunk]], float) -> List[LogChunk]
+    """
+    Returns `fetch()` (the chunks of the log past its first `size`
+    characters) as soon as it's non-empty, waiting up to `timeout` seconds
+    for chunks to be written. `fetch` is only called again once the log is
+    known to be longer than `size`.
+
+    If Redis is unavailable, this doesn't wait.
+    """
+    deadline = time.time() + timeout
+    pubsub = redis.pubsub(ignore_subscribe_messages=True)
+    try:
+        try:
+            # subscribe before the first fetch, so chunks written in between
+            # aren't missed
+            pubsub.subscribe(CHANNEL.format(source_id.hex))
+        except RedisError:
+            logger.warning('Unable to subscribe to log changes', exc_info=True)
+            return fetch()
+
+        chunks = fetch()
+        while not chunks:
+            try:
+                new_size = _next_message(pubsub, deadline)
+            except RedisError:
+                logger.warning('Lost subscription to log changes', exc_info=True)
+                return chunks
+            if new_size is None:
+                break
+            if int(new_size) > size:
+                chunks = fetch()
+        return chunks
+    finally:
+        pubsub.close()
+
+
+def _next_message(pubsub, deadline):
+    # type: (PubSub, float) -> Optional[str]
+    """
+    Returns the data of the next message published to `pubsub`'s channels,
+    or None if there's none by `deadline`.
+    """
+    # redis-py 2.10's get_message can't wait, so wait on the socket for it
+    while True:
+        message = pubsub.get_message()
+        if message is not None:
+            return message['data']
+        # get_message returns None for an ignored subscribe message too, and
+        # what came after it may already be read into the parser's buffer,
+        # where select won't see it
+        if pubsub.connection.can_read():
+            continue
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return None
+        select([pubsub.connection._sock], [], [], remaining)
@@ -0,0 +1,322 @@
+"""
+An outbox for notifications to other services (mail, Phabricator comments,
+analytics, green build receivers), so that listeners don't hold a worker
+while those services respond.
+
+A listener works out what to send and calls `send(destination, data)`, which
+adds a Notification and commits it. deliver_notifications (on the
+'notifications' queue, so its workers are a pool of their own) then
+delivers it with the destination's Sender (NOTIFICATION_SENDERS):
+
+- at most NOTIFICATION_CONCURRENCY[destination] workers deliver to a
+  destination at once (1 if it isn't listed);
+- a Sender may deliver several notifications in one request;
+- failed deliveries are retried with jittered exponential backoff, until
+  NOTIFICATION_MAX_ATTEMPTS, when the Sender is told it failed;
+- a Sender may have a delivered notification supersede older pending ones,
+  so that they don't arrive out of order;
+- sweep_notifications periodically picks up anything due that wasn't.
+
+With NOTIFICATION_OUTBOX_ENABLED off, `send` delivers the notification
+straight away instead, without retrying.
+"""
+
+from __future__ import absolute_import
+
+import logging
+import random
+
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from flask import current_app
+from typing import Any, Dict, Hashable, List  # NOQA
+
+from changes.config import db, queue, redis, statsreporter
+from changes.ext.redis import UnableToGetLock
+from changes.models.notification import Notification, NotificationStatus
+from changes.utils.imports import import_string
+
+logger = logging.getLogger('notifications')
+
+# how many notifications a worker takes at a time
+CLAIM_SIZE = 50
+
+SLOT_KEY = 'notifications:{}:{}'
+
+
+class Sender(object):
+    """
+    Delivers notifications to a destination. Subclasses implement `deliver`,
+    and may batch notifications by setting max_batch_size (and `batch_key`,
+    if only some can go together, and `batch_weight`, if some take up more
+    of a batch than others).
+    """
+    max_batch_size = 1
+
+    def batch_key(self, data):
+        # type: (Dict[str, Any]) -> Hashable
+        """Notifications are only batched with others of the same key."""
+        return None
+
+    def batch_weight(self, data):
+        # type: (Dict[str, Any]) -> int
+        """
+        How much of max_batch_size a notification takes up. One that's
+        heavier than that on its own is delivered alone.
+        """
+        return 1
+
+    def supersede_key(self, data):
+        # type: (Dict[str, Any]) -> Hashable
+        """
+        Once a notification is delivered, pending ones created before it with
+        the same key (other than None) aren't delivered at all, so that a
+        retried notification can't arrive after a newer one.
+        """
+        return None
+
+    def deliver(self, batch):
+        # type: (List[Dict[str, Any]]) -> None
+        """Delivers the notifications' data, raising if they weren't."""
+        raise NotImplementedError
+
+    def should_retry(self, exc):
+        # type: (Exception) -> bool
+        """
+        False for failures that trying again won't fix, such as the
+        destination rejecting the notification. They aren't logged, so
+        `failed` should report them if need be.
+        """
+        return True
+
+    def delivered(self, data):
+        # type: (Dict[str, Any]) -> None
+        """Called once a notification is delivered."""
+
+    def failed(self, data, exc):
+        # type: (Dict[str, Any], Exception) -> None
+        """Called when we've given up on delivering a notification."""
+
+
+_senders = {}  # type: Dict[str, Sender]
+
+
+def get_sender(destination):
+    # type: (str) -> Sender
+    path = current_app.config['NOTIFICATION_SENDERS'][destination]
+    sender = _senders.get(path)
+    if sender is None:
+        sender = _senders[path] = import_string(path)()
+    return sender
+
+
+def send(destination, data):
+    # type: (str, Dict[str, Any]) -> None
+    """
+    Sends a notification to the destination. This commits the session, so
+    the notification is only sent along with what the caller has done.
+    """
+    send_many(destination, [data])
+
+
+def send_many(destination, datas):
+    # type: (str, List[Dict[str, Any]]) -> None
+    """
+    Sends several notifications to the destination, as `send`, but
+    committing (and queueing their delivery) once.
+    """
+    if not current_app.config['NOTIFICATION_OUTBOX_ENABLED']:
+        for data in datas:
+            _deliver_now(destination, data)
+        return
+    if not datas:
+        return
+
+    db.session.add_all([Notification(destination=destination, data=data) for data in datas])
+    db.session.commit()
+    queue.delay('deliver_notifications', kwargs={'destination': destination})
+
+
+def _deliver_now(destination, data):
+    # type: (str, Dict[str, Any]) -> None
+    sender = get_sender(destination)
+    try:
+        sender.deliver([data])
+    except Exception as e:
+        if sender.should_retry(e):
+            logger.exception('Failed to deliver %s notification', destination)
+        sender.failed(data, e)
+    else:
+        sender.delivered(data)
+
+
+def deliver(destination):
+    # type: (str) -> int
+    """
+    Delivers the destination's due notifications, if fewer than its limit of
+    workers already are. Returns how many were dealt with.
+    """
+    lease = current_app.config['NOTIFICATION_LEASE']
+    limit = current_app.config['NOTIFICATION_CONCURRENCY'].get(destination, 1)
+    for slot in random.sample(range(limit), limit):
+        try:
+            with redis.lock(SLOT_KEY.format(destination, slot), expire=lease, nowait=True):
+                return _deliver_due(destination, lease)
+        except UnableToGetLock:
+            continue
+    # they're all busy, and will get to what's due
+    return 0
+
+
+def _deliver_due(destination, lease):
+    # type: (str, int) -> int
+    sender = get_sender(destination)
+    # stop taking more well before the slot's lock expires
+    stop_at = datetime.utcnow() + timedelta(seconds=lease / 2)
+    count = 0
+    while datetime.utcnow() < stop_at:
+        notifications = _claim(destination, lease)
+        if not notifications:
+            break
+        batches = _batches(sender, notifications)
+        while batches and datetime.utcnow() < stop_at:
+            # superseded by one delivered earlier in this claim
+            batch = [n for n in batches.pop(0) if n.status == NotificationStatus.pending]
+            if batch:
+                _deliver_batch(destination, sender, batch)
+                db.session.commit()
+            count += len(batch)
+        if batches:
+            _release([n for rest in batches for n in rest])
+            break
+    return count
+
+
+def _claim(destination, lease):
+    # type: (str, int) -> List[Notification]
+    """
+    Takes the destination's next due notifications, pushing back when
+    they're due so that no one else does too.
+    """
+    now = datetime.utcnow()
+    notifications = Notification.query.filter(
+        Notification.destination == destination,
+        Notification.status == NotificationStatus.pending,
+        Notification.date_next_attempt <= now,
+    ).order_by(
+        Notification.date_next_attempt,
+    ).limit(CLAIM_SIZE).with_for_update().all()
+    for notification in notifications:
+        notification.num_attempts += 1
+        notification.date_next_attempt = now + timedelta(seconds=lease)
+    db.session.commit()
+    return notifications
+
+
+def _release(notifications):
+    # type: (List[Notification]) -> None
+    """
+    Hands back claimed notifications that weren't delivered, so that they're
+    due again now rather than once the claim's lease is up.
+    """
+    now = datetime.utcnow()
+    for notification in notifications:
+        notification.num_attempts -= 1
+        notification.date_next_attempt = now
+    db.session.commit()
+
+
+def _batches(sender, notifications):
+    # type: (Sender, List[Notification]) -> List[List[Notification]]
+    by_key = OrderedDict()  # type: Dict[Hashable, List[Notification]]
+    for notification in notifications:
+        by_key.setdefault(sender.batch_key(notification.data), []).append(notification)
+    batches = []  # type: List[List[Notification]]
+    for group in by_key.values():
+        batch = []  # type: List[Notification]
+        weight = 0
+        for notification in group:
+            notification_weight = sender.batch_weight(notification.data)
+            if batch and weight + notification_weight > sender.max_batch_size:
+                batches.append(batch)
+                batch = []
+                weight = 0
+            batch.append(notification)
+            weight += notification_weight
+        if batch:
+            batches.append(batch)
+    return batches
+
+
+def _deliver_batch(destination, sender, batch):
+    # type: (str, Sender, List[Notification]) -> None
+    try:
+        sender.deliver([n.data for n in batch])
+    except Exception as e:
+        _failed(destination, sender, batch, e)
+        return
+
+    now = datetime.utcnow()
+    for notification in batch:
+        notification.status = NotificationStatus.sent
+        notification.date_sent = now
+        sender.delivered(notification.data)
+        _supersede(destination, sender, notification)
+    statsreporter.stats().incr('notifications_sent_{}'.format(destination), len(batch))
+
+
+def _supersede(destination, sender, notification):
+    # type: (str, Sender, Notification) -> None
+    key = sender.supersede_key(notification.data)
+    if key is None:
+        return
+    older = Notification.query.filter(
+        Notification.destination == destination,
+        Notification.status == NotificationStatus.pending,
+        Notification.date_created < notification.date_created,
+    )
+    for other in older:
+        if sender.supersede_key(other.data) == key:
+            other.status = NotificationStatus.superseded
+            other.last_error = 'Superseded by {}'.format(notification.id.hex)
+
+
+def _failed(destination, sender, batch, exc):
+    # type: (str, Sender, List[Notification], Exception) -> None
+    max_attempts = current_app.config['NOTIFICATION_MAX_ATTEMPTS']
+    retry = sender.should_retry(exc)
+    given_up = 0
+    for notification in batch:
+        notification.last_error = repr(exc)
+        if retry and notification.num_attempts < max_attempts:
+            notification.date_next_attempt = datetime.utcnow() + retry_delay(notification.num_attempts)
+            continue
+        notification.status = NotificationStatus.failed
+        sender.failed(notification.data, exc)
+        given_up += 1
+    if retry and given_up:
+        logger.exception('Gave up delivering %d %s notification(s)', given_up, destination)
+    elif retry:
+        logger.warning('Failed to deliver %d %s notification(s), will retry', len(batch), destination,
+                       exc_info=True)
+    statsreporter.stats().incr('notifications_failed_{}'.format(destination), len(batch))
+
+
+def retry_delay(num_attempts):
+    # type: (int) -> timedelta
+    """
+    Doubles with each attempt up to NOTIFICATION_RETRY_MAX_DELAY, jittered so
+    that notifications that failed together aren't retried together.
+    """
+    delay = min(current_app.config['NOTIFICATION_RETRY_DELAY'] * 2 ** (num_attempts - 1),
+                current_app.config['NOTIFICATION_RETRY_MAX_DELAY'])
+    return timedelta(seconds=delay * random.uniform(0.5, 1.5))
+
+
+def due_destinations():
+    # type: () -> List[str]
+    """The destinations with notifications due."""
+    return [d for d, in db.session.query(Notification.destination).filter(
+        Notification.status == NotificationStatus.pending,
+        Notification.date_next_attempt <= datetime.utcnow(),
+    ).distinct()]
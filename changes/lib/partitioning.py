@@ -0,0 +1,291 @@
+"""
+Time-based range partitioning of large, append-mostly tables.
+
+A `RangePartitioning` declares that a table is (or is to be) partitioned by
+range on a timestamp column into partitions of a fixed interval, named
+`<table>_p<YYYYMMDD>` after their start. Old data can then be removed by
+detaching and dropping whole partitions, which is nearly free, instead of
+deleting rows, which writes WAL for (and bloats) every row and index touched.
+
+Partitioning needs PostgreSQL 11 or later. Until a table has been converted,
+`is_partitioned` is false and callers are expected to fall back to deleting
+rows.
+
+Converting a table is done online, in three steps that can each be rerun:
+
+1. `create`: creates `<table>_partitioned`, partitioned like the table, with
+   partitions covering all of its existing rows and a default partition for
+   outliers.
+2. `copy`: copies the existing rows over, a partition at a time.
+3. `swap`: copies anything written since, then renames the tables (under an
+   exclusive lock, briefly). The original is kept as `<table>_unpartitioned`.
+
+Partitioned tables can't have unique constraints that don't include the
+partition column, so `create` extends them (the primary key included) with
+it. For the same reason, foreign keys referencing the table are dropped by
+`swap`, so deletes no longer cascade to the tables that referenced it.
+"""
+
+from __future__ import absolute_import
+
+import logging
+import re
+
+from datetime import datetime, timedelta
+from typing import List, NamedTuple, Optional, Tuple  # NOQA
+
+from changes.config import db
+
+logger = logging.getLogger('changes.partitioning')
+
+# partitions start at multiples of their interval since this (a Monday)
+EPOCH = datetime(2000, 1, 3)
+
+# how many intervals ahead of the newest data to create partitions for
+PARTITIONS_AHEAD = 4
+
+Partition = NamedTuple('Partition', [('name', str), ('start', datetime), ('end', datetime)])
+
+_BOUND_RE = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+class RangePartitioning(object):
+    """
+    Args:
+        table (str): The table to partition.
+        column (str): The timestamp column to partition it by.
+        interval (timedelta): How much time each partition covers.
+        parent (Optional[Tuple[str, str]]): For a table whose rows may have no
+            value for `column` (e.g. because it was added later), a
+            (table, foreign key column) pair to copy those rows' values from
+            when converting the table.
+    """
+
+    def __init__(self, table, column='date_created', interval=timedelta(days=7), parent=None):
+        # type: (str, str, timedelta, Optional[Tuple[str, str]]) -> None
+        self.table = table
+        self.column = column
+        self.interval = interval
+        self.parent = parent
+
+    def __repr__(self):
+        return '<RangePartitioning {} by {} every {}>'.format(self.table, self.column, self.interval)
+
+    @property
+    def partitioned_name(self):
+        return '{}_partitioned'.format(self.table)
+
+    @property
+    def unpartitioned_name(self):
+        return '{}_unpartitioned'.format(self.table)
+
+    def align(self, date):
+        # type: (datetime) -> datetime
+        """Returns the start of the partition `date` falls in."""
+        offset = (date - EPOCH).total_seconds() % self.interval.total_seconds()
+        return date - timedelta(seconds=offset)
+
+    def partition_name(self, start, table=None):
+        # type: (datetime, Optional[str]) -> str
+        return '{}_p{}'.format(table or self.table, start.strftime('%Y%m%d'))
+
+    def is_partitioned(self):
+        # type: () -> bool
+        if db.session.bind.dialect.server_version_info < (11,):
+            return False
+        return bool(db.session.execute(
+            'SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)',
+            {'table': self.table},
+        ).scalar())
+
+    def partitions(self, table=None):
+        # type: (Optional[str]) -> List[Partition]
+        """The (non-default) partitions of the table, oldest first."""
+        rows = db.session.execute("""
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(:table)
+        """, {'table': table or self.table})
+        result = []
+        for name, bound in rows:
+            match = _BOUND_RE.search(bound)
+            if match:
+                start, end = [datetime.strptime(d[:19], '%Y-%m-%d %H:%M:%S') for d in match.groups()]
+                result.append(Partition(name, start, end))
+        return sorted(result, key=lambda p: p.start)
+
+    def create_partitions(self, start, end, table=None):
+        # type: (datetime, datetime, Optional[str]) -> List[str]
+        """
+        Creates any missing partitions covering [start, end), returning their
+        names. The caller is responsible for committing.
+        """
+        table = table or self.table
+        existing = set(p.start for p in self.partitions(table))
+        created = []
+        start = self.align(start)
+        while start < end:
+            if start not in existing:
+                name = self.partition_name(start, table)
+                db.session.execute(
+                    "CREATE TABLE {} PARTITION OF {} FOR VALUES FROM ('{}') TO ('{}')".format(
+                        name, table, start.isoformat(' '), (start + self.interval).isoformat(' ')))
+                created.append(name)
+            start += self.interval
+        return created
+
+    def drop_partitions_before(self, cutoff):
+        # type: (datetime) -> List[str]
+        """
+        Detaches and drops the partitions holding only rows from before
+        `cutoff`, oldest first and each in its own transaction, returning
+        their names.
+        """
+        dropped = []
+        for partition in self.partitions():
+            if partition.end > cutoff:
+                break
+            db.session.execute('ALTER TABLE {} DETACH PARTITION {}'.format(self.table, partition.name))
+            db.session.execute('DROP TABLE {}'.format(partition.name))
+            db.session.commit()
+            dropped.append(partition.name)
+        return dropped
+
+    def create(self):
+        # type: () -> None
+        """
+        Creates the partitioned copy of the table, with the same columns,
+        defaults and indexes (named with a `_p` suffix until `swap`).
+        """
+        new = self.partitioned_name
+        db.session.execute(
+            'CREATE TABLE IF NOT EXISTS {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+            'PARTITION BY RANGE ({})'.format(new, self.table, self.column))
+
+        for name, columns, unique, primary in self._indexes(self.table):
+            if unique and self.column not in columns:
+                columns.append(self.column)
+            if primary:
+                exists = db.session.execute(
+                    "SELECT 1 FROM pg_constraint WHERE conrelid = to_regclass(:table) AND contype = 'p'",
+                    {'table': new},
+                ).scalar()
+                if not exists:
+                    db.session.execute('ALTER TABLE {} ADD CONSTRAINT {}_p PRIMARY KEY ({})'.format(
+                        new, name, ', '.join(columns)))
+            else:
+                db.session.execute('CREATE {}INDEX IF NOT EXISTS {}_p ON {} ({})'.format(
+                    'UNIQUE ' if unique else '', name, new, ', '.join(columns)))
+
+        # foreign keys to tables that are (or are about to be) partitioned
+        # can't be kept, as they don't have a unique key on just the id
+        foreign_keys = db.session.execute("""
+            SELECT c.conname, pg_get_constraintdef(c.oid) FROM pg_constraint c
+            WHERE c.conrelid = to_regclass(:table) AND c.contype = 'f'
+            AND NOT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = c.confrelid)
+            AND to_regclass(c.confrelid::regclass || '_partitioned') IS NULL
+            AND NOT EXISTS (
+                SELECT 1 FROM pg_constraint WHERE conrelid = to_regclass(:new) AND conname = c.conname)
+        """, {'table': self.table, 'new': new}).fetchall()
+        for name, definition in foreign_keys:
+            db.session.execute('ALTER TABLE {} ADD CONSTRAINT {} {}'.format(new, name, definition))
+
+        if self.parent:
+            parent_table, _ = self.parent
+            oldest, newest = db.session.execute('SELECT min({0}), max({0}) FROM {1}'.format(
+                self.column, parent_table)).fetchone()
+        else:
+            oldest, newest = db.session.execute('SELECT min({0}), max({0}) FROM {1}'.format(
+                self.column, self.table)).fetchone()
+        now = datetime.utcnow()
+        self.create_partitions(min(oldest or now, now),
+                               max(newest or now, now) + self.interval * PARTITIONS_AHEAD, new)
+        db.session.execute('CREATE TABLE IF NOT EXISTS {0}_default PARTITION OF {0} DEFAULT'.format(new))
+        db.session.commit()
+
+    def copy(self, since=None):
+        # type: (Optional[datetime]) -> int
+        """
+        Copies the table's rows into its partitioned copy a partition at a
+        time (committing after each), optionally only those since `since`.
+        Rows that are already there are skipped. Returns the number copied.
+        """
+        total = 0
+        for partition in self.partitions(self.partitioned_name):
+            if since is not None and partition.end <= since:
+                continue
+            total += self._copy_range(max(partition.start, since or partition.start), partition.end)
+            db.session.commit()
+            logger.info('Copied %s rows from %s to %s', total, self.table, partition.name)
+        return total
+
+    def swap(self, since):
+        # type: (datetime) -> None
+        """
+        Copies rows written to the table since `since` (which should be
+        before `copy` was last started), then replaces the table with its
+        partitioned copy.
+        """
+        db.session.execute('LOCK TABLE {} IN EXCLUSIVE MODE'.format(self.table))
+        self._copy_range(since, None)
+
+        references = db.session.execute("""
+            SELECT conrelid::regclass, conname FROM pg_constraint
+            WHERE confrelid = to_regclass(:table) AND contype = 'f' AND conparentid = 0
+        """, {'table': self.table}).fetchall()
+        for table, name in references:
+            db.session.execute('ALTER TABLE {} DROP CONSTRAINT {}'.format(table, name))
+
+        for name, _, _, _ in self._indexes(self.table):
+            db.session.execute('ALTER INDEX {} RENAME TO {}_unpartitioned'.format(name, name))
+            db.session.execute('ALTER INDEX {}_p RENAME TO {}'.format(name, name))
+        db.session.execute('ALTER TABLE {} RENAME TO {}'.format(self.table, self.unpartitioned_name))
+        db.session.execute('ALTER TABLE {} RENAME TO {}'.format(self.partitioned_name, self.table))
+        for partition in self.partitions(self.table):
+            db.session.execute('ALTER TABLE {} RENAME TO {}'.format(
+                partition.name, self.partition_name(partition.start)))
+        db.session.execute('ALTER TABLE {}_default RENAME TO {}_default'.format(
+            self.partitioned_name, self.table))
+        db.session.commit()
+
+    def _indexes(self, table):
+        # type: (str) -> List[Tuple[str, List[str], bool, bool]]
+        """The (name, columns, is unique, is primary key) of each of the table's indexes."""
+        rows = db.session.execute("""
+            SELECT i.relname, x.indisunique, x.indisprimary,
+                array(SELECT pg_get_indexdef(x.indexrelid, k + 1, true)
+                      FROM generate_subscripts(x.indkey, 1) AS k ORDER BY k)
+            FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+            WHERE x.indrelid = to_regclass(:table)
+        """, {'table': table})
+        return [(name, list(columns), unique, primary) for name, unique, primary, columns in rows]
+
+    def _columns(self):
+        # type: () -> List[str]
+        return [name for name, in db.session.execute("""
+            SELECT attname FROM pg_attribute
+            WHERE attrelid = to_regclass(:table) AND attnum > 0 AND NOT attisdropped
+            ORDER BY attnum
+        """, {'table': self.table})]
+
+    def _copy_range(self, start, end):
+        # type: (datetime, Optional[datetime]) -> int
+        columns = self._columns()
+        if self.parent:
+            parent_table, foreign_key = self.parent
+            values = ['coalesce(t.{0}, p.{0})'.format(c) if c == self.column else 't.{}'.format(c)
+                      for c in columns]
+            source = '{} t JOIN {} p ON p.id = t.{}'.format(self.table, parent_table, foreign_key)
+            column = 'p.{}'.format(self.column)
+        else:
+            values = ['t.{}'.format(c) for c in columns]
+            source = '{} t'.format(self.table)
+            column = 't.{}'.format(self.column)
+        condition = '{} >= :start'.format(column)
+        if end is not None:
+            condition += ' AND {} < :end'.format(column)
+        return db.session.execute(
+            'INSERT INTO {} ({}) SELECT {} FROM {} WHERE {} ON CONFLICT DO NOTHING'.format(
+                self.partitioned_name, ', '.join(columns), ', '.join(values), source, condition),
+            {'start': start, 'end': end},
+        ).rowcount
@@ -0,0 +1,155 @@
+"""
+Short-lived, per-process caches for lookups made on hot paths (e.g. the
+Jenkins master blacklist, which would otherwise be read from Redis for every
+job created).
+
+Entries live for a TTL given with each lookup, but can be dropped sooner:
+`ProcessCache.invalidate` publishes on a Redis channel that every process
+subscribes to, and each process applies the invalidations it has received
+before its next lookup. Reading them doesn't wait on Redis (they're already
+on the socket), so an update is seen everywhere as soon as it's published.
+If the subscription is lost, every cache is cleared and the TTL alone bounds
+staleness until it's back.
+
+Hits, misses and invalidations are counted (process_cache_{hit,miss,
+invalidated}_<name>), and the age of each entry served is timed
+(process_cache_age_<name>), to show how stale cached values get.
+"""
+
+from __future__ import absolute_import
+
+import logging
+import os
+import threading
+import time
+
+from redis import RedisError
+from typing import Any, Callable, Dict, Optional, Tuple  # NOQA
+from uuid import uuid4
+
+from changes.config import redis, statsreporter
+
+logger = logging.getLogger('changes.process_cache')
+
+CHANNEL = 'process_cache:invalidate'
+
+# name => ProcessCache
+_caches = {}  # type: Dict[str, ProcessCache]
+# guards the caches' entries and the subscription
+_lock = threading.RLock()
+# the pid the subscription belongs to, so forked workers make their own, and
+# the id this process gives its own invalidations, so it can ignore them
+_subscription = {'pid': None, 'pubsub': None, 'origin': None}
+
+
+class ProcessCache(object):
+    def __init__(self, name):
+        # type: (str) -> None
+        assert name not in _caches, 'Duplicate process cache: {}'.format(name)
+        self.name = name
+        # key => (time loaded, value)
+        self._entries = {}  # type: Dict[str, Tuple[float, Any]]
+        # bumped whenever entries are dropped, so values loaded from before
+        # an invalidation aren't cached
+        self._generation = 0
+        _caches[name] = self
+
+    def get(self, key, load, ttl, cache_if=None):
+        # type: (str, Callable[[], Any], float, Optional[Callable[[Any], bool]]) -> Any
+        """
+        Returns the cached value for `key` if it's less than `ttl` seconds
+        old, or else `load()` (which is cached, unless `cache_if` is given and
+        returns False for it). A `ttl` of 0 disables caching.
+        """
+        if ttl <= 0:
+            return load()
+
+        stats = statsreporter.stats()
+        _apply_invalidations()
+        now = time.time()
+        with _lock:
+            entry = self._entries.get(key)
+            generation = self._generation
+        if entry is not None and now - entry[0] < ttl:
+            stats.incr('process_cache_hit_' + self.name)
+            stats.log_timing('process_cache_age_' + self.name, int((now - entry[0]) * 1000))
+            return entry[1]
+
+        stats.incr('process_cache_miss_' + self.name)
+        value = load()
+        if cache_if is not None and not cache_if(value):
+            return value
+        with _lock:
+            if self._generation == generation:
+                self._entries[key] = (now, value)
+        return value
+
+    def invalidate(self, key=None):
+        # type: (Optional[str]) -> None
+        """
+        Drops `key` (or everything, if it's None) from this cache, in this
+        process and every other one.
+        """
+        self._drop(key)
+        target = self.name if key is None else '{}:{}'.format(self.name, key)
+        try:
+            with _lock:
+                _apply_invalidations()
+                origin = _subscription['origin']
+            redis.publish(CHANNEL, '{} {}'.format(origin, target))
+        except RedisError:
+            logger.exception('Unable to publish invalidation of %s', target)
+
+    def clear(self):
+        # type: () -> None
+        """Drops everything from this cache, in this process only."""
+        self._drop(None)
+
+    def _drop(self, key):
+        # type: (Optional[str]) -> bool
+        with _lock:
+            self._generation += 1
+            if key is None:
+                dropped = bool(self._entries)
+                self._entries.clear()
+            else:
+                dropped = self._entries.pop(key, None) is not None
+        return dropped
+
+
+def clear_all():
+    # type: () -> None
+    """Drops everything from every cache, in this process only."""
+    for cache in _caches.values():
+        cache.clear()
+
+
+def _apply_invalidations():
+    # type: () -> None
+    """Drops whatever other processes have invalidated since the last call."""
+    with _lock:
+        pubsub = _subscription['pubsub']
+        try:
+            if pubsub is None or _subscription['pid'] != os.getpid():
+                pubsub = redis.pubsub(ignore_subscribe_messages=True)
+                _subscription.update(pid=os.getpid(), pubsub=pubsub, origin=uuid4().hex)
+                pubsub.subscribe(CHANNEL)
+                # anything cached before now may have missed invalidations
+                clear_all()
+            while True:
+                message = pubsub.get_message()
+                if message is None:
+                    break
+                origin, _, target = message['data'].partition(' ')
+                if origin == _subscription['origin']:
+                    continue
+                name, _, key = target.partition(':')
+                cache = _caches.get(name)
+                if cache is not None and cache._drop(key or None):
+                    statsreporter.stats().incr('process_cache_invalidated_' + name)
+        except RedisError:
+            logger.warning('Lost process cache invalidations', exc_info=True)
+            _subscription['pubsub'] = None
+            if pubsub is not None:
+                pubsub.close()
+            clear_all()
@@ -0,0 +1,120 @@
+"""
+An index of a repository's projects by their build.file-whitelist, for working
+out which projects a commit's changed files match without trying every file
+against every pattern of every project.
+
+Patterns are fnmatch-style, as in changes.utils.project_trigger. Each is filed
+in a trie under its literal prefix (everything before its first wildcard), so
+a changed file is only tried against the patterns whose prefix it starts with:
+
+- a pattern without wildcards matches if the path ends at its node;
+- a prefix followed only by '*' matches any path reaching its node;
+- otherwise the rest of the pattern is matched from the end of the prefix,
+  as one regex per project and node.
+"""
+
+from __future__ import absolute_import
+
+import fnmatch
+import re
+
+from collections import defaultdict
+from typing import Dict, FrozenSet, Hashable, Iterable, List, Pattern, Set, Tuple  # NOQA
+
+WILDCARDS = frozenset('*?[')
+
+
+class _Node(object):
+    __slots__ = ('children', 'exact', 'prefix', 'patterns')
+
+    def __init__(self):
+        self.children = {}  # type: Dict[str, _Node]
+        # projects with a pattern matching exactly the path to this node
+        self.exact = set()  # type: Set[Hashable]
+        # projects with a pattern matching anything below it
+        self.prefix = set()  # type: Set[Hashable]
+        # project -> compiled regex for the rest of its other patterns
+        self.patterns = {}  # type: Dict[Hashable, Pattern]
+
+
+class TriggerIndex(object):
+    """
+    >>> index = TriggerIndex({project.id: ['ci/*', 'setup.py']})
+    >>> index.match(['ci/run.sh', 'README'])
+    {project.id: ['ci/run.sh']}
+    """
+    def __init__(self, whitelists):
+        # type: (Dict[Hashable, List[str]]) -> None
+        """
+        Args:
+            whitelists: project -> file whitelist patterns. Projects without
+                any aren't restricted, and aren't in the index.
+        """
+        self._root = _Node()
+        self.restricted = frozenset(k for k, v in whitelists.items() if v)
+
+        remainders = defaultdict(list)  # type: Dict[Tuple[_Node, Hashable], List[str]]
+        for project_id, patterns in whitelists.items():
+            for pattern in patterns:
+                split = next((i for i, c in enumerate(pattern) if c in WILDCARDS), len(pattern))
+                node = self._root
+                for c in pattern[:split]:
+                    node = node.children.setdefault(c, _Node())
+                rest = pattern[split:]
+                if not rest:
+                    node.exact.add(project_id)
+                elif rest.strip('*') == '':
+                    node.prefix.add(project_id)
+                else:
+                    remainders[node, project_id].append(fnmatch.translate(rest))
+
+        for (node, project_id), regexes in remainders.items():
+            if project_id not in node.prefix:
+                node.patterns[project_id] = re.compile('|'.join('(?:%s)' % r for r in regexes))
+
+    def match(self, files):
+        # type: (Iterable[str]) -> Dict[Hashable, List[str]]
+        """
+        Returns the files matching each restricted project's whitelist, for
+        the projects with any.
+        """
+        matched = defaultdict(list)  # type: Dict[Hashable, List[str]]
+        for path in files:
+            for project_id in self._match_path(path):
+                matched[project_id].append(path)
+        return dict(matched)
+
+    def _match_path(self, path):
+        # type: (str) -> Set[Hashable]
+        found = set()  # type: Set[Hashable]
+        node = self._root
+        depth = 0
+        while True:
+            if node.prefix:
+                found |= node.prefix
+            for project_id, regex in node.patterns.iteritems():
+                if project_id not in found and regex.match(path, depth):
+                    found.add(project_id)
+            if depth == len(path):
+                found |= node.exact
+                return found
+            node = node.children.get(path[depth])
+            if node is None:
+                return found
+            depth += 1
+
+
+_index_cache = {}  # type: Dict[Hashable, Tuple[FrozenSet, TriggerIndex]]
+
+
+def get_trigger_index(repository_id, whitelists):
+    # type: (Hashable, Dict[Hashable, List[str]]) -> TriggerIndex
+    """
+    Returns a TriggerIndex of the whitelists, reusing the repository's last
+    one until they change.
+    """
+    version = frozenset((k, tuple(v)) for k, v in whitelists.items())
+    cached = _index_cache.get(repository_id)
+    if cached is None or cached[0] != version:
+        cached = _index_cache[repository_id] = (version, TriggerIndex(whitelists))
+    return cached[1]
@@ -9,22 +9,24 @@ import logging
 import json
 import re
 import requests
-from sqlalchemy import distinct
 from collections import defaultdict
 from datetime import datetime
 from uuid import UUID  # NOQA
 
 from flask import current_app
-from typing import Any, Dict, List, Tuple, Union  # NOQA
+from sqlalchemy.orm import joinedload
+from typing import Any, Dict, Iterator, List, Set, Tuple, Union  # NOQA
 
 from changes.config import db, statsreporter
 from changes.constants import Result
+from changes.lib import build_context_lib, log_segments, notifications
 from changes.models.build import Build
 from changes.models.job import Job
 from changes.models.jobstep import JobStep
-from changes.models.log import LogChunk, LogSource
+from changes.models.log import LogSource
 from changes.models.failurereason import FailureReason
 from changes.models.itemstat import ItemStat
+from changes.utils.batching import batched
 from changes.experimental import categorize
 
 logger = logging.getLogger('analytics_notifier')
@@ -62,28 +64,6 @@ def _get_phabricator_revision_url(build):
     return None
 
 
-def _get_build_failure_reasons(build):
-    # type: (Build) -> List[str]
-    """Return the names of all the FailureReasons associated with a build.
-    Args:
-        build (Build): The build to return reasons for.
-    Returns:
-        list: A sorted list of the distinct FailureReason.reason values associated with
-        the build.
-    """
-    failure_reasons = [r for r, in db.session.query(
-                distinct(FailureReason.reason)
-            ).join(
-                JobStep, JobStep.id == FailureReason.step_id,
-            ).filter(
-                FailureReason.build_id == build.id,
-                JobStep.replacement_id.is_(None),
-            ).all()]
-    # The order isn't particularly meaningful; the sorting is primarily
-    # to make the same set of reasons reliably result in the same JSON.
-    return sorted(failure_reasons)
-
-
 def maybe_ts(dt):
     # type: (datetime) -> Union[int, None]
     if dt:
@@ -100,14 +80,7 @@ def build_finished_handler(build_id, **kwargs):
     if build is None:
         return
 
-    failure_reasons = _get_build_failure_reasons(build)
-
-    jobsteps_replaced = JobStep.query.join(
-        Job, Job.id == JobStep.job_id,
-    ).filter(
-        Job.build_id == build.id,
-        JobStep.replacement_id.isnot(None)
-    ).count()
+    snapshot = build_context_lib.get_build_snapshot(build)
 
     sorted_tags = sorted(list(build.tags or []))
 
@@ -129,8 +102,8 @@ def build_finished_handler(build_id, **kwargs):
         # be globally unique, whereas the id is only certain to be unique for
         # a single Phabricator instance.
         'phab_revision_url': _get_phabricator_revision_url(build),
-        'failure_reasons': failure_reasons,
-        'jobsteps_replaced': jobsteps_replaced,
+        'failure_reasons': snapshot.failure_reasons,
+        'jobsteps_replaced': snapshot.jobsteps_replaced,
         # tags is a dict rather than just a list because some analytics backends (Hive, for
         # example) handle JSON objects much more conveniently than lists.
         'tags': {'tags': sorted_tags},
@@ -138,7 +111,7 @@ def build_finished_handler(build_id, **kwargs):
         # charting systems) only take strings, booleans, numbers, and dates/timestamps.
         # So make the tags a string too.
         'tags_string': ','.join(sorted_tags),
-        'item_stats': _get_itemstat_dict(build.id),
+        'item_stats': snapshot.item_stats,
     }
     if build.author:
         data['author'] = build.author.email
@@ -151,28 +124,35 @@ def post_analytics_data(url, data):
     """
     Args:
         url (str): HTTP URL to POST to.
-        data (list): Records to POST as JSON.
+        data (list): Records to POST as JSON, in requests of at most
+            ANALYTICS_POST_MAX_RECORDS.
     """
-    try:
-        resp = requests.post(url, headers={'Content-Type': 'application/json'},
-                             data=json.dumps(data), timeout=10)
-        resp.raise_for_status()
-        # Should probably retry here so that transient failures don't result in
-        # missing data.
-    except Exception:
-        logger.exception("Failed to post to Analytics")
+    notifications.send_many('analytics', [
+        {'url': url, 'records': records}
+        for records in batched(data, current_app.config['ANALYTICS_POST_MAX_RECORDS'])
+    ])
 
 
-def _get_itemstat_dict(iid):
-    # type: (UUID) -> Dict[str, Any]
+class AnalyticsSender(notifications.Sender):
     """
-    Args:
-        iid (UUID): The ID of the item to get stats for.
-
-    Returns:
-        dict: Dictionary of stats.
+    POSTs the records of notifications for the same URL together, as one JSON
+    array of at most ANALYTICS_POST_MAX_RECORDS.
     """
-    return dict((s.name, s.value) for s in ItemStat.query.filter(ItemStat.item_id == iid))
+    @property
+    def max_batch_size(self):
+        return current_app.config['ANALYTICS_POST_MAX_RECORDS']
+
+    def batch_key(self, data):
+        return data['url']
+
+    def batch_weight(self, data):
+        return len(data['records'])
+
+    def deliver(self, batch):
+        records = [record for data in batch for record in data['records']]
+        resp = requests.post(batch[0]['url'], headers={'Content-Type': 'application/json'},
+                             data=json.dumps(records), timeout=10)
+        resp.raise_for_status()
 
 
 def job_finished_handler(job_id, **kwargs):
@@ -185,9 +165,36 @@ def job_finished_handler(job_id, **kwargs):
     url = current_app.config.get('ANALYTICS_JOBSTEP_POST_URL')
     if not url:
         return
+    post_analytics_data(url, _get_jobstep_records([job.id], tags_by_step))
+
+
+def _get_jobstep_records(job_ids, tags_by_step):
+    # type: (List[UUID], Dict[UUID, Set[str]]) -> List[Dict[str, Any]]
+    """Return the analytics records of the jobs' jobsteps.
+
+    The jobsteps, their failure reasons and their stats are each fetched in
+    one query, however many jobs and jobsteps there are.
+
+    Args:
+        job_ids (List[UUID]): The jobs to return records for.
+        tags_by_step (Dict[UUID, Set[str]]): The categories observed for the
+            jobsteps' logs, as from _categorize_step_logs.
+    Returns:
+        list: A record per jobstep, oldest first.
+    """
+    if not job_ids:
+        return []
+    jobsteps = JobStep.query.options(
+        joinedload('job', innerjoin=True),
+        joinedload('project', innerjoin=True),
+    ).filter(
+        JobStep.job_id.in_(job_ids),
+    ).order_by(JobStep.date_created)
+    failure_reasons_by_jobstep = _get_failure_reasons_by_jobstep(job_ids)
+    item_stats_by_jobstep = _get_item_stats_by_jobstep(job_ids)
+
     records = []
-    failure_reasons_by_jobstep = _get_job_failure_reasons_by_jobstep(job)
-    for jobstep in JobStep.query.filter(JobStep.job == job):
+    for jobstep in jobsteps:
         duration = None
         if jobstep.date_finished and jobstep.date_started:
             duration = int(round((jobstep.date_finished - jobstep.date_started).total_seconds() * 1000))
@@ -195,7 +202,7 @@ def job_finished_handler(job_id, **kwargs):
                 'jobstep_id': jobstep.id.hex,
                 'job_id': jobstep.job_id.hex,
                 'phase_id': jobstep.phase_id.hex,
-                'build_id': job.build_id.hex,
+                'build_id': jobstep.job.build_id.hex,
                 'label': jobstep.label,
                 'project_slug': jobstep.project.slug,
                 'cluster': jobstep.cluster,
@@ -209,12 +216,33 @@ def job_finished_handler(job_id, **kwargs):
                 'data': jobstep.data.value,
                 'log_categories': sorted(list(tags_by_step[jobstep.id])),
                 'failure_reasons': failure_reasons_by_jobstep[jobstep.id],
-                'item_stats': _get_itemstat_dict(jobstep.id),
+                'item_stats': item_stats_by_jobstep[jobstep.id],
                 'duration': duration,
         }
 
         records.append(data)
-    post_analytics_data(url, records)
+    return records
+
+
+def _get_item_stats_by_jobstep(job_ids):
+    # type: (List[UUID]) -> Dict[UUID, Dict[str, Any]]
+    """Return dict mapping jobstep ids to their stats.
+    Args:
+        job_ids (List[UUID]): The jobs to return the jobsteps' stats of.
+    Returns:
+        dict: A dict mapping from jobstep id to a dict of its stats
+    """
+    stats_by_jobstep = defaultdict(dict)  # type: Dict[UUID, Dict[str, Any]]
+    stats = db.session.query(
+        ItemStat.item_id, ItemStat.name, ItemStat.value,
+    ).join(
+        JobStep, JobStep.id == ItemStat.item_id,
+    ).filter(
+        JobStep.job_id.in_(job_ids),
+    )
+    for step_id, name, value in stats:
+        stats_by_jobstep[step_id][name] = value
+    return stats_by_jobstep
 
 
 def _categorize_step_logs(job):
@@ -228,7 +256,7 @@ def _categorize_step_logs(job):
     rules = _get_rules()
     if rules:
         for ls in _get_failing_log_sources(job):
-            logdata = _get_log_data(ls)
+            logdata = _iter_log_data(ls)
             tags, applicable = categorize.categorize(job.project.slug, rules, logdata)
             tags_by_step[ls.step_id].update(tags)
             _incr("failing-log-processed")
@@ -240,17 +268,17 @@ def _categorize_step_logs(job):
     return tags_by_step
 
 
-def _get_job_failure_reasons_by_jobstep(job):
+def _get_failure_reasons_by_jobstep(job_ids):
     """Return dict mapping jobstep ids to names of all associated FailureReasons.
     Args:
-        job (Job): The job to return failure reasons for.
+        job_ids (List[UUID]): The jobs to return failure reasons for.
     Returns:
         dict: A dict mapping from jobstep id to a sorted list of failure reasons
     """
     reasons = [r for r in db.session.query(
                 FailureReason.reason, FailureReason.step_id
             ).filter(
-                FailureReason.job_id == job.id
+                FailureReason.job_id.in_(job_ids)
             ).all()]
 
     reasons_by_jobsteps = defaultdict(list)
@@ -279,22 +307,20 @@ def _get_failing_log_sources(job):
     ).order_by(JobStep.date_created))
 
 
-def _get_log_data(source):
-    queryset = LogChunk.query.filter(
-        LogChunk.source_id == source.id,
-    ).order_by(LogChunk.offset.asc())
-    return ''.join(l.text for l in queryset)
+def _iter_log_data(source):
+    # type: (LogSource) -> Iterator[unicode]
+    return log_segments.iter_text(source)
 
 
 def _get_rules():
-    # type: () -> List[Tuple[str, str, str]]
+    # type: () -> categorize.RuleSet
     """Return the current rules to be used with categorize.categorize.
-    NB: Reloads the rules file at each call.
+    NB: Reloads the rules file whenever it changes.
     """
     rules_file = current_app.config.get('CATEGORIZE_RULES_FILE')
     if not rules_file:
         return None
-    return categorize.load_rules(rules_file)
+    return categorize.load_ruleset(rules_file)
 
 
 def _incr(name):
@@ -6,10 +6,11 @@ from typing import List, Set  # NOQA
 
 from flask import current_app
 from changes.api.build_index import BuildIndexAPIView
+from changes.lib.trigger_index import get_trigger_index
 from changes.models.project import (
     Project, ProjectStatus, ProjectOptionsHelper)
 from changes.models.revision import Revision
-from changes.utils.project_trigger import files_changed_should_trigger_project
+from changes.utils.project_trigger import files_changed_should_trigger_project, get_file_whitelist
 from changes.vcs.base import ConcurrentUpdateError, UnknownRevision
 
 
@@ -74,9 +75,7 @@ class CommitTrigger(object):
             'build.file-whitelist',
         ])
 
-        files_changed = self.get_changed_files()
-
-        projects_to_build = []
+        candidates = []
         for project in project_list:
             if options[project.id].get('build.commit-trigger', '1') != '1':
                 self.logger.info('build.commit-trigger is disabled for project %s', project.slug)
@@ -86,8 +85,27 @@ class CommitTrigger(object):
             if not revision.should_build_branch(branch_names):
                 self.logger.info('No branches matched build.branch-names for project %s', project.slug)
                 continue
+            candidates.append(project)
+        if not candidates:
+            return
 
-            if not files_changed_should_trigger_project(files_changed, project, options[project.id], revision.sha):
+        files_changed = self.get_changed_files()
+
+        # the index covers all the repository's projects, so it's reused
+        # whichever branch a revision is on
+        trigger_index = get_trigger_index(self.revision.repository_id, {
+            project.id: get_file_whitelist(options[project.id]) for project in project_list
+        })
+        whitelisted_files = trigger_index.match(files_changed)
+
+        projects_to_build = []
+        for project in candidates:
+            if project.id in trigger_index.restricted:
+                whitelisted = whitelisted_files.get(project.id, [])
+            else:
+                whitelisted = files_changed
+            if not files_changed_should_trigger_project(files_changed, project, options[project.id], revision.sha,
+                                                        whitelisted_files=whitelisted):
                 self.logger.info('No changed files matched project trigger for project %s', project.slug)
                 continue
             projects_to_build.append(project)
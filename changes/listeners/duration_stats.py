@@ -0,0 +1,20 @@
+"""Folds finished builds' test durations into their project's sharding stats.
+"""
+
+from typing import Any  # NOQA
+from uuid import UUID  # NOQA
+
+from changes.config import db
+from changes.lib import duration_stats
+from changes.models.build import Build
+
+
+def build_finished_handler(build_id, **kwargs):
+    # type: (UUID, **Any) -> None
+    build = Build.query.get(build_id)
+    if build is None:
+        return
+
+    duration_stats.record_build(build)
+    # release the stats' row locks
+    db.session.commit()
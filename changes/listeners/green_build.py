@@ -12,6 +12,7 @@ from sqlalchemy.orm import joinedload
 from changes.config import db
 from changes.constants import Result
 from changes.db.utils import create_or_update
+from changes.lib import notifications
 from changes.models.event import Event, EventType
 from changes.models.latest_green_build import LatestGreenBuild
 from changes.models.project import ProjectOption
@@ -121,8 +122,11 @@ def revision_result_updated_handler(revision_result_id, **kwargs):
     committed_timestamp_sec = calendar.timegm(source.revision.date_committed.utctimetuple())
 
     logging.info('Making green_build request to %s', url)
-    try:
-        requests.post(url, auth=auth, timeout=10, data={
+    notifications.send('green_build', {
+        'build_id': build.id.hex,
+        'project': project,
+        'release_id': release_id,
+        'form': {
             'project': project,
             'id': release_id,
             'build_url': build_web_uri('/projects/{0}/builds/{1}/'.format(
@@ -132,33 +136,52 @@ def revision_result_updated_handler(revision_result_id, **kwargs):
             'author_email': source.revision.author.email,
             'commit_timestamp': committed_timestamp_sec,
             'revision_message': source.revision.message,
-        }).raise_for_status()
-    except HTTPError as ex:
+        },
+    })
+
+
+def _is_conflict(exc):
+    # NOTE: We compare `ex.response` to None explicitly because any non-200 response
+    # evaluates to `False`.
+    return isinstance(exc, HTTPError) and exc.response is not None and exc.response.status_code == 409
+
+
+class GreenBuildSender(notifications.Sender):
+    def deliver(self, batch):
+        green_build, = batch
+        requests.post(current_app.config['GREEN_BUILD_URL'], auth=current_app.config['GREEN_BUILD_AUTH'],
+                      timeout=10, data=green_build['form']).raise_for_status()
+
+    def should_retry(self, exc):
         # Conflicts aren't necessarily failures; some green build receivers
         # report conflict if they see out-of-order results (not uncommon in Changes).
-        # We want to track those situations independently of other non-success responses.
-        # NOTE: We compare `ex.response` to None explicitly because any non-200 response
-        # evaluates to `False`.
-        if ex.response is not None and ex.response.status_code == 409:
+        return not _is_conflict(exc)
+
+    def supersede_key(self, data):
+        # A retried green build mustn't reach the receiver after a newer one
+        # for the project.
+        return data['project']
+
+    def delivered(self, data):
+        _record_green_build_status(data['build_id'], 'success')
+
+    def failed(self, data, exc):
+        # We want to track conflicts independently of other non-success responses.
+        if _is_conflict(exc):
             logger.warning("Conflict when reporting green build", extra={
                 'data': {
-                    'project': project,
-                    'release_id': release_id,
-                    'build_id': build.id.hex,
+                    'project': data['project'],
+                    'release_id': data['release_id'],
+                    'build_id': data['build_id'],
                 }
             })
-        else:
-            logger.exception('Failed to report green build')
-        status = 'fail'
-    except Exception:
-        logger.exception('Failed to report green build')
-        status = 'fail'
-    else:
-        status = 'success'
+        _record_green_build_status(data['build_id'], 'fail')
+
 
+def _record_green_build_status(build_id, status):
     create_or_update(Event, where={
         'type': EventType.green_build,
-        'item_id': build.id,
+        'item_id': build_id,
     }, values={
         'data': {
             'status': status,
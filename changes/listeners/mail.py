@@ -13,12 +13,10 @@ from typing import List  # NOQA
 from changes.config import db, mail
 from changes.constants import Result, Status
 from changes.db.utils import try_create
-from changes.lib import build_context_lib, build_type
+from changes.lib import build_context_lib, build_type, notifications
 from changes.lib.build_context_lib import CollectionContext  # NOQA
 from changes.models.event import Event, EventType
 from changes.models.build import Build
-from changes.models.job import Job
-from changes.models.jobplan import JobPlan
 from changes.models.project import ProjectOption
 
 
@@ -64,7 +62,13 @@ class MailNotificationHandler(object):
                 build.collection_id, build.id.hex)
             return
 
-        mail.send(msg)
+        notifications.send('mail', {
+            'subject': msg.subject,
+            'recipients': msg.recipients,
+            'body': msg.body,
+            'html': unicode(msg.html),
+            'extra_headers': msg.extra_headers,
+        })
 
     def get_msg(self, builds):
         # type: (List[Build]) -> Message
@@ -173,10 +177,9 @@ class MailNotificationHandler(object):
 
         # Get options for all failing jobs.
         jobs_options = []
-        for job in list(Job.query.filter(Job.build_id == build.id)):
-            if job.result != Result.passed:
-                jobs_options.append(dict(
-                    build_options, **self.get_job_options(job)))
+        for job in build_context_lib.get_build_snapshot(build).jobs:
+            if job['result'] != Result.passed.name:
+                jobs_options.append(dict(build_options, **job['options']))
 
         # Merge all options.
 
@@ -206,14 +209,11 @@ class MailNotificationHandler(object):
                 )
         return merged_options
 
-    def get_job_options(self, job):
-        jobplan = JobPlan.query.filter(
-            JobPlan.job_id == job.id,
-        ).first()
-        options = {}
-        if jobplan and 'snapshot' in jobplan.data:
-            options = jobplan.data['snapshot']['options']
-        return options
+
+class MailSender(notifications.Sender):
+    def deliver(self, batch):
+        message, = batch
+        mail.send(Message(**message))
 
 
 def build_finished_handler(build_id, *args, **kwargs):
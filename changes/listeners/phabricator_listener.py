@@ -7,21 +7,17 @@ from flask import current_app
 from changes.config import db
 from changes.constants import Result, Status
 from changes.db.utils import try_create
-from changes.lib import build_context_lib, build_type
+from changes.lib import base_commit_failures, build_context_lib, build_type, notifications
 from changes.lib.coverage import get_coverage_by_build_id, merged_coverage_data
 from changes.models.build import Build
 from changes.models.option import ItemOption
 from changes.models.project import ProjectOption, ProjectOptionsHelper
 from changes.models.repository import RepositoryBackend
-from changes.models.source import Source
 from changes.models.event import Event, EventType
-from changes.models.job import Job
-from changes.models.test import TestCase
 from changes.utils.http import build_web_uri
-from changes.utils.phabricator_utils import logger, PhabricatorClient, post_comment
+from changes.utils.phabricator_utils import logger, PhabricatorClient
 from changes.vcs.git import GitVcs
 from changes.vcs.hg import MercurialVcs
-from sqlalchemy.orm import joinedload
 
 # Copied from api/serializer/models/repository.py
 DEFAULT_BRANCHES = {
@@ -206,7 +202,7 @@ def build_finished_handler(build_id, **kwargs):
         message += '(NOTE) Passing builds:\n\n'
         message += '\n'.join([_get_message_for_build_context(x) for x in good_builds])
 
-    post_comment(target, message, phab)
+    notifications.send('phabricator', {'target': target, 'message': message})
 
 
 def _get_message_for_build_context(build_context):
@@ -227,37 +223,15 @@ def _get_message_for_build_context(build_context):
 def get_test_failures_in_base_commit(build):
     """
     Returns: None if there was a problem locating the base commit or base build.
-        Otherwise a dictionary of test names that failed in the most recent base
-        build.
+        Otherwise the name hashes (TestCase.name_sha) of the tests that failed
+        in the most recent base build.
     """
-    commit_sources = [s.id for s in Source.query.filter(
-            Source.revision_sha == build.source.revision_sha) if s.is_commit()]
-
-    base_builds = Build.query.filter(
-        Build.source_id.in_(commit_sources),
-        Build.project_id == build.project_id
-    )
-    if not list(base_builds):
-        logger.info("Unable to find base build for %s",
-                    build.source.revision_sha)
-        return None
-
-    jobs = list(Job.query.filter(
-        Job.build_id.in_([b.id for b in base_builds])
-    ))
-    if not list(jobs):
-        logger.info("Unable to find jobs matching build for %s",
+    failures = base_commit_failures.get_failing_test_hashes(
+        build.project_id, build.source.revision_sha)
+    if failures is None:
+        logger.info("Unable to find base build with jobs for %s",
                     build.source.revision_sha)
-        return None
-
-    test_failures = TestCase.query.options(
-        joinedload('job', innerjoin=True),
-    ).filter(
-        TestCase.job_id.in_([j.id for j in jobs]),
-        TestCase.result == Result.failed,
-    )
-
-    return {test.name for test in test_failures}
+    return failures
 
 
 def _generate_remarkup_table_for_tests(build, tests):
@@ -307,8 +281,8 @@ def get_test_failure_remarkup(build, tests):
         message += _generate_remarkup_table_for_tests(build, total_failures)
 
     else:
-        new_failures = [t for t in tests if t.name not in base_commit_failures]
-        failures_in_parent = [t for t in tests if t.name in base_commit_failures]
+        new_failures = [t for t in tests if t.name_sha not in base_commit_failures]
+        failures_in_parent = [t for t in tests if t.name_sha in base_commit_failures]
         message = ' There were {new_failures} new [test failures]({link})'.format(
             new_failures=len(new_failures),
             link=build_web_uri('/build_tests/{0}/'.format(build.id.hex))
@@ -7,7 +7,7 @@ from uuid import UUID  # NOQA
 from changes.config import db
 from changes.constants import ResultSource
 from changes.db.utils import create_or_update
-from changes.jobs.signals import fire_signal
+from changes.jobs.signals import dispatch_signal
 from changes.lib.build_type import is_any_commit_build
 from changes.lib.revision_lib import get_child_revisions, get_latest_finished_build_for_revision
 from changes.models.bazeltarget import BazelTarget
@@ -123,7 +123,7 @@ def create_or_update_revision_result(revision_sha, project_id, propagation_limit
     })
 
     db.session.commit()
-    fire_signal.delay(
+    dispatch_signal(
         signal='revision_result.updated',
         kwargs={'revision_result_id': revision_result.id.hex},
     )
@@ -0,0 +1,50 @@
+from __future__ import absolute_import
+
+import uuid
+
+from datetime import datetime
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, LargeBinary, String
+from sqlalchemy.orm import deferred, relationship
+from sqlalchemy.schema import UniqueConstraint
+
+from changes.config import db
+from changes.db.types.guid import GUID
+
+
+class DurationStats(db.Model):
+    """
+    Smoothed durations of a project's tests (or Bazel targets), kept up to
+    date as its commit builds finish, so that expanders can shard them
+    without reading every test of a recent build (see
+    changes.lib.duration_stats, which owns the format of the blobs).
+
+    summary holds what sharding needs: durations by normalized name, for
+    tests and groups of tests alike. state holds the per-test values that
+    each build is folded into, and is only loaded when updating.
+    """
+    __tablename__ = 'durationstats'
+    __table_args__ = (
+        UniqueConstraint('project_id', 'kind', name='unq_durationstats_project_kind'),
+    )
+
+    id = Column(GUID, primary_key=True, default=uuid.uuid4)
+    project_id = Column(GUID, ForeignKey('project.id', ondelete="CASCADE"), nullable=False)
+    # 'tests' or 'targets'
+    kind = Column(String(16), nullable=False)
+    # how many builds have been folded in, and the latest of them
+    num_builds = Column(Integer, default=0, server_default='0', nullable=False)
+    last_build_id = Column(GUID, ForeignKey('build.id', ondelete="SET NULL"))
+    summary = Column(LargeBinary, nullable=False)
+    state = deferred(Column(LargeBinary, nullable=False))
+    date_modified = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    project = relationship('Project')
+
+    def __init__(self, **kwargs):
+        super(DurationStats, self).__init__(**kwargs)
+        if self.id is None:
+            self.id = uuid.uuid4()
+        if self.num_builds is None:
+            self.num_builds = 0
+        if self.date_modified is None:
+            self.date_modified = datetime.utcnow()
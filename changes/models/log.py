@@ -1,7 +1,7 @@
 import uuid
 
 from datetime import datetime
-from sqlalchemy import Boolean, Column, DateTime, ForeignKey, String, Text, Integer
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, LargeBinary, String, Text, Integer
 from sqlalchemy.orm import backref, relationship
 from sqlalchemy.schema import Index, UniqueConstraint
 
@@ -20,6 +20,11 @@ class LogSource(db.Model):
 
     If we're using artifact store to store/host the log file, in_artifact_store will be set to true.
     No logchunk entries will be associated with such logsources.
+
+    Once a log is complete, its logchunks can be sealed into compressed
+    logsegments (see changes.lib.log_segments). sealed_size is the length of
+    the text that's been sealed: it's in logsegments, and anything after it
+    is still in logchunks.
     """
     __tablename__ = 'logsource'
     __table_args__ = (
@@ -36,6 +41,7 @@ class LogSource(db.Model):
     name = Column(String(64), nullable=False)
     date_created = Column(DateTime, default=datetime.utcnow)
     in_artifact_store = Column(Boolean, default=False)
+    sealed_size = Column(Integer, default=0, server_default='0', nullable=False)
 
     job = relationship('Job')
     project = relationship('Project')
@@ -47,6 +53,8 @@ class LogSource(db.Model):
             self.id = uuid.uuid4()
         if self.date_created is None:
             self.date_created = datetime.utcnow()
+        if self.sealed_size is None:
+            self.sealed_size = 0
 
     def is_infrastructural(self):
         """
@@ -107,3 +115,36 @@ class LogChunk(db.Model):
             self.id = uuid.uuid4()
         if self.date_created is None:
             self.date_created = datetime.utcnow()
+
+
+class LogSegment(db.Model):
+    """
+    A run of contiguous logchunks of a logsource, sealed into a single
+    compressed blob. offset and size are those of the text it holds, so
+    (like logchunks) the segments needed for part of a log can be found by
+    offset without decompressing anything.
+    """
+    __tablename__ = 'logsegment'
+    __table_args__ = (
+        UniqueConstraint('source_id', 'offset', name='unq_logsegment_source_offset'),
+    )
+
+    id = Column(GUID, primary_key=True, default=uuid.uuid4)
+    source_id = Column(GUID, ForeignKey('logsource.id', ondelete="CASCADE"), nullable=False)
+    # offset is sum(s.size for s in segments_before_this)
+    offset = Column(Integer, nullable=False)
+    # size is len(text), i.e. the uncompressed size in characters
+    size = Column(Integer, nullable=False)
+    # the compression used for data, e.g. 'zlib'
+    codec = Column(String(16), nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    date_created = Column(DateTime, default=datetime.utcnow)
+
+    source = relationship('LogSource')
+
+    def __init__(self, **kwargs):
+        super(LogSegment, self).__init__(**kwargs)
+        if self.id is None:
+            self.id = uuid.uuid4()
+        if self.date_created is None:
+            self.date_created = datetime.utcnow()
@@ -0,0 +1,68 @@
+from __future__ import absolute_import
+
+import uuid
+
+from datetime import datetime
+from enum import Enum
+from sqlalchemy import Column, DateTime, Integer, String, Text, text
+from sqlalchemy.schema import Index
+
+from changes.config import db
+from changes.db.types.enum import Enum as EnumType
+from changes.db.types.guid import GUID
+from changes.db.types.json import JSONEncodedDict
+from changes.db.utils import model_repr
+
+
+class NotificationStatus(Enum):
+    pending = 1
+    sent = 2
+    failed = 3
+    # a later notification with the same Sender.supersede_key was sent
+    superseded = 4
+
+
+class Notification(db.Model):
+    """
+    A message for another service (an email, a Phabricator comment, analytics
+    records...) waiting in the outbox to be delivered, or that was. See
+    changes.lib.notifications.
+
+    `destination` names the Sender that delivers it, and `data` is what the
+    Sender needs to. A pending notification is delivered once
+    date_next_attempt has passed; a worker delivering it pushes that forward,
+    so that it isn't picked up twice, and failed deliveries push it further
+    to retry later.
+    """
+    __tablename__ = 'notification'
+    __table_args__ = (
+        # for finding what's due; 1 is NotificationStatus.pending
+        Index('idx_notification_pending', 'destination', 'date_next_attempt',
+              postgresql_where=text('status = 1')),
+        Index('idx_notification_date_created', 'date_created'),
+    )
+
+    id = Column(GUID, primary_key=True, default=uuid.uuid4)
+    destination = Column(String(32), nullable=False)
+    data = Column(JSONEncodedDict, nullable=False)
+    status = Column(EnumType(NotificationStatus), nullable=False, default=NotificationStatus.pending)
+    num_attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text)
+    date_created = Column(DateTime, default=datetime.utcnow, nullable=False)
+    date_next_attempt = Column(DateTime, default=datetime.utcnow, nullable=False)
+    date_sent = Column(DateTime)
+
+    __repr__ = model_repr('destination', 'status')
+
+    def __init__(self, **kwargs):
+        super(Notification, self).__init__(**kwargs)
+        if self.id is None:
+            self.id = uuid.uuid4()
+        if self.status is None:
+            self.status = NotificationStatus.pending
+        if self.num_attempts is None:
+            self.num_attempts = 0
+        if self.date_created is None:
+            self.date_created = datetime.utcnow()
+        if self.date_next_attempt is None:
+            self.date_next_attempt = self.date_created
@@ -3,7 +3,7 @@ from __future__ import absolute_import
 import uuid
 
 from datetime import datetime
-from sqlalchemy import Column, DateTime, String, Integer
+from sqlalchemy import Column, DateTime, String, Integer, text
 from sqlalchemy.schema import Index, UniqueConstraint
 
 from changes.config import db
@@ -43,6 +43,10 @@ class Task(db.Model):
         Index('idx_task_date_created', 'date_created'),
         UniqueConstraint('task_name', 'parent_id', 'child_id', name='unq_task_entity'),
         Index('idx_task_status', 'status'),
+        # for finding stale tasks (see changes.jobs.cleanup_tasks); 3 is
+        # Status.finished
+        Index('idx_task_unfinished_date_modified', 'date_modified', 'id',
+              postgresql_where=text('status != 3')),
     )
 
     id = Column(GUID, primary_key=True, default=uuid.uuid4)
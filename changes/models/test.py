@@ -7,7 +7,7 @@ from datetime import datetime
 from hashlib import sha1
 from sqlalchemy import Column, DateTime, ForeignKey, String, Text, Integer
 from sqlalchemy.event import listen
-from sqlalchemy.orm import deferred, relationship
+from sqlalchemy.orm import Query, deferred, relationship  # NOQA
 from sqlalchemy.schema import UniqueConstraint, Index
 
 from changes.config import db
@@ -15,6 +15,17 @@ from changes.constants import Result
 from changes.db.types.enum import Enum
 from changes.db.types.guid import GUID
 from changes.db.utils import model_repr
+from changes.lib.partitioning import RangePartitioning
+
+# How the test tables are partitioned, once converted with `bin/db
+# partition-tests`. The tables of test messages and artifacts come first, as
+# their rows belong to tests.
+TEST_PARTITIONING = RangePartitioning('test')
+TEST_PARTITIONINGS = (
+    RangePartitioning('testmessage', parent=('test', 'test_id')),
+    RangePartitioning('testartifact'),
+    TEST_PARTITIONING,
+)
 
 
 class TestCase(db.Model):
@@ -126,3 +137,24 @@ def set_name_sha(target, value, oldvalue, initiator):
 
 
 listen(TestCase.name, 'set', set_name_sha, retval=False)
+
+
+def delete_test_children(tests):
+    # type: (Query) -> None
+    """
+    Deletes the messages and artifacts of the tests `tests` (a TestCase
+    query) selects. Call it before deleting those tests, or anything deletes
+    cascade to them from (jobs, builds and projects): partitioned tables
+    can't be referenced by foreign keys, so once the test table is
+    partitioned, those deletes don't cascade to these anymore.
+    """
+    from changes.models.testartifact import TestArtifact
+    from changes.models.testmessage import TestMessage
+
+    if not TEST_PARTITIONING.is_partitioned():
+        return
+    test_ids = tests.with_entities(TestCase.id).subquery()
+    for model in (TestMessage, TestArtifact):
+        db.session.query(model).filter(
+            model.test_id.in_(test_ids),
+        ).delete(synchronize_session=False)
@@ -1,6 +1,7 @@
 import uuid
 
-from sqlalchemy import Column, ForeignKey, Integer, Text
+from datetime import datetime
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, Text
 from sqlalchemy.orm import relationship
 from sqlalchemy.schema import Index
 
@@ -27,6 +28,8 @@ class TestMessage(db.Model):
     label = Column(Text, nullable=False)
     start_offset = Column(Integer, default=0, nullable=False)
     length = Column(Integer, nullable=False)
+    # what the table is partitioned by (see changes.jobs.delete_old_data)
+    date_created = Column(DateTime, default=datetime.utcnow)
 
     test = relationship('TestCase', backref='messages')
     artifact = relationship('Artifact')
@@ -35,6 +38,8 @@ class TestMessage(db.Model):
         super(TestMessage, self).__init__(**kwargs)
         if self.id is None:
             self.id = uuid.uuid4()
+        if self.date_created is None:
+            self.date_created = datetime.utcnow()
 
     def get_message(self):
         return self.artifact.file.get_file(self.start_offset, self.length).read()
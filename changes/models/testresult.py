@@ -16,7 +16,7 @@ from changes.db.utils import create_or_update
 from changes.lib.artifact_store_lib import ArtifactStoreClient
 from changes.models.failurereason import FailureReason
 from changes.models.itemstat import ItemStat
-from changes.models.test import TestCase
+from changes.models.test import TEST_PARTITIONING, TestCase, delete_test_children
 from changes.models.testartifact import TestArtifact
 from changes.models.testmessage import TestMessage
 
@@ -92,9 +92,11 @@ class TestResultManager(object):
         """
         Removes all existing test data from this job.
         """
-        TestCase.query.filter(
+        tests = TestCase.query.filter(
             TestCase.step_id == self.step.id,
-        ).delete(synchronize_session=False)
+        )
+        delete_test_children(tests)
+        tests.delete(synchronize_session=False)
 
     def save(self, test_list):
         if not test_list:
@@ -112,6 +114,13 @@ class TestResultManager(object):
         bad_duration_test_name = None
         bad_duration_value = None
 
+        # Once the test table is partitioned by date, its unique key on
+        # (job_id, label_sha) includes date_created, so it only catches
+        # duplicate tests with the same date: give them all the job's.
+        date_created = None
+        if TEST_PARTITIONING.is_partitioned():
+            date_created = job.date_created
+
         for test in test_list:
             duration = test.duration
             # Maximum value for the Integer column type
@@ -132,7 +141,7 @@ class TestResultManager(object):
                 duration=duration,
                 message=test.message,
                 result=test.result,
-                date_created=test.date_created,
+                date_created=date_created or test.date_created,
                 reruns=test.reruns,
                 owner=test.owner,
             )
@@ -5,12 +5,12 @@ import logging
 from datetime import datetime, timedelta
 from functools import wraps
 from threading import local, Lock
-from uuid import uuid4
+from uuid import UUID, uuid4
 from collections import Counter
 
 from changes.config import db, queue, statsreporter
 from changes.constants import Result, Status
-from changes.db.utils import get_or_create
+from changes.db.utils import bulk_insert, get_or_create
 from changes.models.task import Task
 from changes.utils.locking import lock
 
@@ -323,6 +323,44 @@ class TrackedTask(local):
         if created:
             self._report_created()
 
+    def create_many(self, kwargs_list):
+        """
+        Adds the Tasks for many new tasks at once, with bulk_insert (so their
+        task_ids mustn't exist yet), without enqueueing them. Returns them as
+        (name, kwargs) pairs for queue.delay_many once they're committed.
+
+        >>> tasks = sync_job_step.create_many([{
+        >>>     'step_id': step.id.hex,
+        >>>     'task_id': step.id.hex,
+        >>>     'parent_task_id': job.id.hex,
+        >>> } for step in steps])
+        >>> db.session.commit()
+        >>> queue.delay_many(tasks)
+        """
+        tasks = []
+        rows = []
+        for kwargs in kwargs_list:
+            kwargs = dict(kwargs)
+            kwargs.setdefault('task_id', uuid4().hex)
+            parent_task_id = kwargs.get('parent_task_id')
+            rows.append({
+                'task_name': self.task_name,
+                'task_id': UUID(kwargs['task_id']),
+                'parent_id': UUID(parent_task_id) if parent_task_id else None,
+                'data': {
+                    'kwargs': dict(
+                        (k, v) for k, v in kwargs.iteritems()
+                        if k not in ('task_id', 'parent_task_id')
+                    ),
+                },
+                'status': Status.queued,
+            })
+            tasks.append((self.task_name, kwargs))
+        bulk_insert(Task, rows)
+        if rows:
+            statsreporter.stats().incr('new_task_created_' + self.task_name, len(rows))
+        return tasks
+
     def delay(self, **kwargs):
         """
         Enqueue this task.
@@ -2,12 +2,13 @@ from __future__ import absolute_import, division
 
 from collections import defaultdict
 from datetime import datetime, timedelta
-from sqlalchemy.sql import func
+from sqlalchemy.sql import and_, case, func, or_
 
 from changes.config import db
 from changes.constants import Status, Result
 from changes.models.build import Build
 from changes.models.failurereason import FailureReason
+from changes.models.job import Job
 from changes.models.jobstep import JobStep
 from changes.models.test import TestCase
 from changes.models.source import Source
@@ -46,10 +47,12 @@ class BuildReport(object):
             previous_end_period = start_period
         previous_start_period = previous_end_period - days_delta
 
-        current_results = self.get_project_stats(
-            start_period, end_period)
-        previous_results = self.get_project_stats(
-            previous_start_period, previous_end_period)
+        periods = [
+            (start_period, end_period),
+            (previous_start_period, previous_end_period),
+        ]
+
+        current_results, previous_results = self.get_project_stats(periods)
 
         for project, stats in current_results.items():
             # exclude projects that had no builds in this period
@@ -90,10 +93,7 @@ class BuildReport(object):
                 x[0].name,
             ))
 
-        current_failure_stats = self.get_failure_stats(
-            start_period, end_period)
-        previous_failure_stats = self.get_failure_stats(
-            previous_start_period, previous_end_period)
+        current_failure_stats, previous_failure_stats = self.get_failure_stats(periods)
         failure_stats = []
         for stat_name, current_stat_value in current_failure_stats['reasons'].iteritems():
             previous_stat_value = previous_failure_stats['reasons'].get(stat_name, 0)
@@ -131,40 +131,51 @@ class BuildReport(object):
             },
         }
 
-    def get_project_stats(self, start_period, end_period):
+    def get_project_stats(self, periods):
+        """
+        Returns build statistics per project for each of the given
+        [start, end) periods, from a single query.
+        """
         projects_by_id = dict((p.id, p) for p in self.projects)
         project_ids = projects_by_id.keys()
 
         # fetch overall build statistics per project
-        query = db.session.query(
-            Build.project_id, Build.result,
-            func.count(Build.id).label('num'),
-            func.avg(Build.duration).label('duration'),
+        builds = db.session.query(
+            _period(Build.date_created, periods).label('period'),
+            Build.project_id, Build.result, Build.id, Build.duration,
         ).join(
             Source, Source.id == Build.source_id,
         ).filter(
             Build.project_id.in_(project_ids),
             Build.status == Status.finished,
             Build.result.in_([Result.failed, Result.passed]),
-            Build.date_created >= start_period,
-            Build.date_created < end_period,
+            _in_periods(Build.date_created, periods),
             *build_type.get_any_commit_build_filters()
-        ).group_by(Build.project_id, Build.result)
-
-        project_results = {}
-        for project in self.projects:
-            project_results[project] = {
-                'total_builds': 0,
-                'green_builds': 0,
-                'green_percent': None,
-                'avg_duration': 0,
-                'link': build_web_uri('/project/{0}/'.format(project.slug)),
-            }
-
-        for project_id, result, num_builds, duration in query:
+        ).subquery()
+        query = db.session.query(
+            builds.c.period, builds.c.project_id, builds.c.result,
+            func.count(builds.c.id).label('num'),
+            func.avg(builds.c.duration).label('duration'),
+        ).group_by(builds.c.period, builds.c.project_id, builds.c.result)
+
+        results = []
+        for _ in periods:
+            project_results = {}
+            for project in self.projects:
+                project_results[project] = {
+                    'total_builds': 0,
+                    'green_builds': 0,
+                    'green_percent': None,
+                    'avg_duration': 0,
+                    'link': build_web_uri('/project/{0}/'.format(project.slug)),
+                }
+            results.append(project_results)
+
+        for period, project_id, result, num_builds, duration in query:
             if duration is None:
                 duration = 0
 
+            project_results = results[period]
             project = projects_by_id[project_id]
 
             if result == Result.passed:
@@ -174,40 +185,30 @@ class BuildReport(object):
             if result == Result.passed:
                 project_results[project]['green_builds'] += num_builds
 
-        for project, stats in project_results.iteritems():
-            if stats['total_builds']:
-                stats['green_percent'] = percent(stats['green_builds'], stats['total_builds'])
-            else:
-                stats['green_percent'] = None
-
-        return project_results
-
-    def get_failure_stats(self, start_period, end_period):
-        failure_stats = {
-            'total': 0,
-            'reasons': defaultdict(int),
-        }
-        for project in self.projects:
-            for stat, value in self.get_failure_stats_for_project(
-                    project, start_period, end_period).iteritems():
-                failure_stats['reasons'][stat] += value
-
-        failure_stats['total'] = Build.query.join(
-            Source, Source.id == Build.source_id,
-        ).filter(
-            Build.project_id.in_(p.id for p in self.projects),
-            Build.status == Status.finished,
-            Build.result == Result.failed,
-            Build.date_created >= start_period,
-            Build.date_created < end_period,
-            *build_type.get_any_commit_build_filters()
-        ).count()
-
-        return failure_stats
-
-    def get_failure_stats_for_project(self, project, start_period, end_period):
-        base_query = db.session.query(
-            FailureReason.reason, FailureReason.build_id
+        for project_results in results:
+            for project, stats in project_results.iteritems():
+                if stats['total_builds']:
+                    stats['green_percent'] = percent(stats['green_builds'], stats['total_builds'])
+                else:
+                    stats['green_percent'] = None
+
+        return results
+
+    def get_failure_stats(self, periods):
+        """
+        Returns the number of failed builds and of builds failing for each
+        reason, across all projects, for each of the given [start, end)
+        periods.
+        """
+        project_ids = [p.id for p in self.projects]
+        results = [{'total': 0, 'reasons': defaultdict(int)} for _ in periods]
+
+        # a build counts once for each reason, however many of its steps failed for it
+        reasons = db.session.query(
+            _period(Build.date_created, periods).label('period'),
+            FailureReason.reason, FailureReason.build_id,
+        ).select_from(
+            FailureReason,
         ).join(
             Build, Build.id == FailureReason.build_id,
         ).join(
@@ -215,52 +216,61 @@ class BuildReport(object):
         ).join(
             JobStep, JobStep.id == FailureReason.step_id,
         ).filter(
-            Build.project_id == project.id,
-            Build.date_created >= start_period,
-            Build.date_created < end_period,
+            Build.project_id.in_(project_ids),
+            _in_periods(Build.date_created, periods),
             JobStep.replacement_id.is_(None),
             *build_type.get_any_commit_build_filters()
-        ).group_by(
-            FailureReason.reason, FailureReason.build_id
+        ).distinct().subquery()
+
+        for period, reason, num_builds in db.session.query(
+            reasons.c.period, reasons.c.reason, func.count(),
+        ).group_by(reasons.c.period, reasons.c.reason):
+            results[period]['reasons'][reason] = num_builds
+
+        failed_builds = db.session.query(
+            _period(Build.date_created, periods).label('period'),
+        ).join(
+            Source, Source.id == Build.source_id,
+        ).filter(
+            Build.project_id.in_(project_ids),
+            Build.status == Status.finished,
+            Build.result == Result.failed,
+            _in_periods(Build.date_created, periods),
+            *build_type.get_any_commit_build_filters()
         ).subquery()
 
-        return dict(
-            db.session.query(
-                base_query.c.reason,
-                func.count(),
-            ).group_by(
-                base_query.c.reason,
-            )
-        )
+        for period, num_builds in db.session.query(
+            failed_builds.c.period, func.count(),
+        ).group_by(failed_builds.c.period):
+            results[period]['total'] = num_builds
+
+        return results
 
     def get_slow_tests(self, start_period, end_period):
-        slow_tests = []
-        for project in self.projects:
-            slow_tests.extend(self.get_slow_tests_for_project(
-                project, start_period, end_period))
-        slow_tests.sort(key=lambda x: x['duration_raw'], reverse=True)
-        return slow_tests[:MAX_SLOW_TESTS]
-
-    def get_slow_tests_for_project(self, project, start_period, end_period):
-        latest_build = Build.query.filter(
-            Build.project == project,
+        """
+        Returns the slowest tests of the latest passing build of each project
+        in the period.
+        """
+        projects_by_id = dict((p.id, p) for p in self.projects)
+
+        latest_builds = db.session.query(
+            Build.id,
+        ).filter(
+            Build.project_id.in_(projects_by_id.keys()),
             Build.status == Status.finished,
             Build.result == Result.passed,
             Build.date_created >= start_period,
             Build.date_created < end_period,
+        ).distinct(
+            Build.project_id,
         ).order_by(
-            Build.date_created.desc(),
-        ).limit(1).first()
-
-        if not latest_build:
-            return []
-
-        job_list = list(latest_build.jobs)
-        if not job_list:
-            return []
+            Build.project_id, Build.date_created.desc(),
+        ).subquery()
 
-        queryset = TestCase.query.filter(
-            TestCase.job_id.in_(j.id for j in job_list),
+        queryset = TestCase.query.join(
+            Job, Job.id == TestCase.job_id,
+        ).filter(
+            Job.build_id.in_(db.session.query(latest_builds.c.id)),
             TestCase.result == Result.passed,
             TestCase.date_created > start_period,
             TestCase.date_created <= end_period,
@@ -271,13 +281,25 @@ class BuildReport(object):
         slow_list = []
         for test in queryset:
             slow_list.append({
-                'project': project,
+                'project': projects_by_id[test.project_id],
                 'name': test.short_name,
                 'package': test.package,
                 'duration': '%.2f s' % (test.duration / 1000.0,),
                 'duration_raw': test.duration,
                 'link': build_web_uri('/project_test/{0}/{1}/'.format(
-                    project.id.hex, test.name_sha)),
+                    test.project_id.hex, test.name_sha)),
             })
 
         return slow_list
+
+
+def _period(column, periods):
+    """The index of the [start, end) period `column` falls in, if any."""
+    return case([
+        (and_(column >= start, column < end), n)
+        for n, (start, end) in enumerate(periods)
+    ])
+
+
+def _in_periods(column, periods):
+    return or_(*[and_(column >= start, column < end) for start, end in periods])
@@ -0,0 +1,127 @@
+from __future__ import absolute_import
+
+import json
+import re
+import urlparse
+
+from collections import Counter
+
+import responses
+
+
+class FakeJenkins(object):
+    """
+    A fake Jenkins master, for tests using `responses` (which must be
+    activated). Builds POSTed to it are queued, and its queue, queue items and
+    builds (by CHANGES_BID) can be looked up as the JenkinsBuilder does.
+
+    Requests made to it are counted in `requests`, by kind ('build', 'queue',
+    'queue_item' and 'find_build').
+
+    Args:
+        base_url (str): The URL of the master.
+        first_item_id (int): The id of the first item queued.
+        start_when_seen (bool): Whether to start queued builds as soon as
+            they've been listed in the queue once, as if an executor was free.
+    """
+
+    def __init__(self, base_url='http://jenkins.example.com', first_item_id=1, start_when_seen=False):
+        self.base_url = base_url
+        self.start_when_seen = start_when_seen
+        self.requests = Counter()
+        # newest first, like Jenkins
+        self.queue = []
+        self.next_item_id = first_item_id
+        # item id => (job name, CHANGES_BID, build number) of started builds
+        self.started = {}
+        self.next_build_no = Counter()
+
+        escaped_url = re.escape(base_url)
+        responses.add_callback(
+            responses.POST, re.compile(escaped_url + r'/job/([^/]+)/build$'),
+            callback=self._post_build)
+        responses.add_callback(
+            responses.GET, re.compile(escaped_url + r'/queue/api/json/(\?.*)?$'),
+            callback=self._get_queue)
+        responses.add_callback(
+            responses.GET, re.compile(escaped_url + r'/queue/item/(\d+)/api/json/$'),
+            callback=self._get_queue_item)
+        responses.add_callback(
+            responses.GET, re.compile(escaped_url + r'/job/([^/]+)/api/xml/\?'),
+            callback=self._find_build)
+
+    def enqueue(self, job_name, changes_bid, blocked=False):
+        """Queues a build of `job_name` and returns its queue item id."""
+        item_id = self.next_item_id
+        self.next_item_id += 1
+        self.queue.insert(0, {
+            'id': item_id,
+            'blocked': blocked,
+            'task': {'name': job_name},
+            'actions': [{'parameters': [{'name': 'CHANGES_BID', 'value': changes_bid}]}],
+        })
+        return item_id
+
+    def start(self, item_id):
+        """Starts the build of a queued item, returning its build number."""
+        item = self._get_item(item_id)
+        self.queue.remove(item)
+        job_name = item['task']['name']
+        self.next_build_no[job_name] += 1
+        build_no = self.next_build_no[job_name]
+        self.started[item_id] = (job_name, item['actions'][0]['parameters'][0]['value'], build_no)
+        return build_no
+
+    def _get_item(self, item_id):
+        for item in self.queue:
+            if item['id'] == item_id:
+                return item
+        return None
+
+    def _job_name(self, request):
+        return request.url[len(self.base_url):].split('/')[2]
+
+    def _post_build(self, request):
+        self.requests['build'] += 1
+        data = json.loads(urlparse.parse_qs(request.body)['json'][0])
+        params = dict((p['name'], p['value']) for p in data['parameter'])
+        self.enqueue(self._job_name(request), params['CHANGES_BID'])
+        return (201, {}, '')
+
+    def _get_queue(self, request):
+        self.requests['queue'] += 1
+        body = json.dumps({'items': self.queue})
+        if self.start_when_seen:
+            for item in list(self.queue):
+                self.start(item['id'])
+        return (200, {}, body)
+
+    def _get_queue_item(self, request):
+        self.requests['queue_item'] += 1
+        item_id = int(request.url.rstrip('/').split('/')[-3])
+        item = self._get_item(item_id)
+        if item is not None:
+            return (200, {}, json.dumps(dict(item, cancelled=False)))
+        if item_id in self.started:
+            job_name, _, build_no = self.started[item_id]
+            return (200, {}, json.dumps({
+                'id': item_id,
+                'blocked': False,
+                'cancelled': False,
+                'executable': {
+                    'number': build_no,
+                    'url': '{}/job/{}/{}/'.format(self.base_url, job_name, build_no),
+                },
+            }))
+        return (404, {}, '')
+
+    def _find_build(self, request):
+        self.requests['find_build'] += 1
+        job_name = self._job_name(request)
+        xpath = urlparse.parse_qs(urlparse.urlparse(request.url).query)['xpath'][0]
+        numbers = [
+            '<number>{}</number>'.format(build_no)
+            for name, changes_bid, build_no in sorted(self.started.values(), key=lambda b: -b[2])
+            if name == job_name and 'value="{}"'.format(changes_bid) in xpath
+        ]
+        return (200, {}, '<x>{}</x>'.format(''.join(numbers)))
@@ -0,0 +1,107 @@
+from __future__ import absolute_import
+
+import asyncore
+import smtpd
+import threading
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from collections import namedtuple
+from typing import List, Tuple  # NOQA
+
+Request = namedtuple('Request', ['method', 'path', 'headers', 'body'])
+Mail = namedtuple('Mail', ['sender', 'recipients', 'data'])
+
+
+class HTTPSink(object):
+    """
+    A local HTTP server that records the requests made to it, for testing
+    what would be sent to other services.
+
+    >>> sink = HTTPSink()
+    >>> sink.responses.append(500)  # fail the first request
+    >>> requests.post(sink.url + '/foo', data='bar')
+    >>> sink.requests
+    [Request(method='POST', path='/foo', headers=..., body='bar')]
+    """
+    def __init__(self):
+        self.requests = []  # type: List[Request]
+        # statuses to respond to the next requests with, then 200s
+        self.responses = []  # type: List[int]
+
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                sink.requests.append(Request(self.command, self.path, dict(self.headers), body))
+                self.send_response(sink.responses.pop(0) if sink.responses else 200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            do_PUT = do_POST
+
+            def log_message(self, *args):
+                pass
+
+        self._server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.host, self.port = self._server.server_address
+        self.url = 'http://{}:{}'.format(self.host, self.port)
+        self._thread = threading.Thread(target=self._server.serve_forever, kwargs={'poll_interval': 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class SMTPSink(object):
+    """
+    A local SMTP server that records the mail sent to it.
+
+    >>> sink = SMTPSink()
+    >>> smtplib.SMTP(sink.host, sink.port).sendmail('a@example.com', ['b@example.com'], 'hi')
+    >>> sink.mail
+    [Mail(sender='a@example.com', recipients=['b@example.com'], data='hi')]
+    """
+    def __init__(self):
+        self.mail = []  # type: List[Mail]
+        self._map = {}
+        sink = self
+
+        class Server(smtpd.SMTPServer):
+            def __init__(self):
+                # as smtpd.SMTPServer, but with a map of our own
+                asyncore.dispatcher.__init__(self, map=sink._map)
+                self.create_socket(smtpd.socket.AF_INET, smtpd.socket.SOCK_STREAM)
+                self.set_reuse_addr()
+                self.bind(('127.0.0.1', 0))
+                self.listen(5)
+
+            def handle_accept(self):
+                pair = self.accept()
+                if pair is not None:
+                    channel = smtpd.SMTPChannel(self, *pair)
+                    # move the channel to our map too
+                    del asyncore.socket_map[channel._fileno]
+                    channel._map = sink._map
+                    channel.add_channel()
+
+            def process_message(self, peer, mailfrom, rcpttos, data):
+                sink.mail.append(Mail(mailfrom, rcpttos, data))
+
+        self._server = Server()
+        self.host, self.port = self._server.getsockname()
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _loop(self):
+        while not self._closed:
+            asyncore.loop(timeout=0.05, map=self._map, count=1)
+
+    def close(self):
+        self._closed = True
+        self._thread.join()
+        asyncore.close_all(self._map)
@@ -0,0 +1,41 @@
+from __future__ import absolute_import
+
+import socket
+
+from typing import List  # NOQA
+
+
+class UDPSink(object):
+    """
+    Listens on a local UDP port, collecting what's sent to it; for testing
+    what would be sent to statsd.
+
+    >>> sink = UDPSink()
+    >>> client = AggregatingStatsClient(host=sink.host, port=sink.port)
+    """
+    def __init__(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind(('127.0.0.1', 0))
+        self.host, self.port = self._sock.getsockname()
+
+    def packets(self, timeout=0.2):
+        # type: (float) -> List[str]
+        """Returns the datagrams received since the last call, waiting up to
+        timeout seconds for the first."""
+        packets = []
+        self._sock.settimeout(timeout)
+        try:
+            while True:
+                packets.append(self._sock.recv(65536))
+                self._sock.settimeout(0.01)
+        except socket.timeout:
+            pass
+        return packets
+
+    def lines(self, timeout=0.2):
+        # type: (float) -> List[str]
+        """As packets, but returns the lines (metrics) in them."""
+        return [line for packet in self.packets(timeout) for line in packet.split('\n')]
+
+    def close(self):
+        self._sock.close()
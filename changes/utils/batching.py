@@ -0,0 +1,13 @@
+from itertools import islice
+
+
+def batched(iterable, size):
+    """
+    Splits `iterable` into lists of at most `size` items, consuming it lazily.
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
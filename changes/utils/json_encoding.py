@@ -0,0 +1,128 @@
+"""
+Pluggable JSON encoding.
+
+The JSON we produce in bulk (API responses, Celery messages and
+JSONEncodedDict columns) is encoded with `dumps`, which uses the first
+available backend in BACKEND_PREFERENCE unless one is chosen explicitly with
+`set_backend` (see the JSON_ENCODER_BACKEND config option).
+
+With `native_types=True`, `dumps` also encodes datetimes, UUIDs and Enums the
+same way their crumblers do, so API responses can skip crumbling them (see
+`serialize(native_types=True)`).
+
+Decoding always uses the stdlib, which is C-accelerated and, unlike
+simplejson, consistently returns unicode strings.
+"""
+
+from __future__ import absolute_import
+
+import json
+
+from collections import OrderedDict
+from datetime import datetime
+from enum import Enum
+from uuid import UUID
+
+from typing import Any, Callable, Optional  # NOQA
+
+try:
+    import simplejson
+except ImportError:
+    simplejson = None
+
+
+# Backends are functions of (value, default) that return a JSON string, where
+# `default` is called for objects the backend can't otherwise encode (as with
+# json.dumps).
+_backends = OrderedDict()  # type: OrderedDict[str, Callable[[Any, Optional[Callable]], str]]
+
+# The order in which backends are tried when none has been chosen. The C
+# encoders are several times faster than the pure-Python ones, and within a few
+# percent of each other on our payloads (see benchmarks/json_encoding.py), so
+# the stdlib's is preferred.
+BACKEND_PREFERENCE = ('json-c', 'simplejson-c', 'json')
+
+_current = None  # type: Optional[str]
+
+
+def register_backend(name, encode):
+    # type: (str, Callable[[Any, Optional[Callable]], str]) -> None
+    _backends[name] = encode
+
+
+# The pure-Python backends use the encoders' iterencode, which (unlike
+# encode, and so dumps) never uses their C accelerations.
+
+def _json_dumps(value, default=None):
+    return ''.join(json.JSONEncoder(default=default).iterencode(value))
+
+
+def _json_c_dumps(value, default=None):
+    return json.dumps(value, default=default)
+
+
+def _simplejson_dumps(value, default=None):
+    # match the stdlib's output for namedtuples (arrays, not objects)
+    return ''.join(simplejson.JSONEncoder(default=default, namedtuple_as_object=False).iterencode(value))
+
+
+def _simplejson_c_dumps(value, default=None):
+    return simplejson.dumps(value, default=default, namedtuple_as_object=False)
+
+
+register_backend('json', _json_dumps)
+if json.encoder.c_make_encoder is not None:
+    register_backend('json-c', _json_c_dumps)
+if simplejson is not None:
+    register_backend('simplejson', _simplejson_dumps)
+    if simplejson._import_c_make_encoder() is not None:
+        register_backend('simplejson-c', _simplejson_c_dumps)
+
+
+def get_backend():
+    # type: () -> str
+    """Returns the name of the backend `dumps` uses."""
+    if _current is None:
+        return next(name for name in BACKEND_PREFERENCE if name in _backends)
+    return _current
+
+
+def set_backend(name):
+    # type: (Optional[str]) -> None
+    """
+    Makes `dumps` use the backend called `name`, or the preferred available
+    backend if `name` is None.
+    """
+    global _current
+    if name is not None and name not in _backends:
+        raise ValueError('Unknown (or unavailable) JSON backend: {}'.format(name))
+    _current = name
+
+
+def encode_native(obj):
+    # type: (Any) -> Any
+    """
+    `default` hook that encodes types the same way as DateTimeCrumbler,
+    UUIDCrumbler and EnumCrumbler.
+    """
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if isinstance(obj, UUID):
+        return obj.hex
+    if isinstance(obj, Enum):
+        return {
+            'id': obj.name,
+            'name': unicode(obj),
+        }
+    raise TypeError('{!r} is not JSON serializable'.format(obj))
+
+
+def dumps(value, native_types=False):
+    # type: (Any, bool) -> str
+    encode = _backends[get_backend()]
+    return encode(value, encode_native if native_types else None)
+
+
+def loads(value):
+    # type: (str) -> Any
+    return json.loads(value)
@@ -5,6 +5,8 @@ import logging
 
 from flask import current_app
 
+from changes.lib import notifications
+
 # The name is a historical relic -- phabricator_listener.py imports this same logger.
 logger = logging.getLogger('phabricator-listener')
 
@@ -140,3 +142,14 @@ def post_comment(target, message, request=None):
         post_diff_comment(revision_id, message, request)
     except requests.exceptions.ConnectionError:
         logger.exception("Failed to post to target: %s", target)
+
+
+class CommentSender(notifications.Sender):
+    """Posts comments to diffs; see post_comment."""
+    def deliver(self, batch):
+        comment, = batch
+        request = PhabricatorClient()
+        if not request.connect():
+            raise RuntimeError('Unable to connect to Phabricator')
+        logger.info("Posting build results to %s", comment['target'])
+        post_diff_comment(comment['target'][1:], comment['message'], request)
@@ -15,8 +15,13 @@ def _match_file_patterns(patterns, fname):
     return any(pattern.match(fname) for pattern in patterns)
 
 
+def get_file_whitelist(project_options):
+    """Returns the patterns in a project's build.file-whitelist option."""
+    return filter(bool, project_options.get('build.file-whitelist', '').splitlines())
+
+
 def _in_project_files_whitelist(project_options, files_changed):
-    file_whitelist = filter(bool, project_options.get('build.file-whitelist', '').splitlines())
+    file_whitelist = get_file_whitelist(project_options)
     if file_whitelist:
         whitelist_patterns = _compile_patterns(file_whitelist)
         for filename in files_changed:
@@ -26,7 +31,8 @@ def _in_project_files_whitelist(project_options, files_changed):
     return True
 
 
-def files_changed_should_trigger_project(files_changed, project, project_options, sha, diff=None):
+def files_changed_should_trigger_project(files_changed, project, project_options, sha, diff=None,
+                                         whitelisted_files=None):
     """Given a list of changed files for a project at a given revision,
     determine if a build should be started.
 
@@ -40,6 +46,9 @@ def files_changed_should_trigger_project(files_changed, project, project_options
         sha (str) - The sha identifying the revision to look up the config from
         diff (str) - (optional) patch to apply before reading
                      config
+        whitelisted_files (list(str)) - (optional) the changed files that
+                     match the project's file whitelist, if they've already
+                     been worked out (see changes.lib.trigger_index)
 
     Returns:
         boolean - True if a build should be started.
@@ -49,6 +58,10 @@ def files_changed_should_trigger_project(files_changed, project, project_options
     if config_path in files_changed:
         return True
 
+    # nothing to build, so don't bother reading the config
+    if whitelisted_files is not None and not whitelisted_files:
+        return False
+
     try:
         config = project.get_config(sha, diff, config_path)
     except ProjectConfigError:
@@ -65,6 +78,8 @@ def files_changed_should_trigger_project(files_changed, project, project_options
 
     # filter out files in blacklist
     blacklist_patterns = _compile_patterns(blacklist)
+    if whitelisted_files is not None:
+        return any(not _match_file_patterns(blacklist_patterns, f) for f in whitelisted_files)
     files_changed = filter(lambda f: not _match_file_patterns(blacklist_patterns, f), files_changed)
 
     # apply whitelist, if there are still files left
@@ -14,6 +14,7 @@ from sqlalchemy.orm import Session
 alembic_cfg = Config(os.path.join(root, 'alembic.ini'))
 
 from changes.config import create_app, db
+from changes.lib import process_cache
 from changes.storage.mock import FileStorageCache
 
 
@@ -100,3 +101,4 @@ def redis_session(request, app):
 
 def pytest_runtest_setup(item):
     FileStorageCache.clear()
+    process_cache.clear_all()
@@ -0,0 +1,35 @@
+"""add logsegment and logsource.sealed_size
+
+Revision ID: 3a1e6f7d2c4b
+Revises: 1164433ae5c9
+Create Date: 2016-10-12 11:02:37.481205
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3a1e6f7d2c4b'
+down_revision = '1164433ae5c9'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('logsegment',
+        sa.Column('id', sa.GUID(), nullable=False),
+        sa.Column('source_id', sa.GUID(), nullable=False),
+        sa.Column('offset', sa.Integer(), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=False),
+        sa.Column('codec', sa.String(length=16), nullable=False),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.Column('date_created', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['source_id'], ['logsource.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('source_id', 'offset', name='unq_logsegment_source_offset')
+    )
+    op.add_column('logsource', sa.Column('sealed_size', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    op.drop_column('logsource', 'sealed_size')
+    op.drop_table('logsegment')
@@ -0,0 +1,24 @@
+"""add partial index on unfinished tasks
+
+Revision ID: 4b2d9e3c7a51
+Revises: 3a1e6f7d2c4b
+Create Date: 2016-10-14 16:21:09.120349
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4b2d9e3c7a51'
+down_revision = '3a1e6f7d2c4b'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # 3 is Status.finished
+    op.create_index('idx_task_unfinished_date_modified', 'task', ['date_modified', 'id'],
+                    postgresql_where=sa.text('status != 3'))
+
+
+def downgrade():
+    op.drop_index('idx_task_unfinished_date_modified', 'task')
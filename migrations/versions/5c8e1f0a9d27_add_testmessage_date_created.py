@@ -0,0 +1,24 @@
+"""add testmessage.date_created
+
+Revision ID: 5c8e1f0a9d27
+Revises: 4b2d9e3c7a51
+Create Date: 2016-10-17 14:02:51.204117
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5c8e1f0a9d27'
+down_revision = '4b2d9e3c7a51'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # nullable, and not backfilled here: existing rows get theirs from their
+    # test when the table is partitioned (see changes.lib.partitioning)
+    op.add_column('testmessage', sa.Column('date_created', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('testmessage', 'date_created')
@@ -0,0 +1,35 @@
+"""add durationstats
+
+Revision ID: 6d3b8a2f1e47
+Revises: 5c8e1f0a9d27
+Create Date: 2016-10-19 12:30:11.204873
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6d3b8a2f1e47'
+down_revision = '5c8e1f0a9d27'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('durationstats',
+        sa.Column('id', sa.GUID(), nullable=False),
+        sa.Column('project_id', sa.GUID(), nullable=False),
+        sa.Column('kind', sa.String(length=16), nullable=False),
+        sa.Column('num_builds', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('last_build_id', sa.GUID(), nullable=True),
+        sa.Column('summary', sa.LargeBinary(), nullable=False),
+        sa.Column('state', sa.LargeBinary(), nullable=False),
+        sa.Column('date_modified', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['project_id'], ['project.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['last_build_id'], ['build.id'], ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('project_id', 'kind', name='unq_durationstats_project_kind')
+    )
+
+
+def downgrade():
+    op.drop_table('durationstats')
@@ -0,0 +1,37 @@
+"""add notification
+
+Revision ID: 7e4c1b9d3a62
+Revises: 6d3b8a2f1e47
+Create Date: 2016-10-19 15:02:47.318220
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7e4c1b9d3a62'
+down_revision = '6d3b8a2f1e47'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('notification',
+        sa.Column('id', sa.GUID(), nullable=False),
+        sa.Column('destination', sa.String(length=32), nullable=False),
+        sa.Column('data', sa.JSONEncodedDict(), nullable=False),
+        sa.Column('status', sa.Enum(), nullable=False),
+        sa.Column('num_attempts', sa.Integer(), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('date_created', sa.DateTime(), nullable=False),
+        sa.Column('date_next_attempt', sa.DateTime(), nullable=False),
+        sa.Column('date_sent', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    # 1 is NotificationStatus.pending
+    op.create_index('idx_notification_pending', 'notification', ['destination', 'date_next_attempt'],
+                    postgresql_where=sa.text('status = 1'))
+    op.create_index('idx_notification_date_created', 'notification', ['date_created'])
+
+
+def downgrade():
+    op.drop_table('notification')
@@ -2,6 +2,7 @@ from datetime import datetime
 from uuid import UUID
 
 from changes.api.serializer import serialize
+from changes.api.serializer.models.logsource import LogSourceWithoutStepCrumbler
 from changes.models.job import Job
 from changes.models.jobstep import JobStep
 from changes.models.log import LogSource
@@ -24,3 +25,19 @@ def test_simple():
     assert result['name'] == 'console'
     assert result['dateCreated'] == '2013-09-19T22:15:22'
     assert result['step']['id'] == '36c7af5e56aa4a7fbf076e13ac00a866'
+
+
+def test_without_step():
+    logsource = LogSource(
+        id=UUID(hex='33846695b2774b29a71795a009e8168a'),
+        job_id=UUID(hex='2e18a7cbc0c24316b2ef9d41fea191d6'),
+        step_id=UUID(hex='36c7af5e56aa4a7fbf076e13ac00a866'),
+        name='console',
+        date_created=datetime(2013, 9, 19, 22, 15, 22),
+    )
+    crumbler = LogSourceWithoutStepCrumbler()
+    # the step isn't bulk-loaded, as it isn't serialized
+    assert crumbler.eager_load == ()
+    result = serialize(logsource, {LogSource: crumbler})
+    assert result['id'] == '33846695b2774b29a71795a009e8168a'
+    assert 'step' not in result
@@ -35,9 +35,11 @@ class SerializeTest(TestCase):
             tuple of (foo_crumbler, bar_crumbler)
         """
         foo_crumbler = mock.Mock(spec=Crumbler())
+        foo_crumbler.eager_load = ()
         foo_crumbler.crumble.side_effect = lambda item, attrs: item.inner
         foo_crumbler.get_extra_attrs_from_db.return_value = {}
         bar_crumbler = mock.Mock(spec=Crumbler())
+        bar_crumbler.eager_load = ()
         bar_crumbler.crumble.side_effect = lambda item, attrs: item.inner
         bar_crumbler.get_extra_attrs_from_db.return_value = {}
         crumbler_mapping = {SerializeTest._Foo: foo_crumbler, SerializeTest._Bar: bar_crumbler}
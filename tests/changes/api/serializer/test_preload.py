@@ -0,0 +1,78 @@
+from flask import current_app
+from flask.ext.sqlalchemy import get_debug_queries
+
+from changes.api.serializer import Crumbler, serialize
+from changes.api.serializer.preload import pop_lazy_loads, preload
+from changes.config import db
+from changes.models.build import Build
+from changes.testutils import TestCase
+
+
+class PreloadTest(TestCase):
+    def _get_builds(self, count=3):
+        project = self.create_project()
+        build_ids = [
+            self.create_build(project, author=self.create_author()).id
+            for _ in range(count)
+        ]
+        db.session.expire_all()
+        return project, Build.query.filter(Build.id.in_(build_ids)).all()
+
+    def test_many_to_one(self):
+        project, builds = self._get_builds()
+
+        num_queries = len(get_debug_queries())
+        preload(builds, ['project', 'author', 'source'])
+        # one query per relationship, regardless of the number of builds
+        assert len(get_debug_queries()) == num_queries + 3
+
+        num_queries = len(get_debug_queries())
+        for build in builds:
+            assert build.project.id == project.id
+            assert build.author.id == build.author_id
+            assert build.source.id == build.source_id
+        assert len(get_debug_queries()) == num_queries
+
+    def test_nested_path(self):
+        _, builds = self._get_builds()
+
+        num_queries = len(get_debug_queries())
+        preload(builds, ['source.revision'])
+        assert len(get_debug_queries()) == num_queries + 2
+
+        num_queries = len(get_debug_queries())
+        for build in builds:
+            assert build.source.revision.sha == build.source.revision_sha
+        assert len(get_debug_queries()) == num_queries
+
+    def test_skips_loaded_and_null(self):
+        _, builds = self._get_builds()
+        for build in builds:
+            build.project
+        builds[0].author_id = None
+
+        num_queries = len(get_debug_queries())
+        preload(builds, ['project', 'author'])
+        assert len(get_debug_queries()) == num_queries + 1
+        assert builds[0].author is None
+
+    def test_non_model_items(self):
+        preload(['foo', 1, None], ['project'])
+
+    def test_lazy_load_tracking(self):
+        _, builds = self._get_builds(count=2)
+
+        class LazyBuildCrumbler(Crumbler):
+            def crumble(self, item, attrs):
+                return item.project.slug
+
+        current_app.config['API_DEBUG_LAZY_LOADS'] = True
+        try:
+            serialize(builds, {Build: LazyBuildCrumbler()})
+        finally:
+            current_app.config['API_DEBUG_LAZY_LOADS'] = False
+
+        # the first build loads the project, the second finds it in the
+        # identity map
+        assert pop_lazy_loads() == {'LazyBuildCrumbler': 1}
+        assert pop_lazy_loads() is None
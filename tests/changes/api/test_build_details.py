@@ -1,4 +1,5 @@
 from datetime import datetime
+from uuid import UUID
 
 from changes.config import db
 from changes.constants import Status
@@ -115,3 +116,21 @@ class BuildUpdateTest(APITestCase):
 
         build = Build.query.get(build.id)
         assert build.priority == BuildPriority.high
+
+
+class BuildDetailsConditionalGetTest(APITestCase):
+    def test_no_etag(self):
+        # failure origins and the like depend on more than the build's own
+        # rows, so there's no cheap version for the response
+        build = self.create_build(self.create_project())
+        path = '/api/0/builds/{0}/'.format(build.id.hex)
+
+        resp = self.client.get(path, headers={'If-None-Match': '*'})
+        assert resp.status_code == 200
+        assert 'ETag' not in resp.headers
+
+    def test_missing(self):
+        path = '/api/0/builds/{0}/'.format(UUID(int=0).hex)
+        resp = self.client.get(path, headers={'If-None-Match': '*'})
+        assert resp.status_code == 404
+        assert 'ETag' not in resp.headers
@@ -1,11 +1,16 @@
 import mock
 
+from datetime import datetime
+
 from changes.config import db
 from changes.constants import Result, Status
 from changes.models.build import Build
 from changes.models.job import Job
 from changes.models.jobstep import JobStep
 from changes.models.itemstat import ItemStat
+from changes.models.test import TEST_PARTITIONINGS
+from changes.models.testartifact import TestArtifact
+from changes.models.testmessage import TestMessage
 from changes.testutils import APITestCase
 
 
@@ -54,3 +59,28 @@ class BuildRestartTest(APITestCase):
         assert not ItemStat.query.filter(ItemStat.item_id.in_([
             build.id, job.id, step.id
         ])).first()
+
+    @mock.patch('changes.api.build_restart.execute_build')
+    def test_partitioned_test_data(self, execute_build):
+        project = self.create_project()
+        build = self.create_build(project=project, status=Status.finished)
+        job = self.create_job(build=build)
+        step = self.create_jobstep(phase=self.create_jobphase(job=job))
+        test = self.create_test(job)
+        db.session.add(TestArtifact(test=test, name='output.txt'))
+        db.session.add(TestMessage(test=test, artifact=self.create_artifact(step, 'junit.xml'),
+                                   label='stdout', length=1))
+        db.session.commit()
+
+        for partitioning in TEST_PARTITIONINGS:
+            partitioning.create()
+            partitioning.copy()
+            partitioning.swap(since=datetime.utcnow())
+
+        path = '/api/0/builds/{0}/restart/'.format(build.id.hex)
+        resp = self.client.post(path, follow_redirects=True)
+        assert resp.status_code == 200
+
+        # deleting the jobs doesn't cascade to these anymore
+        assert not TestArtifact.query.first()
+        assert not TestMessage.query.first()
@@ -3,11 +3,13 @@ from __future__ import absolute_import
 from mock import Mock, patch
 
 from changes.buildsteps.base import BuildStep
+from changes.config import redis
 from changes.constants import Result, Status
 from changes.expanders.base import Expander
 from changes.models.command import Command, CommandType, FutureCommand
 from changes.models.jobphase import JobPhase
 from changes.models.jobstep import FutureJobStep, JobStep
+from changes.models.task import Task
 from changes.testutils import APITestCase
 
 
@@ -81,9 +83,10 @@ class UpdateCommandTest(APITestCase):
         assert command.date_started is not None
         assert command.date_finished is not None
 
+    @patch('changes.config.queue.delay_many')
     @patch('changes.models.jobplan.JobPlan.get_build_step_for_job')
     @patch('changes.api.command_details.CommandDetailsAPIView.get_expander')
-    def test_simple_expander(self, mock_get_expander, mock_get_build_step_for_job):
+    def test_simple_expander(self, mock_get_expander, mock_get_build_step_for_job, mock_delay_many):
         project = self.create_project()
         build = self.create_build(project)
         job = self.create_job(build)
@@ -98,8 +101,8 @@ class UpdateCommandTest(APITestCase):
             jobstep, type=CommandType.collect_tests,
             status=Status.in_progress)
 
-        def dummy_create_expanded_jobstep(jobstep, new_jobphase, future_jobstep):
-            return future_jobstep.as_jobstep(new_jobphase)
+        def dummy_create_expanded_jobsteps(jobstep, new_jobphase, future_jobsteps):
+            return [future_jobstep.as_jobstep(new_jobphase) for future_jobstep in future_jobsteps]
 
         dummy_expander = Mock(spec=Expander)
         dummy_expander.expand.return_value = [FutureJobStep(
@@ -113,12 +116,16 @@ class UpdateCommandTest(APITestCase):
         dummy_expander.default_phase_name.return_value = 'dummy'
         mock_get_expander.return_value.return_value = dummy_expander
         mock_buildstep = Mock(spec=BuildStep)
-        mock_buildstep.create_expanded_jobstep.side_effect = dummy_create_expanded_jobstep
+        mock_buildstep.create_expanded_jobsteps.side_effect = dummy_create_expanded_jobsteps
 
         mock_get_build_step_for_job.return_value = jobplan, mock_buildstep
 
         path = '/api/0/commands/{0}/'.format(command.id.hex)
 
+        lock_key = 'expand:{}'.format(command.id.hex)
+        locked_when_queued = []
+        mock_delay_many.side_effect = lambda tasks: locked_when_queued.append(redis.exists(lock_key))
+
         # missing output
         resp = self.client.post(path, data={
             'status': 'finished',
@@ -154,6 +161,16 @@ class UpdateCommandTest(APITestCase):
         new_jobstep = phase2.current_steps[0]
         assert new_jobstep.label == 'test'
 
+        # its sync task is queued, once the expand lock is released
+        assert locked_when_queued == [False]
+        (tasks,), _ = mock_delay_many.call_args
+        assert tasks == [('sync_job_step', {
+            'step_id': new_jobstep.id.hex,
+            'task_id': new_jobstep.id.hex,
+            'parent_task_id': job.id.hex,
+        })]
+        assert Task.query.filter(Task.task_id == new_jobstep.id).one().status == Status.queued
+
     @patch('changes.models.jobplan.JobPlan.get_build_step_for_job')
     @patch('changes.api.command_details.CommandDetailsAPIView.get_expander')
     def test_expander_no_commands(self, mock_get_expander, mock_get_build_step_for_job):
@@ -176,6 +193,8 @@ class UpdateCommandTest(APITestCase):
         empty_expander.default_phase_name.return_value = 'empty'
         mock_get_expander.return_value.return_value = empty_expander
         mock_buildstep = Mock(spec=BuildStep)
+        mock_buildstep.create_expanded_jobsteps.side_effect = (
+            lambda jobstep, new_jobphase, future_jobsteps: list(future_jobsteps))
 
         mock_get_build_step_for_job.return_value = jobplan, mock_buildstep
 
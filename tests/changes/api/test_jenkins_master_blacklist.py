@@ -1,3 +1,4 @@
+from changes.backends.jenkins.builder import get_master_blacklist
 from changes.testutils import APITestCase
 
 
@@ -43,3 +44,15 @@ class JenkinsMasterBlacklist(APITestCase):
         assert resp.status_code == 200
         result = self.unserialize(resp)
         assert 'warning' in result
+
+    def test_invalidates_cached_blacklist(self):
+        path = '/api/0/jenkins_master_blacklist/'
+        assert get_master_blacklist() == set()
+
+        resp = self.client.post(path, data=dict(master_url='https://jenkins-master-a'))
+        assert resp.status_code == 200
+        assert get_master_blacklist() == {'https://jenkins-master-a'}
+
+        resp = self.client.post(path, data=dict(master_url='https://jenkins-master-a', remove=1))
+        assert resp.status_code == 200
+        assert get_master_blacklist() == set()
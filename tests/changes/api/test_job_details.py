@@ -26,3 +26,13 @@ class JobDetailsTest(APITestCase):
         assert len(data['logs']) == 2
         assert data['logs'][0]['id'] == ls1.id.hex
         assert data['logs'][1]['id'] == ls2.id.hex
+
+    def test_no_etag(self):
+        # failure origins and the like depend on more than the job's own
+        # rows, so there's no cheap version for the response
+        job = self.create_job(self.create_build(self.create_project()))
+        path = '/api/0/jobs/{0}/'.format(job.id.hex)
+
+        resp = self.client.get(path, headers={'If-None-Match': '*'})
+        assert resp.status_code == 200
+        assert 'ETag' not in resp.headers
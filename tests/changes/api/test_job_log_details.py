@@ -1,4 +1,5 @@
 from changes.config import db
+from changes.lib import log_segments
 from changes.models.log import LogSource, LogChunk
 from changes.testutils import APITestCase
 
@@ -61,3 +62,38 @@ class JobLogDetailsTest(APITestCase):
         assert resp.status_code == 200
         assert resp.headers['Content-Type'] == 'text/plain; charset=utf-8'
         assert resp.data == lc1.text + lc2.text
+
+    def test_sealed(self):
+        project = self.create_project()
+        build = self.create_build(project)
+        job = self.create_job(build)
+        source = self.create_logsource(job=job, name='test')
+        offset = 0
+        for n in range(10):
+            self.create_logchunk(source, text=str(n) * 1000, offset=offset)
+            offset += 1000
+        log_segments.seal(source, segment_size=3000)
+        self.create_logchunk(source, text='x' * 100, offset=offset)
+        db.session.commit()
+
+        path = '/api/0/jobs/{0}/logs/{1}/'.format(
+            job.id.hex, source.id.hex)
+
+        full_text = ''.join(str(n) * 1000 for n in range(10)) + 'x' * 100
+
+        resp = self.client.get(path + '?limit=2000')
+        assert resp.status_code == 200
+        data = self.unserialize(resp)
+        assert data['nextOffset'] == 10101
+        text = ''.join(c['text'] for c in data['chunks'])
+        assert len(text) >= 2000
+        assert full_text.endswith(text)
+
+        resp = self.client.get(path + '?offset=3999&limit=2000')
+        assert resp.status_code == 200
+        data = self.unserialize(resp)
+        assert data['nextOffset'] == 6001
+        assert ''.join(c['text'] for c in data['chunks']) == '4' * 1000 + '5' * 1000
+
+        resp = self.client.get(path + '?raw=1')
+        assert resp.data == full_text
@@ -0,0 +1,100 @@
+from __future__ import absolute_import
+
+import mock
+import time
+
+from changes.config import db
+from changes.constants import Status
+from changes.lib import log_segments, log_tail
+from changes.models.log import LogSource, LogChunk
+from changes.testutils import APITestCase, override_config
+
+
+class JobLogTailTest(APITestCase):
+    def setUp(self):
+        super(JobLogTailTest, self).setUp()
+        self.project = self.create_project()
+        self.job = self.create_job(self.create_build(self.project))
+        self.step = self.create_jobstep(self.create_jobphase(self.job), status=Status.in_progress)
+        self.source = LogSource(job=self.job, project=self.project, step=self.step, name='console')
+        db.session.add(self.source)
+        for offset, text in ((0, 'a' * 100), (100, 'b' * 100)):
+            db.session.add(LogChunk(
+                job=self.job, project=self.project, source=self.source,
+                offset=offset, size=len(text), text=text,
+            ))
+        db.session.commit()
+        self.path = '/api/0/jobs/{0}/logs/{1}/tail/'.format(self.job.id.hex, self.source.id.hex)
+
+    def test_existing_chunks(self):
+        resp = self.client.get(self.path + '?offset=100')
+        assert resp.status_code == 200
+        data = self.unserialize(resp)
+        assert data['source']['id'] == self.source.id.hex
+        assert [c['text'] for c in data['chunks']] == ['b' * 100]
+        assert data['nextOffset'] == 200
+
+    def test_max_bytes(self):
+        with override_config('LOG_TAIL_MAX_BYTES', 50):
+            data = self.unserialize(self.client.get(self.path + '?offset=0'))
+            assert [c['text'] for c in data['chunks']] == ['a' * 100]
+            assert data['nextOffset'] == 100
+
+            # a smaller limit is allowed, but not a bigger one
+            data = self.unserialize(self.client.get(self.path + '?offset=0&limit=500'))
+            assert [c['text'] for c in data['chunks']] == ['a' * 100]
+
+    def test_waits_for_chunks(self):
+        real_get_chunks = log_segments.get_chunks
+        written = []
+
+        def get_chunks(*args, **kwargs):
+            chunks = real_get_chunks(*args, **kwargs)
+            if not chunks and not written:
+                # written (and announced) elsewhere while the request waits
+                db.session.add(LogChunk(
+                    job_id=self.job.id, project_id=self.project.id, source_id=self.source.id,
+                    offset=200, size=3, text='ccc',
+                ))
+                db.session.commit()
+                written.append(True)
+            return chunks
+
+        with mock.patch.object(log_segments, 'get_chunks', side_effect=get_chunks) as fetch:
+            started = time.time()
+            data = self.unserialize(self.client.get(self.path + '?offset=200'))
+
+        assert time.time() - started < 5
+        assert fetch.call_count == 2
+        assert [c['text'] for c in data['chunks']] == ['ccc']
+        assert data['nextOffset'] == 203
+
+    def test_timeout(self):
+        with override_config('LOG_TAIL_TIMEOUT', 0.1):
+            data = self.unserialize(self.client.get(self.path + '?offset=200'))
+        assert data['chunks'] == []
+        assert data['nextOffset'] == 200
+
+    def test_finished_step(self):
+        self.step.status = Status.finished
+        db.session.commit()
+
+        with mock.patch.object(log_tail, 'wait_for_chunks') as wait:
+            data = self.unserialize(self.client.get(self.path + '?offset=200'))
+        assert data['chunks'] == []
+        assert not wait.called
+
+    def test_too_many_tailers(self):
+        with override_config('LOG_TAIL_MAX_CONNECTIONS', 1):
+            with log_tail.tailer_slot(1):
+                resp = self.client.get(self.path + '?offset=200')
+        assert resp.status_code == 503
+
+    def test_invalid_offset(self):
+        assert self.client.get(self.path).status_code == 400
+        assert self.client.get(self.path + '?offset=-5').status_code == 400
+
+    def test_wrong_job(self):
+        path = '/api/0/jobs/{0}/logs/{1}/tail/?offset=0'.format(
+            self.create_job(self.create_build(self.project)).id.hex, self.source.id.hex)
+        assert self.client.get(path).status_code == 404
@@ -158,3 +158,50 @@ class JobPhaseIndexTest(APITestCase):
         assert len(data[1]['steps'][0]['logSources']) == 0
         assert data[1]['steps'][1]['id'] == step_2_b.id.hex
         assert len(data[1]['steps'][1]['logSources']) == 0
+
+    def test_not_modified(self):
+        project = self.create_project()
+        build = self.create_build(project)
+        job = self.create_job(build)
+        phase = self.create_jobphase(job)
+        step = self.create_jobstep(phase, status=Status.queued)
+
+        path = '/api/0/jobs/{0}/phases/'.format(job.id.hex)
+
+        resp = self.client.get(path)
+        assert resp.status_code == 200
+        etag = resp.headers['ETag']
+
+        resp = self.client.get(path, headers={'If-None-Match': etag})
+        assert resp.status_code == 304
+
+        step.status = Status.allocated
+        db.session.add(step)
+        db.session.commit()
+
+        resp = self.client.get(path, headers={'If-None-Match': etag})
+        assert resp.status_code == 200
+        data = self.unserialize(resp)
+        assert data[0]['steps'][0]['status']['id'] == 'allocated'
+
+    def test_not_modified_test_failures(self):
+        project = self.create_project()
+        build = self.create_build(project)
+        job = self.create_job(build)
+        phase = self.create_jobphase(job)
+        step = self.create_jobstep(phase)
+        test = self.create_test(job, step=step, result=Result.passed)
+
+        path = '/api/0/jobs/{0}/phases/?test_counts=1'.format(job.id.hex)
+
+        resp = self.client.get(path)
+        etag = resp.headers['ETag']
+
+        test.result = Result.failed
+        db.session.add(test)
+        db.session.commit()
+
+        resp = self.client.get(path, headers={'If-None-Match': etag})
+        assert resp.status_code == 200
+        data = self.unserialize(resp)
+        assert data[0]['steps'][0]['testFailures'] == 1
@@ -3,13 +3,15 @@ from __future__ import absolute_import
 import json
 
 import mock
+import pytest
 from datetime import datetime
+from redis import RedisError
 from urllib import urlencode
 
 from changes.testutils import APITestCase
 from changes.buildsteps.base import BuildStep
 from changes.constants import Status
-from changes.ext.redis import UnableToGetLock
+from changes.lib import allocation_index
 
 
 class JobStepAllocateTest(APITestCase):
@@ -54,19 +56,81 @@ class JobStepAllocateTest(APITestCase):
         assert jobstep.status == Status.allocated
         assert jobstep.last_heartbeat >= before
 
-    @mock.patch('changes.config.redis.lock',)
-    def test_locked(self, mock_allocate):
+    @mock.patch('changes.models.jobplan.JobPlan.get_build_step_for_job')
+    def test_claimed_jobsteps_not_offered(self, get_build_step_for_job):
+        implementation = mock.Mock(spec=BuildStep)
+        implementation.get_resource_limits.return_value = {}
+        implementation.get_allocation_command.return_value = 'echo 1'
+        get_build_step_for_job.return_value = (None, implementation)
+
         project = self.create_project()
         build = self.create_build(project)
         job = self.create_job(build)
         jobphase = self.create_jobphase(job)
+        jobstep = self.create_jobstep(jobphase, status=Status.pending_allocation)
+
+        resp = self.get()
+        assert [js['id'] for js in self.unserialize(resp)['jobsteps']] == [jobstep.id.hex]
 
-        jobstep = self.create_jobstep(jobphase, status=Status.unknown)
+        # e.g. another scheduler is part way through allocating it
+        assert allocation_index.claim([jobstep.id.hex]) == []
+        resp = self.get()
+        assert self.unserialize(resp) == {'jobsteps': []}
+
+    @mock.patch('changes.models.jobplan.JobPlan.get_build_step_for_job')
+    def test_failed_allocation_requeues(self, get_build_step_for_job):
+        implementation = mock.Mock(spec=BuildStep)
+        implementation.get_resource_limits.return_value = {}
+        implementation.get_allocation_command.return_value = 'echo 1'
+        get_build_step_for_job.return_value = (None, implementation)
 
-        mock_allocate.side_effect = UnableToGetLock("Can't get lock")
-        resp = self.post([jobstep.id.hex])
+        project = self.create_project()
+        build = self.create_build(project)
+        job = self.create_job(build)
+        jobphase = self.create_jobphase(job)
+        jobstep_pending = self.create_jobstep(jobphase, status=Status.pending_allocation)
+        jobstep_allocated = self.create_jobstep(jobphase, status=Status.allocated)
+        assert allocation_index.ensure_ready()
+
+        resp = self.post([jobstep_pending.id.hex, jobstep_allocated.id.hex], cluster=None)
         assert resp.status_code == 409
 
+        resp = self.get()
+        assert [js['id'] for js in self.unserialize(resp)['jobsteps']] == [jobstep_pending.id.hex]
+
+    @mock.patch('changes.models.jobplan.JobPlan.get_build_step_for_job')
+    def test_get_failure_not_truncated(self, get_build_step_for_job):
+        implementation = mock.Mock(spec=BuildStep)
+        implementation.get_resource_limits.return_value = {}
+        implementation.get_allocation_command.side_effect = ['echo 1', Exception('oops')]
+        get_build_step_for_job.return_value = (None, implementation)
+
+        project = self.create_project()
+        build = self.create_build(project)
+        job = self.create_job(build)
+        jobphase = self.create_jobphase(job)
+        self.create_jobstep(jobphase, status=Status.pending_allocation)
+        self.create_jobstep(jobphase, status=Status.pending_allocation)
+
+        # fails before responding, rather than part way through a 200
+        with pytest.raises(Exception):
+            self.get()
+
+    @mock.patch('changes.lib.allocation_index.claim')
+    def test_alloc_without_redis(self, claim):
+        claim.side_effect = RedisError('down')
+
+        project = self.create_project()
+        build = self.create_build(project)
+        job = self.create_job(build)
+        jobphase = self.create_jobphase(job)
+        jobstep = self.create_jobstep(jobphase, status=Status.pending_allocation)
+        assert allocation_index.ensure_ready()
+
+        # the database still says it's pending
+        self.assert_successful_allocate([jobstep.id.hex])
+        assert jobstep.status == Status.allocated
+
     def test_already_allocated(self):
         project = self.create_project()
         build = self.create_build(project)
@@ -1,7 +1,12 @@
+from datetime import datetime
+from flask import current_app
+from mock import patch
 from uuid import uuid4
 
 from changes.config import db
 from changes.constants import Result, Status
+from changes.lib import heartbeats
+from changes.models.jobstep import JobStep
 from changes.testutils import APITestCase
 
 
@@ -32,3 +37,49 @@ class JobStepHeartbeatTest(APITestCase):
 
         resp = self.client.post(path)
         assert resp.status_code == 410
+
+    def test_buffered(self):
+        project = self.create_project()
+        build = self.create_build(project)
+        job = self.create_job(build)
+        jobphase = self.create_jobphase(job)
+        jobstep = self.create_jobstep(jobphase, status=Status.in_progress)
+
+        path = '/api/0/jobsteps/{0}/heartbeat/'.format(jobstep.id.hex)
+
+        resp = self.client.post(path, data={'date': '2016-10-12T10:00:00.000000Z'})
+        assert resp.status_code == 200
+
+        # the jobstep has been checked, so later heartbeats don't query it
+        with patch.object(JobStep, 'query') as mock_query:
+            resp = self.client.post(path, data={'date': '2016-10-12T10:01:00.000000Z'})
+        assert resp.status_code == 200
+        assert not mock_query.get.called
+
+        db.session.expire(jobstep)
+        assert jobstep.last_heartbeat is None
+        assert heartbeats.get(jobstep.id) == datetime(2016, 10, 12, 10, 1)
+
+        heartbeats.flush()
+        db.session.expire(jobstep)
+        assert jobstep.last_heartbeat == datetime(2016, 10, 12, 10, 1)
+
+    def test_unbuffered(self):
+        project = self.create_project()
+        build = self.create_build(project)
+        job = self.create_job(build)
+        jobphase = self.create_jobphase(job)
+        jobstep = self.create_jobstep(jobphase, status=Status.in_progress)
+
+        path = '/api/0/jobsteps/{0}/heartbeat/'.format(jobstep.id.hex)
+
+        current_app.config['JOBSTEP_HEARTBEAT_BUFFER_ENABLED'] = False
+        try:
+            resp = self.client.post(path, data={'date': '2016-10-12T10:00:00.000000Z'})
+        finally:
+            current_app.config['JOBSTEP_HEARTBEAT_BUFFER_ENABLED'] = True
+        assert resp.status_code == 200
+
+        db.session.expire(jobstep)
+        assert jobstep.last_heartbeat == datetime(2016, 10, 12, 10)
+        assert heartbeats.get(jobstep.id) is None
@@ -0,0 +1,49 @@
+from __future__ import absolute_import
+
+import responses
+
+from datetime import datetime
+
+from changes.constants import Status
+from changes.testutils import APITestCase
+
+MASTER = 'http://jenkins.example.com'
+
+
+class NodeStatusTest(APITestCase):
+    def setUp(self):
+        super(NodeStatusTest, self).setUp()
+        self.node = self.create_node(label='node-1')
+        project = self.create_project()
+        jobphase = self.create_jobphase(self.create_job(self.create_build(project)))
+        self.create_jobstep(
+            jobphase, node=self.node, status=Status.finished, date_finished=datetime.utcnow(),
+            data={'master': MASTER})
+        self.path = '/api/0/nodes/{0}/status/'.format(self.node.id.hex)
+
+    @responses.activate
+    def test_jenkins_status(self):
+        responses.add(responses.GET, MASTER + '/computer/node-1/api/json',
+                      body='{"temporarilyOffline": false}')
+
+        assert self.unserialize(self.client.get(self.path)) == {'offline': False}
+        # cached
+        assert self.unserialize(self.client.get(self.path)) == {'offline': False}
+        assert len(responses.calls) == 1
+
+    @responses.activate
+    def test_toggle(self):
+        responses.add(responses.GET, MASTER + '/computer/node-1/api/json',
+                      body='{"temporarilyOffline": false}')
+        responses.add(responses.POST, MASTER + '/computer/node-1/toggleOffline')
+        self.client.get(self.path)
+
+        responses.reset()
+        responses.add(responses.GET, MASTER + '/computer/node-1/api/json',
+                      body='{"temporarilyOffline": true}')
+        responses.add(responses.POST, MASTER + '/computer/node-1/toggleOffline')
+        self.login_default()
+
+        resp = self.client.post(self.path + '?toggle=1')
+        assert resp.status_code == 200
+        assert self.unserialize(resp) == {'offline': True}
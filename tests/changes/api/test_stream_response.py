@@ -0,0 +1,42 @@
+import json
+
+from changes.api.base import APIView
+from changes.testutils import TestCase
+
+
+class FakeStreamAPIView(APIView):
+    def get(self, items, **kwargs):
+        return self.respond_stream(items, **kwargs)
+
+
+class StreamResponseTest(TestCase):
+    def test_list(self):
+        response = FakeStreamAPIView().get(iter(range(10)), chunk_size=3)
+        assert response.is_streamed
+        assert response.headers['Content-Type'] == 'application/json'
+        chunks = list(response.response)
+        # the opening bracket, 4 chunks of items and the closing bracket
+        assert len(chunks) == 6
+        assert json.loads(''.join(chunks)) == range(10)
+
+    def test_empty(self):
+        response = FakeStreamAPIView().get(iter([]))
+        assert json.loads(response.get_data()) == []
+
+        response = FakeStreamAPIView().get(iter([]), key='jobsteps')
+        assert json.loads(response.get_data()) == {'jobsteps': []}
+
+    def test_key(self):
+        response = FakeStreamAPIView().get(iter(['a', 'b']), key='items', chunk_size=1)
+        assert json.loads(response.get_data()) == {'items': ['a', 'b']}
+
+    def test_as_object(self):
+        pairs = [('foo.py', 'CCU'), ('bar.py', 'NNC'), ('baz.py', 'U')]
+        response = FakeStreamAPIView().get(iter(pairs), as_object=True, chunk_size=2)
+        assert json.loads(response.get_data()) == dict(pairs)
+
+    def test_serializes_items(self):
+        project = self.create_project()
+        response = FakeStreamAPIView().get(iter([project]))
+        data = json.loads(response.get_data())
+        assert data[0]['id'] == project.id.hex
@@ -8,18 +8,19 @@ import re
 import time
 
 from flask import current_app
-from uuid import UUID
+from uuid import UUID, uuid4
 
 from changes.config import db, redis
 from changes.constants import Status, Result
 
-from changes.lib.artifact_store_lib import ArtifactState
+from changes.lib.artifact_store_lib import APPEND_BATCH_SIZE, ArtifactState
 from changes.lib.artifact_store_mock import ArtifactStoreMock
 
 from changes.models.artifact import Artifact
 from changes.models.failurereason import FailureReason
 from changes.models.filecoverage import FileCoverage
 from changes.models.job import Job
+from changes.models.jobstep import JobStep
 from changes.models.log import LogSource
 from changes.models.patch import Patch
 from changes.models.test import TestCase
@@ -28,8 +29,9 @@ from changes.models.testartifact import TestArtifact
 from changes.backends.jenkins.builder import JenkinsBuilder, MASTER_BLACKLIST_KEY, JENKINS_LOG_NAME
 from changes.testutils import (
     BackendTestCase, eager_tasks, SAMPLE_DIFF, SAMPLE_XUNIT, SAMPLE_COVERAGE,
-    SAMPLE_XUNIT_TESTARTIFACTS
+    SAMPLE_XUNIT_TESTARTIFACTS, override_config
 )
+from changes.testutils.jenkins import FakeJenkins
 
 
 class BaseTestCase(BackendTestCase):
@@ -85,20 +87,7 @@ class CreateBuildTest(BaseTestCase):
     @responses.activate
     def test_queued_creation(self):
         job_id = '81d1596fd4d642f4a6bdf86c45e014e8'
-        responses.add(
-            responses.POST, 'http://jenkins.example.com/job/server/build',
-            body='',
-            status=201)
-
-        responses.add(
-            responses.GET,
-            re.compile('http://jenkins\\.example\\.com/queue/api/xml/\\?xpath=%2Fqueue%2Fitem%5Baction%2Fparameter%2Fname%3D%22CHANGES_BID%22\\+and\\+action%2Fparameter%2Fvalue%3D%22.*?%22%5D%2Fid&wrapper=x'),
-            body=self.load_fixture('fixtures/GET/queue_item_by_job_id.xml'))
-
-        responses.add(
-            responses.GET,
-            re.compile('http://jenkins\\.example\\.com/job/server/api/xml/\\?depth=1&xpath=/queue/item\\[action/parameter/name=%22CHANGES_BID%22%20and%20action/parameter/value=%22.*?%22\\]/id'),
-            status=404)
+        jenkins = FakeJenkins(first_item_id=13)
 
         build = self.create_build(self.project)
         job = self.create_job(
@@ -118,6 +107,7 @@ class CreateBuildTest(BaseTestCase):
             'uri': None,
             'master': 'http://jenkins.example.com',
         }
+        assert jenkins.requests == {'build': 1, 'queue': 1}
 
     @responses.activate
     def test_active_creation(self):
@@ -128,9 +118,8 @@ class CreateBuildTest(BaseTestCase):
             status=201)
 
         responses.add(
-            responses.GET,
-            re.compile('http://jenkins\\.example\\.com/queue/api/xml/\\?xpath=%2Fqueue%2Fitem%5Baction%2Fparameter%2Fname%3D%22CHANGES_BID%22\\+and\\+action%2Fparameter%2Fvalue%3D%22.*?%22%5D%2Fid&wrapper=x'),
-            status=404)
+            responses.GET, 'http://jenkins.example.com/queue/api/json/',
+            body='{"items": []}')
 
         responses.add(
             responses.GET,
@@ -157,6 +146,31 @@ class CreateBuildTest(BaseTestCase):
             'master': 'http://jenkins.example.com',
         }
 
+    @responses.activate
+    @mock.patch.object(JenkinsBuilder, '_find_job')
+    def test_find_job_after_post(self, find_job):
+        posted_at = []
+
+        def post(request):
+            posted_at.append(time.time())
+            return 201, {}, ''
+
+        responses.add_callback(
+            responses.POST, 'http://jenkins.example.com/job/server/build', callback=post)
+        find_job.side_effect = [None, {'job_name': 'server', 'queued': True, 'item_id': 13}]
+
+        builder = self.get_builder()
+        sleep = time.sleep
+        with mock.patch('changes.backends.jenkins.builder.time.sleep', side_effect=lambda s: sleep(0.01)):
+            job_data = builder.create_jenkins_job_from_params('a' * 32, [])
+        assert job_data['item_id'] == 13
+
+        # only snapshots of the queue from after the POST, and a newer one
+        # once it wasn't in the first
+        (_, _, _, first_queued_at), _ = find_job.call_args_list[0]
+        (_, _, _, second_queued_at), _ = find_job.call_args_list[1]
+        assert posted_at[0] <= first_queued_at < second_queued_at
+
     @responses.activate
     @mock.patch.object(JenkinsBuilder, '_find_job')
     def test_patch(self, find_job):
@@ -209,9 +223,8 @@ class CreateBuildTest(BaseTestCase):
             status=201)
 
         responses.add(
-            responses.GET,
-            re.compile('http://jenkins-2\\.example\\.com/queue/api/xml/\\?xpath=%2Fqueue%2Fitem%5Baction%2Fparameter%2Fname%3D%22CHANGES_BID%22\\+and\\+action%2Fparameter%2Fvalue%3D%22.*?%22%5D%2Fid&wrapper=x'),
-            status=404)
+            responses.GET, 'http://jenkins-2.example.com/queue/api/json/',
+            body='{"items": []}')
 
         responses.add(
             responses.GET,
@@ -255,9 +268,8 @@ class CreateBuildTest(BaseTestCase):
             status=201)
 
         responses.add(
-            responses.GET,
-            re.compile('http://jenkins-2\\.example\\.com/queue/api/xml/\\?xpath=%2Fqueue%2Fitem%5Baction%2Fparameter%2Fname%3D%22CHANGES_BID%22\\+and\\+action%2Fparameter%2Fvalue%3D%22.*?%22%5D%2Fid&wrapper=x'),
-            status=404)
+            responses.GET, 'http://jenkins-2.example.com/queue/api/json/',
+            body='{"items": []}')
 
         responses.add(
             responses.GET,
@@ -290,6 +302,26 @@ class CreateBuildTest(BaseTestCase):
         ]
         assert 'http://jenkins-2.example.com' == builder._pick_master('job1')
 
+    def test_get_node_id(self):
+        node = self.create_node(label='node-1')
+        builder = self.get_builder()
+        with mock.patch.object(builder, '_get_node', wraps=builder._get_node) as get_node:
+            assert builder._get_node_id('http://jenkins.example.com', 'node-1') == node.id
+            assert builder._get_node_id('http://jenkins.example.com', 'node-1') == node.id
+        assert get_node.call_count == 1
+
+    @responses.activate
+    def test_get_node_id_created(self):
+        responses.add(responses.GET, 'http://jenkins.example.com/computer/node-2/config.xml', status=404)
+        builder = self.get_builder()
+        with mock.patch.object(builder, '_get_node', wraps=builder._get_node) as get_node:
+            node_id = builder._get_node_id('http://jenkins.example.com', 'node-2')
+            # not cached until it's known to have been committed
+            db.session.commit()
+            assert builder._get_node_id('http://jenkins.example.com', 'node-2') == node_id
+            assert builder._get_node_id('http://jenkins.example.com', 'node-2') == node_id
+        assert get_node.call_count == 2
+
     @responses.activate
     def test_jobstep_replacement(self):
         job_id = 'f9481a17aac446718d7893b6e1c6288b'
@@ -299,9 +331,8 @@ class CreateBuildTest(BaseTestCase):
             status=201)
 
         responses.add(
-            responses.GET,
-            re.compile('http://jenkins\\.example\\.com/queue/api/xml/\\?xpath=%2Fqueue%2Fitem%5Baction%2Fparameter%2Fname%3D%22CHANGES_BID%22\\+and\\+action%2Fparameter%2Fvalue%3D%22.*?%22%5D%2Fid&wrapper=x'),
-            status=404)
+            responses.GET, 'http://jenkins.example.com/queue/api/json/',
+            body='{"items": []}')
 
         responses.add(
             responses.GET,
@@ -452,6 +483,9 @@ class CancelStepTest(BaseTestCase):
 class SyncStepTest(BaseTestCase):
     @responses.activate
     def test_waiting_in_queue(self):
+        responses.add(
+            responses.GET, 'http://jenkins.example.com/queue/api/json/',
+            body='{"items": []}')
         responses.add(
             responses.GET, 'http://jenkins.example.com/queue/item/13/api/json/',
             body=self.load_fixture('fixtures/GET/queue_details_pending.json'))
@@ -475,8 +509,72 @@ class SyncStepTest(BaseTestCase):
 
         assert step.status == Status.queued
 
+    @responses.activate
+    def test_waiting_in_queue_snapshot(self):
+        jenkins = FakeJenkins()
+
+        build = self.create_build(self.project)
+        job = self.create_job(build=build)
+        phase = self.create_jobphase(job)
+        step = self.create_jobstep(phase)
+        item_id = jenkins.enqueue('server', step.id.hex, blocked=True)
+        step.data.update({
+            'build_no': None,
+            'item_id': str(item_id),
+            'job_name': 'server',
+            'queued': True,
+            'master': 'http://jenkins.example.com',
+        })
+
+        builder = self.get_builder()
+        builder.sync_step(step)
+
+        assert step.status == Status.queued
+        assert jenkins.requests == {'queue': 1}
+
+    @responses.activate
+    def test_many_waiting_in_queue(self):
+        jenkins = FakeJenkins()
+        jenkins_2 = FakeJenkins('http://jenkins-2.example.com')
+
+        build = self.create_build(self.project)
+        job = self.create_job(build=build)
+        phase = self.create_jobphase(job)
+        steps = []
+        for n in range(200):
+            master = jenkins if n % 3 else jenkins_2
+            step = JobStep(
+                id=uuid4(), job=job, project=self.project, phase=phase, label=phase.label,
+                status=Status.in_progress)
+            item_id = master.enqueue('server', step.id.hex, blocked=n % 2 == 0)
+            step.data = {
+                'build_no': None,
+                'item_id': str(item_id),
+                'job_name': 'server',
+                'queued': True,
+                'master': master.base_url,
+            }
+            steps.append(step)
+        db.session.add_all(steps)
+        db.session.commit()
+
+        builder = self.get_builder()
+        builder.master_urls = [jenkins.base_url, jenkins_2.base_url]
+        for step in steps:
+            builder.sync_step(step)
+        for _ in range(10):
+            builder._pick_master('server')
+
+        # one fetch of each master's queue, however many steps are queued
+        assert jenkins.requests == {'queue': 1}
+        assert jenkins_2.requests == {'queue': 1}
+        assert [s.status for s in steps[::2]] == [Status.queued] * 100
+
     @responses.activate
     def test_cancelled_in_queue(self):
+        responses.add(
+            responses.GET, 'http://jenkins.example.com/queue/api/json/',
+            body='{"items": []}')
         responses.add(
             responses.GET, 'http://jenkins.example.com/queue/item/13/api/json/',
             body=self.load_fixture('fixtures/GET/queue_details_cancelled.json'))
@@ -504,6 +602,9 @@ class SyncStepTest(BaseTestCase):
     @responses.activate
     @mock.patch('changes.backends.jenkins.builder.ArtifactStoreClient', ArtifactStoreMock)
     def test_queued_to_active(self):
+        responses.add(
+            responses.GET, 'http://jenkins.example.com/queue/api/json/',
+            body='{"items": []}')
         responses.add(
             responses.GET, 'http://jenkins.example.com/queue/item/13/api/json/',
             body=self.load_fixture('fixtures/GET/queue_details_building.json'))
@@ -698,6 +799,49 @@ class SyncStepTest(BaseTestCase):
         assert "LOG TRUNCATED" in ArtifactStoreMock('').\
             get_artifact_content(bucket_name, artifact_name).getvalue()
 
+    @responses.activate
+    @mock.patch('changes.backends.jenkins.builder.ArtifactStoreClient', ArtifactStoreMock)
+    def test_result_large_log(self):
+        data = ''.join('line %d\n' % n for n in range(400000))
+        responses.add(
+            responses.GET, 'http://jenkins.example.com/job/server/2/api/json/',
+            body=self.load_fixture('fixtures/GET/job_details_failed.json'))
+        responses.add(
+            responses.GET, 'http://jenkins.example.com/job/server/2/logText/progressiveText/?start=0',
+            match_querystring=True,
+            adding_headers={'X-Text-Size': str(len(data))},
+            body=data)
+        responses.add(
+            responses.GET, 'http://jenkins.example.com/computer/server-ubuntu-10.04%20(ami-746cf244)%20(i-836023b7)/config.xml',
+            body=self.load_fixture('fixtures/GET/node_config.xml'))
+
+        build = self.create_build(self.project)
+        job = self.create_job(
+            build=build,
+            id=UUID('81d1596fd4d642f4a6bdf86c45e014e8'),
+            data={
+                'build_no': 2,
+                'item_id': 13,
+                'job_name': 'server',
+                'queued': False,
+                'master': 'http://jenkins.example.com',
+            },
+        )
+        phase = self.create_jobphase(job)
+        step = self.create_jobstep(phase, data=job.data)
+
+        builder = self.get_builder()
+        with mock.patch.object(ArtifactStoreMock, 'append_artifact_bytes', autospec=True,
+                               side_effect=ArtifactStoreMock.append_artifact_bytes) as append:
+            builder.sync_step(step)
+
+        # a request per batch, rather than per LOG_CHUNK_SIZE chunk
+        assert append.call_count == len(data) // APPEND_BATCH_SIZE + 1
+        assert step.data['log_offset'] == len(data)
+        bucket_name = step.id.hex + '-jenkins'
+        artifact_name = step.data['log_artifact_name']
+        assert ArtifactStoreMock('').get_artifact_content(bucket_name, artifact_name).getvalue() == data
+
 
 class SyncGenericResultsTest(BaseTestCase):
     @responses.activate
@@ -999,17 +1143,11 @@ class JenkinsIntegrationTest(BaseTestCase):
         job_id = '81d1596fd4d642f4a6bdf86c45e014e8'
 
         # TODO: move this out of this file and integrate w/ buildstep
-        responses.add(
-            responses.POST, 'http://jenkins.example.com/job/server/build',
-            body='',
-            status=201)
-        responses.add(
-            responses.GET,
-            re.compile('http://jenkins\\.example\\.com/queue/api/xml/\\?xpath=%2Fqueue%2Fitem%5Baction%2Fparameter%2Fname%3D%22CHANGES_BID%22\\+and\\+action%2Fparameter%2Fvalue%3D%22.*?%22%5D%2Fid&wrapper=x'),
-            body=self.load_fixture('fixtures/GET/queue_item_by_job_id.xml'))
         responses.add(
             responses.GET, 'http://jenkins.example.com/queue/item/13/api/json/',
             body=self.load_fixture('fixtures/GET/queue_details_building.json'))
+        # the build starts once it's been seen in the queue
+        FakeJenkins(first_item_id=13, start_when_seen=True)
         responses.add(
             responses.GET, 'http://jenkins.example.com/job/server/2/api/json/',
             body=self.load_fixture('fixtures/GET/job_details_success.json'))
@@ -1046,11 +1184,13 @@ class JenkinsIntegrationTest(BaseTestCase):
         job_id = job.id.hex
         build_id = build.id.hex
 
-        create_job.delay(
-            job_id=job_id,
-            task_id=job_id,
-            parent_task_id=build_id,
-        )
+        # so that syncing sees the build leave the queue
+        with override_config('JENKINS_QUEUE_SNAPSHOT_TTL', 0):
+            create_job.delay(
+                job_id=job_id,
+                task_id=job_id,
+                parent_task_id=build_id,
+            )
 
         job = Job.query.get(job_id)
 
@@ -0,0 +1,103 @@
+from __future__ import absolute_import
+
+import json
+import mock
+import os.path
+import time
+
+from redis import RedisError
+
+from changes.backends.jenkins import queue_snapshot
+from changes.backends.jenkins.queue_snapshot import QueueSnapshot, get_queue_snapshot
+from changes.config import redis
+from changes.testutils import TestCase
+
+MASTER = 'http://jenkins.example.com'
+
+
+def load_queue(name):
+    path = os.path.join(os.path.dirname(__file__), 'fixtures', 'GET', name)
+    with open(path) as fp:
+        return json.load(fp)
+
+
+class QueueSnapshotTest(TestCase):
+    def test_from_queue(self):
+        snapshot = QueueSnapshot.from_queue(1000.0, load_queue('queue_list.json'))
+
+        assert snapshot.count('server') == 1
+        assert snapshot.count('other') == 0
+        assert snapshot.find('81d1596fd4d642f4a6bdf86c45e014e8') == {
+            'id': '13',
+            'job_name': 'server',
+            'blocked': True,
+        }
+        assert snapshot.find('f9481a17aac446718d7893b6e1c6288b') is None
+
+        copy = QueueSnapshot.loads(snapshot.dumps())
+        assert copy.fetched_at == 1000.0
+        assert copy.counts == snapshot.counts
+        assert copy.items == snapshot.items
+
+
+class GetQueueSnapshotTest(TestCase):
+    def setUp(self):
+        super(GetQueueSnapshotTest, self).setUp()
+        self.fetch = mock.Mock(return_value=load_queue('queue_list.json'))
+
+    def test_shared(self):
+        first = get_queue_snapshot(MASTER, self.fetch, ttl=5)
+        second = get_queue_snapshot(MASTER, self.fetch, ttl=5)
+
+        assert self.fetch.call_count == 1
+        assert second.items == first.items
+        assert 0 < redis.ttl(queue_snapshot.SNAPSHOT_KEY.format(MASTER)) <= 5
+
+        get_queue_snapshot('http://jenkins-2.example.com', self.fetch, ttl=5)
+        assert self.fetch.call_count == 2
+
+    def test_fetched_after(self):
+        first = get_queue_snapshot(MASTER, self.fetch, ttl=5)
+        get_queue_snapshot(MASTER, self.fetch, ttl=5, fetched_after=first.fetched_at - 1)
+        assert self.fetch.call_count == 1
+
+        second = get_queue_snapshot(MASTER, self.fetch, ttl=5, fetched_after=time.time())
+        assert self.fetch.call_count == 2
+        assert second.fetched_at > first.fetched_at
+
+    def test_not_shared(self):
+        get_queue_snapshot(MASTER, self.fetch, ttl=0)
+        get_queue_snapshot(MASTER, self.fetch, ttl=0)
+
+        assert self.fetch.call_count == 2
+        assert not redis.exists(queue_snapshot.SNAPSHOT_KEY.format(MASTER))
+
+    @mock.patch.object(queue_snapshot, 'WAIT_TIMEOUT', 0.2)
+    def test_waits_for_other_fetch(self):
+        other = QueueSnapshot.from_queue(time.time(), {'items': []})
+
+        def other_fetch(seconds):
+            # what another worker holding the lock would do
+            redis.setex(queue_snapshot.SNAPSHOT_KEY.format(MASTER), other.dumps(), 5)
+
+        with redis.lock(queue_snapshot.LOCK_KEY.format(MASTER), expire=30):
+            with mock.patch.object(queue_snapshot.time, 'sleep', side_effect=other_fetch):
+                snapshot = get_queue_snapshot(MASTER, self.fetch, ttl=5)
+
+        assert not self.fetch.called
+        assert snapshot.fetched_at == other.fetched_at
+
+    @mock.patch.object(queue_snapshot, 'WAIT_TIMEOUT', 0.2)
+    def test_other_fetch_times_out(self):
+        with redis.lock(queue_snapshot.LOCK_KEY.format(MASTER), expire=30):
+            snapshot = get_queue_snapshot(MASTER, self.fetch, ttl=5)
+
+        assert self.fetch.call_count == 1
+        assert snapshot.count('server') == 1
+
+    def test_redis_unavailable(self):
+        with mock.patch.object(redis, 'get', side_effect=RedisError()):
+            snapshot = get_queue_snapshot(MASTER, self.fetch, ttl=5)
+
+        assert self.fetch.call_count == 1
+        assert snapshot.count('server') == 1
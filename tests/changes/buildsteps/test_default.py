@@ -4,14 +4,17 @@ import mock
 
 from datetime import datetime, timedelta
 from flask import current_app
+from sqlalchemy import event
 
 from changes.buildsteps.default import (
     DEFAULT_ARTIFACTS, DEFAULT_ENV, DEFAULT_PATH, DEFAULT_RELEASE,
     DefaultBuildStep
 )
-from changes.config import db
+from changes.config import db, redis
 from changes.constants import Result, ResultSource, Status, Cause
+from changes.lib import allocation_index
 from changes.models.command import CommandType, FutureCommand
+from changes.models.jobphase import JobPhase
 from changes.models.jobstep import FutureJobStep
 from changes.models.repository import Repository
 from changes.testutils import TestCase, override_config
@@ -500,6 +503,92 @@ This target was affected by the following files:
         assert len(jobstep.targets) == 2
         assert set(t.name for t in jobstep.targets) == set(['//a/b:b_test', '//a:a_test'])
 
+    @mock.patch.object(Repository, 'get_vcs')
+    def test_create_expanded_jobsteps(self, get_vcs):
+        build = self.create_build(self.create_project())
+        job = self.create_job(build)
+        jobphase = self.create_jobphase(job, label='foo')
+        jobstep = self.create_jobstep(jobphase, data={'release': 'trusty', 'max_executors': 2})
+
+        # not flushed yet, as when expanding
+        new_jobphase = JobPhase(job_id=job.id, project_id=job.project_id, label='bar')
+        db.session.add(new_jobphase)
+
+        vcs = mock.Mock(spec=Vcs)
+        vcs.get_buildstep_clone.return_value = 'git clone https://example.com'
+        get_vcs.return_value = vcs
+
+        def future_jobsteps():
+            yield FutureJobStep(
+                label='a',
+                commands=[FutureCommand('bazel test {}'.format(n)) for n in range(3)],
+                data={
+                    'targets': ['//a:test', '//b:test'],
+                    'dependency_map': {'//a:test': ['a/test.sh'], '//c:test': ['c/test.sh']},
+                },
+            )
+            yield FutureJobStep(label='b', commands=[FutureCommand('bazel test')])
+
+        buildstep = self.get_buildstep(cluster='foo')
+        with mock.patch.object(buildstep, 'iter_all_commands', wraps=buildstep.iter_all_commands) as iter_all_commands:
+            statements = []
+
+            def listener(conn, cursor, statement, *args):
+                statements.append(statement)
+
+            event.listen(db.engine, 'before_cursor_execute', listener)
+            try:
+                new_jobsteps = buildstep.create_expanded_jobsteps(jobstep, new_jobphase, future_jobsteps())
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', listener)
+        # setup and teardown commands are only looked up once
+        assert iter_all_commands.call_count == 1
+        # a single INSERT each for the jobsteps, their commands, and their
+        # targets and messages
+        inserts = [s.split()[2] for s in statements if s.startswith('INSERT')]
+        assert inserts.count('jobstep') == 1
+        assert inserts.count('command') == 1
+        assert inserts.count('bazeltarget') == 1
+        assert inserts.count('bazeltargetmessage') == 1
+
+        db.session.commit()
+        db.session.expire_all()
+
+        assert [s.label for s in new_jobsteps] == ['a', 'b']
+        # and are waiting to be allocated
+        assert set(redis.zrange(allocation_index._queue_key('foo', build.priority), 0, -1)) == {
+            s.id.hex for s in new_jobsteps}
+        for new_jobstep in new_jobsteps:
+            assert new_jobstep.phase == new_jobphase
+            assert new_jobstep.job == job
+            assert new_jobstep.status == Status.pending_allocation
+            assert new_jobstep.cluster == 'foo'
+            assert new_jobstep.data['expanded'] is True
+            assert new_jobstep.data['release'] == 'trusty'
+            assert 'max_executors' not in new_jobstep.data
+
+        commands = new_jobsteps[0].commands
+        assert [c.order for c in commands] == range(6)
+        assert commands[0].type == CommandType.infra_setup
+        assert commands[2].script == 'echo "hello world 2"'
+        assert [c.script for c in commands[3:]] == ['bazel test 0', 'bazel test 1', 'bazel test 2']
+        assert commands[3].cwd == DEFAULT_PATH
+        assert commands[3].env == DEFAULT_ENV
+        assert [c.script for c in new_jobsteps[1].commands] == [c.script for c in commands[:3]] + ['bazel test']
+
+        targets = sorted(new_jobsteps[0].targets, key=lambda t: t.name)
+        assert [t.name for t in targets] == ['//a:test', '//b:test']
+        for target in targets:
+            assert target.job == job
+            assert target.status is Status.in_progress
+            assert target.result is Result.unknown
+            assert target.result_source is ResultSource.from_self
+            assert target.duration == 0
+        assert [m.text for m in targets[0].messages] == [
+            'This target was affected by the following files:\n    a/test.sh']
+        assert targets[1].messages == []
+        assert new_jobsteps[1].targets == []
+
     @mock.patch.object(Repository, 'get_vcs')
     def test_create_replacement_jobstep_expanded(self, get_vcs):
         build = self.create_build(self.create_project())
@@ -149,6 +149,7 @@ class BazelTargetsExpanderTest(TestCase):
             'artifact_search_path': 'artifacts/',
             'dependency_map': {
                 '//foo/bar:test': ['foo/bar/test.sh'],
+                '//foo/baz:test': ['foo/baz/test.sh'],
             },
         }).expand(job=job, max_executors=1))
 
@@ -0,0 +1,105 @@
+from __future__ import absolute_import
+
+import time
+
+from flask import Flask
+from unittest import TestCase
+
+from changes.ext.statsreporter import AggregatingStatsClient, Stats, StatsReporter
+from changes.testutils.statsd import UDPSink
+
+
+class AggregatingStatsClientTest(TestCase):
+    def setUp(self):
+        self.sink = UDPSink()
+
+    def tearDown(self):
+        self.sink.close()
+
+    def get_client(self, **kwargs):
+        # not flushed unless asked to
+        kwargs.setdefault('flush_interval', 60)
+        return AggregatingStatsClient(host=self.sink.host, port=self.sink.port, **kwargs)
+
+    def test_aggregates(self):
+        client = self.get_client(prefix='changes')
+        stats = Stats(client=client)
+        for _ in range(10):
+            stats.incr('foo')
+            with stats.timer('bar'):
+                pass
+        stats.incr('foo', 5)
+        stats.log_timing('bar', 20)
+        stats.set_gauge('baz', 3)
+        stats.set_gauge('baz', 4)
+
+        assert self.sink.packets(timeout=0.05) == []
+        client.flush()
+
+        packets = self.sink.packets()
+        assert len(packets) == 1
+        # every timing is sent
+        assert sorted(packets[0].split('\n')) == ['changes.bar:0|ms'] * 10 + [
+            'changes.bar:20|ms',
+            'changes.baz:4|g',
+            'changes.foo:15|c',
+        ]
+
+        # and starts over
+        client.flush()
+        assert self.sink.packets(timeout=0.05) == []
+
+    def test_packs_datagrams(self):
+        client = self.get_client(max_packet_size=100)
+        for n in range(20):
+            client.incr('key_{:02d}'.format(n))
+        client.flush()
+
+        packets = self.sink.packets()
+        assert len(packets) == 3
+        assert all(len(p) <= 100 for p in packets)
+        assert sorted(l for p in packets for l in p.split('\n')) == [
+            'key_{:02d}:1|c'.format(n) for n in range(20)]
+
+    def test_drops(self):
+        client = self.get_client(max_buffered=3)
+        client.incr('foo')
+        client.timing('bar', 10)
+        client.timing('bar', 10)
+        client.incr('baz')
+        client.timing('bar', 20)
+        # already buffered, so not dropped
+        client.incr('foo')
+        assert client.dropped == 2
+        client.flush()
+
+        assert sorted(self.sink.lines()) == [
+            'bar:10|ms',
+            'bar:10|ms',
+            'foo:2|c',
+            'statsd_dropped:2|c',
+        ]
+        assert client.dropped == 0
+
+    def test_flushes_in_background(self):
+        client = self.get_client(flush_interval=0.05)
+        client.incr('foo')
+        time.sleep(0.2)
+
+        assert self.sink.lines(timeout=0.5) == ['foo:1|c']
+
+
+class StatsReporterTest(TestCase):
+    def get_app(self, **config):
+        app = Flask(__name__)
+        app.config.update(STATSD_PREFIX='changes', STATSD_PORT=8125, **config)
+        return app
+
+    def test_aggregates_when_configured(self):
+        reporter = StatsReporter(self.get_app(
+            STATSD_HOST='localhost', STATSD_FLUSH_INTERVAL=1,
+            STATSD_MAX_PACKET_SIZE=512, STATSD_MAX_BUFFERED=10))
+        assert isinstance(reporter.stats()._client, AggregatingStatsClient)
+
+        reporter = StatsReporter(self.get_app(STATSD_HOST='localhost', STATSD_FLUSH_INTERVAL=0))
+        assert not isinstance(reporter.stats()._client, AggregatingStatsClient)
@@ -5,15 +5,17 @@ from mock import patch
 from datetime import datetime
 from uuid import uuid4
 
+from changes.config import db
 from changes.constants import Status
-from changes.jobs.cleanup_tasks import cleanup_tasks, CHECK_TIME
+from changes.jobs import cleanup_tasks as cleanup_tasks_module
+from changes.jobs.cleanup_tasks import cleanup_tasks, CHECK_TIME, EXPIRE_TIME
 from changes.models.task import Task
 from changes.testutils import TestCase
 
 
 class CleanupTasksTest(TestCase):
-    @patch('changes.config.queue.delay')
-    def test_queues_jobs(self, mock_delay):
+    @patch('changes.config.queue.delay_many')
+    def test_queues_jobs(self, mock_delay_many):
         now = datetime.utcnow()
         old_dt = now - (CHECK_TIME * 2)
 
@@ -41,15 +43,71 @@ class CleanupTasksTest(TestCase):
 
         cleanup_tasks()
 
-        mock_delay.assert_called_once_with(
-            'cleanup_tasks',
-            kwargs={
+        mock_delay_many.assert_called_once_with([
+            ('cleanup_tasks', {
                 'task_id': task.task_id.hex,
                 'parent_task_id': None,
                 'foo': 'bar',
-            },
-        )
+            }),
+        ])
 
+        # the job updates tasks in bulk, bypassing the session
+        db.session.expire(task)
         task = Task.query.get(task.id)
 
         assert task.date_modified > old_dt
+
+    @patch.object(cleanup_tasks_module, 'REQUEUE_LIMIT_PER_TASK_NAME', 2)
+    @patch.object(cleanup_tasks_module, 'REQUEUE_BATCH_SIZE', 2)
+    @patch('changes.config.queue.delay_many')
+    def test_requeue_limit_per_task_name(self, mock_delay_many):
+        now = datetime.utcnow()
+        old_dt = now - (CHECK_TIME * 2)
+
+        for _ in range(3):
+            self.create_task(task_name='sync_job', task_id=uuid4(),
+                             date_created=old_dt, status=Status.queued,
+                             data={'kwargs': {}})
+        self.create_task(task_name='sync_build', task_id=uuid4(),
+                         date_created=old_dt, status=Status.queued,
+                         data={'kwargs': {}})
+
+        with patch('changes.config.statsreporter.stats') as mock_stats:
+            cleanup_tasks()
+
+        requeued = [name for call in mock_delay_many.call_args_list
+                    for name, _ in call[0][0]]
+        assert sorted(requeued) == ['sync_build', 'sync_job', 'sync_job']
+        # one publish per batch
+        assert mock_delay_many.call_count == 2
+
+        # the one left out is still stale, so the next run picks it up
+        assert Task.query.filter(Task.date_modified == old_dt).count() == 1
+
+        incr = mock_stats.return_value.incr
+        incr.assert_any_call('tasks_requeued', 3)
+        incr.assert_any_call('tasks_requeued_sync_job', 2)
+        incr.assert_any_call('tasks_requeued_sync_build', 1)
+
+    @patch.object(cleanup_tasks_module, 'DELETE_BATCH_SIZE', 2)
+    @patch('changes.config.queue.delay_many')
+    def test_deletes_in_batches(self, mock_delay_many):
+        now = datetime.utcnow()
+        old_dt = now - (EXPIRE_TIME * 2)
+
+        for name in ('sync_job', 'sync_job', 'sync_job', 'sync_build'):
+            self.create_task(task_name=name, task_id=uuid4(),
+                             date_created=old_dt, status=Status.finished)
+        recent = self.create_task(task_name='sync_job', task_id=uuid4(),
+                                  date_created=now, status=Status.finished)
+
+        with patch('changes.config.statsreporter.stats') as mock_stats:
+            cleanup_tasks()
+
+        assert not mock_delay_many.called
+        assert [t.id for t in Task.query.all()] == [recent.id]
+
+        incr = mock_stats.return_value.incr
+        incr.assert_any_call('tasks_deleted', 4)
+        incr.assert_any_call('tasks_deleted_sync_job', 3)
+        incr.assert_any_call('tasks_deleted_sync_build', 1)
@@ -2,8 +2,10 @@ from __future__ import absolute_import
 
 from datetime import datetime, timedelta
 
-from changes.models.test import TestCase
-from changes.jobs.delete_old_data import clean_project_tests
+from changes.config import db
+from changes.models.test import TEST_PARTITIONING, TEST_PARTITIONINGS, TestCase
+from changes.models.testmessage import TestMessage
+from changes.jobs.delete_old_data import clean_project_tests, delete_old_data_limited, drop_old_test_partitions
 from changes.testutils import TestCase as BaseTestCase
 
 
@@ -102,3 +104,58 @@ class DeleteOldDataTest(BaseTestCase):
         ).all()
 
         assert len(cases) == 2
+
+
+class PartitionedDeleteOldDataTest(BaseTestCase):
+    def setUp(self):
+        super(PartitionedDeleteOldDataTest, self).setUp()
+        self.now = datetime.utcnow()
+        project = self.create_project()
+        self.create_project_option(project, 'history.test-retention-days', 10)
+        self.short_job = self.create_job(self.create_build(project))
+        self.long_job = self.create_job(self.create_build(self.create_project()))
+
+    def partition(self):
+        for partitioning in TEST_PARTITIONINGS:
+            partitioning.create()
+            partitioning.copy()
+            partitioning.swap(since=self.now)
+
+    def test_drop_old_test_partitions(self):
+        expired = self.create_test(self.long_job, date_created=self.now - timedelta(days=140))
+        kept = self.create_test(self.long_job, date_created=self.now - timedelta(days=100))
+        step = self.create_jobstep(self.create_jobphase(self.long_job))
+        message = TestMessage(test=expired, artifact=self.create_artifact(step, 'junit.xml'),
+                              label='stdout', length=1)
+        db.session.add(message)
+        db.session.commit()
+
+        # nothing to do until the tables are partitioned
+        drop_old_test_partitions(self.now)
+        assert TestCase.query.count() == 2
+
+        self.partition()
+        drop_old_test_partitions(self.now)
+
+        assert [t.id for t in TestCase.query.all()] == [kept.id]
+        # message partitions go by their own date_created
+        assert TestMessage.query.count() == 1
+        # and there are partitions ready for new tests
+        assert TEST_PARTITIONING.partitions()[-1].start > self.now
+
+    def test_clean_project_tests_fallback(self):
+        short_old = self.create_test(self.short_job, date_created=self.now - timedelta(days=11))
+        short_new = self.create_test(self.short_job, date_created=self.now - timedelta(days=9))
+        long_old = self.create_test(self.long_job, date_created=self.now - timedelta(days=11))
+        step = self.create_jobstep(self.create_jobphase(self.short_job))
+        message = TestMessage(test=short_old, artifact=self.create_artifact(step, 'junit.xml'),
+                              label='stdout', length=1)
+        db.session.add(message)
+        db.session.commit()
+        self.partition()
+
+        delete_old_data_limited(timedelta(days=3), self.now)
+
+        # only the project with a shorter retention than others needs deletes
+        assert sorted(t.id for t in TestCase.query.all()) == sorted([short_new.id, long_old.id])
+        assert TestMessage.query.count() == 0
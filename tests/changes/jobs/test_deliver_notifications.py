@@ -0,0 +1,25 @@
+from __future__ import absolute_import
+
+import mock
+
+from datetime import datetime, timedelta
+
+from changes.config import db
+from changes.jobs.deliver_notifications import sweep_notifications
+from changes.models.notification import Notification, NotificationStatus
+from changes.testutils import TestCase
+
+
+class SweepNotificationsTest(TestCase):
+    @mock.patch('changes.config.queue.delay_many')
+    def test_simple(self, delay_many):
+        db.session.add(Notification(destination='mail', data={}))
+        db.session.add(Notification(destination='mail', data={}))
+        db.session.add(Notification(destination='analytics', data={},
+                                    date_next_attempt=datetime.utcnow() + timedelta(minutes=1)))
+        db.session.add(Notification(destination='phabricator', data={}, status=NotificationStatus.sent))
+        db.session.commit()
+
+        sweep_notifications()
+
+        delay_many.assert_called_once_with([('deliver_notifications', {'destination': 'mail'})])
@@ -0,0 +1,22 @@
+from __future__ import absolute_import
+
+from datetime import datetime
+
+from changes.config import db
+from changes.constants import Status
+from changes.jobs.flush_heartbeats import flush_heartbeats
+from changes.lib import heartbeats
+from changes.testutils import TestCase
+
+
+class FlushHeartbeatsTest(TestCase):
+    def test_simple(self):
+        project = self.create_project()
+        jobphase = self.create_jobphase(self.create_job(self.create_build(project)))
+        jobstep = self.create_jobstep(jobphase, status=Status.in_progress)
+        heartbeats.record(jobstep.id, datetime(2016, 10, 12, 10))
+
+        flush_heartbeats()
+
+        db.session.expire(jobstep)
+        assert jobstep.last_heartbeat == datetime(2016, 10, 12, 10)
@@ -0,0 +1,36 @@
+from __future__ import absolute_import
+
+from datetime import datetime
+
+from changes.constants import Status
+from changes.jobs.seal_logs import seal_logs, MIN_AGE
+from changes.models.log import LogChunk, LogSegment
+from changes.testutils import TestCase
+
+
+class SealLogsTest(TestCase):
+    def create_step_log(self, **kwargs):
+        project = self.create_project()
+        build = self.create_build(project)
+        job = self.create_job(build)
+        jobphase = self.create_jobphase(job)
+        jobstep = self.create_jobstep(jobphase, **kwargs)
+        source = self.create_logsource(step=jobstep, name='console')
+        self.create_logchunk(source, text='a' * 100, offset=0)
+        self.create_logchunk(source, text='b' * 100, offset=100)
+        return source
+
+    def test_simple(self):
+        now = datetime.utcnow()
+        old = self.create_step_log(status=Status.finished, date_finished=now - MIN_AGE * 2)
+        recent = self.create_step_log(status=Status.finished, date_finished=now)
+        running = self.create_step_log(status=Status.in_progress)
+
+        seal_logs()
+
+        assert old.sealed_size == 200
+        assert LogChunk.query.filter(LogChunk.source_id == old.id).count() == 0
+        assert LogSegment.query.filter(LogSegment.source_id == old.id).count() == 1
+        for source in (recent, running):
+            assert source.sealed_size == 0
+            assert LogChunk.query.filter(LogChunk.source_id == source.id).count() == 2
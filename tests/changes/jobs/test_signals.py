@@ -1,8 +1,13 @@
+import pytest
+
 from mock import Mock, patch
 
 from flask import current_app
 
-from changes.jobs.signals import fire_signal, run_event_listener
+from changes.jobs.signals import (
+    dispatch_signal, fire_signal, run_event_listener, run_untracked_event_listener
+)
+from changes.models.task import Task
 from changes.testutils import TestCase
 
 
@@ -13,6 +18,9 @@ class SignalTestBase(TestCase):
         current_app.config['EVENT_LISTENERS'] = (
             ('mock.Mock', 'test.signal'),
             ('mock.Mock', 'test.signal2'),
+            ('mock.MagicMock', 'test.signal', {'tracked': True}),
+            ('mock.NonCallableMock', 'test.signal', {'inline': True}),
+            ('mock.PropertyMock', 'test.signal', {'dedupe': ('foo',)}),
         )
 
     def tearDown(self):
@@ -20,17 +28,78 @@ class SignalTestBase(TestCase):
         super(SignalTestBase, self).tearDown()
 
 
+class DispatchSignalTest(SignalTestBase):
+    @patch('changes.jobs.signals.import_string')
+    @patch('changes.jobs.signals.queue')
+    def test_simple(self, mock_queue, mock_import_string):
+        dispatch_signal(signal='test.signal', kwargs={'foo': 'bar'})
+
+        # queued together
+        assert mock_queue.delay_many.call_count == 1
+        (tasks,), _ = mock_queue.delay_many.call_args
+        assert [(name, kwargs['listener']) for name, kwargs in tasks] == [
+            ('run_untracked_event_listener', 'mock.Mock'),
+            ('run_event_listener', 'mock.MagicMock'),
+            ('run_untracked_event_listener', 'mock.PropertyMock'),
+        ]
+        assert 'task_id' not in tasks[0][1]
+        assert tasks[0][1]['kwargs'] == {'foo': 'bar'}
+
+        # only tracked listeners get a Task
+        task = Task.query.filter(Task.task_name == 'run_event_listener').one()
+        assert task.task_id.hex == tasks[1][1]['task_id']
+        assert task.data['kwargs'] == {
+            'listener': 'mock.MagicMock',
+            'signal': 'test.signal',
+            'kwargs': {'foo': 'bar'},
+        }
+
+        # and inline listeners are run there and then
+        mock_import_string.assert_called_once_with('mock.NonCallableMock')
+        mock_import_string.return_value.assert_called_once_with(foo='bar')
+
+    @patch('changes.jobs.signals.import_string')
+    @patch('changes.jobs.signals.queue')
+    def test_inline_failure(self, mock_queue, mock_import_string):
+        mock_import_string.return_value.side_effect = Exception('oops')
+
+        dispatch_signal(signal='test.signal', kwargs={'foo': 'bar'})
+
+        assert mock_queue.delay_many.call_count == 1
+
+    @patch('changes.jobs.signals.queue')
+    def test_dedupe(self, mock_queue):
+        dispatch_signal(signal='test.signal2', kwargs={'foo': 'bar'})
+        dispatch_signal(signal='test.signal', kwargs={'foo': 'bar'})
+        dispatch_signal(signal='test.signal', kwargs={'foo': 'bar'})
+        dispatch_signal(signal='test.signal', kwargs={'foo': 'baz'})
+
+        listeners = [
+            [kwargs['listener'] for _, kwargs in call[0][0]]
+            for call in mock_queue.delay_many.call_args_list
+        ]
+        assert [l.count('mock.PropertyMock') for l in listeners] == [0, 1, 0, 1]
+
+    @patch('changes.jobs.signals.queue')
+    def test_dedupe_publish_failure(self, mock_queue):
+        mock_queue.delay_many.side_effect = Exception('broker down')
+        with pytest.raises(Exception):
+            dispatch_signal(signal='test.signal', kwargs={'foo': 'bar'})
+
+        # it wasn't queued, so it isn't deduped when fired again
+        mock_queue.delay_many.side_effect = None
+        dispatch_signal(signal='test.signal', kwargs={'foo': 'bar'})
+        (tasks,), _ = mock_queue.delay_many.call_args
+        assert 'mock.PropertyMock' in [task_kwargs['listener'] for name, task_kwargs in tasks]
+
+
 class FireSignalTest(SignalTestBase):
-    @patch('changes.jobs.signals.run_event_listener')
-    def test_simple(self, mock_run_event_listener):
+    @patch('changes.jobs.signals.dispatch_signal')
+    def test_simple(self, mock_dispatch_signal):
         with patch.object(fire_signal, 'allow_absent_from_db', True):
             fire_signal(signal='test.signal', kwargs={'foo': 'bar'})
 
-        mock_run_event_listener.delay.assert_called_once_with(
-            listener='mock.Mock',
-            signal='test.signal',
-            kwargs={'foo': 'bar'},
-        )
+        mock_dispatch_signal.assert_called_once_with('test.signal', {'foo': 'bar'})
 
 
 class RunEventListenerTest(SignalTestBase):
@@ -49,3 +118,16 @@ class RunEventListenerTest(SignalTestBase):
         mock_import_string.assert_called_once_with('mock.Mock')
 
         mock_listener.assert_called_once_with(foo='bar')
+
+    @patch('changes.jobs.signals.import_string')
+    def test_untracked(self, mock_import_string):
+        mock_listener = Mock()
+        mock_import_string.return_value = mock_listener
+
+        run_untracked_event_listener(
+            listener='mock.Mock',
+            signal='test.signal',
+            kwargs={'foo': 'bar'},
+        )
+
+        mock_listener.assert_called_once_with(foo='bar')
@@ -4,7 +4,8 @@ from datetime import datetime
 from mock import patch
 
 from changes.constants import Status, Result
-from changes.config import db
+from changes.config import db, redis
+from changes.lib import build_context_lib
 from changes.models.build import Build
 from changes.models.itemstat import ItemStat
 from changes.jobs.sync_build import sync_build
@@ -89,6 +90,13 @@ class SyncBuildTest(TestCase):
         ).first()
         assert stat.value == 1
 
+        # shared with the build.finished listeners, with the aggregated stats
+        snapshot = build_context_lib.BuildSnapshot.loads(
+            redis.get(build_context_lib.SNAPSHOT_KEY.format(build.id.hex)))
+        assert snapshot.build_id == build.id.hex
+        assert snapshot.item_stats['tests_missing'] == 1
+        assert sorted(j['id'] for j in snapshot.jobs) == sorted([job_a.id.hex, job_b.id.hex])
+
     @patch('changes.jobs.sync_build.datetime')
     def test_finished_no_jobs(self, sync_build_datetime):
         project = self.create_project()
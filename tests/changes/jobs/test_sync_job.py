@@ -81,11 +81,11 @@ class SyncJobTest(TestCase):
 
         assert task.status == Status.in_progress
 
-    @mock.patch('changes.jobs.sync_job.fire_signal')
+    @mock.patch('changes.jobs.sync_job.dispatch_signal')
     @mock.patch('changes.jobs.sync_job.queue.delay')
     @mock.patch.object(HistoricalImmutableStep, 'get_implementation')
     def test_finished(self, get_implementation, queue_delay,
-                      mock_fire_signal):
+                      mock_dispatch_signal):
         implementation = mock.Mock()
         get_implementation.return_value = implementation
 
@@ -135,7 +135,7 @@ class SyncJobTest(TestCase):
             'plan_id': self.plan.id.hex,
         }, countdown=1)
 
-        mock_fire_signal.delay.assert_any_call(
+        mock_dispatch_signal.assert_any_call(
             signal='job.finished',
             kwargs={'job_id': job.id.hex},
         )
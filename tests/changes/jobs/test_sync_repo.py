@@ -12,10 +12,10 @@ from changes.vcs.base import Vcs, RevisionResult
 
 
 class SyncRepoTest(TestCase):
-    @mock.patch('changes.jobs.sync_repo.fire_signal')
+    @mock.patch('changes.jobs.sync_repo.dispatch_signal')
     @mock.patch('changes.models.repository.Repository.get_vcs')
     @mock.patch('changes.config.queue.delay')
-    def test_simple(self, queue_delay, get_vcs_backend, mock_fire_signal):
+    def test_simple(self, queue_delay, get_vcs_backend, mock_dispatch_signal):
         vcs_backend = mock.MagicMock(spec=Vcs)
 
         def log(parent, limit, first_parent):
@@ -57,7 +57,7 @@ class SyncRepoTest(TestCase):
             'parent_task_id': None,
         }, countdown=20)
 
-        mock_fire_signal.delay.assert_any_call(
+        mock_dispatch_signal.assert_any_call(
             signal='revision.created',
             kwargs={
                 'repository_id': repo.id.hex,
@@ -65,10 +65,10 @@ class SyncRepoTest(TestCase):
             },
         )
 
-    @mock.patch('changes.jobs.sync_repo.fire_signal')
+    @mock.patch('changes.jobs.sync_repo.dispatch_signal')
     @mock.patch('changes.models.repository.Repository.get_vcs')
     @mock.patch('changes.config.queue.delay')
-    def test_with_existing_revision(self, queue_delay, get_vcs_backend, mock_fire_signal):
+    def test_with_existing_revision(self, queue_delay, get_vcs_backend, mock_dispatch_signal):
         """
         Ensure that sync_repo creates and fires signals for existing revisions
         only if we haven't done so before and there are branches.
@@ -138,7 +138,7 @@ class SyncRepoTest(TestCase):
         assert repo.last_update is not None
 
         for i in range(4):
-            mock_fire_signal.delay.assert_any_call(
+            mock_dispatch_signal.assert_any_call(
                 signal='revision.created',
                 kwargs={
                     'repository_id': repo.id.hex,
@@ -146,11 +146,11 @@ class SyncRepoTest(TestCase):
                 },
             )
 
-        assert mock_fire_signal.delay.call_count == 4
+        assert mock_dispatch_signal.call_count == 4
 
         # Now all the revisions have been handled.
         # Another call to sync_repo should do nothing.
-        mock_fire_signal.delay.call_count = 0
+        mock_dispatch_signal.call_count = 0
         with mock.patch.object(sync_repo, 'allow_absent_from_db', True):
             sync_repo(repo_id=repo.id.hex, task_id=repo.id.hex)
-        assert mock_fire_signal.delay.call_count == 0
+        assert mock_dispatch_signal.call_count == 0
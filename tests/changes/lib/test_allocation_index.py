@@ -0,0 +1,160 @@
+from __future__ import absolute_import
+
+from datetime import datetime, timedelta
+
+from changes.config import db, redis
+from changes.constants import Status
+from changes.lib import allocation_index
+from changes.models.build import BuildPriority
+from changes.testutils import TestCase
+
+
+class AllocationIndexTestCase(TestCase):
+    def queued(self, cluster=None):
+        return {
+            priority: redis.zrange(allocation_index._queue_key(cluster, priority), 0, -1)
+            for priority in allocation_index.PRIORITIES
+            if redis.zcard(allocation_index._queue_key(cluster, priority))
+        }
+
+    def active_count(self, project):
+        return int(redis.hget(allocation_index.ACTIVE_COUNTS_KEY, project.id.hex) or 0)
+
+    def test_tracks_pending_jobsteps(self):
+        project = self.create_project()
+        build = self.create_build(project)
+        job = self.create_job(build, status=Status.queued)
+        jobphase = self.create_jobphase(job)
+        jobstep = self.create_jobstep(jobphase, status=Status.pending_allocation, cluster='foo')
+        self.create_jobstep(jobphase, status=Status.unknown, cluster='foo')
+
+        assert self.queued('foo') == {BuildPriority.default: [jobstep.id.hex]}
+
+        build.priority = BuildPriority.high
+        db.session.add(build)
+        db.session.commit()
+        assert self.queued('foo') == {BuildPriority.high: [jobstep.id.hex]}
+
+        jobstep.cluster = 'bar'
+        db.session.add(jobstep)
+        db.session.commit()
+        assert self.queued('foo') == {}
+        assert self.queued('bar') == {BuildPriority.high: [jobstep.id.hex]}
+
+        jobstep.status = Status.allocated
+        db.session.add(jobstep)
+        db.session.commit()
+        assert self.queued('bar') == {}
+
+    def test_tracks_active_jobs(self):
+        project = self.create_project()
+        build = self.create_build(project)
+        job = self.create_job(build, status=Status.queued)
+        assert self.active_count(project) == 0
+
+        job.status = Status.in_progress
+        db.session.add(job)
+        db.session.commit()
+        assert self.active_count(project) == 1
+
+        # counts are per job, not per change
+        job.status = Status.allocated
+        db.session.add(job)
+        db.session.commit()
+        self.create_job(build, status=Status.in_progress)
+        assert self.active_count(project) == 2
+
+        job.status = Status.finished
+        db.session.add(job)
+        db.session.commit()
+        assert self.active_count(project) == 1
+
+    def test_rollback_discards_changes(self):
+        project = self.create_project()
+        build = self.create_build(project)
+        job = self.create_job(build)
+        jobphase = self.create_jobphase(job)
+        jobstep = self.create_jobstep(jobphase, status=Status.unknown)
+
+        db.session.begin_nested()
+        jobstep.status = Status.pending_allocation
+        db.session.add(jobstep)
+        db.session.flush()
+        db.session.rollback()
+        db.session.commit()
+
+        assert self.queued() == {}
+
+    def test_rebuild(self):
+        project = self.create_project()
+        build = self.create_build(project)
+        job = self.create_job(build, status=Status.in_progress)
+        jobphase = self.create_jobphase(job)
+        jobstep = self.create_jobstep(jobphase, status=Status.pending_allocation)
+        redis.flushdb()
+
+        assert not allocation_index.is_ready()
+        assert allocation_index.ensure_ready()
+        assert allocation_index.is_ready()
+        assert redis.ttl(allocation_index.READY_KEY) > 1
+        assert self.queued() == {BuildPriority.default: [jobstep.id.hex]}
+        assert self.active_count(project) == 1
+
+    def test_find_next_jobsteps(self):
+        now = datetime.utcnow()
+        busy_project = self.create_project()
+        for _ in range(allocation_index.MAX_ACTIVE_JOBS_PER_PROJECT):
+            self.create_job(self.create_build(busy_project), status=Status.in_progress)
+        busy_jobphase = self.create_jobphase(self.create_job(
+            self.create_build(busy_project), status=Status.queued))
+        busy = self.create_jobstep(busy_jobphase, status=Status.pending_allocation,
+                                   date_created=now - timedelta(minutes=10))
+
+        project = self.create_project()
+        unstarted_jobphase = self.create_jobphase(self.create_job(
+            self.create_build(project), status=Status.queued))
+        unstarted = self.create_jobstep(unstarted_jobphase, status=Status.pending_allocation,
+                                        date_created=now - timedelta(minutes=5))
+        started_jobphase = self.create_jobphase(self.create_job(
+            self.create_build(project), status=Status.in_progress))
+        started = self.create_jobstep(started_jobphase, status=Status.pending_allocation,
+                                      date_created=now - timedelta(minutes=1))
+        urgent_jobphase = self.create_jobphase(self.create_job(
+            self.create_build(project, priority=BuildPriority.high), status=Status.queued))
+        urgent = self.create_jobstep(urgent_jobphase, status=Status.pending_allocation,
+                                     date_created=now)
+
+        # as in the SQL fallback, jobs that have started come first regardless of priority
+        assert allocation_index.find_next_jobsteps(10) == [started, urgent, unstarted, busy]
+        assert allocation_index.find_next_jobsteps(2) == [started, urgent]
+
+    def test_find_next_jobsteps_removes_stale(self):
+        project = self.create_project()
+        jobphase = self.create_jobphase(self.create_job(self.create_build(project)))
+        jobstep = self.create_jobstep(jobphase, status=Status.pending_allocation)
+
+        # e.g. a change made without the listeners
+        db.session.query(type(jobstep)).filter_by(id=jobstep.id).update(
+            {'status': Status.allocated}, synchronize_session='fetch')
+        db.session.commit()
+        assert self.queued() == {BuildPriority.default: [jobstep.id.hex]}
+
+        assert allocation_index.find_next_jobsteps(10) == []
+        assert self.queued() == {}
+
+    def test_claim_and_requeue(self):
+        project = self.create_project()
+        jobphase = self.create_jobphase(self.create_job(self.create_build(project)))
+        jobstep_a = self.create_jobstep(jobphase, status=Status.pending_allocation)
+        jobstep_b = self.create_jobstep(jobphase, status=Status.pending_allocation)
+        missing = self.create_jobstep(jobphase, status=Status.unknown)
+
+        # all or nothing
+        assert allocation_index.claim([jobstep_a.id.hex, missing.id.hex]) == [missing.id.hex]
+        assert len(self.queued()[BuildPriority.default]) == 2
+
+        assert allocation_index.claim([jobstep_a.id.hex, jobstep_b.id.hex]) == []
+        assert self.queued() == {}
+
+        allocation_index.requeue([jobstep_a.id, jobstep_b.id, missing.id])
+        assert sorted(self.queued()[BuildPriority.default]) == sorted([jobstep_a.id.hex, jobstep_b.id.hex])
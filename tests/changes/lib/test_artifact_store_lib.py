@@ -7,6 +7,18 @@ import requests
 import responses
 from changes.testutils.cases import TestCase
 
+ARTIFACT = {
+    'bucketId': 'bbbbb',
+    'dateCreated': '2016-06-15T18:18:30.560047Z',
+    'id': 5,
+    'name': 'arti',
+    's3URL': '',
+    'size': 0,
+    'state': 2,
+    'deadlineMins': 30,
+    'relativePath': 'arti',
+}
+
 
 class ArtifactStoreClientTestCase(TestCase):
     @responses.activate
@@ -97,6 +109,58 @@ class ArtifactStoreClientTestCase(TestCase):
         # Should fail immediately
         assert len(responses.calls) == 1
 
+    @responses.activate
+    def test_append_artifact_chunks(self):
+        client = artifact_store_lib.ArtifactStoreClient('http://artifactstore:1234')
+        written = []
+
+        def append(request):
+            start, end = request.headers['Content-Range'][len('bytes '):-len('/*')].split('-')
+            assert int(start) == sum(len(w) for w in written)
+            assert int(end) == int(start) + len(request.body) - 1
+            assert request.headers['Content-Type'] == 'application/octet-stream'
+            written.append(request.body)
+            return 200, {}, json.dumps(dict(ARTIFACT, size=int(end) + 1))
+
+        responses.add_callback(responses.POST, 'http://artifactstore:1234/buckets/bbbbb/artifacts/arti',
+                               callback=append)
+
+        chunks = ['%04d\n' % n for n in range(1000)]
+        offsets = list(client.append_artifact_chunks('bbbbb', 'arti', 0, chunks, batch_size=2000))
+
+        assert offsets == [2000, 4000, 5000]
+        assert ''.join(written) == ''.join(chunks)
+        assert len(responses.calls) == 3
+
+    @responses.activate
+    def test_append_artifact_chunks_resume(self):
+        client = artifact_store_lib.ArtifactStoreClient('http://artifactstore:1234')
+        written = ['a' * 10]
+
+        def append(request):
+            start = int(request.headers['Content-Range'][len('bytes '):].split('-')[0])
+            size = sum(len(w) for w in written)
+            if start != size:
+                return 400, {}, '{"error": "bad offset"}'
+            written.append(request.body)
+            return 200, {}, json.dumps(dict(ARTIFACT, size=size + len(request.body)))
+
+        responses.add_callback(responses.POST, 'http://artifactstore:1234/buckets/bbbbb/artifacts/arti',
+                               callback=append)
+        responses.add_callback(responses.GET, 'http://artifactstore:1234/buckets/bbbbb/artifacts/arti',
+                               callback=lambda r: (200, {}, json.dumps(dict(
+                                   ARTIFACT, size=sum(len(w) for w in written)))))
+
+        # the first 4 bytes of the batch were written by an earlier attempt
+        offsets = list(client.append_artifact_chunks('bbbbb', 'arti', 6, ['aaaabbbb']))
+
+        assert offsets == [14]
+        assert ''.join(written) == 'a' * 10 + 'bbbb'
+
+        # anything else is an error
+        with self.assertRaises(requests.HTTPError):
+            list(client.append_artifact_chunks('bbbbb', 'arti', 20, ['cccc']))
+
 
 @pytest.mark.skipif(True, reason='needs a test artifact store at artifacts:8001')
 class ArtifactStoreIntegrationTestCase(TestCase):
@@ -0,0 +1,70 @@
+from __future__ import absolute_import
+
+from datetime import datetime, timedelta
+
+from changes.config import db
+from changes.constants import Result, Status
+from changes.lib import base_commit_failures
+from changes.testutils import TestCase
+
+
+class GetFailingTestHashesTest(TestCase):
+    def setUp(self):
+        super(GetFailingTestHashesTest, self).setUp()
+        self.project = self.create_project()
+        self.source = self.create_source(self.project, revision_sha='a' * 40)
+
+    def create_failures(self, names, **kwargs):
+        kwargs.setdefault('status', Status.finished)
+        build = self.create_build(self.project, source=self.source, **kwargs)
+        job = self.create_job(build)
+        self.create_test(job, name='passing', result=Result.passed)
+        return [self.create_test(job, name=name, result=Result.failed) for name in names]
+
+    def test_latest_build(self):
+        now = datetime.utcnow()
+        self.create_failures(['foo'], date_created=now - timedelta(hours=1))
+        tests = self.create_failures(['foo', 'bar'], date_created=now)
+        # another job of the same build, with the same failure
+        self.create_test(self.create_job(tests[0].job.build), name='foo', result=Result.failed)
+        # builds of patches to the commit don't count
+        patch_source = self.create_source(self.project, revision_sha='a' * 40, patch=self.create_patch())
+        self.create_build(self.project, source=patch_source, date_created=now + timedelta(hours=1),
+                          status=Status.finished)
+        # nor do rebuilds still in progress
+        self.create_failures(['baz'], date_created=now + timedelta(hours=1), status=Status.in_progress)
+
+        assert base_commit_failures.get_failing_test_hashes(self.project.id, 'a' * 40) == {
+            t.name_sha for t in tests}
+
+    def test_no_failures(self):
+        self.create_failures([])
+        assert base_commit_failures.get_failing_test_hashes(self.project.id, 'a' * 40) == set()
+
+    def test_no_base_build(self):
+        assert base_commit_failures.get_failing_test_hashes(self.project.id, 'a' * 40) is None
+        # or one without jobs
+        source = self.create_source(self.project, revision_sha='b' * 40)
+        self.create_build(self.project, source=source, status=Status.finished)
+        assert base_commit_failures.get_failing_test_hashes(self.project.id, 'b' * 40) is None
+
+    def test_cached(self):
+        tests = self.create_failures(['foo'])
+        assert base_commit_failures.get_failing_test_hashes(self.project.id, 'a' * 40) == {
+            tests[0].name_sha}
+
+        self.create_test(tests[0].job, name='bar', result=Result.failed)
+        assert base_commit_failures.get_failing_test_hashes(self.project.id, 'a' * 40) == {
+            tests[0].name_sha}
+
+    def test_not_cached_without_finished_build(self):
+        tests = self.create_failures(['foo'], status=Status.in_progress)
+        assert base_commit_failures.get_failing_test_hashes(self.project.id, 'a' * 40) is None
+
+        # the build finishing is picked up right away
+        build = tests[0].job.build
+        build.status = Status.finished
+        db.session.add(build)
+        db.session.commit()
+        assert base_commit_failures.get_failing_test_hashes(self.project.id, 'a' * 40) == {
+            tests[0].name_sha}
@@ -1,10 +1,17 @@
+import json
+import mock
+
 from datetime import datetime
 
-from changes.config import db
-from changes.constants import Result
+from changes.config import db, redis
+from changes.constants import Result, Status
+from changes.models.failurereason import FailureReason
 from changes.models.log import LogSource, LogChunk
+from changes.models.option import ItemOption
 from changes.lib import build_context_lib
 from changes.testutils.cases import TestCase
+from changes.testutils.helpers import override_config
+from changes.utils.http import build_web_uri
 
 
 class GetTitleTestCase(TestCase):
@@ -135,6 +142,136 @@ class BuildingContextTestCase(TestCase):
         assert context.failing_tests_count == 0
 
 
+class BuildSnapshotTestCase(TestCase):
+    def create_failing_build(self, project, **kwargs):
+        build = self.create_build(project, result=Result.failed, **kwargs)
+        job = self.create_job(build=build, result=Result.failed, label='job')
+        plan = self.create_plan(project)
+        db.session.add(ItemOption(item_id=plan.id, name='mail.notify-author', value='0'))
+        db.session.flush()
+        self.create_job_plan(job, plan)
+        phase = self.create_jobphase(job=job)
+        step = self.create_jobstep(phase=phase, result=Result.failed)
+        logsource = self.create_logsource(step=step, name='console')
+        self.create_logchunk(source=logsource, text='hello world')
+        test_case = self.create_test(job, name='foo.bar.test_baz', result=Result.failed)
+        self.create_test(job, name='foo.bar.test_qux', result=Result.passed)
+        self.create_itemstat(item_id=build.id, name='test_failures', value=1)
+        return build, test_case
+
+    def test_simple(self):
+        project = self.create_project()
+        build, test_case = self.create_failing_build(project)
+        job = build.jobs[0]
+
+        snapshot = build_context_lib.store_build_snapshot(build)
+
+        assert snapshot.build_id == build.id.hex
+        assert snapshot.parent_build_id is None
+        assert snapshot.item_stats == {'test_failures': 1}
+        assert snapshot.failure_reasons == []
+        assert snapshot.jobsteps_replaced == 0
+        (job_snapshot,) = snapshot.jobs
+        assert job_snapshot['id'] == job.id.hex
+        assert job_snapshot['label'] == 'job'
+        assert job_snapshot['result'] == 'failed'
+        assert job_snapshot['uri'] == build_web_uri(build_context_lib._get_job_uri(job))
+        assert job_snapshot['options'] == {'mail.notify-author': '0'}
+        assert job_snapshot['failing_tests'] == [{
+            'id': test_case.id.hex,
+            'name': 'foo.bar.test_baz',
+            'package': 'foo.bar',
+            'name_sha': test_case.name_sha,
+            'uri': build_web_uri(build_context_lib._get_test_case_uri(test_case)),
+            'message': '',
+        }]
+        (log,) = job_snapshot['failing_logs']
+        assert log['name'] == 'console'
+        assert log['text'] == 'hello world'
+
+        # shared, rather than computed again
+        with mock.patch.object(build_context_lib.BuildSnapshot, 'from_build') as from_build:
+            shared = build_context_lib.get_build_snapshot(build)
+        assert not from_build.called
+        assert shared.__dict__ == json.loads(json.dumps(snapshot.__dict__))
+
+    def test_not_shared(self):
+        project = self.create_project()
+        build, _ = self.create_failing_build(project)
+
+        with override_config('BUILD_SNAPSHOT_TTL', 0):
+            build_context_lib.store_build_snapshot(build)
+            assert redis.get(build_context_lib.SNAPSHOT_KEY.format(build.id.hex)) is None
+            assert build_context_lib.get_build_snapshot(build).build_id == build.id.hex
+
+    def test_parent(self):
+        project = self.create_project()
+        parent_revision = self.create_revision(repository=project.repository)
+        parent_build = self.create_build(
+            project, status=Status.finished, tags=['commit'],
+            source=self.create_source(project, revision_sha=parent_revision.sha))
+        patch = self.create_patch(repository=project.repository, parent_revision_sha=parent_revision.sha)
+        build, _ = self.create_failing_build(project, source=self.create_source(
+            project, revision_sha=parent_revision.sha, patch=patch))
+
+        snapshot = build_context_lib.get_build_snapshot(build)
+        assert snapshot.parent_build_id == parent_build.id.hex
+
+        context = build_context_lib.get_collection_context([build])
+        assert context.builds[0]['parent_build']['build'] == parent_build
+
+    def test_collection_context(self):
+        project = self.create_project()
+        build, test_case = self.create_failing_build(project)
+        build_context_lib.store_build_snapshot(build)
+
+        context = build_context_lib.get_collection_context([build])
+
+        (build_context,) = context.builds
+        assert build_context['build'] == build
+        assert build_context['failing_tests_count'] == 1
+        assert build_context['failing_logs_count'] == 1
+        (job_context,) = build_context['jobs']
+        assert job_context['job'].id == build.jobs[0].id
+        assert job_context['job'].label == 'job'
+        assert job_context['job'].result == Result.failed
+        (failing_test,) = build_context['failing_tests']
+        assert failing_test['test_case'].id == test_case.id
+        assert failing_test['test_case'].name == test_case.name
+        assert failing_test['test_case'].package == test_case.package
+        assert failing_test['test_case'].name_sha == test_case.name_sha
+
+    def test_failure_reasons_no_failures(self):
+        project = self.create_project(name='test', slug='project-slug')
+        build = self.create_build(project, result=Result.passed, target='D1',
+                                  label='Some sweet diff')
+        self.assertEquals(build_context_lib._get_failure_reasons(build), [])
+
+    def test_failure_reasons_multiple_failures(self):
+        project = self.create_project(name='test', slug='project-slug')
+        build = self.create_build(project, result=Result.failed, target='D1',
+                                  label='Some sweet diff')
+        job = self.create_job(build=build, result=Result.failed)
+        jobphase = self.create_jobphase(job)
+        jobstep = self.create_jobstep(jobphase, status=Status.finished, result=Result.failed)
+        for reason in ('missing_tests', 'timeout', 'aborted'):
+            db.session.add(FailureReason(step_id=jobstep.id, job_id=job.id, build_id=build.id, project_id=project.id,
+                                         reason=reason))
+        jobstep2 = self.create_jobstep(jobphase, status=Status.finished, result=Result.failed)
+        for reason in ('timeout', 'insufficient_politeness'):
+            db.session.add(FailureReason(step_id=jobstep2.id, job_id=job.id, build_id=build.id, project_id=project.id,
+                                         reason=reason))
+        jobstep3 = self.create_jobstep(jobphase, status=Status.finished, result=Result.infra_failed,
+                                       replacement_id=jobstep.id)
+        # shouldn't be included because jobstep3 is replaced
+        db.session.add(FailureReason(step_id=jobstep3.id, job_id=job.id, build_id=build.id,
+                                     project_id=project.id, reason='infra_reasons'))
+        db.session.commit()
+
+        self.assertEquals(build_context_lib._get_failure_reasons(build),
+                          ['aborted', 'insufficient_politeness', 'missing_tests', 'timeout'])
+
+
 class GetLogClippingTestCase(TestCase):
     def test_simple(self):
         project = self.create_project()
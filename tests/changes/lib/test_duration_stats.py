@@ -0,0 +1,112 @@
+from __future__ import absolute_import
+
+from changes.constants import Result, Status
+from changes.lib import duration_stats
+from changes.models.durationstats import DurationStats
+from changes.testutils import TestCase
+from changes.testutils.helpers import override_config
+
+
+class DurationStatsTest(TestCase):
+    def setUp(self):
+        super(DurationStatsTest, self).setUp()
+        self.project = self.create_project()
+
+    def create_build_with_tests(self, durations, result=Result.passed, **kwargs):
+        kwargs.setdefault('status', Status.finished)
+        build = self.create_build(self.project, result=result, **kwargs)
+        job = self.create_job(build)
+        for name, duration in durations.items():
+            self.create_test(job, name=name, duration=duration)
+        return build
+
+    def get_stats(self):
+        return DurationStats.query.filter(
+            DurationStats.project_id == self.project.id,
+            DurationStats.kind == duration_stats.TESTS,
+        ).first()
+
+    def test_seeds_from_last_passing_build(self):
+        self.create_build_with_tests({'foo.bar.test_baz': 50, 'foo.bar.test_bar': 25})
+        self.create_build_with_tests({'foo.bar.test_baz': 500}, result=Result.failed)
+
+        stats, avg = duration_stats.get_test_stats(self.project.slug)
+        assert avg == 37
+        assert stats == {
+            ('foo',): 75,
+            ('foo', 'bar'): 75,
+            ('foo', 'bar', 'test_baz'): 50,
+            ('foo', 'bar', 'test_bar'): 25,
+        }
+        assert self.get_stats().num_builds == 1
+
+        # and is read back from then on
+        self.create_build_with_tests({'foo.bar.test_baz': 1000})
+        assert duration_stats.get_test_stats(self.project.slug) == (stats, avg)
+
+    def test_no_builds(self):
+        assert duration_stats.get_test_stats(self.project.slug) == ({}, 0)
+        assert duration_stats.get_test_stats('no-such-project') == ({}, 0)
+        assert self.get_stats() is None
+
+    def test_record_build(self):
+        build = self.create_build_with_tests({'foo.bar.test_baz': 50, 'foo.bar.test_bar': 25})
+        duration_stats.record_build(build)
+        build = self.create_build_with_tests({'foo.bar.test_baz': 100, 'foo.bar.test_bar': 25})
+        duration_stats.record_build(build)
+        # already recorded
+        duration_stats.record_build(build)
+
+        stats, avg = duration_stats.get_test_stats(self.project.slug)
+        assert stats[('foo', 'bar', 'test_baz')] == 65
+        assert stats[('foo', 'bar', 'test_bar')] == 25
+        assert stats[('foo', 'bar')] == 90
+        assert avg == 45
+        assert self.get_stats().num_builds == 2
+        assert self.get_stats().last_build_id == build.id
+
+        with override_config('DURATION_STATS_SHARD_BY', 'p90'):
+            stats, _ = duration_stats.get_test_stats(self.project.slug)
+        # sqrt(0.7 * 50 * 15) * 1.2816
+        assert stats[('foo', 'bar', 'test_baz')] == 65 + 29
+        assert stats[('foo', 'bar', 'test_bar')] == 25
+
+    def test_record_build_ignores_other_builds(self):
+        build = self.create_build_with_tests({'foo.test_bar': 25}, tags=['commit-queue'])
+        duration_stats.record_build(build)
+        build = self.create_build_with_tests({'foo.test_bar': 25}, status=Status.in_progress)
+        duration_stats.record_build(build)
+        assert self.get_stats() is None
+
+    def test_record_build_prefers_passing_builds(self):
+        build = self.create_build_with_tests({'foo.test_bar': 10}, result=Result.failed)
+        duration_stats.record_build(build)
+        assert duration_stats.get_test_stats(self.project.slug)[0][('foo', 'test_bar')] == 10
+
+        build = self.create_build_with_tests({'foo.test_bar': 20}, result=Result.passed)
+        duration_stats.record_build(build)
+        build = self.create_build_with_tests({'foo.test_bar': 80}, result=Result.failed)
+        duration_stats.record_build(build)
+
+        stats, _ = duration_stats.get_test_stats(self.project.slug)
+        assert stats[('foo', 'test_bar')] == 20
+        assert self.get_stats().num_builds == 1
+
+    def test_record_build_forgets_old_tests(self):
+        with override_config('DURATION_STATS_MAX_AGE', 2):
+            for durations in ({'foo.test_old': 10, 'foo.test_new': 10}, {'foo.test_new': 10}, {'foo.test_new': 10}):
+                duration_stats.record_build(self.create_build_with_tests(durations))
+
+        stats, _ = duration_stats.get_test_stats(self.project.slug)
+        assert ('foo', 'test_old') not in stats
+        assert stats[('foo',)] == 10
+
+    def test_target_stats(self):
+        build = self.create_build(self.project, status=Status.finished, result=Result.passed)
+        job = self.create_job(build)
+        self.create_target(job, name='//foo:test', duration=50)
+        duration_stats.record_build(build)
+
+        assert duration_stats.get_target_stats(self.project.slug) == ({'//foo:test': 50}, 50)
+        # tests are kept separately
+        assert duration_stats.get_test_stats(self.project.slug) == ({}, 0)
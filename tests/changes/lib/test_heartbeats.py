@@ -0,0 +1,75 @@
+from __future__ import absolute_import
+
+from datetime import datetime
+
+from changes.config import db, redis
+from changes.constants import Result, Status
+from changes.lib import heartbeats
+from changes.testutils import TestCase
+
+
+class HeartbeatsTestCase(TestCase):
+    def create_step(self, **kwargs):
+        project = self.create_project()
+        jobphase = self.create_jobphase(self.create_job(self.create_build(project)))
+        return self.create_jobstep(jobphase, status=Status.in_progress, **kwargs)
+
+    def test_flush(self):
+        fresh = self.create_step(last_heartbeat=datetime(2016, 10, 12, 9))
+        stale = self.create_step(last_heartbeat=datetime(2016, 10, 12, 11))
+        heartbeats.record(fresh.id, datetime(2016, 10, 12, 10, 0, 0, 123456))
+        heartbeats.record(stale.id, datetime(2016, 10, 12, 10))
+
+        assert heartbeats.flush() == 2
+        db.session.expire_all()
+        assert fresh.last_heartbeat == datetime(2016, 10, 12, 10, 0, 0, 123456)
+        # never moved backwards
+        assert stale.last_heartbeat == datetime(2016, 10, 12, 11)
+
+        # flushed heartbeats are no longer buffered
+        assert heartbeats.get(fresh.id) is None
+        assert heartbeats.flush() == 0
+
+    def test_flush_keeps_newer_heartbeats(self):
+        step = self.create_step()
+        heartbeats.record(step.id, datetime(2016, 10, 12, 10))
+        real_execute = db.session.execute
+
+        def execute(*args, **kwargs):
+            # a heartbeat arriving mid-flush
+            heartbeats.record(step.id, datetime(2016, 10, 12, 10, 1))
+            return real_execute(*args, **kwargs)
+
+        db.session.execute = execute
+        try:
+            assert heartbeats.flush() == 1
+        finally:
+            del db.session.execute
+
+        assert heartbeats.get(step.id) == datetime(2016, 10, 12, 10, 1)
+        assert heartbeats.flush() == 1
+        db.session.expire_all()
+        assert step.last_heartbeat == datetime(2016, 10, 12, 10, 1)
+
+    def test_refresh(self):
+        step = self.create_step(last_heartbeat=datetime(2016, 10, 12, 10))
+
+        heartbeats.refresh(step)
+        assert step.last_heartbeat == datetime(2016, 10, 12, 10)
+
+        heartbeats.record(step.id, datetime(2016, 10, 12, 10, 1))
+        heartbeats.refresh(step)
+        assert step.last_heartbeat == datetime(2016, 10, 12, 10, 1)
+
+    def test_abort_forgets_check(self):
+        step = self.create_step()
+        heartbeats.mark_checked(step.id, 30)
+        assert heartbeats.is_checked(step.id)
+        assert redis.ttl(heartbeats.CHECKED_KEY.format(step.id.hex)) > 1
+
+        step.result = Result.failed
+        assert heartbeats.is_checked(step.id)
+
+        step.result = Result.aborted
+        assert not heartbeats.is_checked(step.id)
+        assert not redis.exists(heartbeats.CHECKED_KEY.format(step.id.hex))
@@ -0,0 +1,102 @@
+from __future__ import absolute_import
+
+import pytest
+
+from changes.config import db
+from changes.lib import log_segments
+from changes.models.log import LOG_CHUNK_SIZE, LogChunk, LogSegment
+from changes.testutils import TestCase
+
+
+class LogSegmentsTestCase(TestCase):
+    def create_log(self, texts):
+        project = self.create_project()
+        build = self.create_build(project)
+        job = self.create_job(build)
+        source = self.create_logsource(job=job, name='console')
+        offset = 0
+        for text in texts:
+            self.create_logchunk(source, text=text, offset=offset)
+            offset += len(text)
+        return source
+
+    def test_seal(self):
+        texts = [u'%d caf\xe9\n' % n * 500 for n in range(10)]
+        source = self.create_log(texts)
+
+        assert log_segments.seal(source, segment_size=LOG_CHUNK_SIZE, codec='zlib') == 4
+        db.session.commit()
+
+        assert source.sealed_size == len(u''.join(texts))
+        assert LogChunk.query.filter(LogChunk.source_id == source.id).count() == 0
+        segments = list(LogSegment.query.filter(
+            LogSegment.source_id == source.id,
+        ).order_by(LogSegment.offset))
+        assert [s.offset for s in segments] == [0, 10500, 21000, 31500]
+        assert sum(s.size for s in segments) == source.sealed_size
+        assert sum(len(s.data) for s in segments) < source.sealed_size / 10
+
+        assert log_segments.get_log_size(source) == source.sealed_size
+        assert u''.join(c.text for c in log_segments.get_chunks(source)) == u''.join(texts)
+
+    def test_seal_stops_at_gap(self):
+        source = self.create_log(['a' * 10, 'b' * 10])
+        self.create_logchunk(source, text='d' * 10, offset=30)
+
+        assert log_segments.seal(source, codec='zlib') == 1
+        db.session.commit()
+
+        assert source.sealed_size == 20
+        assert [c.offset for c in LogChunk.query.filter(LogChunk.source_id == source.id)] == [30]
+        assert log_segments.get_log_size(source) == 40
+
+    def test_seal_unknown_codec(self):
+        source = self.create_log(['a'])
+        with pytest.raises(ValueError):
+            log_segments.seal(source, codec='nope')
+
+    def test_get_chunks(self):
+        texts = [chr(ord('a') + n) * 3000 for n in range(20)]
+        source = self.create_log(texts)
+        log_segments.seal(source, segment_size=LOG_CHUNK_SIZE * 2, codec='zlib')
+        # part of the log is still in chunks, as while it's being written
+        self.create_logchunk(source, text='z' * 100, offset=60000)
+        full_text = u''.join(texts) + 'z' * 100
+        assert log_segments.get_log_size(source) == len(full_text)
+
+        for kwargs in ({},
+                       {'min_end': 55000},
+                       {'after': 20000},
+                       {'after': 20000, 'until': 40000},
+                       {'after': 59999},
+                       {'after': 60000}):
+            chunks = log_segments.get_chunks(source, **kwargs)
+            for chunk in chunks:
+                assert chunk.text == full_text[chunk.offset:chunk.offset + chunk.size]
+                assert log_segments._matches(chunk, kwargs.get('after'), kwargs.get('until'),
+                                             kwargs.get('min_end'))
+            # contiguous, and covering what was asked for
+            assert [c.offset for c in chunks[1:]] == [c.offset + c.size for c in chunks[:-1]]
+            if chunks:
+                assert chunks[0].offset <= max(kwargs.get('after', 0), kwargs.get('min_end', 0)) + LOG_CHUNK_SIZE
+                assert chunks[-1].offset + chunks[-1].size >= min(kwargs.get('until', len(full_text)), len(full_text))
+            else:
+                assert kwargs == {'after': 60000}
+
+    def test_get_chunks_reads_only_needed_segments(self):
+        source = self.create_log(['a' * LOG_CHUNK_SIZE] * 10)
+        log_segments.seal(source, segment_size=LOG_CHUNK_SIZE, codec='zlib')
+        db.session.commit()
+
+        chunks = log_segments.get_chunks(source, min_end=log_segments.get_log_size(source) - 10)
+        assert [c.offset for c in chunks] == [9 * LOG_CHUNK_SIZE]
+        assert chunks[0] not in db.session
+
+    def test_iter_text(self):
+        texts = [chr(ord('a') + n) * 3000 for n in range(20)]
+        source = self.create_log(texts)
+        log_segments.seal(source, segment_size=LOG_CHUNK_SIZE * 2, codec='zlib')
+        self.create_logchunk(source, text='z' * 100, offset=60000)
+        self.create_logchunk(source, text='y' * 100, offset=60100)
+
+        assert u''.join(log_segments.iter_text(source, batch_size=2)) == u''.join(texts) + 'z' * 100 + 'y' * 100
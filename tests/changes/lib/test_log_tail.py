@@ -0,0 +1,103 @@
+from __future__ import absolute_import
+
+import mock
+import pytest
+import threading
+import time
+
+from redis import RedisError
+
+from changes.config import db, redis
+from changes.lib import log_tail
+from changes.models.log import LogChunk, LogSource
+from changes.testutils import TestCase
+
+
+class LogTailTestCase(TestCase):
+    def setUp(self):
+        super(LogTailTestCase, self).setUp()
+        self.project = self.create_project()
+        self.job = self.create_job(self.create_build(self.project))
+        self.source = LogSource(job=self.job, project=self.project, name='console')
+        db.session.add(self.source)
+        db.session.commit()
+
+    def subscribe(self):
+        pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(log_tail.CHANNEL.format(self.source.id.hex))
+        self.addCleanup(pubsub.close)
+        return pubsub
+
+    def add_chunk(self, offset, size):
+        db.session.add(LogChunk(
+            job=self.job, project=self.project, source=self.source,
+            offset=offset, size=size, text='a' * size,
+        ))
+
+    def publish_later(self, size):
+        timer = threading.Timer(0.05, redis.publish, [log_tail.CHANNEL.format(self.source.id.hex), size])
+        timer.start()
+        self.addCleanup(timer.join)
+
+    def test_publish_on_commit(self):
+        pubsub = self.subscribe()
+        self.add_chunk(0, 100)
+        self.add_chunk(100, 100)
+        db.session.flush()
+        assert log_tail._next_message(pubsub, time.time() + 0.05) is None
+
+        db.session.commit()
+        assert log_tail._next_message(pubsub, time.time() + 1) == '200'
+
+        self.add_chunk(200, 100)
+        db.session.flush()
+        db.session.rollback()
+        db.session.commit()
+        assert log_tail._next_message(pubsub, time.time() + 0.05) is None
+
+    def test_next_message_buffered(self):
+        pubsub = self.subscribe()
+        redis.publish(log_tail.CHANNEL.format(self.source.id.hex), 100)
+        time.sleep(0.05)
+
+        # the message comes in the same read as the (ignored) subscribe
+        # confirmation, so it's buffered rather than waiting on the socket
+        start = time.time()
+        assert log_tail._next_message(pubsub, start + 1) == '100'
+        assert time.time() - start < 0.5
+
+    def test_wait_for_chunks(self):
+        fetch = mock.Mock(side_effect=[[], ['chunk']])
+        self.publish_later(200)
+
+        started = time.time()
+        assert log_tail.wait_for_chunks(self.source.id, 100, fetch, timeout=5) == ['chunk']
+        assert time.time() - started < 5
+        assert fetch.call_count == 2
+
+    def test_wait_for_chunks_times_out(self):
+        fetch = mock.Mock(return_value=[])
+        # no text after offset 100 yet
+        self.publish_later(100)
+
+        started = time.time()
+        assert log_tail.wait_for_chunks(self.source.id, 100, fetch, timeout=0.2) == []
+        assert time.time() - started >= 0.2
+        assert fetch.call_count == 1
+
+    def test_wait_for_chunks_without_redis(self):
+        fetch = mock.Mock(return_value=[])
+        with mock.patch('redis.client.PubSub.execute_command', side_effect=RedisError()):
+            started = time.time()
+            assert log_tail.wait_for_chunks(self.source.id, 100, fetch, timeout=5) == []
+        assert time.time() - started < 5
+        assert fetch.call_count == 1
+
+    def test_tailer_slot(self):
+        with log_tail.tailer_slot(2):
+            with log_tail.tailer_slot(2):
+                with pytest.raises(log_tail.TooManyTailers):
+                    with log_tail.tailer_slot(2):
+                        pass
+            with log_tail.tailer_slot(2):
+                pass
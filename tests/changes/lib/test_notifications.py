@@ -0,0 +1,190 @@
+from __future__ import absolute_import
+
+import json
+import mock
+
+from datetime import datetime, timedelta
+from flask import current_app
+
+from changes.config import db, redis
+from changes.lib import notifications
+from changes.models.notification import Notification, NotificationStatus
+from changes.testutils import TestCase
+from changes.testutils.helpers import override_config
+from changes.testutils.sinks import HTTPSink, SMTPSink
+
+
+class SendTest(TestCase):
+    @mock.patch('changes.lib.notifications.get_sender')
+    def test_delivers_now(self, get_sender):
+        sender = get_sender.return_value
+        notifications.send('analytics', {'foo': 'bar'})
+
+        get_sender.assert_called_once_with('analytics')
+        sender.deliver.assert_called_once_with([{'foo': 'bar'}])
+        sender.delivered.assert_called_once_with({'foo': 'bar'})
+        assert not Notification.query.first()
+
+        error = ValueError()
+        sender.deliver.side_effect = error
+        notifications.send('analytics', {'foo': 'baz'})
+        sender.failed.assert_called_once_with({'foo': 'baz'}, error)
+
+    @mock.patch('changes.config.queue.delay')
+    def test_outbox(self, queue_delay):
+        with override_config('NOTIFICATION_OUTBOX_ENABLED', True):
+            notifications.send('analytics', {'foo': 'bar'})
+
+        notification = Notification.query.one()
+        assert notification.destination == 'analytics'
+        assert notification.data == {'foo': 'bar'}
+        assert notification.status == NotificationStatus.pending
+        queue_delay.assert_called_once_with('deliver_notifications', kwargs={'destination': 'analytics'})
+
+    @mock.patch('changes.config.queue.delay')
+    def test_outbox_many(self, queue_delay):
+        with override_config('NOTIFICATION_OUTBOX_ENABLED', True):
+            notifications.send_many('analytics', [{'foo': 'bar'}, {'foo': 'baz'}])
+
+        assert sorted(n.data['foo'] for n in Notification.query) == ['bar', 'baz']
+        queue_delay.assert_called_once_with('deliver_notifications', kwargs={'destination': 'analytics'})
+
+
+class DeliverTest(TestCase):
+    def setUp(self):
+        super(DeliverTest, self).setUp()
+        self.sink = HTTPSink()
+        self.addCleanup(self.sink.close)
+
+    def create_notification(self, destination, data, **kwargs):
+        notification = Notification(destination=destination, data=data, **kwargs)
+        db.session.add(notification)
+        db.session.commit()
+        return notification
+
+    def test_batches(self):
+        other_url = self.sink.url + '/other'
+        batched = [
+            self.create_notification('analytics', {'url': self.sink.url, 'records': [1, 2]}),
+            self.create_notification('analytics', {'url': other_url, 'records': [3]}),
+            self.create_notification('analytics', {'url': self.sink.url, 'records': [4]}),
+        ]
+        # not due yet
+        self.create_notification('analytics', {'url': self.sink.url, 'records': [5]},
+                                 date_next_attempt=datetime.utcnow() + timedelta(minutes=1))
+
+        assert notifications.deliver('analytics') == 3
+
+        assert sorted((r.path, json.loads(r.body)) for r in self.sink.requests) == [
+            ('/', [1, 2, 4]),
+            ('/other', [3]),
+        ]
+        for notification in batched:
+            assert notification.status == NotificationStatus.sent
+            assert notification.num_attempts == 1
+            assert notification.date_sent
+
+    def test_batch_weight(self):
+        batched = [
+            self.create_notification('analytics', {'url': self.sink.url, 'records': [1, 2]}),
+            self.create_notification('analytics', {'url': self.sink.url, 'records': [3]}),
+            self.create_notification('analytics', {'url': self.sink.url, 'records': [4]}),
+            self.create_notification('analytics', {'url': self.sink.url, 'records': [5, 6, 7]}),
+        ]
+
+        # analytics batches are limited by their number of records
+        with override_config('ANALYTICS_POST_MAX_RECORDS', 2):
+            assert notifications.deliver('analytics') == 4
+
+        assert [json.loads(r.body) for r in self.sink.requests] == [[1, 2], [3, 4], [5, 6, 7]]
+        for notification in batched:
+            assert notification.status == NotificationStatus.sent
+
+    def test_retries(self):
+        notification = self.create_notification('analytics', {'url': self.sink.url, 'records': [1]})
+        self.sink.responses.extend([500, 502])
+
+        with override_config('NOTIFICATION_MAX_ATTEMPTS', 2):
+            notifications.deliver('analytics')
+            assert notification.status == NotificationStatus.pending
+            assert notification.num_attempts == 1
+            assert '500' in notification.last_error
+            # with jitter, from 15 to 45 seconds later
+            delay = notification.date_next_attempt - datetime.utcnow()
+            assert timedelta(seconds=10) < delay <= timedelta(seconds=45)
+
+            # not due yet
+            notifications.deliver('analytics')
+            assert notification.num_attempts == 1
+
+            notification.date_next_attempt = datetime.utcnow()
+            db.session.commit()
+            notifications.deliver('analytics')
+            assert notification.status == NotificationStatus.failed
+            assert notification.num_attempts == 2
+            assert len(self.sink.requests) == 2
+
+    def test_deadline(self):
+        batched = [
+            self.create_notification('analytics', {'url': self.sink.url, 'records': [1]}),
+            self.create_notification('analytics', {'url': self.sink.url + '/other', 'records': [2]}),
+        ]
+
+        # out of time once the first batch is delivered
+        start = datetime.utcnow()
+        late = start + timedelta(seconds=current_app.config['NOTIFICATION_LEASE'] / 2 + 1)
+        with mock.patch('changes.lib.notifications.datetime') as mock_datetime:
+            mock_datetime.utcnow.side_effect = lambda: late if self.sink.requests else start
+            assert notifications.deliver('analytics') == 1
+
+        assert len(self.sink.requests) == 1
+        assert batched[0].status == NotificationStatus.sent
+        # handed back, due then rather than when the lease is up
+        assert batched[1].status == NotificationStatus.pending
+        assert batched[1].num_attempts == 0
+        assert batched[1].date_next_attempt == late
+
+        batched[1].date_next_attempt = datetime.utcnow()
+        db.session.commit()
+        assert notifications.deliver('analytics') == 1
+        assert batched[1].status == NotificationStatus.sent
+
+    def test_concurrency_limit(self):
+        self.create_notification('analytics', {'url': self.sink.url, 'records': [1]})
+
+        with override_config('NOTIFICATION_CONCURRENCY', {'analytics': 2}):
+            with redis.lock(notifications.SLOT_KEY.format('analytics', 0)):
+                with redis.lock(notifications.SLOT_KEY.format('analytics', 1)):
+                    assert notifications.deliver('analytics') == 0
+                assert notifications.deliver('analytics') == 1
+
+        assert len(self.sink.requests) == 1
+
+    def test_mail(self):
+        sink = SMTPSink()
+        self.addCleanup(sink.close)
+        self.create_notification('mail', {
+            'subject': 'Build failed',
+            'recipients': ['foo@example.com'],
+            'body': 'It failed.',
+            'html': '<p>It failed.</p>',
+            'extra_headers': {'Reply-To': 'foo@example.com'},
+        })
+
+        with mock.patch.multiple(current_app.extensions['mail'], server=sink.host, port=sink.port,
+                                 suppress=False):
+            assert notifications.deliver('mail') == 1
+
+        (mail,) = sink.mail
+        assert mail.recipients == ['foo@example.com']
+        assert 'Subject: Build failed' in mail.data
+        assert 'Reply-To: foo@example.com' in mail.data
+
+
+class RetryDelayTest(TestCase):
+    def test_simple(self):
+        with override_config('NOTIFICATION_RETRY_DELAY', 10):
+            with override_config('NOTIFICATION_RETRY_MAX_DELAY', 100):
+                for attempts, delay in ((1, 10), (3, 40), (10, 100)):
+                    seconds = notifications.retry_delay(attempts).total_seconds()
+                    assert delay * 0.5 <= seconds <= delay * 1.5
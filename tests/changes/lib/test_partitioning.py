@@ -0,0 +1,92 @@
+from __future__ import absolute_import
+
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from changes.config import db
+from changes.lib.partitioning import RangePartitioning
+from changes.testutils import TestCase
+
+
+class RangePartitioningTest(TestCase):
+    def setUp(self):
+        super(RangePartitioningTest, self).setUp()
+        db.session.execute("""
+            CREATE TABLE widget (
+                id uuid PRIMARY KEY,
+                name text NOT NULL UNIQUE,
+                date_created timestamp NOT NULL DEFAULT now()
+            )
+        """)
+        db.session.execute('CREATE INDEX idx_widget_date_created ON widget (date_created)')
+        self.partitioning = RangePartitioning('widget')
+
+    def add_widget(self, name, date_created):
+        db.session.execute('INSERT INTO widget VALUES (:id, :name, :date_created)', {
+            'id': uuid4().hex, 'name': name, 'date_created': date_created,
+        })
+
+    def widgets(self, table='widget'):
+        return sorted(name for name, in db.session.execute('SELECT name FROM {}'.format(table)))
+
+    def test_align(self):
+        # 2016-10-10 is a Monday
+        assert self.partitioning.align(datetime(2016, 10, 10)) == datetime(2016, 10, 10)
+        assert self.partitioning.align(datetime(2016, 10, 16, 23, 59)) == datetime(2016, 10, 10)
+        assert self.partitioning.align(datetime(2016, 10, 17)) == datetime(2016, 10, 17)
+
+    def test_convert(self):
+        now = datetime.utcnow()
+        self.add_widget('old', now - timedelta(days=20))
+        self.add_widget('new', now)
+        assert not self.partitioning.is_partitioned()
+
+        self.partitioning.create()
+        self.partitioning.copy()
+        # written after the copy
+        self.add_widget('newer', now)
+        self.partitioning.swap(since=now - timedelta(hours=1))
+
+        assert self.partitioning.is_partitioned()
+        assert self.widgets() == ['new', 'newer', 'old']
+        assert self.widgets('widget_unpartitioned') == ['new', 'newer', 'old']
+        partitions = self.partitioning.partitions()
+        assert partitions[0].start == self.partitioning.align(now - timedelta(days=20))
+        assert partitions[-1].end > now + timedelta(days=7)
+        assert partitions[0].name == self.partitioning.partition_name(partitions[0].start)
+
+        # indexes keep their names, and unique ones include date_created
+        indexes = dict(db.session.execute(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = 'widget'").fetchall())
+        assert '(id, date_created)' in indexes['widget_pkey']
+        assert 'UNIQUE' in indexes['widget_name_key']
+        assert 'idx_widget_date_created' in indexes
+
+        # rows outside of every range go to the default partition
+        self.add_widget('ancient', datetime(1990, 1, 1))
+        assert self.widgets('widget_default') == ['ancient']
+
+    def test_drop_partitions_before(self):
+        now = datetime.utcnow()
+        self.add_widget('old', now - timedelta(days=20))
+        self.add_widget('new', now)
+        self.partitioning.create()
+        self.partitioning.copy()
+        self.partitioning.swap(since=now)
+
+        dropped = self.partitioning.drop_partitions_before(now - timedelta(days=10))
+        assert dropped == [self.partitioning.partition_name(
+            self.partitioning.align(now - timedelta(days=20)))]
+        assert self.widgets() == ['new']
+
+    def test_create_partitions(self):
+        start = datetime(2016, 10, 10)
+        db.session.execute("""
+            CREATE TABLE gadget (id uuid, date_created timestamp) PARTITION BY RANGE (date_created)
+        """)
+        partitioning = RangePartitioning('gadget')
+        assert partitioning.create_partitions(start, start + timedelta(days=14)) == [
+            'gadget_p20161010', 'gadget_p20161017']
+        assert partitioning.create_partitions(start, start + timedelta(days=15)) == ['gadget_p20161024']
+        assert [p.start for p in partitioning.partitions()] == [
+            start, start + timedelta(days=7), start + timedelta(days=14)]
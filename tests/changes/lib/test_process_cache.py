@@ -0,0 +1,117 @@
+from __future__ import absolute_import
+
+import mock
+import time
+
+from redis import ConnectionError
+
+from changes.config import redis
+from changes.lib import process_cache
+from changes.lib.process_cache import ProcessCache
+from changes.testutils import TestCase
+
+cache = ProcessCache('test_cache')
+other_cache = ProcessCache('test_other_cache')
+
+
+def wait_for_delivery():
+    # published messages reach subscribers' sockets asynchronously
+    time.sleep(0.05)
+
+
+class ProcessCacheTest(TestCase):
+    def setUp(self):
+        super(ProcessCacheTest, self).setUp()
+        self.load = mock.Mock(side_effect=lambda: self.load.call_count)
+
+    def test_get(self):
+        assert cache.get('a', self.load, ttl=60) == 1
+        assert cache.get('a', self.load, ttl=60) == 1
+        assert cache.get('b', self.load, ttl=60) == 2
+        assert other_cache.get('a', self.load, ttl=60) == 3
+
+        with mock.patch.object(process_cache.time, 'time', return_value=time.time() + 61):
+            assert cache.get('a', self.load, ttl=60) == 4
+
+    def test_ttl_zero(self):
+        assert cache.get('a', self.load, ttl=0) == 1
+        assert cache.get('a', self.load, ttl=0) == 2
+
+    def test_cache_if(self):
+        def cache_if(value):
+            return value > 1
+
+        assert cache.get('a', self.load, ttl=60, cache_if=cache_if) == 1
+        assert cache.get('a', self.load, ttl=60, cache_if=cache_if) == 2
+        assert cache.get('a', self.load, ttl=60, cache_if=cache_if) == 2
+
+    def test_invalidate(self):
+        cache.get('a', self.load, ttl=60)
+        cache.get('b', self.load, ttl=60)
+        other_cache.get('a', self.load, ttl=60)
+
+        cache.invalidate('a')
+        assert cache.get('a', self.load, ttl=60) == 4
+        assert cache.get('b', self.load, ttl=60) == 2
+        assert other_cache.get('a', self.load, ttl=60) == 3
+
+        cache.invalidate()
+        assert cache.get('b', self.load, ttl=60) == 5
+
+    def test_invalidated_by_other_process(self):
+        cache.get('http://jenkins.example.com', self.load, ttl=60)
+        cache.get('b', self.load, ttl=60)
+
+        # what invalidate would publish in another process
+        redis.publish(process_cache.CHANNEL, 'other test_cache:http://jenkins.example.com')
+        wait_for_delivery()
+
+        assert cache.get('http://jenkins.example.com', self.load, ttl=60) == 3
+        assert cache.get('b', self.load, ttl=60) == 2
+
+        redis.publish(process_cache.CHANNEL, 'other test_cache')
+        wait_for_delivery()
+        assert cache.get('b', self.load, ttl=60) == 4
+
+    def test_own_invalidations_ignored(self):
+        cache.invalidate('a')
+        assert cache.get('a', self.load, ttl=60) == 1
+        wait_for_delivery()
+        assert cache.get('a', self.load, ttl=60) == 1
+
+    def test_invalidated_while_loading(self):
+        def load():
+            cache.invalidate('a')
+            return 'old'
+
+        assert cache.get('a', load, ttl=60) == 'old'
+        assert cache.get('a', self.load, ttl=60) == 1
+
+    def test_lost_subscription(self):
+        cache.get('a', self.load, ttl=60)
+
+        pubsub = process_cache._subscription['pubsub']
+        with mock.patch.object(pubsub, 'get_message', side_effect=ConnectionError()):
+            assert cache.get('a', self.load, ttl=60) == 2
+        # and resubscribes, dropping anything cached in between
+        assert cache.get('a', self.load, ttl=60) == 3
+        assert process_cache._subscription['pubsub'] is not pubsub
+        assert cache.get('a', self.load, ttl=60) == 3
+
+    def test_stats(self):
+        with mock.patch.object(process_cache.statsreporter, 'stats') as stats:
+            cache.get('a', self.load, ttl=60)
+            cache.get('a', self.load, ttl=60)
+            redis.publish(process_cache.CHANNEL, 'other test_cache:a')
+            wait_for_delivery()
+            cache.get('a', self.load, ttl=60)
+
+        assert stats.return_value.incr.call_args_list == [
+            mock.call('process_cache_miss_test_cache'),
+            mock.call('process_cache_hit_test_cache'),
+            mock.call('process_cache_invalidated_test_cache'),
+            mock.call('process_cache_miss_test_cache'),
+        ]
+        (key, age), _ = stats.return_value.log_timing.call_args
+        assert key == 'process_cache_age_test_cache'
+        assert 0 <= age < 1000
@@ -0,0 +1,59 @@
+from __future__ import absolute_import
+
+import fnmatch
+
+from unittest import TestCase
+
+from changes.lib import trigger_index
+from changes.lib.trigger_index import TriggerIndex, get_trigger_index
+
+
+class TriggerIndexTest(TestCase):
+    def test_match(self):
+        index = TriggerIndex({
+            'exact': ['setup.py', 'ci/run.sh'],
+            'prefix': ['ci/*'],
+            'suffix': ['*.py'],
+            'mixed': ['src/*/BUILD', 'src/a?c.txt', 'docs/[ab]*.md'],
+            'none': [],
+        })
+        assert index.restricted == {'exact', 'prefix', 'suffix', 'mixed'}
+
+        assert index.match([
+            'setup.py', 'setup.pyc', 'ci/run.sh', 'ci/a/b', 'ci', 'src/foo/bar.py', 'src/foo/BUILD',
+            'src/abc.txt', 'src/abcd.txt', 'docs/b.md', 'docs/c.md', 'README',
+        ]) == {
+            'exact': ['setup.py', 'ci/run.sh'],
+            'prefix': ['ci/run.sh', 'ci/a/b'],
+            'suffix': ['setup.py', 'src/foo/bar.py'],
+            'mixed': ['src/foo/BUILD', 'src/abc.txt', 'docs/b.md'],
+        }
+
+    def test_same_as_fnmatch(self):
+        whitelists = {
+            1: ['a/*', 'b/c*d', '*/e'],
+            2: ['a/b', 'a/b*', 'a/b/*.txt'],
+            3: ['?/b', '[!a]/*', 'a[/]b'],
+        }
+        files = ['a/b', 'a/bc', 'a/b/c.txt', 'b/cxd', 'b/cd', 'c/e', 'e', 'x/b', 'a/b/e', 'a', '']
+        expected = {}
+        for project_id, patterns in whitelists.items():
+            matching = [f for f in files if any(fnmatch.fnmatchcase(f, p) for p in patterns)]
+            if matching:
+                expected[project_id] = matching
+
+        assert TriggerIndex(whitelists).match(files) == expected
+
+
+class GetTriggerIndexTest(TestCase):
+    def setUp(self):
+        trigger_index._index_cache.clear()
+
+    def test_rebuilt_on_change(self):
+        index = get_trigger_index('repo', {1: ['a/*'], 2: []})
+        assert get_trigger_index('repo', {2: [], 1: ['a/*']}) is index
+        assert get_trigger_index('other', {1: ['a/*'], 2: []}) is not index
+
+        changed = get_trigger_index('repo', {1: ['b/*'], 2: []})
+        assert changed is not index
+        assert changed.match(['a/x', 'b/x']) == {1: ['b/x']}
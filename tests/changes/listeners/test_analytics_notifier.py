@@ -6,19 +6,21 @@ from collections import defaultdict
 from datetime import datetime
 
 from flask import current_app
+from flask.ext.sqlalchemy import get_debug_queries
 import mock
 
 from changes.config import db
 from changes.constants import Result, Status
 from changes.testutils import TestCase
+from changes.testutils.helpers import override_config
 from changes.models.failurereason import FailureReason
 from changes.listeners.analytics_notifier import (
         build_finished_handler,
         job_finished_handler,
         _categorize_step_logs,
-        _get_build_failure_reasons,
         _get_phabricator_revision_url,
-        _get_job_failure_reasons_by_jobstep,
+        _get_failure_reasons_by_jobstep,
+        _get_jobstep_records,
 )
 
 
@@ -75,7 +77,7 @@ class AnalyticsNotifierTest(TestCase):
 
         with mock.patch('changes.listeners.analytics_notifier._get_phabricator_revision_url') as mock_get_phab:
             mock_get_phab.return_value = 'https://example.com/D1'
-            with mock.patch('changes.listeners.analytics_notifier._get_build_failure_reasons') as mock_get_failures:
+            with mock.patch('changes.lib.build_context_lib._get_failure_reasons') as mock_get_failures:
                 mock_get_failures.return_value = ['aborted', 'missing_tests']
                 build_finished_handler(build_id=build.id.hex)
 
@@ -102,36 +104,6 @@ class AnalyticsNotifierTest(TestCase):
         }
         post_fn.assert_called_once_with(URL, [expected_data])
 
-    def test_get_build_failure_reasons_no_failures(self):
-        project = self.create_project(name='test', slug='project-slug')
-        build = self.create_build(project, result=Result.passed, target='D1',
-                                  label='Some sweet diff')
-        self.assertEquals(_get_build_failure_reasons(build), [])
-
-    def test_get_build_failure_reasons_multiple_failures(self):
-        project = self.create_project(name='test', slug='project-slug')
-        build = self.create_build(project, result=Result.failed, target='D1',
-                                  label='Some sweet diff')
-        job = self.create_job(build=build, result=Result.failed)
-        jobphase = self.create_jobphase(job)
-        jobstep = self.create_jobstep(jobphase, status=Status.finished, result=Result.failed)
-        for reason in ('missing_tests', 'timeout', 'aborted'):
-            db.session.add(FailureReason(step_id=jobstep.id, job_id=job.id, build_id=build.id, project_id=project.id,
-                                         reason=reason))
-        jobstep2 = self.create_jobstep(jobphase, status=Status.finished, result=Result.failed)
-        for reason in ('timeout', 'insufficient_politeness'):
-            db.session.add(FailureReason(step_id=jobstep2.id, job_id=job.id, build_id=build.id, project_id=project.id,
-                                         reason=reason))
-        jobstep3 = self.create_jobstep(jobphase, status=Status.finished, result=Result.infra_failed,
-                                       replacement_id=jobstep.id)
-        # shouldn't be included because jobstep3 is replaced
-        db.session.add(FailureReason(step_id=jobstep3.id, job_id=job.id, build_id=build.id,
-                                     project_id=project.id, reason='infra_reasons'))
-        db.session.commit()
-
-        self.assertEquals(_get_build_failure_reasons(build),
-                          ['aborted', 'insufficient_politeness', 'missing_tests', 'timeout'])
-
     def test_get_phab_revision_url_diff(self):
         project = self.create_project(name='test', slug='test')
         source_data = {'phabricator.revisionURL': 'https://tails.corp.dropbox.com/D6789'}
@@ -223,7 +195,9 @@ class AnalyticsNotifierTest(TestCase):
             incr.assert_any_call("failing-log-category-tag1")
             incr.assert_any_call("failing-log-category-tag2")
 
-        categorize_fn.assert_called_with('project-slug', fake_rules, ''.join(chunks))
+        project_slug, rules, logdata = categorize_fn.call_args[0]
+        assert (project_slug, rules) == ('project-slug', fake_rules)
+        assert ''.join(logdata) == ''.join(chunks)
         self.assertSetEqual(tags_by_step[step.id], {'tag1', 'tag2'})
 
     @mock.patch('changes.listeners.analytics_notifier.categorize.categorize')
@@ -250,19 +224,21 @@ class AnalyticsNotifierTest(TestCase):
             tags_by_step = _categorize_step_logs(job)
             incr.assert_any_call("failing-log-uncategorized")
 
-        categorize_fn.assert_called_with('project-slug', fake_rules, 'Some log text')
+        project_slug, rules, logdata = categorize_fn.call_args[0]
+        assert (project_slug, rules) == ('project-slug', fake_rules)
+        assert ''.join(logdata) == 'Some log text'
         self.assertSetEqual(tags_by_step[step.id], set())
 
-    def test_get_job_failure_reasons_by_jobstep_passed(self):
+    def test_get_failure_reasons_by_jobstep_passed(self):
         project = self.create_project(name='test', slug='project-slug')
         build = self.create_build(project, result=Result.passed, target='D1',
                                   label='Some sweet diff')
         job = self.create_job(build=build, result=Result.passed)
         jobphase = self.create_jobphase(job)
         jobstep = self.create_jobstep(jobphase, status=Status.finished, result=Result.passed)
-        self.assertEquals(_get_job_failure_reasons_by_jobstep(job)[jobstep.id], [])
+        self.assertEquals(_get_failure_reasons_by_jobstep([job.id])[jobstep.id], [])
 
-    def test_get_job_failure_reasons_by_jobstep_failures(self):
+    def test_get_failure_reasons_by_jobstep_failures(self):
         project = self.create_project(name='test', slug='project-slug')
 
         build = self.create_build(project, result=Result.failed, target='D1', label='Some sweet diff')
@@ -282,7 +258,7 @@ class AnalyticsNotifierTest(TestCase):
         expected_data = defaultdict(list)
         expected_data[jobstep_a.id] = ['aborted', 'missing_tests']
         expected_data[jobstep_b.id] = ['aborted']
-        self.assertEquals(_get_job_failure_reasons_by_jobstep(job), expected_data)
+        self.assertEquals(_get_failure_reasons_by_jobstep([job.id]), expected_data)
 
     @mock.patch('changes.listeners.analytics_notifier.post_analytics_data')
     def test_failed_job(self, post_fn):
@@ -315,7 +291,7 @@ class AnalyticsNotifierTest(TestCase):
                                      reason='aborted'))
         db.session.commit()
 
-        with mock.patch('changes.listeners.analytics_notifier._get_job_failure_reasons_by_jobstep') as mock_get_failures:
+        with mock.patch('changes.listeners.analytics_notifier._get_failure_reasons_by_jobstep') as mock_get_failures:
             mock_get_failures.return_value = defaultdict(list)
             mock_get_failures.return_value[jobstep.id] = ['aborted', 'missing_tests']
             job_finished_handler(job_id=job.id.hex)
@@ -371,7 +347,7 @@ class AnalyticsNotifierTest(TestCase):
         self.create_itemstat(item_id=jobstep.id, name='files', value=55)
         self.create_itemstat(item_id=jobstep.id, name='lines', value=44)
 
-        with mock.patch('changes.listeners.analytics_notifier._get_job_failure_reasons_by_jobstep') as mock_get_failures:
+        with mock.patch('changes.listeners.analytics_notifier._get_failure_reasons_by_jobstep') as mock_get_failures:
             mock_get_failures.return_value = defaultdict(list)
             job_finished_handler(job_id=job.id.hex)
 
@@ -396,3 +372,63 @@ class AnalyticsNotifierTest(TestCase):
         }
         post_fn.assert_called_once_with(URL, [expected_data])
         json.dumps(post_fn.call_args[0][1])
+
+    @mock.patch('changes.lib.notifications.send_many')
+    def test_job_batches(self, send_many):
+        URL = "https://analytics.example.com/report?source=changes_jobstep"
+        self._set_config_url(build_url=None, jobstep_url=URL)
+        project = self.create_project()
+        build = self.create_build(project, result=Result.passed)
+        job = self.create_job(build=build, result=Result.passed)
+        jobphase = self.create_jobphase(job)
+        jobsteps = [self.create_jobstep(jobphase, status=Status.finished, result=Result.passed)
+                    for _ in range(3)]
+
+        with override_config('ANALYTICS_POST_MAX_RECORDS', 2):
+            job_finished_handler(job_id=job.id.hex)
+
+        # sent together, in requests of at most 2 records
+        send_many.assert_called_once_with('analytics', mock.ANY)
+        notifications = send_many.call_args[0][1]
+        assert [n['url'] for n in notifications] == [URL, URL]
+        assert [[r['jobstep_id'] for r in n['records']] for n in notifications] == [
+            [jobsteps[0].id.hex, jobsteps[1].id.hex],
+            [jobsteps[2].id.hex],
+        ]
+
+    def test_get_jobstep_records(self):
+        project = self.create_project(name='test', slug='project-slug')
+        build = self.create_build(project, result=Result.failed)
+
+        def create_jobs(num_jobs):
+            jobs = []
+            for _ in range(num_jobs):
+                job = self.create_job(build=build, result=Result.failed)
+                jobphase = self.create_jobphase(job)
+                for n in range(3):
+                    jobstep = self.create_jobstep(jobphase, status=Status.finished, result=Result.failed)
+                    self.create_itemstat(item_id=jobstep.id, name='tests', value=n)
+                    db.session.add(FailureReason(step_id=jobstep.id, job_id=job.id, build_id=build.id,
+                                                 project_id=project.id, reason='timeout'))
+                jobs.append(job)
+            db.session.commit()
+            return jobs
+
+        def count_queries(jobs):
+            job_ids = [j.id for j in jobs]
+            db.session.expire_all()
+            num_queries = len(get_debug_queries())
+            records = _get_jobstep_records(job_ids, defaultdict(set))
+            assert len(records) == len(jobs) * 3
+            return len([q for q in get_debug_queries()[num_queries:] if q.statement.startswith('SELECT')])
+
+        # one query each for the jobsteps, their failure reasons and their stats
+        assert count_queries(create_jobs(1)) == count_queries(create_jobs(5)) == 3
+
+        job, = create_jobs(1)
+        records = _get_jobstep_records([job.id], defaultdict(set))
+        assert [r['job_id'] for r in records] == [job.id.hex] * 3
+        assert [r['build_id'] for r in records] == [build.id.hex] * 3
+        assert [r['project_slug'] for r in records] == ['project-slug'] * 3
+        assert sorted(r['item_stats']['tests'] for r in records) == [0, 1, 2]
+        assert [r['failure_reasons'] for r in records] == [['timeout']] * 3
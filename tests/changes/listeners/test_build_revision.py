@@ -82,6 +82,8 @@ class RevisionCreatedHandlerTestCase(TestCase):
         revision_created_handler(revision_sha=revision.sha, repository_id=repo.id)
 
         assert not Build.query.first()
+        # no project to build, so the repository isn't touched
+        assert not get_vcs.return_value.get_changed_files.called
 
     @patch('changes.models.repository.Repository.get_vcs')
     @patch('changes.api.build_index.identify_revision')
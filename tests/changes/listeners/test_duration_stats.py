@@ -0,0 +1,25 @@
+from __future__ import absolute_import
+
+from uuid import uuid4
+
+from changes.constants import Result, Status
+from changes.listeners.duration_stats import build_finished_handler
+from changes.models.durationstats import DurationStats
+from changes.testutils import TestCase
+
+
+class DurationStatsListenerTest(TestCase):
+    def test_build_finished(self):
+        project = self.create_project()
+        build = self.create_build(project, status=Status.finished, result=Result.passed)
+        self.create_test(self.create_job(build), name='foo.test_bar', duration=10)
+
+        build_finished_handler(build_id=build.id.hex)
+
+        stats = DurationStats.query.filter(DurationStats.project_id == project.id).one()
+        assert stats.kind == 'tests'
+        assert stats.last_build_id == build.id
+        assert stats.num_builds == 1
+
+    def test_missing_build(self):
+        build_finished_handler(build_id=uuid4().hex)
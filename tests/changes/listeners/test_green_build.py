@@ -3,13 +3,17 @@ from __future__ import absolute_import
 import mock
 import responses
 import urlparse
+from datetime import datetime
 from uuid import uuid4
 
+from changes.config import db
 from changes.constants import Result
+from changes.lib import notifications
 from changes.listeners.green_build import revision_result_updated_handler, \
     _set_latest_green_build_for_each_branch
 from changes.models.event import Event, EventType
 from changes.models.latest_green_build import LatestGreenBuild
+from changes.models.notification import Notification, NotificationStatus
 from changes.models.repository import RepositoryBackend
 from changes.testutils import TestCase
 from changes.vcs.base import UnknownChildRevision, UnknownParentRevision
@@ -282,3 +286,75 @@ class GreenBuildTest(TestCase):
             LatestGreenBuild.project_id == project.id,
             LatestGreenBuild.branch == 'default').first()
         assert new_latest_green.build == build_child
+
+
+class GreenBuildSenderTest(TestCase):
+    def create_notification(self, build, **kwargs):
+        notification = Notification(destination='green_build', data={
+            'build_id': build.id.hex,
+            'project': build.project.slug,
+            'release_id': '134:asdadfadf',
+            'form': {'project': build.project.slug, 'id': '134:asdadfadf'},
+        }, **kwargs)
+        db.session.add(notification)
+        db.session.commit()
+        return notification
+
+    def deliver(self, build, status):
+        notification = self.create_notification(build)
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.POST, 'https://foo.example.com', status=status)
+            notifications.deliver('green_build')
+        return notification
+
+    def get_status(self, build):
+        return Event.query.filter(
+            Event.type == EventType.green_build,
+            Event.item_id == build.id,
+        ).one().data['status']
+
+    def test_conflict(self):
+        build = self.create_build(self.create_project())
+
+        notification = self.deliver(build, 500)
+        assert notification.status == NotificationStatus.pending
+        assert not Event.query.first()
+
+        # conflicts aren't retried
+        build = self.create_build(self.create_project())
+        notification = self.deliver(build, 409)
+        assert notification.status == NotificationStatus.failed
+        assert self.get_status(build) == 'fail'
+
+        build = self.create_build(self.create_project())
+        notification = self.deliver(build, 200)
+        assert notification.status == NotificationStatus.sent
+        assert self.get_status(build) == 'success'
+
+    def test_superseded(self):
+        project = self.create_project()
+        older_build = self.create_build(project)
+        other_build = self.create_build(self.create_project())
+        older = self.create_notification(older_build)
+        other = self.create_notification(other_build)
+
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.POST, 'https://foo.example.com', status=500)
+            notifications.deliver('green_build')
+        assert older.status == other.status == NotificationStatus.pending
+
+        # the newer green build for the project gets there first
+        build = self.create_build(project)
+        notification = self.deliver(build, 200)
+        assert notification.status == NotificationStatus.sent
+        assert older.status == NotificationStatus.superseded
+        assert other.status == NotificationStatus.pending
+
+        other.date_next_attempt = older.date_next_attempt = datetime.utcnow()
+        db.session.commit()
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.POST, 'https://foo.example.com', status=200)
+            notifications.deliver('green_build')
+            assert len(rsps.calls) == 1
+        assert other.status == NotificationStatus.sent
+        assert older.status == NotificationStatus.superseded
@@ -233,7 +233,7 @@ class PhabricatorListenerTest(UnitTestCase):
             duration=134,
             result=Result.failed,
             )
-        get_base_failures.return_value = {testcase.name}
+        get_base_failures.return_value = {testcase.name_sha}
 
         build_finished_handler(build_id=build.id.hex)
 
@@ -288,7 +288,7 @@ class PhabricatorListenerTest(UnitTestCase):
             duration=134,
             result=Result.failed,
             )
-        get_base_failures.return_value = {testcase.name}
+        get_base_failures.return_value = {testcase.name_sha}
 
         build_finished_handler(build_id=build.id.hex)
 
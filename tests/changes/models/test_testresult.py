@@ -1,4 +1,5 @@
 from base64 import b64encode
+from datetime import datetime, timedelta
 
 import mock
 
@@ -6,6 +7,7 @@ from changes.constants import Result
 from changes.lib.artifact_store_mock import ArtifactStoreMock
 from changes.models.failurereason import FailureReason
 from changes.models.itemstat import ItemStat
+from changes.models.test import TEST_PARTITIONINGS
 from changes.models.testresult import TestResult, TestResultManager, logger
 from changes.testutils.cases import TestCase
 
@@ -385,3 +387,93 @@ class TestResultManagerTestCase(TestCase):
         failures = FailureReason.query.filter_by(step_id=jobstep2.id).all()
         assert len(failures) == 1
         assert failures[0].reason == 'duplicate_test_name'
+
+    @mock.patch('changes.models.testresult.ArtifactStoreClient', ArtifactStoreMock)
+    @mock.patch('changes.storage.artifactstore.ArtifactStoreClient', ArtifactStoreMock)
+    def test_duplicate_tests_partitioned(self):
+        from changes.models.test import TestCase
+
+        project = self.create_project()
+        build = self.create_build(project)
+        job = self.create_job(build)
+        jobphase = self.create_jobphase(job)
+        jobstep = self.create_jobstep(jobphase, label='STEP1')
+        jobstep2 = self.create_jobstep(jobphase, label='STEP2')
+        artifact = self.create_artifact(jobstep, 'junit.xml')
+        artifact2 = self.create_artifact(jobstep2, 'junit.xml')
+
+        now = datetime.utcnow()
+        for partitioning in TEST_PARTITIONINGS:
+            partitioning.create()
+            partitioning.copy()
+            partitioning.swap(since=now)
+
+        # the unique key now includes date_created, which differs between
+        # the steps' results
+        TestResultManager(jobstep, artifact).save([
+            TestResult(step=jobstep, name='test_foo', package='project.tests',
+                       result=Result.passed, date_created=now),
+        ])
+        TestResultManager(jobstep2, artifact2).save([
+            TestResult(step=jobstep2, name='test_foo', package='project.tests',
+                       result=Result.passed, date_created=now + timedelta(hours=1)),
+        ])
+
+        testcase_list = TestCase.query.all()
+        assert len(testcase_list) == 1
+        assert testcase_list[0].step_id == jobstep.id
+        assert testcase_list[0].date_created == job.date_created
+        assert testcase_list[0].result == Result.failed
+        assert testcase_list[0].message.endswith('\nSTEP1\nSTEP2\n')
+
+        failures = FailureReason.query.filter_by(step_id=jobstep2.id).all()
+        assert len(failures) == 1
+        assert failures[0].reason == 'duplicate_test_name'
+
+    @mock.patch('changes.models.testresult.ArtifactStoreClient', ArtifactStoreMock)
+    @mock.patch('changes.storage.artifactstore.ArtifactStoreClient', ArtifactStoreMock)
+    def test_date_created(self):
+        from changes.models.test import TestCase
+
+        job = self.create_job(self.create_build(self.create_project()))
+        jobstep = self.create_jobstep(self.create_jobphase(job))
+        artifact = self.create_artifact(jobstep, 'junit.xml')
+        date_created = datetime(2016, 10, 10)
+
+        # only tests in a partitioned table get the job's date
+        TestResultManager(jobstep, artifact).save([
+            TestResult(step=jobstep, name='test_foo', package='project.tests',
+                       result=Result.passed, date_created=date_created),
+        ])
+
+        assert TestCase.query.one().date_created == date_created
+
+    @mock.patch('changes.models.testresult.ArtifactStoreClient', ArtifactStoreMock)
+    @mock.patch('changes.storage.artifactstore.ArtifactStoreClient', ArtifactStoreMock)
+    def test_clear_partitioned(self):
+        from changes.models.test import TestCase
+        from changes.models.testartifact import TestArtifact
+        from changes.models.testmessage import TestMessage
+
+        job = self.create_job(self.create_build(self.create_project()))
+        jobstep = self.create_jobstep(self.create_jobphase(job))
+        artifact = self.create_artifact(jobstep, 'junit.xml')
+        for partitioning in TEST_PARTITIONINGS:
+            partitioning.create()
+            partitioning.copy()
+            partitioning.swap(since=datetime.utcnow())
+
+        manager = TestResultManager(jobstep, artifact)
+        manager.save([
+            TestResult(step=jobstep, name='test_foo', package='project.tests',
+                       result=Result.passed, message_offsets=[('system-out', 0, 10)],
+                       artifacts=[{'name': 'out', 'type': 'text', 'base64': b64encode('out')}]),
+        ])
+        assert TestMessage.query.count() == 1
+        assert TestArtifact.query.count() == 1
+
+        manager.clear()
+
+        assert TestCase.query.count() == 0
+        assert TestMessage.query.count() == 0
+        assert TestArtifact.query.count() == 0
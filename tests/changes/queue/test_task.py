@@ -153,6 +153,37 @@ class DelayIfNeededTest(TestCase):
         })
 
 
+class CreateManyTest(TestCase):
+    @mock.patch('changes.config.queue.delay')
+    def test_simple(self, queue_delay):
+        task_ids = [UUID('33846695b2774b29a71795a009e8168a'), UUID('b2de2b3a2a7a4b1e9e6c2c9d3a0f1e55')]
+        parent_task_id = UUID('659974858dcf4aa08e73a940e1066328')
+        tasks = success_task.create_many([{
+            'foo': 'bar',
+            'task_id': task_id.hex,
+            'parent_task_id': parent_task_id.hex,
+        } for task_id in task_ids])
+
+        # only queued once they're committed, by the caller
+        assert not queue_delay.called
+        assert tasks == [('success_task', {
+            'foo': 'bar',
+            'task_id': task_id.hex,
+            'parent_task_id': parent_task_id.hex,
+        }) for task_id in task_ids]
+
+        for task_id in task_ids:
+            task = Task.query.filter(
+                Task.task_id == task_id,
+                Task.task_name == 'success_task'
+            ).one()
+            assert task.status == Status.queued
+            assert task.parent_id == parent_task_id
+            assert task.data == {
+                'kwargs': {'foo': 'bar'},
+            }
+
+
 class VerifyAllChildrenTest(TestCase):
     def test_children_unfinished(self):
         parent_task_id = UUID('659974858dcf4aa08e73a940e1066328')
@@ -0,0 +1,109 @@
+from __future__ import absolute_import
+
+from datetime import datetime, timedelta
+from flask.ext.sqlalchemy import get_debug_queries
+
+from changes.constants import Result, Status
+from changes.config import db
+from changes.models.failurereason import FailureReason
+from changes.models.project import Project
+from changes.reports.build import BuildReport
+from changes.testutils import TestCase
+
+
+class BuildReportTest(TestCase):
+    def create_finished_build(self, project, result, date_created, **kwargs):
+        return self.create_build(
+            project, status=Status.finished, result=result, date_created=date_created, **kwargs)
+
+    def create_failure(self, build, reason, replaced=False):
+        job = self.create_job(build)
+        step = self.create_jobstep(self.create_jobphase(job))
+        if replaced:
+            step.replacement_id = self.create_jobstep(step.phase).id
+        db.session.add(FailureReason(
+            step_id=step.id, job_id=job.id, build_id=build.id, project_id=build.project_id,
+            reason=reason,
+        ))
+        db.session.commit()
+
+    def test_generate(self):
+        now = datetime.utcnow()
+        current = now - timedelta(days=1)
+        previous = now - timedelta(days=8)
+
+        project_a = self.create_project(name='a')
+        project_b = self.create_project(name='b')
+        project_c = self.create_project(name='c')
+
+        older = self.create_finished_build(project_a, Result.passed, current - timedelta(hours=1), duration=1000)
+        self.create_test(self.create_job(older), result=Result.passed, duration=9000, date_created=current)
+        latest = self.create_finished_build(project_a, Result.passed, current, duration=3000)
+        latest_job = self.create_job(latest)
+        self.create_test(latest_job, name='foo.test_slow', result=Result.passed, duration=5000,
+                         date_created=current)
+        self.create_test(latest_job, name='foo.test_fast', result=Result.passed, duration=100,
+                         date_created=current)
+        failed = self.create_finished_build(project_a, Result.failed, current)
+        self.create_failure(failed, 'test_failures')
+        self.create_failure(failed, 'test_failures')
+        self.create_failure(failed, 'missing_artifact', replaced=True)
+        self.create_finished_build(project_a, Result.passed, previous, duration=4000)
+        self.create_failure(self.create_finished_build(project_a, Result.failed, previous), 'test_failures')
+
+        self.create_failure(self.create_finished_build(project_b, Result.failed, current), 'malformed_manifest_json')
+
+        report = BuildReport([project_a, project_b, project_c]).generate(days=7)
+
+        assert [p for p, _ in report['project_stats']] == [project_a, project_b]
+        stats_a = report['project_stats'][0][1]
+        assert stats_a['total_builds'] == 3
+        assert stats_a['green_builds'] == 2
+        assert stats_a['green_percent'] == 66
+        assert stats_a['avg_duration'] == 2000
+        assert stats_a['total_change'] == 1
+        assert stats_a['percent_change'] == 16
+        assert stats_a['duration_change'] == -2000
+        stats_b = report['project_stats'][1][1]
+        assert stats_b['total_builds'] == 1
+        assert stats_b['green_percent'] == 0
+        assert stats_b['total_change'] == 1
+        assert stats_b['percent_change'] is None
+
+        assert sorted(report['failure_stats'], key=lambda s: s['name']) == [{
+            'name': 'malformed_manifest_json',
+            'current': {'value': 1, 'percent': 50},
+            'previous': {'value': 0, 'percent': 0},
+        }, {
+            'name': 'test_failures',
+            'current': {'value': 1, 'percent': 50},
+            'previous': {'value': 1, 'percent': 100},
+        }]
+
+        # only the tests of each project's latest passing build
+        assert [(t['project'], t['name'], t['duration_raw']) for t in report['tests']['slow_list']] == [
+            (project_a, 'test_slow', 5000),
+            (project_a, 'test_fast', 100),
+        ]
+
+    def test_query_count(self):
+        current = datetime.utcnow() - timedelta(days=1)
+
+        def count_queries(num_projects):
+            projects = []
+            for n in range(num_projects):
+                project = self.create_project()
+                self.create_finished_build(project, Result.passed, current, duration=1000)
+                self.create_failure(self.create_finished_build(project, Result.failed, current), 'test_failures')
+                projects.append(project)
+            db.session.expire_all()
+            projects = Project.query.filter(Project.id.in_([p.id for p in projects])).all()
+
+            num_queries = len(get_debug_queries())
+            report = BuildReport(projects).generate(days=7)
+            assert len(report['project_stats']) == num_projects
+            return len(get_debug_queries()) - num_queries
+
+        # one query per section (project stats, failure reasons, failed
+        # builds, slow tests and flaky tests), however many projects
+        assert count_queries(2) == count_queries(40) == 5
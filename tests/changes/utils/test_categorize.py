@@ -1,7 +1,15 @@
+import os
+import shutil
+import tempfile
 import textwrap
 import unittest
 
-from changes.experimental.categorize import parse_rules, _parse_rule, categorize, ParseError
+import mock
+
+from changes.experimental import categorize as categorize_module
+from changes.experimental.categorize import (
+    parse_rules, _parse_rule, _required_literals, categorize, load_ruleset, ParseError, RuleSet
+)
 
 
 class TestCategorize(unittest.TestCase):
@@ -70,6 +78,73 @@ class TestCategorize(unittest.TestCase):
         rules = [('atag', 'aproj', 'line1.*line2')]
         self.assertEqual(categorize('aproj', rules, 'line1\n\nline2'), ({'atag'}, {'atag'}))
 
+    def test_categorize_chunks(self):
+        rules = [('tag', '', '^error$'), ('tag2', '', 'line1.*line2')]
+        tags = {'tag', 'tag2'}
+        self.assertEqual(categorize('proj', rules, ['..\r', '\nerr', 'or\r', '\n']), ({'tag'}, tags))
+        self.assertEqual(categorize('proj', rules, ['line1\n', 'x', '\nline2']), ({'tag2'}, tags))
+        self.assertEqual(categorize('proj', rules, iter([])), (set(), tags))
+
+    def test_categorize_literals_across_windows(self):
+        rules = RuleSet([('tag', '', 'needle'), ('tag2', '', 'needles'), ('tag3', '', 'edl')])
+        chunks = ['x' * 5 + 'nee', 'dles', 'y' * 7]
+        with mock.patch.object(categorize_module, 'SCAN_WINDOW_SIZE', 4):
+            self.assertEqual(rules.categorize('proj', chunks), ({'tag', 'tag2', 'tag3'}, {'tag', 'tag2', 'tag3'}))
+
+    def test_categorize_matches_across_windows(self):
+        rules = RuleSet([('tag', '', 'line1.*line2'), ('tag2', '', '^error$')])
+        chunks = ['line1\n', 'x' * 10 + '\n', 'line2\n', 'err', 'or\n']
+        with mock.patch.object(categorize_module, 'SCAN_WINDOW_SIZE', 4):
+            self.assertEqual(rules.categorize('proj', chunks), ({'tag', 'tag2'}, {'tag', 'tag2'}))
+            with mock.patch.object(categorize_module, 'MATCH_OVERLAP', 8):
+                self.assertEqual(rules.categorize('proj', chunks), ({'tag2'}, {'tag', 'tag2'}))
+
+    def test_categorize_windows_end_at_line_breaks(self):
+        rules = RuleSet([('tag', '', '^error$')])
+        with mock.patch.object(categorize_module, 'SCAN_WINDOW_SIZE', 4):
+            self.assertEqual(rules.categorize('proj', ['..\nerr', 'or', 'x\n']), (set(), {'tag'}))
+            self.assertEqual(rules.categorize('proj', ['..\nx', 'error\n']), (set(), {'tag'}))
+
+    def test_categorize_stops_once_matched(self):
+        rules = RuleSet([('tag', '', 'error'), ('tag2', '', 'fail')])
+        chunks = iter(['error', 'fail', 'more', 'output'])
+        with mock.patch.object(categorize_module, 'SCAN_WINDOW_SIZE', 4):
+            self.assertEqual(rules.categorize('proj', chunks), ({'tag', 'tag2'}, {'tag', 'tag2'}))
+        self.assertEqual(list(chunks), ['more', 'output'])
+
+    def test_categorize_skips_rules_without_literal_matches(self):
+        rules = RuleSet([('tag', '', 'error: (foo|bar)'), ('tag2', '', '[0-9]+ failed')])
+        self.assertEqual(rules.categorize('proj', '3 failed'), ({'tag2'}, {'tag', 'tag2'}))
+
+        search = mock.Mock(return_value=None)
+        rules.rules[0] = rules.rules[0][:2] + (mock.Mock(search=search), rules.rules[0][3])
+        rules.categorize('proj', 'no errors here')
+        assert not search.called
+
+    def test_required_literals(self):
+        self.assertEqual(_required_literals('error'), {'error'})
+        self.assertEqual(_required_literals('^ERROR: (foo|ba)r$'), {'ERROR: '})
+        self.assertEqual(_required_literals('(abc)de[0-9]+xyz'), {'abcde', 'xyz'})
+        self.assertEqual(_required_literals('line1.*line2'), {'line1', 'line2'})
+        self.assertEqual(_required_literals('a|bc'), set())
+        self.assertEqual(_required_literals('(?i)error'), set())
+        self.assertEqual(_required_literals('[a-z]+'), set())
+
+    def test_load_ruleset_cached_by_mtime(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'rules')
+        with open(path, 'w') as f:
+            f.write('tag::error\n')
+        ruleset = load_ruleset(path)
+        self.assertEqual(len(ruleset), 1)
+        self.assertIs(load_ruleset(path), ruleset)
+
+        with open(path, 'w') as f:
+            f.write('tag::error\ntag2::fail\n')
+        os.utime(path, (0, 0))
+        self.assertEqual(len(load_ruleset(path)), 2)
+
     def test_parse_error(self):
         with self.assertRaisesRegexp(ParseError, 'file.ext, line 2: syntax error'):
             parse_rules('foo::bar\n'
@@ -0,0 +1,68 @@
+import json
+import mock
+import pytest
+
+from datetime import datetime
+from uuid import UUID
+
+from changes.api.serializer import serialize
+from changes.constants import Result, Status
+from changes.utils import json_encoding
+
+
+DATA = {
+    'id': UUID('4b6d0c1c8e0a4d0a9a5b1d5f3c0e2a11'),
+    'dateCreated': datetime(2016, 4, 1, 12, 30, 45, 1234),
+    'result': Result.failed,
+    'steps': [{'status': Status.finished, 'name': u'caf\xe9'}, None, 1.5],
+}
+
+
+@pytest.fixture
+def restore_backend(request):
+    original = json_encoding._current
+    request.addfinalizer(lambda: json_encoding.set_backend(original))
+
+
+@pytest.mark.parametrize('backend', json_encoding._backends.keys())
+def test_native_types_match_crumblers(backend, restore_backend):
+    json_encoding.set_backend(backend)
+    assert json.loads(json_encoding.dumps(DATA, native_types=True)) == \
+        json.loads(json.dumps(serialize(DATA)))
+    assert json_encoding.dumps(serialize(DATA, native_types=True), native_types=True) == \
+        json_encoding.dumps(serialize(DATA))
+
+
+@pytest.mark.parametrize('backend', json_encoding._backends.keys())
+def test_strict_by_default(backend, restore_backend):
+    json_encoding.set_backend(backend)
+    with pytest.raises(TypeError):
+        json_encoding.dumps(DATA)
+
+
+@pytest.mark.parametrize('backend', ['json', 'simplejson'])
+def test_pure_python(backend, restore_backend):
+    if backend not in json_encoding._backends:
+        pytest.skip('{} is not installed'.format(backend))
+    json_encoding.set_backend(backend)
+    expected = json.dumps(serialize(DATA), sort_keys=True)
+    with mock.patch('json.encoder.c_make_encoder', side_effect=AssertionError), \
+            mock.patch('simplejson.encoder.c_make_encoder', side_effect=AssertionError):
+        encoded = json_encoding.dumps(DATA, native_types=True)
+    assert json.dumps(json.loads(encoded), sort_keys=True) == expected
+
+
+def test_set_backend(restore_backend):
+    json_encoding.set_backend('json')
+    assert json_encoding.get_backend() == 'json'
+
+    json_encoding.set_backend(None)
+    assert json_encoding.get_backend() in json_encoding.BACKEND_PREFERENCE
+
+    with pytest.raises(ValueError):
+        json_encoding.set_backend('nope')
+
+
+def test_loads_returns_unicode():
+    assert json_encoding.loads('{"a": ["b"]}') == {u'a': [u'b']}
+    assert isinstance(json_encoding.loads('"b"'), unicode)
@@ -235,3 +235,35 @@ z
             (sha, diff, _), _ = mocked.call_args
             assert sha == self.revision.sha
             assert diff is None
+
+    def test_whitelisted_files(self):
+        with mock.patch('changes.models.project.Project.get_config') as mocked:
+            mocked.return_value = {
+                'build.file-blacklist': ['y/*']
+            }
+            # the whitelist option isn't looked at again
+            assert files_changed_should_trigger_project(
+                ['a', 'b', 'y/a.txt'],
+                self.project,
+                {'build.file-whitelist': 'y/*'},
+                self.revision.sha,
+                whitelisted_files=['a'],
+            )
+            assert not files_changed_should_trigger_project(
+                ['a', 'b', 'y/a.txt'],
+                self.project,
+                {},
+                self.revision.sha,
+                whitelisted_files=['y/a.txt'],
+            )
+            assert mocked.call_count == 2
+
+            # nor the config, if no files match
+            assert not files_changed_should_trigger_project(
+                ['a', 'b', 'y/a.txt'],
+                self.project,
+                {},
+                self.revision.sha,
+                whitelisted_files=[],
+            )
+            assert mocked.call_count == 2